@@ -0,0 +1,6 @@
+"""
+性能基准脚本
+
+每个脚本可独立运行（在backend目录下执行）：
+    python -m benchmarks.bench_stream_protocol
+"""
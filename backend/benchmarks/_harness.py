@@ -0,0 +1,81 @@
+"""
+基准脚本公共工具
+
+提供Django初始化和不依赖真实连接的ChatConsumer构造方法。
+"""
+
+import os
+import sys
+import time
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django():
+    """初始化Django（基准脚本不访问数据库）"""
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crewaiplatform.settings')
+    os.environ.setdefault('APP_LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('DJANGO_LOG_LEVEL', 'WARNING')
+
+    import django
+    django.setup()
+
+
+class LoopbackChannelLayer:
+    """把group_send直接分发给同组消费者的通道层，统计经过通道层的字符数"""
+
+    def __init__(self):
+        self.consumers = []
+        self.event_count = 0
+        self.event_chars = 0
+
+    async def group_send(self, group, event):
+        self.event_count += 1
+        self.event_chars += sum(len(v) for v in event.values() if isinstance(v, str))
+        for consumer in self.consumers:
+            await getattr(consumer, event['type'])(event)
+
+
+def make_consumer(layer, query_string=b'', coalesce_window_ms=0):
+    """创建记录下发字节数的ChatConsumer（默认不合并帧）"""
+
+    from crewaiplatform.consumers import ChatConsumer
+    from crewaiplatform.stream_protocol import FrameCoalescer
+
+    consumer = ChatConsumer()
+    consumer.scope = {'query_string': query_string}
+    consumer.channel_layer = layer
+    consumer.conversation_group_name = 'chat_bench'
+    consumer.frames_sent = 0
+    consumer.bytes_sent = 0
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        consumer.frames_sent += 1
+        payload = bytes_data if bytes_data is not None else text_data.encode('utf-8')
+        consumer.bytes_sent += len(payload)
+
+    consumer.send = send
+    consumer.init_stream_state()
+    stream = consumer.response_stream
+    stream.stream_coalescer = FrameCoalescer(stream._group_send_delta, window_ms=coalesce_window_ms)
+    layer.consumers.append(consumer)
+    return consumer
+
+
+def sample_answer(length=4000):
+    """生成指定长度的中英文混合答案文本"""
+
+    base = '这是一个用于基准测试的回答。The quick brown fox jumps over the lazy dog. '
+    return (base * (length // len(base) + 1))[:length]
+
+
+def timed(func, *args, **kwargs):
+    """执行函数并返回(结果, 耗时秒)"""
+
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
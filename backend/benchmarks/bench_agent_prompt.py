@@ -0,0 +1,95 @@
+"""
+Agent提示词编译缓存基准
+
+比较每条消息准备提示词的CPU耗时：
+- 旧实现：每次创建 ChatPromptTemplate、定义输出解析器类、拼接角色设定并格式化消息
+- 新实现：从 agent_prompt_cache 取编译结果（计算配置哈希），只组装本条消息相关的部分
+
+运行: python -m benchmarks.bench_agent_prompt [次数]
+"""
+
+import asyncio
+import re
+import sys
+import time
+from types import SimpleNamespace
+
+from benchmarks._harness import setup_django, sample_answer
+
+
+def _legacy(agent, task_description, context):
+    """原实现每条消息执行的准备工作"""
+    from langchain_core.output_parsers import BaseOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+    from crewaiplatform.services.agent_prompt_cache import THINKING_SYSTEM_TEMPLATE, RESPONSE_REQUIREMENTS
+
+    parts = []
+    if agent.role:
+        parts.append(f"你是一个{agent.role}。")
+    if agent.goal:
+        parts.append(f"你的目标是: {agent.goal}")
+    if agent.backstory:
+        parts.append(f"背景信息: {agent.backstory}")
+    if context:
+        parts.append(f"\n以下是之前的对话历史:\n{context}")
+    parts.append(f"\n当前任务: {task_description}")
+    parts.append(RESPONSE_REQUIREMENTS)
+    prompt = "\n".join(parts)
+
+    class ThinkingOutputParser(BaseOutputParser):
+        def parse(self, text: str) -> dict:
+            match = re.search(r'<answer>(.*?)</answer>', text, re.DOTALL)
+            return {'answer': match.group(1) if match else text}
+
+    template = ChatPromptTemplate.from_messages([("system", THINKING_SYSTEM_TEMPLATE), ("human", "{input}")])
+    ThinkingOutputParser()
+    return asyncio.run(template.aformat_messages(input=prompt))
+
+
+def _compiled(agent, task_description, context):
+    from crewaiplatform.services.agent_prompt_cache import agent_prompt_cache
+
+    compiled = agent_prompt_cache.get(agent)
+    return compiled.messages(compiled.render(task_description, context))
+
+
+def _compiled_async(agent, task_description, context):
+    # 与旧实现同样经过一次事件循环，排除asyncio.run本身的差异
+    async def build():
+        return _compiled(agent, task_description, context)
+    return asyncio.run(build())
+
+
+def run(iterations):
+    agent = SimpleNamespace(
+        pk=1, role='资深技术顾问', goal='帮助用户解决软件架构和性能问题',
+        backstory='在大型互联网公司负责过多个高并发系统的设计与优化。' * 3,
+    )
+    context = sample_answer(3000)
+    task = '回复用户消息: 如何降低接口延迟？'
+
+    # 预热（导入、首次编译）
+    _legacy(agent, task, context)
+    _compiled(agent, task, context)
+
+    print(f"次数: {iterations}")
+    print(f"{'实现':<22}{'每条(us)':>12}")
+    results = {}
+    for name, func in (
+        ('旧实现', _legacy),
+        ('编译缓存(含事件循环)', _compiled_async),
+        ('编译缓存', _compiled),
+    ):
+        start = time.process_time()
+        for _ in range(iterations):
+            func(agent, task, context)
+        results[name] = (time.process_time() - start) / iterations * 1e6
+        print(f"{name:<22}{results[name]:>12.1f}")
+
+    saved = results['旧实现'] - results['编译缓存(含事件循环)']
+    print(f"每条消息节省CPU: {saved:.1f} us（{saved / results['旧实现'] * 100:.0f}%）")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,131 @@
+"""
+通道层吞吐基准
+
+一个成员的群组，发送方逐条 group_send 流式增量大小的事件，接收方 receive 全部消息，比较：
+- memory: InMemoryChannelLayer（发送与接收在同一进程）
+- ipc 本进程: IPCChannelLayer，成员在发送方进程内
+- ipc 跨进程: IPCChannelLayer，成员在另一个进程（fork）内，经Unix域套接字
+- postgres 跨进程: PostgresChannelLayer（仅当数据库为PostgreSQL时）
+
+运行: python -m benchmarks.bench_channel_layer [消息数]
+"""
+
+import asyncio
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks._harness import setup_django
+
+
+GROUP = 'chat_bench'
+
+
+def _message(index):
+    return {'type': 'chat.message', 'delta': '流式增量', 'seq': index}
+
+
+async def _send_all(layer, count):
+    for index in range(count):
+        await layer.group_send(GROUP, _message(index))
+
+
+async def _receive_all(layer, channel, count):
+    for _ in range(count):
+        await layer.receive(channel)
+
+
+async def _same_process(layer, count):
+    channel = await layer.new_channel()
+    await layer.group_add(GROUP, channel)
+    started = time.perf_counter()
+    await asyncio.gather(_send_all(layer, count), _receive_all(layer, channel, count))
+    elapsed = time.perf_counter() - started
+    await layer.group_discard(GROUP, channel)
+    return elapsed
+
+
+def _receiver(make_layer, count, conn):
+    """子进程：加入群组，通知就绪，收齐消息后通知完成"""
+
+    async def run():
+        layer = make_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        conn.send('ready')
+        await _receive_all(layer, channel, count)
+        conn.send('done')
+        await layer.close()
+
+    asyncio.run(run())
+
+
+def _cross_process(make_layer, count):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.get_context('fork').Process(target=_receiver, args=(make_layer, count, child))
+    process.start()
+    _wait_for(parent, process)
+
+    async def send():
+        layer = make_layer()
+        started = time.perf_counter()
+        await _send_all(layer, count)
+        # 等待接收进程收齐（不阻塞事件循环，发送缓冲区仍在写出）
+        while not parent.poll():
+            if not process.is_alive():
+                raise RuntimeError('接收进程异常退出')
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - started
+        await layer.close()
+        return elapsed
+
+    elapsed = asyncio.run(send())
+    _wait_for(parent, process)
+    process.join()
+    return elapsed
+
+
+def _wait_for(conn, process):
+    while not conn.poll(0.1):
+        if not process.is_alive():
+            raise RuntimeError('接收进程异常退出')
+    conn.recv()
+
+
+def run(count):
+    from channels.layers import InMemoryChannelLayer
+    from django.db import connection
+    from crewaiplatform.channel_layers import IPCChannelLayer, PostgresChannelLayer
+
+    path = tempfile.mkdtemp(prefix='bench-channels-')
+    capacity = count + 10
+
+    scenarios = [
+        ('memory', lambda: asyncio.run(_same_process(InMemoryChannelLayer(capacity=capacity), count))),
+        ('ipc 本进程', lambda: asyncio.run(_same_process(IPCChannelLayer(path=path, capacity=capacity), count))),
+        ('ipc 跨进程', lambda: _cross_process(lambda: IPCChannelLayer(path=path, capacity=capacity), count)),
+    ]
+    if connection.vendor == 'postgresql':
+        scenarios.append(
+            ('postgres 跨进程', lambda: _cross_process(lambda: PostgresChannelLayer(capacity=capacity), count))
+        )
+
+    print(f"消息数: {count}")
+    print(f"{'通道层':<18}{'耗时(ms)':>10}{'消息/秒':>12}")
+    try:
+        for name, scenario in scenarios:
+            try:
+                elapsed = scenario()
+            except Exception as e:
+                print(f"{name:<18}失败: {e}")
+                continue
+            print(f"{name:<18}{elapsed * 1000:>10.0f}{count / elapsed:>12.0f}")
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,82 @@
+"""
+对话上下文基准
+
+构造一段长对话（默认30轮，每条助手回答约1500字符），比较
+- 旧实现：最近10条消息直接拼接
+- 新实现：按token预算组装（历史超出预算时带400 token的滚动摘要）
+的提示词token数、组装耗时，以及模拟的首token时间。
+
+首token时间用假模型模拟：固定开销 + 每个提示词token的预填充耗时（默认0.05ms/token），
+实际数值取决于提供商和模型，这里只比较提示词长度带来的差异。
+
+运行: python -m benchmarks.bench_conversation_context [轮数] [回答长度] [预算] [每token预填充ms]
+"""
+
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+from benchmarks._harness import setup_django, sample_answer, timed
+
+
+def _rows(turns, answer_length):
+    """按从新到旧的顺序生成 (ID, 角色, Agent名称, 内容)"""
+    rows = []
+    message_id = turns * 2
+    for turn in range(turns):
+        rows.append((message_id, 'assistant', 'bench', sample_answer(answer_length)))
+        rows.append((message_id - 1, 'user', '', f'第{turns - turn}个问题：请详细解释一下这个概念？'))
+        message_id -= 2
+    return rows
+
+
+def _legacy_context(rows):
+    from crewaiplatform.services.conversation_context import ConversationContextBuilder
+
+    recent = list(reversed(rows[:10]))
+    return "\n".join(ConversationContextBuilder.format_turn(role, name, content) for _, role, name, content in recent)
+
+
+async def _time_to_first_token(prompt_tokens, base_ms, prefill_ms_per_token):
+    started = time.perf_counter()
+    await asyncio.sleep((base_ms + prompt_tokens * prefill_ms_per_token) / 1000)
+    return (time.perf_counter() - started) * 1000
+
+
+def run(turns, answer_length, budget, prefill_ms_per_token, base_ms=150):
+    from crewaiplatform.services.conversation_context import ConversationContextBuilder
+    from crewaiplatform.services.simple_agent_service import SimpleAgentService
+    from crewaiplatform.services.token_counter import estimate_tokens, truncate_to_tokens
+
+    agent = SimpleNamespace(role='技术顾问', goal='准确回答用户的问题', backstory='拥有多年经验')
+    rows = _rows(turns, answer_length)
+    # 历史超出预算时才会产生摘要，按摘要长度上限模拟
+    history_tokens = sum(estimate_tokens(content) for _, _, _, content in rows)
+    summary = truncate_to_tokens(sample_answer(2000), 400) if history_tokens > budget else ''
+    task = '回复用户消息: 请总结一下我们之前讨论的内容'
+
+    legacy, legacy_s = timed(_legacy_context, rows)
+    context, budget_s = timed(ConversationContextBuilder.fit, rows, budget, summary)
+
+    print(f"对话轮数: {turns}, 回答长度: {answer_length} 字符, 预算: {budget} tokens, "
+          f"预填充: {prefill_ms_per_token} ms/token（固定开销 {base_ms} ms）")
+    print(f"{'实现':<10}{'消息数':>8}{'提示词tokens':>14}{'组装(ms)':>10}{'模拟首token(ms)':>18}")
+    for name, text, turns_used, elapsed in (
+        ('最近10条', legacy, min(len(rows), 10), legacy_s),
+        ('按预算', context.text, len(context.turns), budget_s),
+    ):
+        prompt = SimpleAgentService._build_agent_prompt(agent, task, text)
+        tokens = estimate_tokens(prompt)
+        ttft = asyncio.run(_time_to_first_token(tokens, base_ms, prefill_ms_per_token))
+        print(f"{name:<10}{turns_used:>8}{tokens:>14,}{elapsed * 1000:>10.2f}{ttft:>18.0f}")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 30,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1500,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 2000,
+        float(sys.argv[4]) if len(sys.argv) > 4 else 0.05,
+    )
@@ -0,0 +1,84 @@
+"""
+WebSocket帧编码基准
+
+模拟一次逐token流式输出的答案（默认4000字符，每个token 4个字符），记录ChatConsumer要下发的帧，
+再分别用各编码编码这些帧，比较每个事件的编码CPU耗时和每个答案下发的字节数：
+- 旧实现: json.dumps（ASCII转义）
+- json: orjson
+- msgpack: 二进制帧
+- deflate: 超过 CHAT_WS_DEFLATE_MIN_BYTES 的事件压缩
+
+运行: python -m benchmarks.bench_frame_encoding [答案长度] [重复次数]
+"""
+
+import json
+import sys
+import time
+
+from asgiref.sync import async_to_sync
+
+from benchmarks._harness import setup_django, LoopbackChannelLayer, make_consumer, sample_answer
+
+
+class LegacyEncoder:
+    """原实现：json.dumps 后作为文本帧下发"""
+
+    def encode(self, data):
+        return json.dumps(data), None
+
+
+async def _stream(producer, tokens):
+    await producer.send_answer_stream_start()
+    for token in tokens:
+        await producer.send_answer_stream_update(token)
+    await producer.send_answer_stream_complete(''.join(tokens).strip())
+
+
+def _record_frames(protocol, tokens):
+    consumer = make_consumer(LoopbackChannelLayer(), f'stream_protocol={protocol}'.encode())
+    frames = []
+
+    async def send_frame(data):
+        frames.append(data)
+
+    consumer.send_frame = send_frame
+    async_to_sync(_stream)(consumer.response_stream, tokens)
+    return frames
+
+
+def run(length, repeat):
+    from crewaiplatform.frame_encoding import FrameEncoder
+
+    answer = sample_answer(length)
+    tokens = [answer[i:i + 4] for i in range(0, len(answer), 4)]
+    encoders = [
+        ('旧实现 json.dumps', LegacyEncoder()),
+        ('json (orjson)', FrameEncoder('json')),
+        ('msgpack', FrameEncoder('msgpack')),
+        ('deflate', FrameEncoder('deflate')),
+    ]
+
+    for protocol in ('delta', 'cumulative'):
+        frames = _record_frames(protocol, tokens)
+        print(f"\n协议: {protocol}, 答案长度: {len(answer)} 字符, 帧数: {len(frames)}")
+        print(f"{'编码':<20}{'us/事件':>10}{'字节/答案':>14}")
+        for name, encoder in encoders:
+            size = 0
+            for frame in frames:
+                text, binary = encoder.encode(frame)
+                size += len(binary) if binary is not None else len(text.encode('utf-8'))
+
+            started = time.process_time()
+            for _ in range(repeat):
+                for frame in frames:
+                    encoder.encode(frame)
+            per_event = (time.process_time() - started) / (repeat * len(frames)) * 1e6
+            print(f"{name:<20}{per_event:>10.2f}{size:>14,}")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
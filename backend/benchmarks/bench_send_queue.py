@@ -0,0 +1,75 @@
+"""
+WebSocket发送队列基准
+
+模拟弱网客户端（每帧写出耗时固定），生产端按token逐个推送一次答案（不做时间窗口合并），比较：
+- 无队列: 生产端直接等待写出
+- coalesce / drop: 经有界发送队列写出（上限 CHAT_WS_SEND_QUEUE_MAX_FRAMES 帧）
+输出生产端推送完答案的耗时、客户端收齐最终答案的耗时、写出的帧数和字节数，以及队列高水位。
+
+运行: python -m benchmarks.bench_send_queue [答案长度] [每帧写出毫秒] [队列上限] [协议]
+"""
+
+import asyncio
+import sys
+import time
+
+from benchmarks._harness import setup_django, LoopbackChannelLayer, make_consumer, sample_answer
+
+
+async def _scenario(policy, tokens, write_ms, max_frames, protocol):
+    from crewaiplatform.outbound_queue import OutboundQueue
+
+    consumer = make_consumer(LoopbackChannelLayer(), f'stream_protocol={protocol}'.encode())
+    done = asyncio.Event()
+
+    async def slow_send(text_data=None, bytes_data=None, close=False):
+        await asyncio.sleep(write_ms / 1000)
+        consumer.frames_sent += 1
+        consumer.bytes_sent += len(bytes_data if bytes_data is not None else text_data.encode('utf-8'))
+        if text_data is not None and '"answer_stream_complete"' in text_data:
+            done.set()
+
+    consumer.send = slow_send
+    if policy is not None:
+        consumer.send_queue = OutboundQueue(
+            consumer.write_frame, owner=policy, max_frames=max_frames, policy=policy, overflow_seconds=3600
+        )
+        consumer.send_queue.start()
+
+    stream = consumer.response_stream
+    started = time.perf_counter()
+    await stream.send_answer_stream_start()
+    for token in tokens:
+        await stream.send_answer_stream_update(token)
+    await stream.send_answer_stream_complete(''.join(tokens).strip())
+    produced = time.perf_counter() - started
+    await done.wait()
+    delivered = time.perf_counter() - started
+
+    high_water = consumer.send_queue.high_water if consumer.send_queue is not None else 0
+    if consumer.send_queue is not None:
+        await consumer.send_queue.close()
+    return produced, delivered, consumer.frames_sent, consumer.bytes_sent, high_water
+
+
+def run(length, write_ms, max_frames, protocol):
+    answer = sample_answer(length)
+    tokens = [answer[i:i + 4] for i in range(0, len(answer), 4)]
+
+    print(f"协议: {protocol}, token数: {len(tokens)}, 每帧写出: {write_ms} ms, 队列上限: {max_frames} 帧")
+    print(f"{'方式':<12}{'生产端(ms)':>12}{'收齐(ms)':>12}{'帧数':>8}{'字节':>12}{'高水位':>8}")
+    for name, policy in (('无队列', None), ('coalesce', 'coalesce'), ('drop', 'drop')):
+        produced, delivered, frames, size, high_water = asyncio.run(
+            _scenario(policy, tokens, write_ms, max_frames, protocol)
+        )
+        print(f"{name:<12}{produced * 1000:>12.0f}{delivered * 1000:>12.0f}{frames:>8}{size:>12,}{high_water:>8}")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 2.0,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 32,
+        sys.argv[4] if len(sys.argv) > 4 else 'cumulative',
+    )
@@ -0,0 +1,46 @@
+"""
+流式帧合并基准
+
+模拟LLM以固定间隔逐token输出（默认400个token，每5ms一个），
+比较不同合并窗口下通道层事件数、客户端帧数与字节数。
+
+运行: python -m benchmarks.bench_stream_coalescing [token数] [token间隔ms]
+"""
+
+import asyncio
+import sys
+
+from asgiref.sync import async_to_sync
+
+from benchmarks._harness import setup_django, LoopbackChannelLayer, make_consumer, sample_answer, timed
+
+
+async def _stream(producer, tokens, interval):
+    await producer.send_answer_stream_start()
+    for token in tokens:
+        await producer.send_answer_stream_update(token)
+        await asyncio.sleep(interval)
+    await producer.send_answer_stream_complete(''.join(tokens).strip())
+
+
+def run(token_count, interval_ms):
+    text = sample_answer(token_count * 4)
+    tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    print(f"token数: {len(tokens)}, token间隔: {interval_ms} ms")
+    print(f"{'窗口(ms)':>10}{'通道层事件':>12}{'客户端帧':>10}{'合并增量':>10}{'字节':>12}{'耗时(ms)':>10}")
+    for window in (0, 20, 40, 80):
+        layer = LoopbackChannelLayer()
+        client = make_consumer(layer, b'stream_protocol=delta', coalesce_window_ms=window)
+        _, elapsed = timed(async_to_sync(_stream), client, tokens, interval_ms / 1000.0)
+        stats = client.response_stream.stream_coalescer.stats()
+        print(f"{window:>10}{layer.event_count:>12}{client.frames_sent:>10}"
+              f"{stats['frames_coalesced']:>10}{client.bytes_sent:>12,}{elapsed * 1000:>10.0f}")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 400,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    )
@@ -0,0 +1,48 @@
+"""
+流式协议字节数基准
+
+模拟一次逐字符流式输出的答案（默认4000字符），分别统计：
+- cumulative（旧协议/兼容模式）每个答案下发到客户端的字节数
+- delta（协议v2）每个答案下发到客户端的字节数
+- 通道层在旧实现（推送累计内容）与新实现（推送增量）下传递的字符数
+
+运行: python -m benchmarks.bench_stream_protocol [答案长度]
+"""
+
+import sys
+
+from asgiref.sync import async_to_sync
+
+from benchmarks._harness import setup_django, LoopbackChannelLayer, make_consumer, sample_answer, timed
+
+
+async def _stream(producer, answer):
+    await producer.send_answer_stream_start()
+    for char in answer:
+        await producer.send_answer_stream_update(char)
+    await producer.send_answer_stream_complete(answer.strip())
+
+
+def run(length):
+    answer = sample_answer(length)
+
+    layer = LoopbackChannelLayer()
+    legacy = make_consumer(layer, b'stream_protocol=cumulative')
+    delta = make_consumer(layer, b'stream_protocol=delta')
+
+    _, elapsed = timed(async_to_sync(_stream), delta, answer)
+
+    # 旧实现每个字符都把累计内容放进通道层事件
+    legacy_layer_chars = sum(len(answer[:i].strip()) for i in range(1, len(answer) + 1)) + len(answer)
+
+    print(f"答案长度: {len(answer)} 字符, 事件数: {layer.event_count}, 耗时: {elapsed * 1000:.1f} ms")
+    print(f"{'':24}{'帧数':>10}{'字节/答案':>16}")
+    print(f"{'cumulative (兼容/旧)':24}{legacy.frames_sent:>10}{legacy.bytes_sent:>16,}")
+    print(f"{'delta (v2)':24}{delta.frames_sent:>10}{delta.bytes_sent:>16,}")
+    print(f"客户端字节缩减: {legacy.bytes_sent / max(delta.bytes_sent, 1):.1f}x")
+    print(f"通道层字符数: 旧 {legacy_layer_chars:,} -> 新 {layer.event_chars:,}")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4000)
@@ -0,0 +1,98 @@
+"""
+流式事件下发基准
+
+在进程内模拟一个只有一个连接的会话：AgentResponseStream 逐token下发答案增量（不合并帧），
+ChatConsumer 按连接协议编码后"发送"（不写网络）。分别测量经通道层群组转发（group）
+和直接调用连接的事件处理方法（direct）时每核每秒下发的token数（按进程CPU时间计算）。
+
+使用容量足够容纳全部事件的进程内通道层（不丢弃事件），不包含Redis通道层的网络往返，
+因此group的结果是群组转发开销的下限。
+
+运行: python -m benchmarks.bench_stream_send [token数] [轮数] [协议]
+"""
+
+import asyncio
+import sys
+import time
+
+from benchmarks._harness import setup_django
+
+
+async def _run_once(mode, tokens, protocol):
+    from channels.layers import InMemoryChannelLayer
+    from crewaiplatform.consumers import ChatConsumer
+    from crewaiplatform.group_subscribers import group_subscribers
+    from crewaiplatform.stream_protocol import AgentResponseStream
+
+    channel_layer = InMemoryChannelLayer(capacity=tokens + 10)
+    consumer = ChatConsumer()
+    consumer.scope = {'query_string': f'stream_protocol={protocol}'.encode()}
+    consumer.channel_layer = channel_layer
+    consumer.channel_name = await channel_layer.new_channel()
+    consumer.conversation_group_name = f'chat_bench_{id(consumer)}'
+    consumer.init_stream_state()
+
+    frames = 0
+    completed = asyncio.Event()
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        nonlocal frames
+        frames += 1
+        if '"answer_stream_complete"' in text_data:
+            completed.set()
+
+    consumer.send = send
+    await channel_layer.group_add(consumer.conversation_group_name, consumer.channel_name)
+    group_subscribers.add(consumer.conversation_group_name, consumer)
+
+    async def dispatch():
+        # 与Channels的接收循环相同：从通道层读取事件，经 consumer.dispatch 调用处理方法
+        while True:
+            await consumer.dispatch(await channel_layer.receive(consumer.channel_name))
+
+    dispatcher = asyncio.ensure_future(dispatch())
+    stream = AgentResponseStream(consumer)
+    stream.direct_send = mode == 'direct'
+    try:
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        await stream.send_answer_stream_start()
+        for index in range(tokens):
+            await stream.send_answer_stream_update('词')
+            if index % 50 == 0:
+                # 让出事件循环（真实场景中生产端在等待LLM输出）
+                await asyncio.sleep(0)
+        await stream.send_answer_stream_complete('词' * tokens)
+        await asyncio.wait_for(completed.wait(), 60)
+        cpu_seconds = time.process_time() - cpu_started
+        wall_seconds = time.perf_counter() - wall_started
+    finally:
+        dispatcher.cancel()
+        group_subscribers.discard(consumer.conversation_group_name, consumer)
+        await channel_layer.group_discard(consumer.conversation_group_name, consumer.channel_name)
+
+    return frames, tokens / max(cpu_seconds, 1e-9), tokens / max(wall_seconds, 1e-9)
+
+
+def run(tokens, rounds, protocol):
+    from django.test import override_settings
+
+    print(f"token数: {tokens}, 协议: {protocol}, 轮数: {rounds}（取最好的一轮）")
+    print(f"{'模式':<8}{'帧数':>10}{'tokens/s/core':>16}{'tokens/s':>12}")
+    results = {}
+    with override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0):
+        for mode in ('group', 'direct'):
+            runs = [asyncio.run(_run_once(mode, tokens, protocol)) for _ in range(max(rounds, 1))]
+            frames, per_core, per_second = max(runs, key=lambda run: run[1])
+            results[mode] = per_core
+            print(f"{mode:<8}{frames:>10}{per_core:>16.0f}{per_second:>12.0f}")
+
+    print(f"direct / group: {results['direct'] / results['group']:.2f}x")
+
+
+if __name__ == '__main__':
+    setup_django()
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 3,
+        sys.argv[3] if len(sys.argv) > 3 else 'delta',
+    )
@@ -24,7 +24,7 @@ class LLMModelAdmin(admin.ModelAdmin):
             'fields': ('langchain_class', 'api_base_url', 'api_key', 'api_version')
         }),
         ('模型参数', {
-            'fields': ('temperature', 'max_tokens', 'timeout', 'max_retries')
+            'fields': ('temperature', 'max_tokens', 'timeout', 'max_retries', 'max_rpm', 'max_concurrency')
         }),
         ('高级配置', {
             'fields': ('extra_kwargs', 'model_kwargs'),
@@ -102,13 +102,13 @@ class CrewAIAgentAdmin(admin.ModelAdmin):
             'fields': ('role', 'goal', 'backstory')
         }),
         ('LLM模型', {
-            'fields': ('llm_model', 'function_calling_llm')
+            'fields': ('llm_model', 'function_calling_llm', 'fallback_llm_models')
         }),
         ('执行控制', {
             'fields': ('verbose', 'memory', 'max_iter', 'max_rpm', 'max_execution_time', 'max_retry_limit')
         }),
         ('高级功能', {
-            'fields': ('allow_delegation', 'respect_context_window', 'use_system_prompt', 'multimodal', 'inject_date', 'date_format', 'reasoning', 'max_reasoning_attempts'),
+            'fields': ('allow_delegation', 'respect_context_window', 'context_token_budget', 'use_system_prompt', 'multimodal', 'inject_date', 'date_format', 'reasoning', 'max_reasoning_attempts'),
             'classes': ('collapse',)
         }),
         ('监控配置', {
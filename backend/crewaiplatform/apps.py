@@ -4,4 +4,8 @@ class CrewaiplatformConfig(AppConfig):
     """CrewAI Platform 应用配置"""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crewaiplatform'
-    verbose_name = 'CrewAI Platform'
\ No newline at end of file
+    verbose_name = 'CrewAI Platform'
+    
+    def ready(self):
+        """注册模型信号处理"""
+        from . import signals  # noqa: F401
@@ -18,14 +18,17 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crewaiplatform.settings")
 # 获取Django ASGI应用
 django_asgi_app = get_asgi_application()
 
-# 导入WebSocket路由和JWT认证中间件
-from .routing import websocket_urlpatterns
+# 导入WebSocket路由、SSE路由和JWT认证中间件
+from django.urls import re_path
+from .routing import websocket_urlpatterns, http_urlpatterns
 from .middleware import JWTAuthMiddlewareStack
 
 # ASGI应用配置
 application = ProtocolTypeRouter({
-    # HTTP请求使用Django处理
-    "http": django_asgi_app,
+    # SSE流式端点直接处理，其余HTTP请求使用Django处理
+    "http": URLRouter(
+        http_urlpatterns + [re_path(r'', django_asgi_app)]
+    ),
     
     # WebSocket请求使用JWT认证中间件
     "websocket": JWTAuthMiddlewareStack(
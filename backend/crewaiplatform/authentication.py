@@ -0,0 +1,57 @@
+"""
+JWT认证
+
+REST请求（DRF）、WebSocket连接和SSE端点共用的JWT认证：
+- 令牌只解码、校验一次：与DRF的 JWTAuthentication 相同，按 SIMPLE_JWT 的 AUTH_TOKEN_CLASSES
+  （访问令牌）校验签名、有效期和令牌类型
+- 用户经 user_cache 按ID加载，短时缓存，用户保存或删除时失效
+- 用户不存在、已停用（以及开启 CHECK_REVOKE_TOKEN 时密码已修改）与DRF一样认证失败
+"""
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .services.user_cache import user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """从缓存加载用户的JWT认证（DEFAULT_AUTHENTICATION_CLASSES）"""
+
+    def get_user(self, validated_token):
+        return self.check_user(validated_token, user_cache.get(self.get_user_id(validated_token)))
+
+    async def aget_user(self, validated_token):
+        return self.check_user(validated_token, await user_cache.aget(self.get_user_id(validated_token)))
+
+    def authenticate_token(self, raw_token):
+        """校验原始令牌并返回用户，失败时抛出 InvalidToken / AuthenticationFailed"""
+        return self.get_user(self.get_validated_token(raw_token))
+
+    async def aauthenticate_token(self, raw_token):
+        """authenticate_token 的异步版本（令牌校验不访问数据库，直接在事件循环中完成）"""
+        return await self.aget_user(self.get_validated_token(raw_token))
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def check_user(self, validated_token, user):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+
+jwt_authentication = CachedJWTAuthentication()
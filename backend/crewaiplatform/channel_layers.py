@@ -0,0 +1,630 @@
+"""
+不依赖Redis的多进程通道层
+
+InMemoryChannelLayer 只在进程内有效：一个进程生成的流式事件到不了另一个进程持有的WebSocket，
+只能运行一个ASGI进程。这里提供两种跨进程的通道层，在 settings.CHANNEL_LAYERS 中选择：
+
+IPCChannelLayer（同一主机上的多个ASGI/agent worker进程）
+- 每个进程在共享目录下监听Unix域套接字 <path>/<进程前缀>.sock，
+  进程专属通道名形如 specific.<进程前缀>!<随机串>，发送时按前缀找到所属进程
+- 群组成员保存在共享目录 <path>/groups/<群组>/<通道名>（空文件，修改时间为加入时间），
+  所有进程可见；group_send 按所属进程分组，每个进程只写一帧，由接收进程分发给本地成员
+- 连接不上的进程视为已退出，清除它的群组成员和套接字文件
+
+PostgresChannelLayer（多节点，使用 LISTEN/NOTIFY；实验性）
+- LISTEN/NOTIFY 收发、断线重连和切换事件循环的路径尚未在真实的PostgreSQL上验证，
+  生产环境优先使用 IPCChannelLayer（单主机）
+- 每个进程 LISTEN 自己的进程频道，以及本进程有成员的群组频道；
+  send/group_send 通过 pg_notify 发布，超过NOTIFY负载上限的消息在同一事务内分片发送
+- 群组成员只记录在本进程内，发布方自己的成员直接投递
+
+两者的本地投递、容量和过期规则与 InMemoryChannelLayer 相同。跨进程发送时接收方通道已满会
+丢弃消息（记入 channel_layer.dropped 指标），而不是向发送方抛出 ChannelFull。
+消息以JSON编码跨进程传递，事件中只能包含JSON可序列化的值。
+"""
+
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from typing import Dict, List, Optional
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class _ProcessChannelLayer(BaseChannelLayer):
+    """跨进程通道层的公共部分：进程专属通道名、本地队列与投递"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        # 进程前缀：标识本进程（本实例）持有的通道
+        self.client_prefix = uuid.uuid4().hex[:12]
+        # 通道名 -> asyncio.Queue[(过期时间, 消息)]
+        self.channels: Dict[str, asyncio.Queue] = {}
+        self._loop = None
+
+    @staticmethod
+    def channel_owner(channel: str) -> Optional[str]:
+        """进程专属通道所属的进程前缀（普通通道返回None）"""
+        if '!' not in channel:
+            return None
+        return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+    async def new_channel(self, prefix='specific'):
+        await self._start()
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        await self._start()
+
+        queue = self._queue(channel)
+        try:
+            while True:
+                expires_at, message = await queue.get()
+                if expires_at >= time.time():
+                    return message
+        finally:
+            if queue.empty():
+                self.channels.pop(channel, None)
+
+    async def flush(self):
+        self.channels = {}
+
+    # ---- 本地投递 ----
+
+    def _queue(self, channel: str) -> asyncio.Queue:
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _put(self, channel: str, message: dict):
+        """放入本地通道，通道已满时抛出 ChannelFull"""
+        try:
+            self._queue(channel).put_nowait((time.time() + self.expiry, message))
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+
+    def _deliver(self, channels: List[str], message: dict, shared: bool = False):
+        """
+        投递给本地通道，通道已满时丢弃
+
+        Args:
+            shared: 消息是否仍被调用方持有（是则每个通道投递一份副本）
+        """
+        for index, channel in enumerate(channels):
+            try:
+                self._put(channel, deepcopy(message) if shared or index else message)
+            except ChannelFull:
+                metrics.incr('channel_layer.dropped')
+                logger.debug(f"通道 {channel} 已满，丢弃消息 {message.get('type')}")
+
+    # ---- 事件循环 ----
+
+    async def _start(self):
+        """绑定当前事件循环并启动接收端"""
+        self._bind_loop()
+
+    def _bind_loop(self):
+        """
+        绑定当前事件循环
+
+        ASGI服务器和worker只有一个事件循环；async_to_sync 等在新的事件循环中调用时，
+        丢弃绑定在旧循环上的连接（之后按需重建），并把未读消息转移到新的队列
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None:
+            self._release_loop()
+            pending = self.channels
+            self.channels = {}
+            for channel, queue in pending.items():
+                for item in queue._queue:
+                    self._queue(channel).put_nowait(item)
+        self._loop = loop
+
+    def _release_loop(self):
+        """释放绑定在旧事件循环上的资源（子类实现）"""
+
+
+class IPCChannelLayer(_ProcessChannelLayer):
+    """
+    同一主机上多进程共享的通道层（Unix域套接字）
+
+    CONFIG:
+        path: 共享目录（同一主机上的所有进程必须一致，不同部署使用不同目录）
+    """
+
+    def __init__(self, path: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'crewai-channels')
+        self.groups_path = os.path.join(self.path, 'groups')
+        self.socket_path = os.path.join(self.path, f"{self.client_prefix}.sock")
+        self._server: Optional[asyncio.Task] = None
+        # 进程前缀 -> 到该进程的连接
+        self._peers: Dict[str, asyncio.StreamWriter] = {}
+        self._connect_lock: Optional[asyncio.Lock] = None
+        os.makedirs(self.groups_path, mode=0o700, exist_ok=True)
+
+    # ---- 通道层API ----
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        self._bind_loop()
+
+        owner = self.channel_owner(channel)
+        if owner is None or owner == self.client_prefix:
+            self._put(channel, deepcopy(message))
+        else:
+            await self._send_remote(owner, [channel], json.dumps(message, ensure_ascii=False))
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        member = os.path.join(self.groups_path, group, channel)
+        for attempt in range(3):
+            try:
+                with open(member, 'a'):
+                    pass
+                # 已是成员时刷新加入时间
+                os.utime(member)
+                return
+            except FileNotFoundError:
+                # 群组目录不存在（或刚被最后一个离开的成员删除）
+                if attempt == 2:
+                    raise
+                os.makedirs(os.path.dirname(member), exist_ok=True)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        directory = os.path.join(self.groups_path, group)
+        try:
+            os.unlink(os.path.join(directory, channel))
+            os.rmdir(directory)
+        except OSError:
+            # 成员不存在，或群组中还有其他成员
+            pass
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        self._bind_loop()
+
+        by_owner: Dict[str, List[str]] = {}
+        for channel in self._group_members(group):
+            owner = self.channel_owner(channel) or self.client_prefix
+            by_owner.setdefault(owner, []).append(channel)
+
+        encoded = None
+        for owner, channels in by_owner.items():
+            if owner == self.client_prefix:
+                self._deliver(channels, message, shared=True)
+                continue
+            if encoded is None:
+                encoded = json.dumps(message, ensure_ascii=False)
+            await self._send_remote(owner, channels, encoded)
+
+    async def flush(self):
+        await super().flush()
+        shutil.rmtree(self.groups_path, ignore_errors=True)
+        os.makedirs(self.groups_path, mode=0o700, exist_ok=True)
+
+    async def close(self):
+        """停止接收、断开到其他进程的连接，并移除本进程的群组成员"""
+        self._bind_loop()
+        self._release_loop()
+        self._forget_process(self.client_prefix)
+
+    # ---- 群组成员 ----
+
+    def _group_members(self, group: str) -> List[str]:
+        """群组当前的成员，顺便清除超过 group_expiry 的成员"""
+
+        directory = os.path.join(self.groups_path, group)
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return []
+
+        expired_before = time.time() - self.group_expiry
+        members = []
+        for entry in entries:
+            try:
+                joined_at = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if joined_at < expired_before:
+                self._unlink(entry.path)
+            else:
+                members.append(entry.name)
+        return members
+
+    def _forget_process(self, owner: str):
+        """移除某个进程的全部群组成员和套接字文件"""
+
+        marker = f".{owner}!"
+        try:
+            groups = list(os.scandir(self.groups_path))
+        except FileNotFoundError:
+            groups = []
+        for group in groups:
+            try:
+                members = list(os.scandir(group.path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for member in members:
+                if marker in member.name:
+                    self._unlink(member.path)
+        self._unlink(os.path.join(self.path, f"{owner}.sock"))
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # ---- 进程间传输 ----
+
+    async def _start(self):
+        """启动本进程的Unix域套接字服务（进程持有通道时才需要接收）"""
+
+        self._bind_loop()
+        if self._server is None:
+            self._server = asyncio.ensure_future(self._serve())
+        await self._server
+
+    async def _serve(self) -> asyncio.AbstractServer:
+        server = await asyncio.start_unix_server(self._serve_peer, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        return server
+
+    def _release_loop(self):
+        if self._server is not None and self._server.done() and not self._server.exception():
+            self._server.result().close()
+        self._server = None
+        for writer in self._peers.values():
+            try:
+                writer.close()
+            except RuntimeError:
+                # 旧事件循环已关闭
+                pass
+        self._peers = {}
+        self._connect_lock = None
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """读取其他进程发来的帧：4字节长度 + JSON {"c": [通道名], "m": 消息}"""
+
+        try:
+            while True:
+                size = int.from_bytes(await reader.readexactly(4), 'big')
+                frame = json.loads(await reader.readexactly(size))
+                self._deliver(frame['c'], frame['m'])
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # 对方断开，或本进程的事件循环正在关闭
+            pass
+        finally:
+            writer.close()
+
+    async def _send_remote(self, owner: str, channels: List[str], encoded_message: str):
+        """把消息写给目标进程；进程已退出时清除它的群组成员并丢弃消息"""
+
+        body = f'{{"c":{json.dumps(channels)},"m":{encoded_message}}}'.encode('utf-8')
+        for _ in range(2):
+            writer = self._peers.get(owner)
+            if writer is None or writer.is_closing():
+                writer = await self._connect(owner)
+                if writer is None:
+                    return
+            try:
+                writer.write(len(body).to_bytes(4, 'big') + body)
+                await writer.drain()
+                return
+            except ConnectionError:
+                # 连接已断开：重新连接一次，连不上说明进程已退出
+                self._peers.pop(owner, None)
+
+    async def _connect(self, owner: str) -> Optional[asyncio.StreamWriter]:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            writer = self._peers.get(owner)
+            if writer is not None and not writer.is_closing():
+                return writer
+            try:
+                _, writer = await asyncio.open_unix_connection(os.path.join(self.path, f"{owner}.sock"))
+            except (FileNotFoundError, ConnectionRefusedError):
+                logger.info(f"通道层进程 {owner} 已退出，清除其群组成员")
+                metrics.incr('channel_layer.peers_gone')
+                self._peers.pop(owner, None)
+                self._forget_process(owner)
+                return None
+            self._peers[owner] = writer
+            return writer
+
+
+# NOTIFY 负载上限为8000字节，留出分片头
+NOTIFY_PAYLOAD_LIMIT = 7900
+NOTIFY_CHUNK_CHARS = 1900
+
+
+class PostgresChannelLayer(_ProcessChannelLayer):
+    """
+    基于 PostgreSQL LISTEN/NOTIFY 的多节点通道层（实验性）
+
+    CONFIG:
+        database: 使用的Django数据库别名（默认 default），或
+        dsn: libpq连接串
+        prefix: 频道名前缀（同一数据库上的不同部署使用不同前缀）
+    """
+
+    def __init__(self, database: str = 'default', dsn: str = None, prefix: str = 'crewai', **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+        self.dsn = dsn
+        self.prefix = prefix
+        # 群组 -> {通道名: 加入时间}（本进程内的成员）
+        self.groups: Dict[str, Dict[str, float]] = {}
+        self._listen_conn = None
+        # 建立LISTEN连接的任务：并发的 _start（如一批重连的socket）共用同一个
+        self._listener: Optional[asyncio.Task] = None
+        self._notify_conn = None
+        self._listening = set()
+        # LISTEN/NOTIFY 都在同一个线程中执行，保证发布顺序
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pg-channel-layer')
+        self._message_ids = itertools.count()
+        # (发布进程, 消息ID) -> 已收到的分片
+        self._partial: Dict[tuple, List[str]] = {}
+
+    def process_channel(self, owner: str) -> str:
+        return f"{self.prefix}_p_{owner}"
+
+    def group_channel(self, group: str) -> str:
+        return f"{self.prefix}_g_{hashlib.sha1(group.encode('utf-8')).hexdigest()[:24]}"
+
+    # ---- 通道层API ----
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        self._bind_loop()
+
+        owner = self.channel_owner(channel)
+        if owner is None or owner == self.client_prefix:
+            self._put(channel, deepcopy(message))
+        else:
+            await self._notify(self.process_channel(owner), {'c': [channel], 'm': message})
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._start()
+
+        self.groups.setdefault(group, {})[channel] = time.time()
+        await self._listen(self.group_channel(group))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.pop(channel, None)
+        if not members:
+            del self.groups[group]
+            await self._unlisten(self.group_channel(group))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        self._bind_loop()
+
+        local = self._group_members(group)
+        if local:
+            self._deliver(local, message, shared=True)
+        # 其他进程是否有成员只有它们自己知道，总是发布
+        await self._notify(self.group_channel(group), {'g': group, 'm': message})
+
+    async def flush(self):
+        await super().flush()
+        self.groups = {}
+        for channel in list(self._listening):
+            if channel != self.process_channel(self.client_prefix):
+                await self._unlisten(channel)
+
+    async def close(self):
+        self._release_loop()
+        for conn in (self._listen_conn, self._notify_conn):
+            if conn is not None:
+                conn.close()
+        self._listen_conn = self._notify_conn = None
+        self._listening.clear()
+
+    def _group_members(self, group: str) -> List[str]:
+        members = self.groups.get(group)
+        if not members:
+            return []
+        expired_before = time.time() - self.group_expiry
+        for channel, joined_at in list(members.items()):
+            if joined_at < expired_before:
+                del members[channel]
+        return list(members)
+
+    # ---- 发布 ----
+
+    def _payloads(self, data: dict) -> List[str]:
+        """编码为NOTIFY负载：<发布进程>|<消息ID>|<分片序号>|<分片数>|<JSON分片>"""
+
+        encoded = json.dumps(data, ensure_ascii=False)
+        if len(encoded.encode('utf-8')) <= NOTIFY_PAYLOAD_LIMIT:
+            chunks = [encoded]
+        else:
+            chunks = [encoded[i:i + NOTIFY_CHUNK_CHARS] for i in range(0, len(encoded), NOTIFY_CHUNK_CHARS)]
+        message_id = next(self._message_ids)
+        return [
+            f"{self.client_prefix}|{message_id}|{index}|{len(chunks)}|{chunk}"
+            for index, chunk in enumerate(chunks)
+        ]
+
+    async def _notify(self, channel: str, data: dict):
+        payloads = self._payloads(data)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._notify_sync, channel, payloads)
+
+    def _notify_sync(self, channel: str, payloads: List[str]):
+        # 同一事务内的通知连续送达，分片不会与其他消息交错
+        for attempt in range(2):
+            try:
+                if self._notify_conn is None or self._notify_conn.closed:
+                    self._notify_conn = self._connect()
+                with self._notify_conn.cursor() as cursor:
+                    for payload in payloads:
+                        cursor.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+                self._notify_conn.commit()
+                return
+            except self._database_errors() as e:
+                self._notify_conn = None
+                if attempt:
+                    raise
+                logger.warning(f"通道层NOTIFY失败，重新连接: {e}")
+
+    # ---- 接收 ----
+
+    async def _start(self):
+        self._bind_loop()
+        if self._listener is None:
+            self._listener = asyncio.ensure_future(self._open_listen())
+        await self._listener
+
+    async def _open_listen(self):
+        """建立LISTEN连接并恢复已监听的频道"""
+
+        try:
+            conn = await asyncio.get_running_loop().run_in_executor(self._executor, self._connect, True)
+        except Exception:
+            # 下一次 _start 重新连接
+            self._listener = None
+            raise
+        self._listen_conn = conn
+        self._loop.add_reader(conn.fileno(), self._on_notify)
+        channels = self._listening | {self.process_channel(self.client_prefix)}
+        self._listening = set()
+        for channel in channels:
+            await self._listen(channel)
+
+    def _release_loop(self):
+        if self._listen_conn is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self._listen_conn.fileno())
+        if self._listen_conn is not None:
+            # 新的事件循环中重新连接并恢复 LISTEN
+            self._listen_conn.close()
+            self._listen_conn = None
+        self._listener = None
+
+    async def _listen(self, channel: str):
+        if channel in self._listening:
+            return
+        self._listening.add(channel)
+        await self._execute_listen(f'LISTEN "{channel}"')
+
+    async def _unlisten(self, channel: str):
+        if channel not in self._listening:
+            return
+        self._listening.discard(channel)
+        await self._execute_listen(f'UNLISTEN "{channel}"')
+
+    async def _execute_listen(self, sql: str):
+        if self._listen_conn is None:
+            return
+
+        def execute():
+            with self._listen_conn.cursor() as cursor:
+                cursor.execute(sql)
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, execute)
+
+    def _on_notify(self):
+        conn = self._listen_conn
+        try:
+            conn.poll()
+        except self._database_errors() as e:
+            logger.error(f"通道层LISTEN连接断开，重新连接: {e}")
+            self._loop.remove_reader(conn.fileno())
+            self._listen_conn = None
+            self._listener = None
+            asyncio.ensure_future(self._start())
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            self._handle_payload(notify.payload)
+
+    def _handle_payload(self, payload: str):
+        """处理一条NOTIFY负载，分片收齐后投递"""
+
+        sender, message_id, index, total, chunk = payload.split('|', 4)
+        if sender == self.client_prefix:
+            # 本进程发布的群组消息已直接投递
+            return
+        if total != '1':
+            parts = self._partial.setdefault((sender, message_id), [])
+            parts.append(chunk)
+            if len(parts) < int(total):
+                return
+            del self._partial[(sender, message_id)]
+            chunk = ''.join(parts)
+
+        data = json.loads(chunk)
+        channels = self._group_members(data['g']) if 'g' in data else data['c']
+        if channels:
+            self._deliver(channels, data['m'])
+
+    # ---- 数据库连接 ----
+
+    def _connect(self, autocommit: bool = False):
+        import psycopg2
+
+        if self.dsn:
+            conn = psycopg2.connect(self.dsn)
+        else:
+            from django.conf import settings
+
+            database = settings.DATABASES[self.database]
+            conn = psycopg2.connect(
+                dbname=database.get('NAME'),
+                user=database.get('USER'),
+                password=database.get('PASSWORD'),
+                host=database.get('HOST') or None,
+                port=database.get('PORT') or None,
+            )
+        conn.autocommit = autocommit
+        return conn
+
+    @staticmethod
+    def _database_errors():
+        import psycopg2
+
+        return psycopg2.Error
@@ -0,0 +1,116 @@
+"""
+WebSocket连接的会话上下文
+
+ChatConsumer 原本每条消息都重新查询会话（connect 时已经校验过同一个会话），
+AgentReplyService.select_agent 随后又按主要Agent查询一次Agent和LLM模型。
+
+ConnectionContext 在连接时用一次JOIN查询加载会话、主要Agent及其LLM模型，之后的消息直接复用；
+select_agent 遇到已预加载的可用主要Agent（conversation.preloaded_agent）时不再查询。每条消息因此少两次查询。
+
+失效：会话、Agent或LLM模型保存/删除后（事务提交时），信号通过channel layer向相关群组发送
+只含模型名和ID的 chat.context 事件：
+- 会话变更 → 会话群组 chat_<会话ID>
+- Agent变更 → Agent群组 chat_agent_<AgentID>（连接加入其会话主要Agent的群组）
+- LLM模型变更 → 使用该模型的各Agent群组（提交后才查询这些Agent；只更新验证信息时不通知）
+收到事件的连接把上下文标记为过期，下一条消息时重新加载（主要Agent变化时随之切换Agent群组）。
+"""
+
+import logging
+from typing import Callable, Iterable, Optional, Union
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+
+from .metrics import metrics
+from .models import ChatConversation
+
+
+logger = logging.getLogger(__name__)
+
+
+# 上下文失效事件（ChatConsumer.chat_context 处理）
+CONTEXT_EVENT = 'chat.context'
+
+
+def agent_group_name(agent_id) -> str:
+    return f'chat_agent_{agent_id}'
+
+
+class ConnectionContext:
+    """一个WebSocket连接的会话、主要Agent和LLM模型"""
+
+    def __init__(self, conversation_id, user):
+        self.conversation_id = conversation_id
+        self.user = user
+        self.conversation: Optional[ChatConversation] = None
+        # 加载期间收到的失效事件不能被这次加载覆盖：按版本号判断是否需要重新加载
+        self._version = 1
+        self._loaded_version = 0
+
+    @property
+    def agent_id(self):
+        return self.conversation.primary_agent_id if self.conversation is not None else None
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_version != self._version
+
+    async def get(self) -> Optional[ChatConversation]:
+        """返回会话（不存在或无权限时为None），过期时重新加载"""
+
+        while self.stale:
+            version = self._version
+            self.conversation = await database_sync_to_async(self.load)()
+            self._loaded_version = version
+            metrics.incr('chat.connection_context.loads')
+        return self.conversation
+
+    def invalidate(self):
+        self._version += 1
+
+    def load(self) -> Optional[ChatConversation]:
+        try:
+            conversation = ChatConversation.objects.select_related('primary_agent__llm_model').get(
+                id=self.conversation_id,
+                user=self.user
+            )
+        except ChatConversation.DoesNotExist:
+            # 调试：检查会话是否存在但用户不匹配
+            try:
+                existing = ChatConversation.objects.get(id=self.conversation_id)
+                logger.warning(f"会话{self.conversation_id}存在但用户不匹配: 会话用户ID={existing.user_id}, 当前用户ID={self.user.id}")
+            except ChatConversation.DoesNotExist:
+                logger.warning(f"会话{self.conversation_id}不存在")
+            return None
+        # 供 AgentReplyService.select_agent 直接使用，上下文失效后随会话一起重新加载
+        conversation.preloaded_agent = conversation.primary_agent
+        return conversation
+
+
+def notify_context_changed(groups: Union[Iterable[str], Callable[[], Iterable[str]]], model: str, pk):
+    """
+    事务提交后向各群组发送上下文失效事件（由模型信号调用）
+
+    groups 需要查询才能得到时传入返回群组的函数，在事务提交后、确认配置了channel layer时才调用
+    """
+
+    if not callable(groups):
+        groups = list(groups)
+        if not groups:
+            return
+
+    def send():
+        try:
+            from asgiref.sync import async_to_sync
+            from channels.layers import get_channel_layer
+
+            channel_layer = get_channel_layer()
+            if channel_layer is None:
+                return
+            for group in (groups() if callable(groups) else groups):
+                async_to_sync(channel_layer.group_send)(group, {'type': CONTEXT_EVENT, 'model': model, 'id': pk})
+        except Exception as e:
+            # 失效事件发送失败时，连接继续使用旧的上下文直到重连
+            logger.warning(f"发送上下文失效事件失败: {model} {pk}, {e}")
+
+    transaction.on_commit(send)
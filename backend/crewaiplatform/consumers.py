@@ -5,23 +5,42 @@ WebSocket消费者
 - 实时消息推送
 - 任务状态更新
 - Agent响应流式输出
+
+事件按连接协商的帧编码下发（JSON/MessagePack/deflate，见 frame_encoding）。
+会话、主要Agent和LLM模型在连接时加载一次，变更后按失效事件重新加载（见 connection_context）。
+连接建立后帧经有界发送队列写出，慢客户端不阻塞事件处理和Agent回复（见 outbound_queue）。
 """
 
-import json
+import asyncio
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import ChatConversation, ChatMessage, ChatAgentTask
+from .connection_context import ConnectionContext, agent_group_name
+from .frame_encoding import FrameDecodeError, FrameEncodingMixin
+from .group_subscribers import SUBSCRIBER_EVENT, group_subscribers
+from .outbound_queue import SLOW_CLIENT_CLOSE_CODE, OutboundQueue
+from .models import ChatMessage, ChatAgentTask
+from .stream_protocol import (
+    STREAM_PROTOCOL_VERSION,
+    AgentResponseStream,
+    StreamEventEncoder,
+    resolve_stream_protocol,
+)
+from .task_registry import TaskRegistry, agent_task_cancellation
 
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(FrameEncodingMixin, AsyncWebsocketConsumer):
     """聊天WebSocket消费者"""
     
+    # 连接建立后的有界发送队列（未启用时直接写出）
+    send_queue = None
+    
     async def connect(self):
         """建立WebSocket连接"""
         
@@ -31,6 +50,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # 获取会话ID
             self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
             self.user = self.scope['user']
+            self.context = ConnectionContext(self.conversation_id, self.user)
+            
+            self.init_stream_state()
             
             logger.info(f"会话ID: {self.conversation_id}, 用户: {self.user}")
             
@@ -66,20 +88,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.conversation_group_name,
                 self.channel_name
             )
+            # 登记本进程内的订阅者，并通知其他进程的订阅者（用于直接下发的判断）
+            group_subscribers.add(self.conversation_group_name, self)
+            await self.channel_layer.group_send(self.conversation_group_name, {
+                'type': SUBSCRIBER_EVENT,
+                'event': 'joined',
+                'channel': self.channel_name,
+            })
+            # 加入主要Agent的群组，接收Agent及其LLM模型的变更事件
+            await self.follow_agent_group()
             
             logger.info("成功加入会话群组，接受连接")
             
-            # 接受连接
-            await self.accept()
+            # 接受连接（通过子协议协商帧编码时回应选中的子协议）
+            await self.accept(subprotocol=self.frame_subprotocol)
+            self.start_send_queue()
             
             logger.info("连接已接受，发送成功消息")
             
             # 发送连接成功消息
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'connection_established',
                 'conversation_id': self.conversation_id,
+                'stream_protocol': self.stream_protocol,
+                'protocol_version': STREAM_PROTOCOL_VERSION,
+                'encoding': self.frame_encoder.encoding,
                 'message': '连接成功'
-            }))
+            })
             
             logger.info(f"用户 {self.user.username} 成功连接到会话 {self.conversation_id}")
             
@@ -92,23 +127,82 @@ class ChatConsumer(AsyncWebsocketConsumer):
             except:
                 pass
     
+    def start_send_queue(self):
+        """启用有界发送队列（CHAT_WS_SEND_QUEUE_MAX_FRAMES 为0时不启用，帧直接写出）"""
+        
+        if getattr(settings, 'CHAT_WS_SEND_QUEUE_MAX_FRAMES', 256) <= 0:
+            return
+        self.send_queue = OutboundQueue(
+            self.write_frame,
+            on_overflow=self.close_slow_client,
+            owner=f"会话 {self.conversation_id} 连接 {self.channel_name}",
+        )
+        self.send_queue.start()
+    
+    async def send_frame(self, data: dict):
+        """下发一帧：经发送队列时只入队，不等待客户端"""
+        
+        if self.send_queue is not None:
+            self.send_queue.put(data)
+        else:
+            await self.write_frame(data)
+    
+    async def close_slow_client(self):
+        """发送队列持续超限：断开跟不上的客户端"""
+        
+        try:
+            await self.close(code=SLOW_CLIENT_CLOSE_CODE)
+        except Exception as e:
+            logger.warning(f"关闭慢客户端连接失败: {e}")
+    
+    def init_stream_state(self):
+        """初始化流式协议状态：连接默认的响应流、按协议编码帧的编码器、帧编码以及后台任务注册表"""
+        
+        self.init_frame_encoding()
+        self.stream_protocol = resolve_stream_protocol(self.scope)
+        self.stream_encoder = StreamEventEncoder(self.stream_protocol)
+        self.response_stream = AgentResponseStream(self)
+        self.agent_tasks = TaskRegistry(owner=f"会话 {getattr(self, 'conversation_id', '')}")
+    
     async def disconnect(self, close_code):
         """断开WebSocket连接"""
         
+        if self.send_queue is not None:
+            await self.send_queue.close()
+            logger.info(f"{self.send_queue.owner} 发送队列统计: {self.send_queue.stats()}")
+        
         # 离开会话群组
+        remaining_subscribers = 0
         if hasattr(self, 'conversation_group_name'):
             await self.channel_layer.group_discard(
                 self.conversation_group_name,
                 self.channel_name
             )
+            remaining_subscribers = group_subscribers.discard(self.conversation_group_name, self)
+            await self.channel_layer.group_send(self.conversation_group_name, {
+                'type': SUBSCRIBER_EVENT,
+                'event': 'left',
+                'channel': self.channel_name,
+            })
+        if getattr(self, 'agent_group_name', None):
+            await self.channel_layer.group_discard(self.agent_group_name, self.channel_name)
+        
+        # 按策略取消本连接仍在运行的Agent响应，取消时保存部分答案
+        if hasattr(self, 'agent_tasks'):
+            policy = getattr(settings, 'CHAT_CANCEL_ON_DISCONNECT', 'always')
+            if policy == 'always' or (policy == 'last_subscriber' and remaining_subscribers == 0):
+                await self.agent_tasks.cancel_all(reason='disconnect')
+            elif len(self.agent_tasks):
+                logger.info(f"{self.agent_tasks.owner} 仍有其他订阅者，{len(self.agent_tasks)} 个回复继续生成")
+            self.response_stream.discard()
         
         logger.info(f"用户 {self.user.username if hasattr(self, 'user') else 'Unknown'} 断开连接，代码: {close_code}")
     
-    async def receive(self, text_data):
-        """接收WebSocket消息"""
+    async def receive(self, text_data=None, bytes_data=None):
+        """接收WebSocket消息（JSON文本帧，或与下发编码相同的二进制帧）"""
         
         try:
-            data = json.loads(text_data)
+            data = self.frame_encoder.decode(text_data, bytes_data)
             message_type = data.get('type')
             
             # 根据消息类型处理
@@ -120,11 +214,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self.handle_typing_stop(data)
             elif message_type == 'ping':
                 await self.handle_ping(data)
+            elif message_type == 'cancel_task':
+                await self.handle_cancel_task(data)
             else:
                 await self.send_error(f"未知的消息类型: {message_type}")
                 
-        except json.JSONDecodeError:
-            await self.send_error("无效的JSON格式")
+        except FrameDecodeError:
+            await self.send_error("无效的消息格式")
         except Exception as e:
             logger.error(f"处理WebSocket消息失败: {e}")
             await self.send_error(f"处理消息失败: {str(e)}")
@@ -138,25 +234,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
         
         try:
-            # 获取会话
+            # 获取会话（连接上下文，变更后重新加载）
             conversation = await self.get_conversation()
             if not conversation:
                 await self.send_error("会话不存在")
                 return
+            await self.follow_agent_group()
             
             # 创建用户消息
             user_message = await self.create_user_message(conversation, content)
             
-            # 广播新消息
-            await self.channel_layer.group_send(
+            # 广播新消息（唯一订阅者时直接下发，与随后的流式事件保持顺序）
+            await group_subscribers.group_send(
+                self.channel_layer,
                 self.conversation_group_name,
                 {
                     'type': 'new_message',
                     'message': await self.serialize_message(user_message)
-                }
+                },
+                producer=self
             )
             
-            # 触发Agent处理（这里使用简单的模拟）
+            # 在后台触发Agent处理，立即返回接收循环
             await self.trigger_agent_response(conversation, user_message)
             
         except Exception as e:
@@ -166,103 +265,175 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def handle_typing_start(self, data):
         """处理开始输入事件"""
         
-        await self.channel_layer.group_send(
+        await group_subscribers.group_send(
+            self.channel_layer,
             self.conversation_group_name,
             {
                 'type': 'typing_status',
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'is_typing': True
-            }
+            },
+            producer=self
         )
     
     async def handle_typing_stop(self, data):
         """处理停止输入事件"""
         
-        await self.channel_layer.group_send(
+        await group_subscribers.group_send(
+            self.channel_layer,
             self.conversation_group_name,
             {
                 'type': 'typing_status',
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'is_typing': False
-            }
+            },
+            producer=self
         )
     
+    async def handle_cancel_task(self, data):
+        """处理取消任务请求：中断正在生成的回复并保存部分答案"""
+        
+        task_id = data.get('task_id')
+        if not task_id:
+            await self.send_error("缺少task_id")
+            return
+        
+        task = await self.get_agent_task(task_id)
+        if not task:
+            await self.send_error("任务不存在")
+            return
+        if task.status not in ['pending', 'running']:
+            await self.send_error("只能取消待执行或执行中的任务")
+            return
+        
+        from .services import ChatAgentTaskService
+        
+        if not agent_task_cancellation.cancel(task.id, 'websocket'):
+            # 任务不在本进程运行：通知其他进程并直接标记为已取消
+            await database_sync_to_async(ChatAgentTaskService.request_cancel)(task, 'websocket')
+        
+        await self.send_frame({
+            'type': 'task_cancel_requested',
+            'task_id': task.id
+        })
+    
     async def handle_ping(self, data):
         """处理心跳包"""
         
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'pong',
             'timestamp': data.get('timestamp')
-        }))
+        })
     
     async def new_message(self, event):
         """广播新消息"""
         
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'new_message',
             'message': event['message']
-        }))
+        })
+    
+    async def chat_subscriber(self, event):
+        """其他连接加入/离开会话群组：记录其他进程的订阅者，并回复本进程的订阅"""
+        
+        group = self.conversation_group_name
+        channel = event['channel']
+        if group_subscribers.is_local(group, channel):
+            return
+        if event['event'] == 'left':
+            group_subscribers.remote_left(group, channel)
+            return
+        group_subscribers.remote_joined(group, channel)
+        if event['event'] == 'joined':
+            await self.channel_layer.send(channel, {
+                'type': SUBSCRIBER_EVENT,
+                'event': 'present',
+                'channel': self.channel_name,
+            })
     
     async def typing_status(self, event):
         """广播输入状态"""
         
         # 不向自己发送输入状态
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'typing_status',
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'is_typing': event['is_typing']
-            }))
+            })
     
     async def agent_thinking(self, event):
         """广播Agent思考状态"""
         
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'agent_thinking',
             'agent_id': event['agent_id'],
             'agent_name': event['agent_name'],
             'is_thinking': event['is_thinking']
-        }))
+        })
     
     async def task_status_update(self, event):
         """广播任务状态更新"""
         
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'task_status_update',
             'task': event['task']
-        }))
+        })
     
-    async def send_error(self, error_message):
-        """发送错误消息并清理状态"""
+    async def chat_context(self, event):
+        """会话、Agent或LLM模型已变更：下一条消息时重新加载上下文"""
         
-        # 清理所有状态
-        await self.send_thinking_status(False, '')
+        self.context.invalidate()
+    
+    async def agent_task_cancel(self, event):
+        """其他进程请求取消任务：在本进程内运行时中断"""
         
-        await self.send(text_data=json.dumps({
+        agent_task_cancellation.cancel(event['task_id'], event.get('reason', 'api'))
+    
+    async def send_error(self, error_message, stream: AgentResponseStream = None):
+        """发送错误消息；指定响应流时同时结束该流并清除思考状态"""
+        
+        if stream is not None:
+            await stream.abort()
+        
+        await self.send_frame({
             'type': 'error',
             'message': error_message
-        }))
+        })
+    
+    async def get_conversation(self):
+        """获取会话对象（预加载主要Agent及其LLM模型），上下文失效后重新加载"""
+        
+        return await self.context.get()
+    
+    async def follow_agent_group(self):
+        """加入会话当前主要Agent的群组（主要Agent变化时退出原群组）"""
+        
+        agent_id = self.context.agent_id
+        group = agent_group_name(agent_id) if agent_id else None
+        current = getattr(self, 'agent_group_name', None)
+        if group == current:
+            return
+        if current:
+            await self.channel_layer.group_discard(current, self.channel_name)
+        if group:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.agent_group_name = group
     
     @database_sync_to_async
-    def get_conversation(self):
-        """获取会话对象"""
+    def get_agent_task(self, task_id):
+        """获取本会话的Agent任务"""
         
         try:
-            conversation = ChatConversation.objects.select_related('primary_agent').get(
-                id=self.conversation_id,
-                user=self.user
+            return ChatAgentTask.objects.get(
+                id=task_id,
+                conversation_id=self.conversation_id,
+                conversation__user=self.user
             )
-            return conversation
-        except ChatConversation.DoesNotExist:
-            # 调试：检查会话是否存在但用户不匹配
-            try:
-                existing = ChatConversation.objects.get(id=self.conversation_id)
-                logger.warning(f"会话{self.conversation_id}存在但用户不匹配: 会话用户ID={existing.user_id}, 当前用户ID={self.user.id}")
-            except ChatConversation.DoesNotExist:
-                logger.warning(f"会话{self.conversation_id}不存在")
+        except (ChatAgentTask.DoesNotExist, ValueError):
             return None
     
     @database_sync_to_async
@@ -307,150 +478,103 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }
     
     async def trigger_agent_response(self, conversation, user_message):
-        """触发Agent响应（使用真实的LangChain Agent服务）"""
+        """在后台任务中触发Agent响应，不阻塞接收循环"""
+        
+        if not conversation.primary_agent:
+            # 没有配置Agent
+            await self.send_error("该会话没有配置Agent，请先选择一个Agent。")
+            return
+        
+        max_inflight = getattr(settings, 'CHAT_MAX_INFLIGHT_RESPONSES_PER_CONNECTION', 3)
+        if len(self.agent_tasks) >= max_inflight:
+            await self.send_error(f"当前已有 {len(self.agent_tasks)} 个回复正在生成，请稍后再试")
+            return
+        
+        stream = AgentResponseStream(self)
+        stream.task_key = self.agent_tasks.start(self.run_agent_response(user_message, stream))
+    
+    async def run_agent_response(self, user_message, stream: AgentResponseStream):
+        """执行Agent响应（使用真实的LangChain Agent服务），错误通过流事件报告"""
         
         try:
-            agent = conversation.primary_agent
-            if agent:
-                # 1. 发送思考状态开始
-                await self.send_thinking_status(True, '正在分析您的问题...')
-                
-                try:
-                    # 2. 使用真实的SimpleAgentService处理消息，传递WebSocket消费者实例
-                    from .services import SimpleAgentService
-                    
-                    # 直接使用WebSocket专用的处理方法
-                    await SimpleAgentService.process_user_message_with_websocket(user_message, self)
-                    
-                except Exception as e:
-                    logger.error(f"Agent处理失败: {e}")
-                    
-                    # 3. 确保在错误情况下清理状态
-                    await self.send_thinking_status(False, '')
-                    await self.send_error(f"Agent响应失败: {str(e)}")
-                    
-            else:
-                # 没有配置Agent
-                await self.send_error("该会话没有配置Agent，请先选择一个Agent。")
-                
+            # 1. 发送思考状态开始
+            await stream.send_thinking_status(True, '正在分析您的问题...')
+            
+            # 2. 使用真实的SimpleAgentService处理消息，传递本次响应的流
+            from .services import SimpleAgentService
+            await SimpleAgentService.process_user_message_with_websocket(user_message, stream)
+            
+        except asyncio.CancelledError:
+            # 连接关闭：丢弃未下发的缓冲
+            stream.discard()
+            raise
         except Exception as e:
-            logger.error(f"触发Agent响应失败: {e}")
-            # 确保清理状态
-            await self.send_thinking_status(False, '')
-            await self.send_error(f"Agent响应失败: {str(e)}")
+            logger.error(f"Agent处理失败: {e}")
+            # 确保在错误情况下清理状态
+            await self.send_error(f"Agent响应失败: {str(e)}", stream=stream)
+        finally:
+            logger.info(f"{self.agent_tasks.owner} 流式帧统计: {stream.stream_coalescer.stats()}")
     
-    # WebSocket流式传输方法
+    # WebSocket流式传输方法（委托给连接默认的响应流，后台任务使用各自的响应流）
     async def send_thinking_status(self, is_thinking: bool, message: str):
-        """发送思考状态"""
-        await self.channel_layer.group_send(
-            self.conversation_group_name,
-            {
-                'type': 'thinking_status_update',
-                'is_thinking': is_thinking,
-                'message': message
-            }
-        )
+        await self.response_stream.send_thinking_status(is_thinking, message)
     
-    async def send_thinking_update(self, content: str):
-        """发送思考过程更新"""
-        await self.channel_layer.group_send(
-            self.conversation_group_name,
-            {
-                'type': 'thinking_content_update',
-                'content': content
-            }
-        )
+    async def send_thinking_update(self, delta: str):
+        await self.response_stream.send_thinking_update(delta)
     
     async def send_thinking_complete(self, thinking_content: str):
-        """发送思考完成"""
-        await self.channel_layer.group_send(
-            self.conversation_group_name,
-            {
-                'type': 'thinking_complete',
-                'content': thinking_content
-            }
-        )
+        await self.response_stream.send_thinking_complete(thinking_content)
     
     async def send_answer_stream_start(self):
-        """发送答案流开始"""
-        await self.channel_layer.group_send(
-            self.conversation_group_name,
-            {
-                'type': 'answer_stream_start'
-            }
-        )
+        await self.response_stream.send_answer_stream_start()
     
-    async def send_answer_stream_update(self, content: str):
-        """发送答案流更新"""
-        await self.channel_layer.group_send(
-            self.conversation_group_name,
-            {
-                'type': 'answer_stream_update',
-                'content': content
-            }
-        )
+    async def send_answer_stream_update(self, delta: str):
+        await self.response_stream.send_answer_stream_update(delta)
     
     async def send_answer_stream_complete(self, final_content: str):
-        """发送答案流完成"""
-        await self.channel_layer.group_send(
-            self.conversation_group_name,
-            {
-                'type': 'answer_stream_complete',
-                'content': final_content
-            }
-        )
+        await self.response_stream.send_answer_stream_complete(final_content)
     
-    # WebSocket事件处理方法
+    # WebSocket事件处理方法（思考/答案流按连接协议编码）
     async def thinking_status_update(self, event):
         """广播思考状态更新"""
-        await self.send(text_data=json.dumps({
-            'type': 'thinking_status_update',
-            'is_thinking': event['is_thinking'],
-            'message': event['message']
-        }))
+        await self._send_stream_event(event)
     
     async def thinking_content_update(self, event):
         """广播思考内容更新"""
-        await self.send(text_data=json.dumps({
-            'type': 'thinking_content_update',
-            'content': event['content']
-        }))
+        await self._send_stream_event(event)
     
     async def thinking_complete(self, event):
         """广播思考完成"""
-        await self.send(text_data=json.dumps({
-            'type': 'thinking_complete',
-            'content': event['content']
-        }))
+        await self._send_stream_event(event)
     
     async def answer_stream_start(self, event):
         """广播答案流开始"""
-        await self.send(text_data=json.dumps({
-            'type': 'answer_stream_start'
-        }))
+        await self._send_stream_event(event)
     
     async def answer_stream_update(self, event):
         """广播答案流更新"""
-        await self.send(text_data=json.dumps({
-            'type': 'answer_stream_update',
-            'content': event['content']
-        }))
+        await self._send_stream_event(event)
     
     async def answer_stream_complete(self, event):
         """广播答案流完成"""
-        await self.send(text_data=json.dumps({
-            'type': 'answer_stream_complete',
-            'content': event['content']
-        }))
+        await self._send_stream_event(event)
+    
+    async def _send_stream_event(self, event):
+        """按连接协议编码并下发流式事件"""
+        
+        frame = self.stream_encoder.encode(event)
+        if frame is not None:
+            await self.send_frame(frame)
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(FrameEncodingMixin, AsyncWebsocketConsumer):
     """通知消费者（用于全局通知）"""
     
     async def connect(self):
         """建立连接"""
         
         self.user = self.scope['user']
+        self.init_frame_encoding()
         
         # 验证用户认证
         if not self.user.is_authenticated:
@@ -464,13 +588,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        await self.accept()
+        await self.accept(subprotocol=self.frame_subprotocol)
         
         # 发送连接成功消息
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'connected',
             'message': '通知服务已连接'
-        }))
+        })
     
     async def disconnect(self, close_code):
         """断开连接"""
@@ -485,7 +609,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     async def notification_message(self, event):
         """发送通知消息"""
         
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'notification',
             'notification': event['notification']
-        }))
\ No newline at end of file
+        })
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+WebSocket帧编码
+
+ChatConsumer 和 NotificationConsumer 下发的每个事件按连接协商的编码写成一帧：
+- json（默认）: 文本帧，使用 orjson 编码（未安装时回退到标准库json），非ASCII字符不再转义为 \\uXXXX
+- msgpack: 二进制帧，MessagePack编码（需要 ormsgpack 或 msgpack）
+- deflate: 编码后不小于 CHAT_WS_DEFLATE_MIN_BYTES 字节的JSON压缩为二进制帧（raw deflate，
+  浏览器可用 DecompressionStream('deflate-raw') 解压），较小的事件仍是JSON文本帧
+
+客户端在连接时通过WebSocket子协议 crewai.<编码> 或查询参数 ?encoding=<编码> 选择，
+都未指定（或指定的编码不可用）时使用 settings.CHAT_WS_FRAME_ENCODING。
+通过子协议协商时，服务端在握手中回应选中的子协议。
+
+客户端发来的消息可以是JSON文本帧，也可以是与下发编码相同的二进制帧（json连接不接受二进制帧）。
+deflate帧解压后超过 CHAT_WS_MAX_INFLATED_BYTES 字节时拒绝，避免压缩炸弹耗尽内存。
+"""
+
+import json
+import zlib
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+FRAME_ENCODING_JSON = 'json'
+FRAME_ENCODING_MSGPACK = 'msgpack'
+FRAME_ENCODING_DEFLATE = 'deflate'
+FRAME_ENCODINGS = (FRAME_ENCODING_JSON, FRAME_ENCODING_MSGPACK, FRAME_ENCODING_DEFLATE)
+
+# 子协议名：crewai.json / crewai.msgpack / crewai.deflate
+SUBPROTOCOL_PREFIX = 'crewai.'
+
+
+class FrameDecodeError(ValueError):
+    """客户端帧无法按连接的编码解码"""
+
+
+def _load_msgpack():
+    """返回 (packb, unpackb)，未安装MessagePack库时返回None"""
+
+    try:
+        import ormsgpack
+        return ormsgpack.packb, ormsgpack.unpackb
+    except ImportError:
+        pass
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return (
+        lambda data: msgpack.packb(data, use_bin_type=True),
+        lambda payload: msgpack.unpackb(payload, raw=False),
+    )
+
+
+_msgpack = _load_msgpack()
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """当前环境可用的帧编码"""
+    if _msgpack is None:
+        return tuple(encoding for encoding in FRAME_ENCODINGS if encoding != FRAME_ENCODING_MSGPACK)
+    return FRAME_ENCODINGS
+
+
+def dumps_json(data) -> str:
+    """把事件编码为JSON文本（orjson优先，遇到它不支持的类型时回退到标准库json）"""
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False)
+
+
+def loads_json(text):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def resolve_frame_encoding(scope) -> Tuple[str, Optional[str]]:
+    """
+    解析连接请求的帧编码
+
+    Returns:
+        (编码, 需要在握手中回应的子协议；未通过子协议协商时为None)
+    """
+
+    available = available_encodings()
+    for subprotocol in scope.get('subprotocols') or ():
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX) and subprotocol[len(SUBPROTOCOL_PREFIX):] in available:
+            return subprotocol[len(SUBPROTOCOL_PREFIX):], subprotocol
+
+    query_string = scope.get('query_string', b'')
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode()
+    requested = parse_qs(query_string).get('encoding', [None])[0]
+    if requested in available:
+        return requested, None
+
+    default = getattr(settings, 'CHAT_WS_FRAME_ENCODING', FRAME_ENCODING_JSON)
+    return (default if default in available else FRAME_ENCODING_JSON), None
+
+
+class FrameEncoder:
+    """按连接的编码编码下发事件、解码客户端帧"""
+
+    def __init__(self, encoding: str = FRAME_ENCODING_JSON):
+        self.encoding = encoding
+        self.deflate_min_bytes = getattr(settings, 'CHAT_WS_DEFLATE_MIN_BYTES', 1024)
+        self.max_inflated_bytes = getattr(settings, 'CHAT_WS_MAX_INFLATED_BYTES', 1024 * 1024)
+
+    def encode(self, data: dict) -> Tuple[Optional[str], Optional[bytes]]:
+        """返回 (文本帧, 二进制帧)，其中一个为None"""
+
+        if self.encoding == FRAME_ENCODING_MSGPACK:
+            return None, _msgpack[0](data)
+
+        text = dumps_json(data)
+        if self.encoding == FRAME_ENCODING_DEFLATE and len(text) * 3 >= self.deflate_min_bytes:
+            payload = text.encode('utf-8')
+            if len(payload) >= self.deflate_min_bytes:
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+                return None, compressor.compress(payload) + compressor.flush()
+        return text, None
+
+    def decode(self, text_data: str = None, bytes_data: bytes = None) -> dict:
+        try:
+            if text_data is not None:
+                return loads_json(text_data)
+            if self.encoding == FRAME_ENCODING_MSGPACK:
+                return _msgpack[1](bytes_data)
+            if self.encoding == FRAME_ENCODING_DEFLATE:
+                return loads_json(self._inflate(bytes_data))
+        except (ValueError, TypeError, zlib.error) as e:
+            raise FrameDecodeError(str(e))
+        raise FrameDecodeError(f"{self.encoding} 连接不接受二进制帧")
+
+    def _inflate(self, bytes_data: bytes) -> bytes:
+        """解压客户端的deflate帧，解压后的大小不超过 max_inflated_bytes"""
+
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        payload = decompressor.decompress(bytes_data, self.max_inflated_bytes)
+        if decompressor.unconsumed_tail:
+            raise FrameDecodeError(f"解压后超过 {self.max_inflated_bytes} 字节")
+        return payload
+
+
+class FrameEncodingMixin:
+    """WebSocket消费者按连接协商的编码收发帧"""
+
+    def init_frame_encoding(self):
+        encoding, self.frame_subprotocol = resolve_frame_encoding(self.scope)
+        self.frame_encoder = FrameEncoder(encoding)
+
+    async def send_frame(self, data: dict):
+        await self.write_frame(data)
+
+    async def write_frame(self, data: dict):
+        """编码并写出一帧（ChatConsumer的发送队列由写任务调用）"""
+        text_data, bytes_data = self.frame_encoder.encode(data)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
@@ -0,0 +1,107 @@
+"""
+会话群组的订阅者跟踪与直接下发
+
+几乎每个会话只有一个连接：正在生成回复的那个连接。经 channel_layer.group_send 下发
+每个token意味着一次群组查找、一次消息复制和一次队列中转。
+
+GroupSubscribers 记录本进程内每个会话群组的订阅连接，并通过群组内的 chat.subscriber 事件
+得知其他进程的订阅连接：连接加入时广播 joined，其他进程的成员直接回复 present，
+断开时广播 left。生产端所在的连接是群组在本进程内唯一的订阅者、且没有其他进程的订阅者时，
+直接调用该连接的事件处理方法；否则回退到 group_send。
+
+一次响应回退到群组后不再切回直接下发（见 AgentResponseStream），
+避免群组中排队的事件被之后直接下发的事件超过。
+"""
+
+from typing import Dict, Optional, Set
+
+from .metrics import metrics
+
+
+# 订阅者变化事件的类型（经通道层分发到 ChatConsumer.chat_subscriber）
+SUBSCRIBER_EVENT = 'chat.subscriber'
+
+
+class GroupSubscribers:
+    """进程级的会话群组订阅者注册表"""
+
+    def __init__(self):
+        # 群组 -> {channel_name: 本进程内的连接}
+        self._local: Dict[str, Dict[str, object]] = {}
+        # 群组 -> 其他进程的订阅连接（channel_name）
+        self._remote: Dict[str, Set[str]] = {}
+
+    def add(self, group: str, consumer):
+        """登记本进程内的订阅连接"""
+        self._local.setdefault(group, {})[consumer.channel_name] = consumer
+
+    def discard(self, group: str, consumer) -> int:
+        """移除本进程内的订阅连接，返回本进程内剩余的订阅数"""
+
+        local = self._local.get(group)
+        if local is None:
+            return 0
+        local.pop(consumer.channel_name, None)
+        if not local:
+            del self._local[group]
+            # 本进程不再订阅该群组，也不会再收到其他进程的订阅者变化
+            self._remote.pop(group, None)
+            return 0
+        return len(local)
+
+    def local_count(self, group: str) -> int:
+        return len(self._local.get(group, ()))
+
+    def remote_count(self, group: str) -> int:
+        return len(self._remote.get(group, ()))
+
+    def is_local(self, group: str, channel_name: str) -> bool:
+        return channel_name in self._local.get(group, ())
+
+    def remote_joined(self, group: str, channel_name: str):
+        if group in self._local:
+            self._remote.setdefault(group, set()).add(channel_name)
+
+    def remote_left(self, group: str, channel_name: str):
+        remote = self._remote.get(group)
+        if remote is not None:
+            remote.discard(channel_name)
+            if not remote:
+                del self._remote[group]
+
+    def sole_subscriber(self, group: str) -> Optional[object]:
+        """群组只有本进程内的一个订阅连接时返回该连接"""
+
+        local = self._local.get(group)
+        if not local or len(local) != 1 or self._remote.get(group):
+            return None
+        return next(iter(local.values()))
+
+    async def send_direct(self, producer, group: str, event: dict) -> bool:
+        """
+        生产端是群组唯一的订阅者时直接调用其事件处理方法
+
+        Returns:
+            是否已直接下发（False时调用方应使用 group_send）
+        """
+
+        if producer is None or self.sole_subscriber(group) is not producer:
+            return False
+        await getattr(producer, event['type'].replace('.', '_'))(event)
+        metrics.incr('chat.stream.direct_sends')
+        return True
+
+    async def group_send(self, channel_layer, group: str, event: dict, producer=None) -> bool:
+        """优先直接下发，否则经通道层广播；返回是否为直接下发"""
+
+        if await self.send_direct(producer, group, event):
+            return True
+        await channel_layer.group_send(group, event)
+        return False
+
+    def clear(self):
+        self._local.clear()
+        self._remote.clear()
+
+
+group_subscribers = GroupSubscribers()
@@ -0,0 +1,168 @@
+"""
+API密钥加密管理
+
+LLMModel的API密钥以Fernet加密后存储。原实现每次加密/解密都重新派生密钥、
+创建Fernet实例，并且保存时通过"尝试解密"判断是否已加密。
+
+本模块在进程内统一管理加密密钥：
+- 密钥材料来自 settings.LLM_API_KEY_ENCRYPTION_KEYS（版本号 -> 密钥材料），
+  派生出的Fernet实例只创建一次
+- 新密文带版本前缀 enc:<版本>:<Fernet令牌>，判断是否已加密只需检查前缀
+- 无前缀的旧密文（Fernet令牌以 gAAAAA 开头）按全部密钥依次尝试解密
+- 解密结果放入有界LRU缓存，同一密文不会重复解密
+- 轮换密钥：新增版本并设置 LLM_API_KEY_CURRENT_VERSION，
+  再执行 manage.py reencrypt_llm_api_keys 重新加密存量数据
+"""
+
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from cryptography.fernet import Fernet, MultiFernet
+from django.conf import settings
+from django.utils.encoding import force_bytes
+
+from .metrics import metrics
+
+
+ENCRYPTED_PREFIX = 'enc:'
+
+# Fernet令牌首字节为版本号0x80，base64编码后固定以 gAAAAA 开头；
+# 最短令牌（空明文）编码后为100个字符
+LEGACY_TOKEN_PREFIX = 'gAAAAA'
+LEGACY_TOKEN_MIN_LENGTH = 100
+
+
+def derive_fernet_key(secret) -> bytes:
+    """由任意密钥材料派生Fernet密钥（与旧版基于SECRET_KEY的派生方式一致）"""
+    return base64.urlsafe_b64encode(hashlib.sha256(force_bytes(secret)).digest())
+
+
+class KeyManager:
+    """带版本的API密钥加解密管理器"""
+
+    def __init__(self, decrypt_cache_size: int = None):
+        self._decrypt_cache_size = decrypt_cache_size
+        self._lock = threading.Lock()
+        self._fernets: Optional[Dict[str, Fernet]] = None
+        self._multi_fernet: Optional[MultiFernet] = None
+        self._current_version: Optional[str] = None
+        self._decrypt_cache: 'OrderedDict[str, str]' = OrderedDict()
+
+    # ---- 密钥配置 ----
+
+    def _load(self) -> Tuple[Dict[str, Fernet], MultiFernet, str]:
+        """加载（仅首次）并返回 (版本->Fernet, MultiFernet, 当前版本)"""
+
+        if self._fernets is not None:
+            return self._fernets, self._multi_fernet, self._current_version
+
+        with self._lock:
+            if self._fernets is None:
+                keys = getattr(settings, 'LLM_API_KEY_ENCRYPTION_KEYS', None) or {'v1': settings.SECRET_KEY}
+                current = getattr(settings, 'LLM_API_KEY_CURRENT_VERSION', None) or next(iter(keys))
+                if current not in keys:
+                    raise ValueError(f"当前加密密钥版本 {current} 未在 LLM_API_KEY_ENCRYPTION_KEYS 中配置")
+                if ':' in current:
+                    raise ValueError(f"加密密钥版本号不能包含冒号: {current}")
+
+                fernets = {version: Fernet(derive_fernet_key(secret)) for version, secret in keys.items()}
+                # 当前版本排在最前，MultiFernet用它加密，其余版本仅用于解密
+                ordered = [fernets[current]] + [f for version, f in fernets.items() if version != current]
+
+                self._multi_fernet = MultiFernet(ordered)
+                self._current_version = current
+                self._fernets = fernets
+        return self._fernets, self._multi_fernet, self._current_version
+
+    def reload(self):
+        """丢弃已加载的密钥和解密缓存（配置变更后调用）"""
+
+        with self._lock:
+            self._fernets = None
+            self._multi_fernet = None
+            self._current_version = None
+            self._decrypt_cache.clear()
+
+    @property
+    def current_version(self) -> str:
+        return self._load()[2]
+
+    # ---- 加解密 ----
+
+    @staticmethod
+    def is_encrypted(value: str) -> bool:
+        """通过前缀判断值是否已加密，不做解密尝试"""
+
+        if not value:
+            return False
+        if value.startswith(ENCRYPTED_PREFIX):
+            return True
+        return value.startswith(LEGACY_TOKEN_PREFIX) and len(value) >= LEGACY_TOKEN_MIN_LENGTH
+
+    @staticmethod
+    def version_of(value: str) -> Optional[str]:
+        """返回密文的密钥版本，无前缀的旧密文返回None"""
+
+        if value and value.startswith(ENCRYPTED_PREFIX):
+            return value[len(ENCRYPTED_PREFIX):].split(':', 1)[0]
+        return None
+
+    def needs_rotation(self, value: str) -> bool:
+        """密文是否需要用当前版本重新加密"""
+
+        return self.is_encrypted(value) and self.version_of(value) != self.current_version
+
+    def encrypt(self, plaintext: str) -> str:
+        """使用当前版本密钥加密"""
+
+        fernets, _, current = self._load()
+        token = fernets[current].encrypt(plaintext.encode()).decode()
+        return f"{ENCRYPTED_PREFIX}{current}:{token}"
+
+    def decrypt(self, value: str) -> str:
+        """解密（带LRU缓存），失败时抛出 cryptography.fernet.InvalidToken"""
+
+        with self._lock:
+            cached = self._decrypt_cache.get(value)
+            if cached is not None:
+                self._decrypt_cache.move_to_end(value)
+                metrics.incr('llm.api_key.decrypt_cache_hits')
+                return cached
+
+        metrics.incr('llm.api_key.decrypt_cache_misses')
+        plaintext = self._decrypt_uncached(value)
+
+        cache_size = self._decrypt_cache_size
+        if cache_size is None:
+            cache_size = getattr(settings, 'LLM_API_KEY_DECRYPT_CACHE_SIZE', 256)
+        if cache_size > 0:
+            with self._lock:
+                self._decrypt_cache[value] = plaintext
+                while len(self._decrypt_cache) > cache_size:
+                    self._decrypt_cache.popitem(last=False)
+        return plaintext
+
+    def rotate(self, value: str) -> str:
+        """把任意版本的密文重新加密为当前版本"""
+
+        return self.encrypt(self.decrypt(value))
+
+    def _decrypt_uncached(self, value: str) -> str:
+        fernets, multi_fernet, _ = self._load()
+
+        version = self.version_of(value)
+        if version is None:
+            return multi_fernet.decrypt(value.encode()).decode()
+
+        token = value[len(ENCRYPTED_PREFIX) + len(version) + 1:]
+        fernet = fernets.get(version)
+        if fernet is None:
+            # 版本已从配置中移除时仍尝试其余密钥，便于排查
+            return multi_fernet.decrypt(token.encode()).decode()
+        return fernet.decrypt(token.encode()).decode()
+
+
+key_manager = KeyManager()
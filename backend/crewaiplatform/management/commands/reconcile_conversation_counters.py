@@ -0,0 +1,87 @@
+"""
+校正会话计数
+
+根据消息表和任务表重新计算会话的 total_messages、total_agent_calls 和
+last_activity_at（最新消息时间，没有消息时保留原值），修正写后合并丢失的增量、
+批量导入或删除造成的偏差。按主键分批处理，每批一个事务。
+
+用法:
+    python manage.py reconcile_conversation_counters [--conversation ID ...] [--batch-size 500] [--dry-run]
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from crewaiplatform.models import ChatAgentTask, ChatConversation, ChatMessage
+
+
+COUNTER_FIELDS = ('total_messages', 'total_agent_calls', 'last_activity_at')
+
+
+def _aggregate(model, expression):
+    """按会话聚合的相关子查询"""
+    return Subquery(
+        model.objects.filter(conversation=OuterRef('pk'))
+        .order_by().values('conversation').annotate(value=expression).values('value')[:1]
+    )
+
+
+class Command(BaseCommand):
+    help = '根据消息表和任务表重新计算会话计数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', type=int, nargs='*', default=None, help='只校正指定的会话ID')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的会话数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计计数有偏差的会话，不写入数据库')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        dry_run = options['dry_run']
+
+        queryset = ChatConversation.objects.all()
+        if options['conversation']:
+            queryset = queryset.filter(pk__in=options['conversation'])
+        queryset = queryset.annotate(
+            actual_messages=Coalesce(_aggregate(ChatMessage, Count('pk')), 0, output_field=IntegerField()),
+            actual_agent_calls=Coalesce(_aggregate(ChatAgentTask, Count('pk')), 0, output_field=IntegerField()),
+            latest_message_at=_aggregate(ChatMessage, Max('created_at')),
+        )
+
+        scanned = fixed = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    queryset.select_for_update()
+                    .filter(pk__gt=last_pk).order_by('pk')
+                    .only('pk', *COUNTER_FIELDS)[:batch_size]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                scanned += len(batch)
+
+                changed = []
+                for conversation in batch:
+                    expected = (
+                        conversation.actual_messages,
+                        conversation.actual_agent_calls,
+                        conversation.latest_message_at or conversation.last_activity_at,
+                    )
+                    current = tuple(getattr(conversation, field) for field in COUNTER_FIELDS)
+                    if expected == current:
+                        continue
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"会话 {conversation.pk}: {current} -> {expected}")
+                    for field, value in zip(COUNTER_FIELDS, expected):
+                        setattr(conversation, field, value)
+                    changed.append(conversation)
+
+                fixed += len(changed)
+                if changed and not dry_run:
+                    ChatConversation.objects.bulk_update(changed, list(COUNTER_FIELDS))
+
+        action = '计数有偏差' if dry_run else '已校正'
+        self.stdout.write(self.style.SUCCESS(f"扫描 {scanned} 个会话，{action} {fixed} 个"))
@@ -0,0 +1,71 @@
+"""
+重新加密LLM模型的API密钥
+
+轮换加密密钥后，把存量密文（旧版本或无版本前缀的旧格式）以及
+未加密的明文统一加密为当前版本。按主键分批处理，每批一个事务。
+
+用法:
+    python manage.py reencrypt_llm_api_keys [--batch-size 500] [--dry-run]
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crewaiplatform.key_manager import key_manager
+from crewaiplatform.models import LLMModel
+
+
+class Command(BaseCommand):
+    help = '使用当前版本的加密密钥重新加密全部LLM模型API密钥'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的记录数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要重新加密的记录，不写入数据库')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        dry_run = options['dry_run']
+
+        scanned = rotated = failed = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    LLMModel.objects.select_for_update()
+                    .filter(pk__gt=last_pk)
+                    .exclude(api_key__isnull=True).exclude(api_key='')
+                    .order_by('pk')
+                    .only('pk', 'api_key')[:batch_size]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                scanned += len(batch)
+
+                changed = []
+                for llm_model in batch:
+                    value = llm_model.api_key
+                    try:
+                        if not key_manager.is_encrypted(value):
+                            llm_model.api_key = key_manager.encrypt(value)
+                        elif key_manager.needs_rotation(value):
+                            llm_model.api_key = key_manager.rotate(value)
+                        else:
+                            continue
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"LLM模型 {llm_model.pk} 的API密钥无法解密: {e}")
+                        continue
+                    changed.append(llm_model)
+
+                rotated += len(changed)
+                if changed and not dry_run:
+                    # bulk_update不会触发save()，避免重复加密
+                    LLMModel.objects.bulk_update(changed, ['api_key'])
+
+        action = '需要重新加密' if dry_run else '已重新加密'
+        self.stdout.write(self.style.SUCCESS(
+            f"扫描 {scanned} 条，{action} {rotated} 条，失败 {failed} 条"
+            f"（当前密钥版本 {key_manager.current_version}）"
+        ))
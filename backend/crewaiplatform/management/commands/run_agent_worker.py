@@ -0,0 +1,57 @@
+"""
+运行Agent任务worker
+
+从ChatAgentTask队列认领待执行的任务并执行，结果通过channel layer推送给订阅的连接。
+可以在多个节点上同时运行多个worker；worker异常退出后，其任务在租约过期后由其他worker接手。
+
+用法:
+    python manage.py run_agent_worker [--concurrency 4] [--lease-seconds 60]
+                                      [--poll-interval 1.0] [--worker-id ID] [--once]
+"""
+
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from crewaiplatform.services.agent_task_queue import AgentTaskQueue
+from crewaiplatform.services.agent_worker import AgentWorker
+
+
+class Command(BaseCommand):
+    help = '认领并执行队列中的Agent任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='同时执行的任务数')
+        parser.add_argument('--lease-seconds', type=int, default=None,
+                            help='执行租约时长（秒），默认取 CHAT_AGENT_TASK_LEASE_SECONDS')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='队列为空时的轮询间隔（秒）')
+        parser.add_argument('--worker-id', default=None, help='worker标识，默认由主机名和进程号生成')
+        parser.add_argument('--once', action='store_true', help='排空当前队列后退出')
+
+    def handle(self, *args, **options):
+        worker = AgentWorker(
+            worker_id=options['worker_id'],
+            concurrency=options['concurrency'],
+            lease_seconds=options['lease_seconds'],
+            poll_interval=options['poll_interval'],
+        )
+
+        self.stdout.write(
+            f"worker {worker.worker_id} 启动，待执行任务 {AgentTaskQueue.pending_count()} 个"
+        )
+        asyncio.run(self._run(worker, options['once']))
+        self.stdout.write(self.style.SUCCESS(
+            f"worker {worker.worker_id} 已退出，共处理 {worker.processed} 个任务"
+        ))
+
+    @staticmethod
+    async def _run(worker: AgentWorker, once: bool):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                # 收到退出信号后停止认领，等待执行中的任务结束
+                loop.add_signal_handler(sig, worker.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await worker.run(once=once)
@@ -0,0 +1,130 @@
+"""
+运行时指标
+
+进程内的轻量级指标注册表，供流式传输、任务执行等模块记录计数、
+当前值和耗时分布，通过 /api/metrics/ 接口（管理员）查看。
+
+指标名使用点分命名，标签会被拼接为 name{key=value} 形式：
+    metrics.incr('chat.stream.frames_sent')
+    metrics.observe('chat.queue.wait_ms', 12.5, pool='agent')
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+
+def _metric_key(name: str, labels: Optional[dict]) -> str:
+    """生成带标签的指标键"""
+    if not labels:
+        return name
+    label_str = ','.join(f"{key}={labels[key]}" for key in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class _Summary:
+    """耗时/数值分布摘要，保留最近的样本用于计算分位数"""
+
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self, sample_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=sample_size)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.samples.append(value)
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 3) if self.count else 0.0,
+            'max': round(self.max, 3),
+            'p50': round(self.percentile(50), 3),
+            'p95': round(self.percentile(95), 3),
+        }
+
+
+class MetricsRegistry:
+    """线程安全的进程内指标注册表"""
+
+    def __init__(self, sample_size: int = 512):
+        self._lock = threading.Lock()
+        self._sample_size = sample_size
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._summaries: Dict[str, _Summary] = {}
+
+    def incr(self, name: str, value: float = 1, **labels):
+        """累加计数器"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """设置当前值"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def max_gauge(self, name: str, value: float, **labels):
+        """记录最大值（高水位）"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            if value > self._gauges.get(key, float('-inf')):
+                self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一次观测值"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary(self._sample_size)
+            summary.observe(value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_metric_key(name, labels), 0)
+
+    def get_gauge(self, name: str, default: float = 0, **labels) -> float:
+        with self._lock:
+            return self._gauges.get(_metric_key(name, labels), default)
+
+    def get_summary(self, name: str, **labels) -> Optional[dict]:
+        with self._lock:
+            summary = self._summaries.get(_metric_key(name, labels))
+            return summary.snapshot() if summary else None
+
+    def snapshot(self, prefix: str = '') -> dict:
+        """导出全部指标（可按名称前缀过滤）"""
+        with self._lock:
+            return {
+                'counters': {k: v for k, v in self._counters.items() if k.startswith(prefix)},
+                'gauges': {k: v for k, v in self._gauges.items() if k.startswith(prefix)},
+                'summaries': {
+                    k: s.snapshot() for k, s in self._summaries.items() if k.startswith(prefix)
+                },
+            }
+
+    def reset(self):
+        """清空全部指标（测试使用）"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+
+metrics = MetricsRegistry()
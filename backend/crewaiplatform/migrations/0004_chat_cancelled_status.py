@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0003_chat_models"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chatagenttask",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "待执行"),
+                    ("running", "执行中"),
+                    ("completed", "已完成"),
+                    ("failed", "执行失败"),
+                    ("cancelled", "已取消"),
+                ],
+                default="pending",
+                help_text="任务的执行状态",
+                max_length=32,
+                verbose_name="任务状态",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="chatmessage",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "待处理"),
+                    ("sent", "已发送"),
+                    ("processing", "处理中"),
+                    ("completed", "已完成"),
+                    ("failed", "失败"),
+                    ("cancelled", "已取消"),
+                ],
+                default="sent",
+                help_text="消息的处理状态",
+                max_length=32,
+                verbose_name="消息状态",
+            ),
+        ),
+    ]
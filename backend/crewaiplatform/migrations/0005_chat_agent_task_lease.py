@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0004_chat_cancelled_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="lease_owner",
+            field=models.CharField(
+                blank=True,
+                help_text="正在执行任务的worker标识",
+                max_length=128,
+                null=True,
+                verbose_name="租约持有者",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="lease_expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="执行方需在到期前续约，过期的任务会重新入队",
+                null=True,
+                verbose_name="租约到期时间",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="attempts",
+            field=models.PositiveIntegerField(
+                default=0, help_text="任务被认领执行的次数", verbose_name="执行次数"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatagenttask",
+            index=models.Index(
+                fields=["status", "lease_expires_at"],
+                name="chat_agent__status_3d5871_idx",
+            ),
+        ),
+    ]
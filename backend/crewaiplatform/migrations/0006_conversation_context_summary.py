@@ -0,0 +1,48 @@
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0005_chat_agent_task_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatconversation",
+            name="context_summary",
+            field=models.TextField(
+                blank=True,
+                default="",
+                help_text="超出上下文预算的早期对话摘要",
+                verbose_name="上下文摘要",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatconversation",
+            name="summary_message_id",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="已合并到摘要中的最后一条消息ID",
+                null=True,
+                verbose_name="摘要截止消息",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatconversation",
+            name="summary_updated_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="摘要更新时间"),
+        ),
+        migrations.AddField(
+            model_name="crewaiagent",
+            name="context_token_budget",
+            field=models.IntegerField(
+                blank=True,
+                help_text="聊天时放入提示词的历史对话token上限，为空则使用系统默认值",
+                null=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+                verbose_name="上下文Token预算",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0006_conversation_context_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="prompt_tokens",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="本次调用的提示词token总数（含命中提供商缓存的部分）",
+                verbose_name="提示词token数",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="cached_prompt_tokens",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="命中提供商提示词缓存的token数",
+                verbose_name="缓存命中token数",
+            ),
+        ),
+    ]
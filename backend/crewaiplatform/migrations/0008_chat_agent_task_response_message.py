@@ -0,0 +1,25 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0007_chat_agent_task_prompt_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="response_message",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="任务对应的助手回复消息（创建时为处理中的占位消息）",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="response_tasks",
+                to="crewaiplatform.chatmessage",
+                verbose_name="回复消息",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0008_chat_agent_task_response_message"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="llmmodel",
+            name="max_rpm",
+            field=models.IntegerField(
+                blank=True,
+                help_text="所有Agent共享的提供商请求速率上限（跨进程），为空表示不限制",
+                null=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+                verbose_name="每分钟最大请求数",
+            ),
+        ),
+        migrations.AddField(
+            model_name="llmmodel",
+            name="max_concurrency",
+            field=models.IntegerField(
+                blank=True,
+                help_text="同时进行中的请求数上限（跨进程），为空表示不限制",
+                null=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+                verbose_name="最大并发请求数",
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crewaiplatform", "0009_llm_model_rate_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crewaiagent",
+            name="fallback_llm_models",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="按优先顺序排列的备用LLM模型ID列表，主模型首个token过慢或调用失败时依次启用",
+                verbose_name="备用LLM模型",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="llm_model",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="实际返回响应的LLM模型",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="chat_tasks",
+                to="crewaiplatform.llmmodel",
+                verbose_name="响应模型",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatagenttask",
+            name="hedged",
+            field=models.BooleanField(
+                default=False,
+                help_text="是否因首个token过慢或调用失败向备用模型发出了请求",
+                verbose_name="是否对冲",
+            ),
+        ),
+    ]
@@ -18,6 +18,7 @@ class ChatAgentTask(models.Model):
         ('running', '执行中'),
         ('completed', '已完成'),
         ('failed', '执行失败'),
+        ('cancelled', '已取消'),
     ]
     
     # 关联信息
@@ -35,6 +36,15 @@ class ChatAgentTask(models.Model):
         verbose_name='关联消息',
         help_text='任务关联的消息'
     )
+    response_message = models.ForeignKey(
+        ChatMessage,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='response_tasks',
+        verbose_name='回复消息',
+        help_text='任务对应的助手回复消息（创建时为处理中的占位消息）'
+    )
     
     # 任务基础信息
     task_description = models.TextField(
@@ -94,6 +104,54 @@ class ChatAgentTask(models.Model):
         help_text='任务执行失败时的详细错误信息'
     )
     
+    # 提示词token用量（来自模型返回的用量，未返回时为估算值）
+    prompt_tokens = models.PositiveIntegerField(
+        default=0,
+        verbose_name='提示词token数',
+        help_text='本次调用的提示词token总数（含命中提供商缓存的部分）'
+    )
+    cached_prompt_tokens = models.PositiveIntegerField(
+        default=0,
+        verbose_name='缓存命中token数',
+        help_text='命中提供商提示词缓存的token数'
+    )
+    
+    # 实际响应的模型（对冲请求或故障转移时可能是Agent的备用模型）
+    llm_model = models.ForeignKey(
+        'LLMModel',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='chat_tasks',
+        verbose_name='响应模型',
+        help_text='实际返回响应的LLM模型'
+    )
+    hedged = models.BooleanField(
+        default=False,
+        verbose_name='是否对冲',
+        help_text='是否因首个token过慢或调用失败向备用模型发出了请求'
+    )
+    
+    # 执行租约（任务队列）
+    lease_owner = models.CharField(
+        max_length=128,
+        blank=True,
+        null=True,
+        verbose_name='租约持有者',
+        help_text='正在执行任务的worker标识'
+    )
+    lease_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='租约到期时间',
+        help_text='执行方需在到期前续约，过期的任务会重新入队'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='执行次数',
+        help_text='任务被认领执行的次数'
+    )
+    
     # 时间戳
     created_at = models.DateTimeField(
         auto_now_add=True,
@@ -113,6 +171,7 @@ class ChatAgentTask(models.Model):
             models.Index(fields=['conversation', 'status']),
             models.Index(fields=['agent', 'status']),
             models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
         ]
     
     def __str__(self):
@@ -120,15 +179,11 @@ class ChatAgentTask(models.Model):
         return f"[{self.agent_name}] {task_preview} - {self.get_status_display()}"
     
     def save(self, *args, **kwargs):
-        """重写save方法，自动处理Agent名称和统计"""
+        """重写save方法，自动处理Agent名称（会话的Agent调用计数由 conversation_counters 维护）"""
         if not self.agent_name and self.agent:
             self.agent_name = self.agent.name
         
         super().save(*args, **kwargs)
-        
-        # 如果是新任务，更新会话的Agent调用计数
-        if self._state.adding:
-            self.conversation.increment_agent_call_count()
     
     @property
     def is_pending(self):
@@ -150,6 +205,30 @@ class ChatAgentTask(models.Model):
         """是否执行失败"""
         return self.status == 'failed'
     
+    @property
+    def is_cancelled(self):
+        """是否已取消"""
+        return self.status == 'cancelled'
+    
+    @property
+    def uncached_prompt_tokens(self):
+        """未命中提供商缓存的提示词token数"""
+        return max(self.prompt_tokens - self.cached_prompt_tokens, 0)
+    
+    def record_prompt_usage(self, usage):
+        """记录提示词token用量（随任务结束一起保存）"""
+        if usage is None:
+            return
+        self.prompt_tokens = usage.prompt_tokens
+        self.cached_prompt_tokens = usage.cached_tokens
+    
+    def record_llm_route(self, route):
+        """记录实际响应的模型（随任务结束一起保存）"""
+        if route is None or route.llm_model is None:
+            return
+        self.llm_model = route.llm_model
+        self.hedged = route.hedged
+    
     @property
     def execution_duration(self):
         """执行时长"""
@@ -163,6 +242,11 @@ class ChatAgentTask(models.Model):
         self.start_time = timezone.now()
         self.save(update_fields=['status', 'start_time', 'updated_at'])
     
+    def _release_lease(self):
+        """任务结束时释放执行租约"""
+        self.lease_owner = None
+        self.lease_expires_at = None
+    
     def complete_execution(self, result=None):
         """完成任务执行"""
         self.status = 'completed'
@@ -176,8 +260,11 @@ class ChatAgentTask(models.Model):
             duration = self.end_time - self.start_time
             self.execution_time_ms = int(duration.total_seconds() * 1000)
         
+        self._release_lease()
         self.save(update_fields=[
-            'status', 'end_time', 'result', 'execution_time_ms', 'updated_at'
+            'status', 'end_time', 'result', 'execution_time_ms',
+            'prompt_tokens', 'cached_prompt_tokens', 'llm_model', 'hedged',
+            'lease_owner', 'lease_expires_at', 'updated_at'
         ])
     
     def fail_execution(self, error_details=None):
@@ -193,6 +280,31 @@ class ChatAgentTask(models.Model):
             duration = self.end_time - self.start_time
             self.execution_time_ms = int(duration.total_seconds() * 1000)
         
+        self._release_lease()
+        self.save(update_fields=[
+            'status', 'end_time', 'error_details', 'execution_time_ms',
+            'prompt_tokens', 'cached_prompt_tokens', 'llm_model', 'hedged',
+            'lease_owner', 'lease_expires_at', 'updated_at'
+        ])
+    
+    def cancel_execution(self, partial_result=None, reason=None):
+        """取消任务执行，保留已生成的部分结果"""
+        self.status = 'cancelled'
+        self.end_time = timezone.now()
+        
+        if partial_result:
+            self.result = str(partial_result)
+        if reason:
+            self.error_details = str(reason)
+        
+        # 计算执行时间
+        if self.start_time:
+            duration = self.end_time - self.start_time
+            self.execution_time_ms = int(duration.total_seconds() * 1000)
+        
+        self._release_lease()
         self.save(update_fields=[
-            'status', 'end_time', 'error_details', 'execution_time_ms', 'updated_at'
-        ])
\ No newline at end of file
+            'status', 'end_time', 'result', 'error_details', 'execution_time_ms',
+            'prompt_tokens', 'cached_prompt_tokens', 'llm_model', 'hedged',
+            'lease_owner', 'lease_expires_at', 'updated_at'
+        ])
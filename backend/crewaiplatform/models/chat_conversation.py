@@ -5,6 +5,7 @@
 """
 
 from django.db import models
+from django.db.models import F
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
@@ -77,6 +78,25 @@ class ChatConversation(models.Model):
         help_text='会话中的总Agent调用次数'
     )
     
+    # 滚动摘要：超出上下文预算的早期对话被逐步合并到摘要中
+    context_summary = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='上下文摘要',
+        help_text='超出上下文预算的早期对话摘要'
+    )
+    summary_message_id = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='摘要截止消息',
+        help_text='已合并到摘要中的最后一条消息ID'
+    )
+    summary_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='摘要更新时间'
+    )
+    
     # 状态管理
     status = models.CharField(
         max_length=32,
@@ -116,21 +136,38 @@ class ChatConversation(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.title}"
     
+    @classmethod
+    def add_counts(cls, conversation_id, messages=0, agent_calls=0, activity_at=None):
+        """
+        原子累加会话计数（一条UPDATE，使用F表达式，并发写入不会丢失计数）
+        
+        Returns:
+            更新的行数
+        """
+        fields = {}
+        if messages:
+            fields['total_messages'] = F('total_messages') + messages
+        if agent_calls:
+            fields['total_agent_calls'] = F('total_agent_calls') + agent_calls
+        if activity_at is not None:
+            fields['last_activity_at'] = activity_at
+        if not fields:
+            return 0
+        return cls.objects.filter(pk=conversation_id).update(**fields)
+    
     def update_activity(self):
         """更新最后活动时间"""
         self.last_activity_at = timezone.now()
-        self.save(update_fields=['last_activity_at'])
+        ChatConversation.add_counts(self.pk, activity_at=self.last_activity_at)
     
     def increment_message_count(self):
-        """增加消息计数"""
-        self.total_messages += 1
-        self.update_activity()
-        self.save(update_fields=['total_messages', 'last_activity_at'])
+        """增加消息计数（原子更新，内存中的计数不会刷新）"""
+        self.last_activity_at = timezone.now()
+        ChatConversation.add_counts(self.pk, messages=1, activity_at=self.last_activity_at)
     
     def increment_agent_call_count(self):
-        """增加Agent调用计数"""
-        self.total_agent_calls += 1
-        self.save(update_fields=['total_agent_calls'])
+        """增加Agent调用计数（原子更新，内存中的计数不会刷新）"""
+        ChatConversation.add_counts(self.pk, agent_calls=1)
     
     @property
     def is_active(self):
@@ -27,6 +27,7 @@ class ChatMessage(models.Model):
         ('processing', '处理中'),
         ('completed', '已完成'),
         ('failed', '失败'),
+        ('cancelled', '已取消'),
     ]
     
     # 关联信息
@@ -108,14 +109,6 @@ class ChatMessage(models.Model):
         content_preview = self.content[:50] + '...' if len(self.content) > 50 else self.content
         return f"[{self.get_role_display()}] {content_preview}"
     
-    def save(self, *args, **kwargs):
-        """重写save方法，自动更新会话活动时间"""
-        super().save(*args, **kwargs)
-        
-        # 更新会话消息计数和活动时间
-        if self._state.adding:  # 只在新建消息时更新
-            self.conversation.increment_message_count()
-    
     @property
     def is_user_message(self):
         """是否为用户消息"""
@@ -90,6 +90,13 @@ class CrewAIAgent(models.Model):
         help_text="专门用于工具调用的语言模型，可与主模型不同"
     )
     
+    fallback_llm_models = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name="备用LLM模型",
+        help_text="按优先顺序排列的备用LLM模型ID列表，主模型首个token过慢或调用失败时依次启用"
+    )
+    
     # 执行控制参数
     verbose = models.BooleanField(
         default=False,
@@ -146,6 +153,14 @@ class CrewAIAgent(models.Model):
         help_text="是否遵循LLM模型的上下文窗口限制"
     )
     
+    context_token_budget = models.IntegerField(
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(1)],
+        verbose_name="上下文Token预算",
+        help_text="聊天时放入提示词的历史对话token上限，为空则使用系统默认值"
+    )
+    
     use_system_prompt = models.BooleanField(
         default=True,
         verbose_name="使用系统提示",
@@ -321,6 +336,19 @@ class CrewAIAgent(models.Model):
         if self.function_calling_llm and not self.function_calling_llm.is_available:
             raise ValidationError("选择的工具调用LLM模型当前不可用")
         
+        # 验证备用模型列表
+        if self.fallback_llm_models:
+            if not isinstance(self.fallback_llm_models, list) or not all(
+                isinstance(pk, int) for pk in self.fallback_llm_models
+            ):
+                raise ValidationError("备用LLM模型必须是模型ID列表")
+            if self.llm_model_id in self.fallback_llm_models:
+                raise ValidationError("备用LLM模型不能包含主要LLM模型")
+            existing = set(LLMModel.objects.filter(pk__in=self.fallback_llm_models).values_list('pk', flat=True))
+            missing = [pk for pk in self.fallback_llm_models if pk not in existing]
+            if missing:
+                raise ValidationError(f"备用LLM模型不存在: {missing}")
+        
         # 验证日期格式
         if self.inject_date and self.date_format:
             try:
@@ -12,10 +12,10 @@ LLM模型配置 - 基于LangChain框架的大语言模型管理
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import AbstractUser
-from cryptography.fernet import Fernet
-from django.conf import settings
 import json
 
+from ..key_manager import key_manager
+
 
 class LLMModel(models.Model):
     """
@@ -119,6 +119,22 @@ class LLMModel(models.Model):
         verbose_name="最大重试次数",
         help_text="API请求失败时的重试次数"
     )
+
+    max_rpm = models.IntegerField(
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(1)],
+        verbose_name="每分钟最大请求数",
+        help_text="所有Agent共享的提供商请求速率上限（跨进程），为空表示不限制"
+    )
+
+    max_concurrency = models.IntegerField(
+        blank=True,
+        null=True,
+        validators=[MinValueValidator(1)],
+        verbose_name="最大并发请求数",
+        help_text="同时进行中的请求数上限（跨进程），为空表示不限制"
+    )
     
     # 扩展配置
     extra_kwargs = models.JSONField(
@@ -207,46 +223,23 @@ class LLMModel(models.Model):
         return None
     
     def _is_encrypted(self, value):
-        """检查值是否已加密"""
-        try:
-            # 尝试解密，如果成功说明已加密
-            self._decrypt_api_key(value)
-            return True
-        except:
-            return False
+        """检查值是否已加密（只检查密文前缀，不做解密尝试）"""
+        return key_manager.is_encrypted(value)
     
     def _encrypt_api_key(self, api_key):
-        """加密API密钥"""
+        """加密API密钥（使用当前版本的加密密钥）"""
         try:
-            # 使用Django的SECRET_KEY生成加密密钥
-            key = self._get_encryption_key()
-            f = Fernet(key)
-            encrypted_key = f.encrypt(api_key.encode())
-            return encrypted_key.decode()
+            return key_manager.encrypt(api_key)
         except Exception as e:
             raise ValueError(f"加密API密钥失败: {str(e)}")
     
     def _decrypt_api_key(self, encrypted_api_key):
         """解密API密钥"""
         try:
-            key = self._get_encryption_key()
-            f = Fernet(key)
-            decrypted_key = f.decrypt(encrypted_api_key.encode())
-            return decrypted_key.decode()
+            return key_manager.decrypt(encrypted_api_key)
         except Exception as e:
             raise ValueError(f"解密API密钥失败: {str(e)}")
     
-    def _get_encryption_key(self):
-        """生成加密密钥"""
-        from django.utils.encoding import force_bytes
-        import base64
-        import hashlib
-        
-        # 使用Django SECRET_KEY生成Fernet兼容的密钥
-        secret = force_bytes(settings.SECRET_KEY)
-        key = base64.urlsafe_b64encode(hashlib.sha256(secret).digest())
-        return key
-    
     def get_langchain_config(self):
         """获取LangChain模型配置"""
         config = {
@@ -291,10 +284,16 @@ class LLMModel(models.Model):
         
         return config
     
-    def create_langchain_model(self):
-        """创建LangChain模型实例"""
+    def create_langchain_model(self, **overrides):
+        """
+        创建LangChain模型实例
+        
+        Args:
+            overrides: 覆盖或追加的构造参数，如共享的 http_async_client
+        """
         try:
             config = self.get_langchain_config()
+            config.update(overrides)
             
             # 根据提供商创建对应的LangChain模型
             if self.provider == 'openai':
@@ -695,10 +695,17 @@ class MCPTool(models.Model):
             return False, f"STDIO连接测试失败: {str(e)}", None
     
     def call_tool(self, tool_name, arguments=None):
-        """调用MCP工具"""
+        """调用MCP工具（熔断器打开时立即失败，不等待连接超时）"""
+        from ..services.circuit_breaker import CircuitOpenError, circuit_breaker, is_tripped, mcp_tool_key
+        
         if arguments is None:
             arguments = {}
         
+        try:
+            permit = circuit_breaker.before(mcp_tool_key(self), tripped=is_tripped(self.last_error))
+        except CircuitOpenError as e:
+            return False, str(e)
+        
         try:
             client = self.create_mcp_client()
             
@@ -708,15 +715,17 @@ class MCPTool(models.Model):
             # 调用工具
             result = client.call_tool(tool_name, arguments)
             
-            # 记录成功
+            # 记录成功（只保存计数，不覆盖熔断器写回的状态）
             self.success_calls += 1
-            self.save()
+            self.save(update_fields=['total_calls', 'success_calls', 'updated_at'])
+            circuit_breaker.success(permit)
             
             return True, result
             
         except Exception as e:
             # 记录失败但不增加success_calls
-            self.save()
+            self.save(update_fields=['total_calls', 'updated_at'])
+            circuit_breaker.failure(permit, e)
             return False, str(e)
     
     def get_available_tools(self):
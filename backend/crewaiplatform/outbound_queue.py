@@ -0,0 +1,232 @@
+"""
+WebSocket连接的有界发送队列
+
+原实现中事件处理方法直接等待 send：客户端（如弱网下的移动端）读得慢时，
+通道层和服务器为它缓存全部token帧，直接下发的生产端（Agent回复）也被阻塞在发送上。
+
+ChatConsumer 接受连接后，下发的帧先进入 OutboundQueue，由后台写任务按顺序写出，
+事件处理和Agent回复不再等待客户端。队列中的帧数达到 CHAT_WS_SEND_QUEUE_MAX_FRAMES 后，
+中间的流式更新帧（thinking_content_update / answer_stream_update）按策略处理：
+- coalesce（默认）: 合并进队尾同一个流的更新帧。cumulative协议保留最新的累计内容；
+  delta协议拼接增量，序号取最后一个增量的序号（跳过的序号即被合并的帧）
+- drop: 丢弃新的更新帧，客户端以随后的 *_complete 帧中的完整内容为准。
+  delta协议的完成帧在增量拼接一致时不带完整内容，增量不能丢弃，仍按coalesce合并
+开始、完成、状态等其他帧始终入队。队列持续超过上限 CHAT_WS_SEND_QUEUE_OVERFLOW_SECONDS 秒
+仍未降下来时，判定客户端跟不上，断开连接（关闭码4008）。
+
+每个连接的队列深度高水位、合并和丢弃的帧数可通过 outbound_queues.snapshot()
+（/api/metrics/ 的 ws_send_queues）查看，连接关闭时高水位记入 chat.ws.send_queue.high_water 分布。
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+SEND_QUEUE_COALESCE = 'coalesce'
+SEND_QUEUE_DROP = 'drop'
+SEND_QUEUE_POLICIES = (SEND_QUEUE_COALESCE, SEND_QUEUE_DROP)
+
+# 客户端跟不上时的关闭码
+SLOW_CLIENT_CLOSE_CODE = 4008
+
+# 可合并或丢弃的中间更新帧（完成帧带有完整内容）
+INTERMEDIATE_FRAMES = frozenset({'thinking_content_update', 'answer_stream_update'})
+
+
+class OutboundQueue:
+    """一个连接的有界发送队列及其写任务"""
+
+    def __init__(self, write: Callable[[dict], Awaitable[None]],
+                 on_overflow: Callable[[], Awaitable[None]] = None, owner: str = '',
+                 max_frames: int = None, policy: str = None, overflow_seconds: float = None):
+        if max_frames is None:
+            max_frames = getattr(settings, 'CHAT_WS_SEND_QUEUE_MAX_FRAMES', 256)
+        if policy is None:
+            policy = getattr(settings, 'CHAT_WS_SEND_QUEUE_POLICY', SEND_QUEUE_COALESCE)
+        if overflow_seconds is None:
+            overflow_seconds = getattr(settings, 'CHAT_WS_SEND_QUEUE_OVERFLOW_SECONDS', 10)
+
+        self._write = write
+        self._on_overflow = on_overflow
+        self.owner = owner
+        self.max_frames = max(max_frames, 1)
+        self.policy = policy if policy in SEND_QUEUE_POLICIES else SEND_QUEUE_COALESCE
+        self.overflow_seconds = overflow_seconds
+
+        self._frames = deque()
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._overflow_timer: Optional[asyncio.TimerHandle] = None
+        self._overflow_task: Optional[asyncio.Task] = None
+        self.over_limit_since: Optional[float] = None
+        self.closed = False
+
+        # 统计：队列深度高水位、写出/合并/丢弃的帧数
+        self.high_water = 0
+        self.frames_written = 0
+        self.frames_coalesced = 0
+        self.frames_dropped = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._run())
+        outbound_queues.add(self)
+
+    def put(self, frame: dict):
+        """帧入队（不等待写出）；超过上限时按策略合并或丢弃中间更新帧"""
+
+        if self.closed:
+            return
+
+        if len(self._frames) >= self.max_frames and frame.get('type') in INTERMEDIATE_FRAMES:
+            if self.policy == SEND_QUEUE_DROP and 'delta' not in frame:
+                self.frames_dropped += 1
+                metrics.incr('chat.ws.send_queue.dropped')
+                return
+            if self._coalesce(frame):
+                self.frames_coalesced += 1
+                metrics.incr('chat.ws.send_queue.coalesced')
+                return
+
+        self._frames.append(frame)
+        if len(self._frames) > self.high_water:
+            self.high_water = len(self._frames)
+            metrics.max_gauge('chat.ws.send_queue.high_water_max', self.high_water)
+        self._check_limit()
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            'owner': self.owner,
+            'depth': len(self._frames),
+            'high_water': self.high_water,
+            'frames_written': self.frames_written,
+            'frames_coalesced': self.frames_coalesced,
+            'frames_dropped': self.frames_dropped,
+            'over_limit_seconds': round(time.monotonic() - self.over_limit_since, 3)
+            if self.over_limit_since is not None else 0,
+        }
+
+    async def close(self):
+        """停止写任务并丢弃未写出的帧（连接断开时）"""
+
+        if self._writer is not None and outbound_queues.discard(self):
+            metrics.observe('chat.ws.send_queue.high_water', self.high_water)
+        self._stop()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    def _stop(self):
+        self.closed = True
+        self._frames.clear()
+        self._cancel_overflow_timer()
+        if self._writer is not None:
+            self._writer.cancel()
+
+    def _coalesce(self, frame: dict) -> bool:
+        """合并进队尾同一个流的更新帧"""
+
+        if not self._frames:
+            return False
+        tail = self._frames[-1]
+        if tail.get('type') != frame['type'] or tail.get('stream_id') != frame.get('stream_id'):
+            return False
+        if 'delta' in frame:
+            frame = {**frame, 'delta': tail.get('delta', '') + frame['delta']}
+        self._frames[-1] = frame
+        return True
+
+    def _check_limit(self):
+        """进入/离开超限状态：超限时开始计时，持续超限则断开连接"""
+
+        if len(self._frames) >= self.max_frames:
+            if self.over_limit_since is None:
+                self.over_limit_since = time.monotonic()
+                self._overflow_timer = asyncio.get_running_loop().call_later(
+                    self.overflow_seconds, self._overflowed
+                )
+        elif self.over_limit_since is not None:
+            self.over_limit_since = None
+            self._cancel_overflow_timer()
+
+    def _cancel_overflow_timer(self):
+        if self._overflow_timer is not None:
+            self._overflow_timer.cancel()
+            self._overflow_timer = None
+
+    def _overflowed(self):
+        """持续超限：停止写出并断开连接"""
+
+        self._overflow_timer = None
+        logger.warning(
+            f"{self.owner} 客户端跟不上下发速度，队列超过 {self.max_frames} 帧已 {self.overflow_seconds} 秒，"
+            f"断开连接: {self.stats()}"
+        )
+        metrics.incr('chat.ws.send_queue.overflow_disconnects')
+        self._stop()
+        if self._on_overflow is not None:
+            self._overflow_task = asyncio.ensure_future(self._on_overflow())
+
+    async def _run(self):
+        while not self.closed:
+            if not self._frames:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            frame = self._frames.popleft()
+            try:
+                await self._write(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 连接已关闭等：停止写出，由连接的断开流程清理
+                logger.debug(f"{self.owner} 写出帧失败，停止发送队列: {e}")
+                self.closed = True
+                self._frames.clear()
+                self._cancel_overflow_timer()
+                return
+            self.frames_written += 1
+            if self.over_limit_since is not None:
+                self._check_limit()
+
+
+class OutboundQueueRegistry:
+    """本进程中活动连接的发送队列（用于查看每个连接的高水位）"""
+
+    def __init__(self):
+        self._queues = set()
+
+    def add(self, queue: OutboundQueue):
+        self._queues.add(queue)
+
+    def discard(self, queue: OutboundQueue) -> bool:
+        if queue in self._queues:
+            self._queues.discard(queue)
+            return True
+        return False
+
+    def snapshot(self, limit: int = 50) -> list:
+        """按高水位从高到低列出连接的队列统计"""
+        queues = sorted(self._queues, key=lambda queue: queue.high_water, reverse=True)
+        return [queue.stats() for queue in queues[:limit]]
+
+    def __len__(self):
+        return len(self._queues)
+
+
+outbound_queues = OutboundQueueRegistry()
@@ -1,11 +1,13 @@
 """
 WebSocket路由配置
 
-定义WebSocket连接的URL路由。
+定义WebSocket连接的URL路由，以及在Django之前处理的ASGI原生HTTP端点（SSE）。
 """
 
 from django.urls import re_path
 from . import consumers
+from .middleware import JWTAuthMiddlewareStack
+from .sse import ChatEventStreamConsumer
 from .test_consumer import SimpleTestConsumer
 
 websocket_urlpatterns = [
@@ -17,4 +19,12 @@ websocket_urlpatterns = [
     
     # 通知WebSocket - 用户全局通知
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
-]
\ No newline at end of file
+]
+
+http_urlpatterns = [
+    # 聊天响应的SSE流 - 发送消息并在同一个请求中流式返回回复
+    re_path(
+        r'^api/chat/conversations/(?P<conversation_id>\d+)/stream/$',
+        JWTAuthMiddlewareStack(ChatEventStreamConsumer.as_asgi())
+    ),
+]
@@ -130,6 +130,7 @@ class ChatAgentTaskSerializer(serializers.ModelSerializer):
     agent_name = serializers.CharField(read_only=True)
     conversation_title = serializers.CharField(source='conversation.title', read_only=True)
     execution_duration = serializers.SerializerMethodField(read_only=True)
+    uncached_prompt_tokens = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = ChatAgentTask
@@ -137,11 +138,13 @@ class ChatAgentTaskSerializer(serializers.ModelSerializer):
             'id', 'conversation', 'conversation_title', 'message',
             'task_description', 'agent', 'agent_name', 'status',
             'start_time', 'end_time', 'execution_time_ms', 'execution_duration',
-            'result', 'error_details', 'created_at', 'updated_at'
+            'prompt_tokens', 'cached_prompt_tokens', 'uncached_prompt_tokens',
+            'llm_model', 'hedged', 'result', 'error_details', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'conversation_title', 'agent_name', 'execution_duration',
-            'created_at', 'updated_at'
+            'prompt_tokens', 'cached_prompt_tokens', 'uncached_prompt_tokens',
+            'llm_model', 'hedged', 'created_at', 'updated_at'
         ]
     
     def get_execution_duration(self, obj):
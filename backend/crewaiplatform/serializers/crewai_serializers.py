@@ -27,6 +27,7 @@ class LLMModelSerializer(serializers.ModelSerializer):
             'id', 'name', 'provider', 'provider_display', 'model_name', 'description',
             'langchain_class', 'api_base_url', 'api_key', 'api_version',
             'temperature', 'max_tokens', 'timeout', 'max_retries',
+            'max_rpm', 'max_concurrency',
             'extra_kwargs', 'model_kwargs', 'model_info',
             'last_validated', 'is_available', 'is_available_display', 
             'validation_error', 'is_active', 'created_at', 'updated_at'
@@ -163,9 +164,9 @@ class CrewAIAgentSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'name', 'display_name', 'description', 'role', 'goal', 'backstory',
             'llm_model', 'llm_model_info', 'function_calling_llm', 'function_calling_llm_info',
-            'verbose', 'memory', 'max_iter', 'max_rpm', 'max_execution_time', 'max_retry_limit',
-            'allow_delegation', 'respect_context_window', 'use_system_prompt', 'multimodal',
-            'inject_date', 'date_format', 'reasoning', 'max_reasoning_attempts',
+            'fallback_llm_models', 'verbose', 'memory', 'max_iter', 'max_rpm', 'max_execution_time', 'max_retry_limit',
+            'allow_delegation', 'respect_context_window', 'context_token_budget', 'use_system_prompt',
+            'multimodal', 'inject_date', 'date_format', 'reasoning', 'max_reasoning_attempts',
             'step_callback', 'enable_monitoring', 'custom_instructions', 'agent_kwargs',
             'status', 'status_display', 'total_tasks', 'completed_tasks', 'success_rate',
             'total_execution_time', 'avg_execution_time', 'last_execution', 'last_error',
@@ -183,6 +184,7 @@ class CrewAIAgentSerializer(serializers.ModelSerializer):
             'goal': {'help_text': 'Agent的主要目标'},
             'backstory': {'help_text': 'Agent的背景故事'},
             'llm_model': {'help_text': '主要使用的LLM模型'},
+            'fallback_llm_models': {'help_text': '按优先顺序排列的备用LLM模型ID列表'},
             'max_iter': {'help_text': '最大迭代次数(1-100)'},
         }
     
@@ -220,6 +222,13 @@ class CrewAIAgentSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({
                 'non_field_errors': ['选择的工具调用LLM模型当前不可用，请选择其他模型']
             })
+        
+        fallback_llm_models = attrs.get('fallback_llm_models')
+        primary = llm_model or getattr(self.instance, 'llm_model', None)
+        if fallback_llm_models and primary and primary.pk in fallback_llm_models:
+            raise serializers.ValidationError({
+                'fallback_llm_models': ['备用LLM模型不能包含主要LLM模型']
+            })
             
         return attrs
     
@@ -233,6 +242,20 @@ class CrewAIAgentSerializer(serializers.ModelSerializer):
         # 这里只做基本的存在性检查，可用性检查在validate方法中
         return value
     
+    def validate_fallback_llm_models(self, value):
+        """验证备用LLM模型列表（按顺序的模型ID，不重复且模型存在）"""
+        if not value:
+            return []
+        if not isinstance(value, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in value):
+            raise serializers.ValidationError("备用LLM模型必须是模型ID列表")
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("备用LLM模型不能重复")
+        existing = set(LLMModel.objects.filter(pk__in=value, is_active=True).values_list('pk', flat=True))
+        missing = [pk for pk in value if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(f"备用LLM模型不存在或已停用: {missing}")
+        return value
+    
     def validate_max_iter(self, value):
         """验证最大迭代次数"""
         if not 1 <= value <= 100:
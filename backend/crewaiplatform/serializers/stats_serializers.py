@@ -13,6 +13,7 @@ class LLMModelStatsSerializer(serializers.Serializer):
     available_models = serializers.IntegerField()
     provider_distribution = serializers.DictField()
     usage_stats = serializers.DictField()
+    circuit_breakers = serializers.ListField(child=serializers.DictField(), required=False)
 
 
 class MCPToolStatsSerializer(serializers.Serializer):
@@ -21,6 +22,7 @@ class MCPToolStatsSerializer(serializers.Serializer):
     healthy_tools = serializers.IntegerField()
     server_type_distribution = serializers.DictField()
     usage_stats = serializers.DictField()
+    circuit_breakers = serializers.ListField(child=serializers.DictField(), required=False)
 
 
 class CrewAIAgentStatsSerializer(serializers.Serializer):
@@ -0,0 +1,164 @@
+"""
+Agent执行服务
+
+REST接口（发送消息、重试消息）触发的Agent处理原本为每个请求创建一个线程和
+一个新的事件循环，突发流量会产生无限多的线程、事件循环和数据库连接。
+
+AgentExecutor 在进程内维护一个长期运行的事件循环线程：
+- 同时执行的任务数受 CHAT_EXECUTOR_CONCURRENCY 限制
+- 等待执行的任务数受 CHAT_EXECUTOR_QUEUE_LIMIT 限制，队列已满时
+  submit 抛出 AgentExecutorFull，接口据此返回503
+- 排队深度、等待时间、执行时间等指标通过 /api/metrics/ 查看
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Optional
+
+from django.conf import settings
+
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class AgentExecutorFull(Exception):
+    """执行队列已满"""
+
+    def __init__(self, queued: int, limit: int, retry_after: int = 5):
+        self.queued = queued
+        self.limit = limit
+        self.retry_after = retry_after
+        super().__init__(f"Agent执行队列已满（排队 {queued}/{limit}）")
+
+
+class AgentExecutor:
+    """有界的Agent执行服务（单个事件循环线程 + 并发上限 + 排队上限）"""
+
+    def __init__(self, concurrency: int = None, queue_limit: int = None):
+        self._concurrency = concurrency
+        self._queue_limit = queue_limit
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._queued = 0
+        self._running = 0
+
+    @property
+    def concurrency(self) -> int:
+        if self._concurrency is not None:
+            return self._concurrency
+        return getattr(settings, 'CHAT_EXECUTOR_CONCURRENCY', 8)
+
+    @property
+    def queue_limit(self) -> int:
+        if self._queue_limit is not None:
+            return self._queue_limit
+        return getattr(settings, 'CHAT_EXECUTOR_QUEUE_LIMIT', 100)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'running': self._running,
+                'concurrency': self.concurrency,
+                'queue_limit': self.queue_limit,
+            }
+
+    def has_capacity(self) -> bool:
+        """是否还能接受新任务（提交前的快速检查）"""
+        with self._lock:
+            return self._queued < self.queue_limit
+
+    def submit(self, coro_factory: Callable[[], Awaitable], name: str = '') -> Future:
+        """
+        提交一个协程工厂，返回 concurrent.futures.Future
+
+        队列已满时抛出 AgentExecutorFull，不会创建协程。
+        """
+
+        with self._lock:
+            if self._queued >= self.queue_limit:
+                metrics.incr('chat.executor.rejected')
+                raise AgentExecutorFull(self._queued, self.queue_limit)
+            self._queued += 1
+            queued = self._queued
+        metrics.set_gauge('chat.executor.queue_depth', queued)
+        metrics.max_gauge('chat.executor.queue_depth_max', queued)
+        metrics.incr('chat.executor.submitted')
+
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(
+            self._run(coro_factory, name, time.monotonic()), loop
+        )
+
+    def shutdown(self, timeout: float = 5.0):
+        """停止事件循环线程（测试和进程退出时使用）"""
+
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._semaphore = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(timeout)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._thread is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._run_loop, args=(loop,), name='agent-executor', daemon=True
+                )
+                self._loop, self._thread, self._semaphore = loop, thread, None
+                thread.start()
+            return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _run(self, coro_factory: Callable[[], Awaitable], name: str, enqueued_at: float):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphore:
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                queued, running = self._queued, self._running
+            metrics.set_gauge('chat.executor.queue_depth', queued)
+            metrics.set_gauge('chat.executor.running', running)
+            metrics.observe('chat.executor.wait_ms', (time.monotonic() - enqueued_at) * 1000)
+
+            started_at = time.monotonic()
+            try:
+                return await coro_factory()
+            except Exception as e:
+                metrics.incr('chat.executor.failed')
+                logger.error(f"Agent执行任务 {name} 失败: {e}")
+                raise
+            finally:
+                # 数据库操作在asgiref的共享同步线程中执行，任务结束后清理过期连接
+                from asgiref.sync import sync_to_async
+                from django.db import close_old_connections
+                await sync_to_async(close_old_connections)()
+
+                with self._lock:
+                    self._running -= 1
+                    running = self._running
+                metrics.set_gauge('chat.executor.running', running)
+                metrics.observe('chat.executor.run_ms', (time.monotonic() - started_at) * 1000)
+
+
+agent_executor = AgentExecutor()
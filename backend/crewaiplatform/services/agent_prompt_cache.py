@@ -0,0 +1,211 @@
+"""
+Agent提示词编译缓存
+
+每条消息都要重新创建 ChatPromptTemplate、定义新的输出解析器类，
+并根据Agent的 role/goal/backstory 重新拼接角色设定。
+
+CompiledAgentPrompt 把与单条消息无关的部分一次性准备好：
+- 思考模式的系统提示词（及对应的 SystemMessage / ChatPromptTemplate）
+- Agent角色设定（persona）
+- 思考/答案输出解析器
+- 结构化消息布局（prompt_layout）的系统消息：角色设定 + 思考模式说明 + 响应要求
+
+AgentPromptCache 按Agent缓存编译结果，缓存键为Agent提示词相关字段的哈希；
+CrewAIAgent保存或删除时通过信号清除对应条目。
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+
+from ..metrics import metrics
+
+
+# 思考模式的系统提示词
+THINKING_SYSTEM_TEMPLATE = """你是一个善于思考的AI助手。请在回答问题时，先展示你的思考过程，然后给出最终答案。
+
+请严格按照以下格式回答：
+
+<thinking>
+在这里写你的详细思考过程：
+- 分析问题的关键点
+- 考虑不同的角度和可能性
+- 推理和判断过程
+- 得出结论的逻辑
+</thinking>
+
+<answer>
+在这里给出简洁明了的最终答案
+</answer>
+
+注意：
+1. thinking部分要详细展示思考过程
+2. answer部分要简洁直接地回答问题
+3. 必须使用指定的XML标签格式"""
+
+# 响应要求（追加在每条提示词末尾）
+RESPONSE_REQUIREMENTS = (
+    "\n请根据你的角色和目标，结合对话历史，为当前任务提供准确、有用的响应。"
+    "请保持友好、专业的语气，直接回答问题，不需要重复任务描述。"
+)
+
+# 影响提示词的Agent字段
+PROMPT_FIELDS = ('role', 'goal', 'backstory')
+
+
+@lru_cache(maxsize=None)
+def thinking_output_parser_class():
+    """思考/答案输出解析器类（只定义一次）"""
+
+    from langchain_core.output_parsers import BaseOutputParser
+
+    class ThinkingOutputParser(BaseOutputParser):
+        """解析思考过程和答案的输出解析器"""
+
+        def parse(self, text: str) -> dict:
+            thinking_match = re.search(r'<thinking>(.*?)</thinking>', text, re.DOTALL)
+            answer_match = re.search(r'<answer>(.*?)</answer>', text, re.DOTALL)
+
+            return {
+                'thinking': thinking_match.group(1).strip() if thinking_match else '',
+                'answer': answer_match.group(1).strip() if answer_match else text,
+                'full_response': text
+            }
+
+    return ThinkingOutputParser
+
+
+def agent_prompt_hash(agent) -> str:
+    """Agent提示词相关字段的哈希"""
+
+    digest = hashlib.sha1()
+    for field in PROMPT_FIELDS:
+        digest.update((getattr(agent, field, '') or '').encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class CompiledAgentPrompt:
+    """一个Agent配置版本的编译结果"""
+
+    def __init__(self, agent, config_hash: str = None):
+        from langchain_core.messages import SystemMessage
+        from langchain_core.prompts import ChatPromptTemplate
+
+        self.agent_id = getattr(agent, 'pk', None)
+        self.config_hash = config_hash or agent_prompt_hash(agent)
+        self.persona = self.build_persona(agent)
+        self.system_template = THINKING_SYSTEM_TEMPLATE
+        self.system_message = SystemMessage(content=self.system_template)
+        self.prompt_template = ChatPromptTemplate.from_messages([
+            ("system", self.system_template),
+            ("human", "{input}")
+        ])
+        self.output_parser = thinking_output_parser_class()()
+        # 结构化布局的系统消息，同一配置版本内内容不变，提供商可以缓存这段前缀
+        self.structured_system_text = "\n\n".join(
+            part for part in (self.persona, self.system_template, RESPONSE_REQUIREMENTS.strip()) if part
+        )
+        self._structured_system_messages = {}
+
+    @staticmethod
+    def build_persona(agent) -> str:
+        """Agent角色设定"""
+
+        parts = []
+        if agent.role:
+            parts.append(f"你是一个{agent.role}。")
+        if agent.goal:
+            parts.append(f"你的目标是: {agent.goal}")
+        if agent.backstory:
+            parts.append(f"背景信息: {agent.backstory}")
+        return "\n".join(parts)
+
+    def render(self, task_description: str, context: str) -> str:
+        """组装单条消息的提示词（角色设定 + 对话历史 + 当前任务 + 响应要求）"""
+
+        parts = [self.persona] if self.persona else []
+        if context:
+            parts.append(f"\n以下是之前的对话历史:\n{context}")
+        parts.append(f"\n当前任务: {task_description}")
+        parts.append(RESPONSE_REQUIREMENTS)
+        return "\n".join(parts)
+
+    def structured_system_message(self, cache_breakpoint: bool = False):
+        """结构化布局的系统消息（cache_breakpoint时在内容块上标记缓存断点）"""
+
+        message = self._structured_system_messages.get(cache_breakpoint)
+        if message is None:
+            from langchain_core.messages import SystemMessage
+            from .prompt_layout import CACHE_CONTROL
+
+            content = self.structured_system_text
+            if cache_breakpoint:
+                content = [{'type': 'text', 'text': content, 'cache_control': CACHE_CONTROL}]
+            message = self._structured_system_messages[cache_breakpoint] = SystemMessage(content=content)
+        return message
+
+    def messages(self, user_input: str) -> list:
+        """思考模式的消息列表（系统消息复用同一个实例）"""
+
+        from langchain_core.messages import HumanMessage
+        return [self.system_message, HumanMessage(content=user_input)]
+
+
+class AgentPromptCache:
+    """按Agent缓存编译后的提示词（LRU）"""
+
+    def __init__(self, max_entries: int = None):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, CompiledAgentPrompt]' = OrderedDict()
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, 'AGENT_PROMPT_CACHE_SIZE', 256)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, agent) -> CompiledAgentPrompt:
+        """获取Agent当前配置的编译结果，配置变化时重新编译"""
+
+        agent_id = getattr(agent, 'pk', None)
+        config_hash = agent_prompt_hash(agent)
+        if agent_id is None:
+            return CompiledAgentPrompt(agent, config_hash)
+
+        with self._lock:
+            compiled = self._entries.get(agent_id)
+            if compiled is not None and compiled.config_hash == config_hash:
+                self._entries.move_to_end(agent_id)
+                metrics.incr('agent.prompt_cache.hits')
+                return compiled
+
+        metrics.incr('agent.prompt_cache.misses')
+        compiled = CompiledAgentPrompt(agent, config_hash)
+        with self._lock:
+            self._entries[agent_id] = compiled
+            self._entries.move_to_end(agent_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, agent_id: Optional[int] = None):
+        """清除指定Agent（或全部）的编译结果"""
+
+        with self._lock:
+            if agent_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(agent_id, None)
+
+
+agent_prompt_cache = AgentPromptCache()
@@ -0,0 +1,161 @@
+"""
+Agent回复的消息生命周期
+
+一条用户消息的回复原本要经过多次独立的数据库往返：选择Agent、创建任务、创建占位消息、
+设置占位状态、认领任务、完成任务、按"最新处理中消息"查询占位消息、更新占位消息、
+再查询最新的助手消息。
+
+AgentReplyService 把它们合并为两次往返：
+- start：选择Agent，并在同一个事务中创建处理中的占位消息和关联它的任务；
+  当前进程直接执行时任务创建即为已认领（running + 执行租约），不再单独认领
+- 结束（complete / fail / cancel）：在同一个事务中写入任务结果和占位消息
+占位消息通过 ChatAgentTask.response_message 关联，不再按状态查询。
+"""
+
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import ChatAgentTask, ChatMessage, CrewAIAgent
+from .chat_service import ChatAgentTaskService
+
+
+logger = logging.getLogger(__name__)
+
+
+PLACEHOLDER_CONTENT = "正在思考中..."
+
+
+class AgentReplyService:
+    """Agent回复的创建与结束"""
+
+    @staticmethod
+    def select_agent(conversation) -> Optional[CrewAIAgent]:
+        """
+        选择回复的Agent：会话的主要Agent，否则用户的第一个可用Agent（预加载llm_model）
+
+        WebSocket连接的上下文已预加载主要Agent及其LLM模型（conversation.preloaded_agent）时直接使用，不再查询
+        """
+
+        agent = getattr(conversation, 'preloaded_agent', None)
+        if agent is not None and agent.is_active:
+            return agent
+
+        agents = CrewAIAgent.objects.select_related('llm_model')
+        if conversation.primary_agent_id:
+            agent = agents.filter(pk=conversation.primary_agent_id, is_active=True).first()
+            if agent is not None:
+                return agent
+        return agents.filter(owner_id=conversation.user_id, is_active=True).first()
+
+    @staticmethod
+    def start(conversation, user_message: ChatMessage, lease_owner: str = None,
+              lease_seconds: int = None) -> Optional[ChatAgentTask]:
+        """
+        创建回复任务和占位消息（一个事务）
+
+        Args:
+            lease_owner: 当前进程直接执行时的执行方标识，任务创建即为已认领；
+                         为空时任务留在队列中（pending）等待worker认领
+            lease_seconds: 执行租约时长
+
+        Returns:
+            任务（task.agent、task.response_message 已就绪），没有可用Agent时返回None
+        """
+
+        from .agent_task_queue import AgentTaskQueue
+
+        agent = AgentReplyService.select_agent(conversation)
+        if agent is None:
+            return None
+
+        lease_fields = {}
+        if lease_owner:
+            now = timezone.now()
+            lease_fields = {
+                'status': 'running',
+                'start_time': now,
+                'lease_owner': lease_owner,
+                'lease_expires_at': now + timedelta(seconds=lease_seconds or AgentTaskQueue.lease_seconds()),
+                'attempts': 1,
+            }
+
+        with transaction.atomic():
+            placeholder = ChatMessage.objects.create(
+                conversation=conversation,
+                role='assistant',
+                content=PLACEHOLDER_CONTENT,
+                agent=agent,
+                agent_name=agent.name,
+                status='processing',
+            )
+            task = ChatAgentTask.objects.create(
+                conversation=conversation,
+                message=user_message,
+                agent=agent,
+                agent_name=agent.name,
+                task_description=f"回复用户消息: {user_message.content}",
+                response_message=placeholder,
+                **{'status': 'pending', **lease_fields}
+            )
+
+        logger.info(f"Agent任务已创建: {task.id}（回复消息 {placeholder.id}）")
+        return task
+
+    @staticmethod
+    def complete(task: ChatAgentTask, response: str, answer: str) -> Optional[ChatMessage]:
+        """完成任务并保存最终答案（一个事务）"""
+
+        with transaction.atomic():
+            ChatAgentTaskService.complete_task_execution(task, response)
+            return AgentReplyService._save_reply(task, answer, 'completed')
+
+    @staticmethod
+    def fail(task: ChatAgentTask, error: str) -> Optional[ChatMessage]:
+        """标记任务失败并把错误写入回复消息（一个事务）"""
+
+        content = f"抱歉，处理您的请求时遇到了问题: {error}"
+        with transaction.atomic():
+            ChatAgentTaskService.fail_task_execution(task, error)
+            return AgentReplyService._save_reply(task, content, 'failed', content)
+
+    @staticmethod
+    def cancel(task: ChatAgentTask, partial_response: str, partial_answer: str,
+               reason: str) -> Optional[ChatMessage]:
+        """标记任务已取消并保存部分答案（一个事务）"""
+
+        with transaction.atomic():
+            ChatAgentTaskService.cancel_task_execution(task, partial_response, reason)
+            return AgentReplyService._save_reply(task, partial_answer or f"（{reason}）", 'cancelled', reason)
+
+    @staticmethod
+    def _save_reply(task: ChatAgentTask, content: str, status: str,
+                    error_message: str = None) -> Optional[ChatMessage]:
+        message = AgentReplyService.reply_message(task)
+        if message is None:
+            logger.warning(f"未找到待更新的助手消息，任务ID: {task.id}")
+            return None
+
+        message.content = content
+        message.status = status
+        if error_message is not None:
+            message.error_message = error_message
+        message.save(update_fields=['content', 'status', 'error_message', 'updated_at'])
+        logger.info(f"助手消息 {message.id} 已更新")
+        return message
+
+    @staticmethod
+    def reply_message(task: ChatAgentTask) -> Optional[ChatMessage]:
+        """任务的回复消息；没有关联回复消息的旧任务按"最新处理中消息"查找"""
+
+        if task.response_message_id:
+            return task.response_message
+        return ChatMessage.objects.filter(
+            conversation_id=task.conversation_id,
+            role='assistant',
+            agent_id=task.agent_id,
+            status='processing'
+        ).order_by('-created_at').first()
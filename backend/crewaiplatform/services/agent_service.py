@@ -517,6 +517,7 @@ class AgentService:
                     'backstory': source_agent.backstory,
                     'llm_model': source_agent.llm_model,
                     'function_calling_llm': source_agent.function_calling_llm,
+                    'fallback_llm_models': list(source_agent.fallback_llm_models or []),
                     'verbose': source_agent.verbose,
                     'memory': source_agent.memory,
                     'max_iter': source_agent.max_iter,
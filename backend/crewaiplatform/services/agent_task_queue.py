@@ -0,0 +1,212 @@
+"""
+Agent任务队列
+
+ChatAgentTask 表本身就是持久化的任务队列：状态为 pending 的任务等待执行，
+执行方通过"认领"把任务改为 running 并持有一份有时限的执行租约：
+- 认领使用条件更新（status='pending'），同一任务只会被一个执行方认领；
+  数据库支持时批量认领使用 SELECT ... FOR UPDATE SKIP LOCKED，多个worker互不阻塞
+- 执行期间定期续约；续约失败（租约被回收或任务已被取消）时执行方停止执行
+- 租约过期的 running 任务（执行进程崩溃或重启）重新入队，超过最大执行次数的标记为失败
+
+WebSocket连接内执行的任务同样先认领再执行，进程退出后可由worker接手。
+worker见 manage.py run_agent_worker 和 services/agent_worker.py。
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import timedelta
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import ChatAgentTask, ChatMessage
+from ..metrics import metrics
+from .message_cache import recent_message_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+class AgentTaskQueue:
+    """基于ChatAgentTask表的任务队列（认领、续约、回收）"""
+
+    _process_owner = None
+
+    @staticmethod
+    def lease_seconds() -> int:
+        return getattr(settings, 'CHAT_AGENT_TASK_LEASE_SECONDS', 60)
+
+    @staticmethod
+    def max_attempts() -> int:
+        return getattr(settings, 'CHAT_AGENT_TASK_MAX_ATTEMPTS', 3)
+
+    @staticmethod
+    def is_enabled() -> bool:
+        """WebSocket消息是否只入队、由worker执行"""
+        return getattr(settings, 'CHAT_AGENT_TASK_QUEUE_ENABLED', False)
+
+    @staticmethod
+    def new_owner(prefix: str = 'worker') -> str:
+        """生成执行方标识：前缀@主机名:进程号:随机后缀"""
+        return f"{prefix}@{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    @classmethod
+    def process_owner(cls) -> str:
+        """当前进程内联执行（WebSocket连接）使用的执行方标识"""
+        if cls._process_owner is None or f":{os.getpid()}:" not in cls._process_owner:
+            cls._process_owner = cls.new_owner('inline')
+        return cls._process_owner
+
+    @staticmethod
+    def _lease_fields(owner: str, lease_seconds: int = None) -> dict:
+        now = timezone.now()
+        lease = lease_seconds or AgentTaskQueue.lease_seconds()
+        return {
+            'status': 'running',
+            'start_time': now,
+            'lease_owner': owner,
+            'lease_expires_at': now + timedelta(seconds=lease),
+            'attempts': F('attempts') + 1,
+            'updated_at': now,
+        }
+
+    @staticmethod
+    def claim_task(task: ChatAgentTask, owner: str, lease_seconds: int = None) -> bool:
+        """认领指定的待执行任务，已被其他执行方认领或已取消时返回False"""
+
+        fields = AgentTaskQueue._lease_fields(owner, lease_seconds)
+        claimed = ChatAgentTask.objects.filter(pk=task.pk, status='pending').update(**fields)
+        if not claimed:
+            return False
+
+        task.status = 'running'
+        task.start_time = fields['start_time']
+        task.lease_owner = owner
+        task.lease_expires_at = fields['lease_expires_at']
+        task.attempts = (task.attempts or 0) + 1
+        metrics.incr('chat.queue.claimed')
+        return True
+
+    @staticmethod
+    def claim_batch(owner: str, limit: int, lease_seconds: int = None) -> List[ChatAgentTask]:
+        """按创建顺序认领最多limit个待执行任务"""
+
+        if limit <= 0:
+            return []
+
+        with transaction.atomic():
+            queryset = ChatAgentTask.objects.filter(status='pending').order_by('created_at', 'pk')
+            if connection.features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            candidate_ids = list(queryset.values_list('pk', flat=True)[:limit])
+
+            claimed_ids = []
+            for pk in candidate_ids:
+                # 不支持行锁的数据库（SQLite）依靠条件更新避免重复认领
+                fields = AgentTaskQueue._lease_fields(owner, lease_seconds)
+                if ChatAgentTask.objects.filter(pk=pk, status='pending').update(**fields):
+                    claimed_ids.append(pk)
+
+        if not claimed_ids:
+            return []
+        metrics.incr('chat.queue.claimed', len(claimed_ids))
+        return list(
+            ChatAgentTask.objects.select_related('agent__llm_model', 'conversation', 'response_message')
+            .filter(pk__in=claimed_ids).order_by('created_at', 'pk')
+        )
+
+    @staticmethod
+    def renew_lease(task_id: int, owner: str, lease_seconds: int = None) -> bool:
+        """续约，租约已不属于owner（被回收或任务已结束/取消）时返回False"""
+
+        lease = lease_seconds or AgentTaskQueue.lease_seconds()
+        now = timezone.now()
+        return bool(ChatAgentTask.objects.filter(
+            pk=task_id, status='running', lease_owner=owner
+        ).update(lease_expires_at=now + timedelta(seconds=lease), updated_at=now))
+
+    @staticmethod
+    def requeue_stale(max_attempts: int = None) -> Tuple[int, int]:
+        """
+        回收租约已过期的任务
+
+        Returns:
+            (重新入队数, 因超过最大执行次数标记失败数)
+        """
+
+        max_attempts = max_attempts or AgentTaskQueue.max_attempts()
+        now = timezone.now()
+        stale = ChatAgentTask.objects.filter(status='running', lease_expires_at__lt=now)
+
+        requeued = stale.filter(attempts__lt=max_attempts).update(
+            status='pending', lease_owner=None, lease_expires_at=None,
+            start_time=None, updated_at=now
+        )
+
+        failed = 0
+        for task in stale.filter(attempts__gte=max_attempts).only(
+            'pk', 'conversation_id', 'agent_id', 'response_message_id', 'attempts'
+        ):
+            error = f"任务执行中断 {task.attempts} 次（租约过期），不再重试"
+            with transaction.atomic():
+                if not ChatAgentTask.objects.filter(pk=task.pk, status='running', lease_expires_at__lt=now).update(
+                    status='failed', end_time=now, error_details=error,
+                    lease_owner=None, lease_expires_at=None, updated_at=now
+                ):
+                    continue
+                if task.response_message_id:
+                    replies = ChatMessage.objects.filter(pk=task.response_message_id, status='processing')
+                else:
+                    replies = ChatMessage.objects.filter(
+                        conversation_id=task.conversation_id,
+                        role='assistant',
+                        agent_id=task.agent_id,
+                        status='processing'
+                    )
+                replies.update(status='failed', content=f"抱歉，处理您的请求时遇到了问题: {error}",
+                               error_message=error, updated_at=now)
+            # 批量更新不触发信号，丢弃会话的最近消息缓存
+            recent_message_cache.invalidate(task.conversation_id)
+            failed += 1
+
+        if requeued or failed:
+            metrics.incr('chat.queue.requeued', requeued)
+            metrics.incr('chat.queue.expired', failed)
+            logger.warning(f"回收过期任务：重新入队 {requeued} 个，标记失败 {failed} 个")
+        return requeued, failed
+
+    @staticmethod
+    def pending_count() -> int:
+        return ChatAgentTask.objects.filter(status='pending').count()
+
+    @staticmethod
+    async def keep_lease(task: ChatAgentTask, owner: str, cancel_token, lease_seconds: int = None):
+        """
+        执行期间定期续约（作为后台任务运行，任务结束时取消）
+
+        续约失败说明租约已被回收或任务已在别处被取消，通过取消令牌停止执行。
+        """
+
+        from asgiref.sync import sync_to_async
+
+        lease = lease_seconds or AgentTaskQueue.lease_seconds()
+        interval = max(lease / 3, 0.05)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await sync_to_async(AgentTaskQueue.renew_lease)(task.pk, owner, lease)
+            except Exception as e:
+                # 数据库暂时不可用时继续尝试，租约过期前恢复即可
+                logger.warning(f"任务 {task.pk} 续约失败: {e}")
+                continue
+            if not renewed:
+                metrics.incr('chat.queue.lease_lost')
+                logger.warning(f"任务 {task.pk} 的执行租约已失效，停止执行")
+                cancel_token.cancel('lease_lost')
+                return
@@ -0,0 +1,124 @@
+"""
+Agent任务worker
+
+从任务队列（ChatAgentTask表）认领待执行的任务并在本进程的事件循环中执行，
+流式结果通过channel layer推送到会话群组 chat_<会话ID>，
+订阅该会话的WebSocket连接（可以在其他进程/节点上）照常收到思考和答案事件。
+
+多个worker可以同时运行在不同节点上，通过执行租约保证同一任务只被一个worker执行；
+worker崩溃后其任务在租约过期时被任意worker回收并重新执行。
+跨进程推送需要共享的channel layer（同一主机上可使用 CHANNEL_LAYER_BACKEND=ipc，
+多节点使用 postgres 或Redis），InMemoryChannelLayer只在进程内有效。
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from asgiref.sync import sync_to_async
+
+from ..metrics import metrics
+from ..stream_protocol import AgentResponseStream, ChannelGroupTarget
+from .agent_task_queue import AgentTaskQueue
+
+
+logger = logging.getLogger(__name__)
+
+
+class AgentWorker:
+    """认领并执行队列中的Agent任务"""
+
+    def __init__(self, worker_id: str = None, concurrency: int = 4, lease_seconds: int = None,
+                 poll_interval: float = 1.0, channel_layer=None):
+        self.worker_id = worker_id or AgentTaskQueue.new_owner()
+        self.concurrency = max(concurrency, 1)
+        self.lease_seconds = lease_seconds or AgentTaskQueue.lease_seconds()
+        self.poll_interval = poll_interval
+        self.channel_layer = channel_layer
+        self.processed = 0
+        self._running: Dict[int, asyncio.Task] = {}
+        self._stopping: Optional[asyncio.Event] = None
+
+    def stop(self):
+        """请求停止：不再认领新任务，等待执行中的任务结束"""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self, once: bool = False):
+        """
+        运行worker主循环
+
+        Args:
+            once: 队列清空且没有执行中的任务时退出（用于测试和一次性排空队列）
+        """
+
+        self._stopping = asyncio.Event()
+        logger.info(f"Agent worker {self.worker_id} 启动（并发 {self.concurrency}，租约 {self.lease_seconds}s）")
+
+        try:
+            while not self._stopping.is_set():
+                await sync_to_async(AgentTaskQueue.requeue_stale)()
+
+                claimed = await self.claim_and_start()
+                if once and not claimed and not self._running:
+                    break
+
+                await self._wait_for_capacity()
+        finally:
+            if self._running:
+                await asyncio.gather(*self._running.values(), return_exceptions=True)
+            logger.info(f"Agent worker {self.worker_id} 已停止，共处理 {self.processed} 个任务")
+
+    async def claim_and_start(self) -> int:
+        """按空闲并发数认领任务并开始执行，返回认领数"""
+
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+
+        tasks = await sync_to_async(AgentTaskQueue.claim_batch)(self.worker_id, free, self.lease_seconds)
+        for task in tasks:
+            self._running[task.pk] = asyncio.ensure_future(self.execute(task))
+        metrics.set_gauge('chat.worker.running', len(self._running), worker=self.worker_id)
+        return len(tasks)
+
+    async def execute(self, task):
+        """执行一个已认领的任务，事件推送到会话群组"""
+
+        from .simple_agent_service import SimpleAgentService
+
+        stream = AgentResponseStream(ChannelGroupTarget(task.conversation_id, self.channel_layer))
+        try:
+            await stream.send_task_status(task)
+            await stream.send_thinking_status(True, '正在分析您的问题...')
+            await SimpleAgentService._execute_agent_task(
+                task, stream, lease_owner=self.worker_id, lease_seconds=self.lease_seconds
+            )
+            # 租约失效时任务状态由其他执行方写入，广播数据库中的最新状态
+            await sync_to_async(task.refresh_from_db)(fields=['status'])
+            await stream.send_task_status(task)
+            metrics.incr('chat.worker.processed')
+        except Exception as e:
+            metrics.incr('chat.worker.failed')
+            logger.error(f"worker {self.worker_id} 执行任务 {task.pk} 出错: {e}")
+        finally:
+            self.processed += 1
+            self._running.pop(task.pk, None)
+            metrics.set_gauge('chat.worker.running', len(self._running), worker=self.worker_id)
+            # 释放共享同步线程上可能已失效的数据库连接
+            from django.db import close_old_connections
+            await sync_to_async(close_old_connections)()
+
+    async def _wait_for_capacity(self):
+        """等待轮询间隔，或有任务完成（腾出并发）时提前返回"""
+
+        waiters = list(self._running.values())
+        stop_waiter = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait(
+                waiters + [stop_waiter],
+                timeout=self.poll_interval,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            stop_waiter.cancel()
@@ -317,6 +317,54 @@ class ChatAgentTaskService:
         except Exception as e:
             logger.error(f"标记任务失败出错: {e}")
             raise e
+    
+    @staticmethod
+    def cancel_task_execution(task: ChatAgentTask, partial_result: str = None,
+                              reason: str = None) -> ChatAgentTask:
+        """标记任务已取消，保留已生成的部分结果"""
+        
+        try:
+            task.cancel_execution(partial_result, reason)
+            logger.info(f"任务 {task.id} 已取消: {reason}")
+            return task
+            
+        except Exception as e:
+            logger.error(f"标记任务取消出错: {e}")
+            raise e
+    
+    @staticmethod
+    def request_cancel(task: ChatAgentTask, reason: str = 'api') -> bool:
+        """
+        请求取消正在执行的任务
+        
+        任务在本进程内运行时直接中断其流式调用，由执行方保存部分答案，返回True；
+        否则通知会话群组（其他进程中的连接会中断各自运行的任务），
+        并直接把任务和它的回复消息标记为已取消，返回False。
+        """
+        
+        from ..task_registry import agent_task_cancellation, CANCEL_REASON_LABELS
+        
+        if agent_task_cancellation.cancel(task.id, reason):
+            return True
+        
+        try:
+            from asgiref.sync import async_to_sync
+            from channels.layers import get_channel_layer
+            
+            channel_layer = get_channel_layer()
+            if channel_layer is not None:
+                async_to_sync(channel_layer.group_send)(
+                    f'chat_{task.conversation_id}',
+                    {'type': 'agent_task_cancel', 'task_id': task.id, 'reason': reason}
+                )
+        except Exception as e:
+            logger.warning(f"广播任务 {task.id} 取消事件失败: {e}")
+        
+        from .agent_reply import AgentReplyService
+        
+        # 按任务关联的回复消息更新，多个任务同时处理中时不会取消到其他任务的回复
+        AgentReplyService.cancel(task, '', '', CANCEL_REASON_LABELS.get(reason, reason))
+        return False
 
 
 class ChatStatsService:
@@ -408,4 +456,4 @@ class ChatStatsService:
                 'duration_hours': 0,
                 'most_active_agent': None,
                 'last_activity': None
-            }
\ No newline at end of file
+            }
@@ -0,0 +1,334 @@
+"""
+LLM模型与MCP工具的熔断器
+
+可用性原本是静态字段（LLMModel.is_available、MCPTool.status），只有手动验证或健康检查时
+才会变化；在此之前每个发往故障端点的请求都要等满超时时间。
+
+CircuitBreaker 按端点（llm_model:<id>、mcp_tool:<id>）维护三种状态，状态保存在Django缓存中，
+配置 REDIS_URL 时所有worker进程共享：
+- closed：正常调用；按 CIRCUIT_BREAKER_BUCKET_SECONDS 秒分桶统计成功/失败次数，
+  最近 CIRCUIT_BREAKER_WINDOW_SECONDS 秒内调用数不少于 CIRCUIT_BREAKER_MIN_CALLS
+  且失败率达到 CIRCUIT_BREAKER_FAILURE_RATE 时打开
+- open：调用立即失败（CircuitOpenError），调用方转而使用备用模型或跳过工具；
+  打开时把 is_available/status 写回数据库，错误信息以 CIRCUIT_OPEN_PREFIX 开头
+- half-open：打开 CIRCUIT_BREAKER_OPEN_SECONDS 秒后，同一时间只放行一个探测请求；
+  探测成功则关闭并恢复数据库中的可用状态，失败则重新打开
+
+缓存中的状态丢失（如内存缓存的进程重启）而数据库仍为熔断写入的不可用状态时，
+按半开处理，由下一个请求探测。
+"""
+
+import logging
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 熔断写回数据库的错误信息前缀，用于区分熔断与手动验证失败
+CIRCUIT_OPEN_PREFIX = '[熔断] '
+
+
+class CircuitOpenError(Exception):
+    """熔断器已打开，调用被拒绝"""
+
+    def __init__(self, key: str, retry_after: int = 0):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"服务暂时不可用（{key} 已熔断），请 {retry_after} 秒后重试")
+
+
+class BreakerPermit:
+    """一次被放行的调用（probe为半开状态下的探测请求）"""
+
+    __slots__ = ('key', 'probe', 'token')
+
+    def __init__(self, key: str, probe: bool = False, token: str = None):
+        self.key = key
+        self.probe = probe
+        self.token = token
+
+
+def llm_model_key(llm_model) -> str:
+    return f"llm_model:{llm_model.pk}"
+
+
+def mcp_tool_key(mcp_tool) -> str:
+    return f"mcp_tool:{mcp_tool.pk}"
+
+
+def is_tripped(error_message: Optional[str]) -> bool:
+    """数据库中的不可用状态是否由熔断器写入"""
+    return bool(error_message) and error_message.startswith(CIRCUIT_OPEN_PREFIX)
+
+
+class CircuitBreaker:
+    """基于Django缓存的跨进程熔断器"""
+
+    KEY_PREFIX = 'circuit'
+
+    def __init__(self, cache_alias: str = None):
+        self._cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self._cache_alias or 'default']
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, 'CIRCUIT_BREAKER_ENABLED', True)
+
+    @property
+    def window_seconds(self) -> int:
+        return getattr(settings, 'CIRCUIT_BREAKER_WINDOW_SECONDS', 60)
+
+    @property
+    def bucket_seconds(self) -> int:
+        return max(getattr(settings, 'CIRCUIT_BREAKER_BUCKET_SECONDS', 10), 1)
+
+    @property
+    def min_calls(self) -> int:
+        return getattr(settings, 'CIRCUIT_BREAKER_MIN_CALLS', 10)
+
+    @property
+    def failure_rate(self) -> float:
+        return getattr(settings, 'CIRCUIT_BREAKER_FAILURE_RATE', 0.5)
+
+    @property
+    def open_seconds(self) -> int:
+        return getattr(settings, 'CIRCUIT_BREAKER_OPEN_SECONDS', 30)
+
+    @property
+    def probe_timeout(self) -> int:
+        """探测请求的最长占用时间（秒），超时未结束视为探测丢失，允许下一个探测"""
+        return getattr(settings, 'CIRCUIT_BREAKER_PROBE_TIMEOUT', 120)
+
+    def _key(self, key: str, suffix: str) -> str:
+        return f"{self.KEY_PREFIX}:{key}:{suffix}"
+
+    # ---- 调用前后 ----
+
+    def before(self, key: str, tripped: bool = False) -> BreakerPermit:
+        """
+        调用前检查熔断状态
+
+        Args:
+            tripped: 数据库中的不可用状态由熔断写入（缓存中没有状态时按半开处理）
+
+        Raises:
+            CircuitOpenError: 熔断器打开，或半开状态下已有探测请求
+        """
+
+        if not self.enabled:
+            return BreakerPermit(key)
+
+        state = self.cache.get(self._key(key, 'state'))
+        if state is None and not tripped:
+            return BreakerPermit(key)
+
+        if state is not None:
+            retry_after = state['opened_at'] + self.open_seconds - time.time()
+            if retry_after > 0:
+                metrics.incr('circuit.rejected', key=key)
+                raise CircuitOpenError(key, int(retry_after) + 1)
+
+        # 半开：同一时间只放行一个探测请求
+        token = uuid.uuid4().hex
+        if not self.cache.add(self._key(key, 'probe'), token, timeout=self.probe_timeout):
+            metrics.incr('circuit.rejected', key=key)
+            raise CircuitOpenError(key, 1)
+        logger.info(f"熔断器 {key} 半开，放行探测请求")
+        return BreakerPermit(key, probe=True, token=token)
+
+    def success(self, permit: BreakerPermit):
+        """调用成功（探测成功时关闭熔断器并恢复可用状态）"""
+
+        if not self.enabled:
+            return
+        self._count(permit.key, 'ok')
+        if permit.probe:
+            self._close(permit)
+
+    def failure(self, permit: BreakerPermit, error=None):
+        """调用失败（探测失败时重新打开；失败率超过阈值时打开）"""
+
+        if not self.enabled:
+            return
+        self._count(permit.key, 'fail')
+        if permit.probe:
+            self._open(permit.key, error, reopen=True)
+            self.release(permit)
+            return
+
+        calls, failures = self.window_counts(permit.key)
+        if calls >= self.min_calls and failures / calls >= self.failure_rate:
+            self._open(permit.key, error)
+
+    def release(self, permit: BreakerPermit):
+        """放弃调用（如对冲落败被取消），不计入成功或失败；释放探测名额"""
+
+        if permit.probe and self.cache.get(self._key(permit.key, 'probe')) == permit.token:
+            self.cache.delete(self._key(permit.key, 'probe'))
+
+    # ---- 异步版本（缓存和数据库操作在线程中执行）----
+
+    async def abefore(self, key: str, tripped: bool = False) -> BreakerPermit:
+        if not self.enabled:
+            return BreakerPermit(key)
+        return await sync_to_async(self.before)(key, tripped)
+
+    async def asuccess(self, permit: BreakerPermit):
+        if self.enabled:
+            await sync_to_async(self.success)(permit)
+
+    async def afailure(self, permit: BreakerPermit, error=None):
+        if self.enabled:
+            await sync_to_async(self.failure)(permit, error)
+
+    async def arelease(self, permit: BreakerPermit):
+        if self.enabled and permit.probe:
+            await sync_to_async(self.release)(permit)
+
+    # ---- 滑动窗口 ----
+
+    def _bucket(self, now: float = None) -> int:
+        return int((now or time.time()) // self.bucket_seconds)
+
+    def _count(self, key: str, outcome: str):
+        bucket_key = self._key(key, f"{self._bucket()}:{outcome}")
+        ttl = self.window_seconds + self.bucket_seconds
+        self.cache.add(bucket_key, 0, timeout=ttl)
+        try:
+            self.cache.incr(bucket_key)
+        except ValueError:
+            self.cache.add(bucket_key, 1, timeout=ttl)
+
+    def window_counts(self, key: str):
+        """最近一个窗口内（熔断器上次关闭之后）的 (调用数, 失败数)"""
+
+        current = self._bucket()
+        buckets = range(current - self.window_seconds // self.bucket_seconds + 1, current + 1)
+        keys = [self._key(key, f"{bucket}:{outcome}") for bucket in buckets for outcome in ('ok', 'fail')]
+        since_key = self._key(key, 'since')
+        values = self.cache.get_many(keys + [since_key])
+
+        since = values.get(since_key)
+        calls = failures = 0
+        for bucket in buckets:
+            if since is not None and bucket < since:
+                continue
+            ok = values.get(self._key(key, f"{bucket}:ok")) or 0
+            failed = values.get(self._key(key, f"{bucket}:fail")) or 0
+            calls += ok + failed
+            failures += failed
+        return calls, failures
+
+    # ---- 状态转换 ----
+
+    def _open(self, key: str, error=None, reopen: bool = False):
+        state = {'opened_at': time.time(), 'error': str(error or '')[:500]}
+        state_key = self._key(key, 'state')
+        if reopen:
+            self.cache.set(state_key, state, timeout=None)
+            logger.warning(f"熔断器 {key} 探测失败，重新打开: {error}")
+            metrics.incr('circuit.reopened', key=key)
+            return
+
+        # 只有完成状态转换的进程写回数据库
+        if not self.cache.add(state_key, state, timeout=None):
+            return
+        logger.warning(f"熔断器 {key} 打开: {error}")
+        metrics.incr('circuit.opened', key=key)
+        try:
+            self._write_back(key, available=False, error=state['error'])
+        except Exception as e:
+            logger.error(f"写回熔断状态失败 {key}: {e}")
+
+    def _close(self, permit: BreakerPermit):
+        key = permit.key
+        # 关闭前的失败不再计入窗口
+        self.cache.set(self._key(key, 'since'), self._bucket() + 1, timeout=self.window_seconds + self.bucket_seconds)
+        self.cache.delete(self._key(key, 'state'))
+        self.release(permit)
+        logger.info(f"熔断器 {key} 探测成功，已关闭")
+        metrics.incr('circuit.closed', key=key)
+        try:
+            self._write_back(key, available=True)
+        except Exception as e:
+            logger.error(f"写回熔断状态失败 {key}: {e}")
+
+    def reset(self, key: str):
+        """清除熔断状态（手动验证或健康检查通过后）"""
+
+        if self.cache.get(self._key(key, 'state')) is None:
+            return
+        self.cache.delete_many([self._key(key, 'state'), self._key(key, 'probe')])
+        self.cache.set(self._key(key, 'since'), self._bucket() + 1, timeout=self.window_seconds + self.bucket_seconds)
+
+    @staticmethod
+    def _write_back(key: str, available: bool, error: str = ''):
+        """把熔断状态写回数据库；恢复时只恢复由熔断写入的不可用状态"""
+
+        from ..models import LLMModel, MCPTool
+
+        kind, pk = key.split(':', 1)
+        if kind == 'llm_model':
+            queryset = LLMModel.objects.filter(pk=pk)
+            if available:
+                queryset.filter(validation_error__startswith=CIRCUIT_OPEN_PREFIX).update(
+                    is_available=True, validation_error=''
+                )
+            else:
+                queryset.filter(is_available=True).update(
+                    is_available=False, validation_error=f"{CIRCUIT_OPEN_PREFIX}{error}"
+                )
+        elif kind == 'mcp_tool':
+            queryset = MCPTool.objects.filter(pk=pk)
+            if available:
+                queryset.filter(last_error__startswith=CIRCUIT_OPEN_PREFIX).update(status='healthy', last_error='')
+            else:
+                # 健康检查写入的不健康/错误状态保持不变，恢复时也不会被改成健康
+                queryset.filter(status__in=('healthy', 'unknown')).update(
+                    status='unhealthy', last_error=f"{CIRCUIT_OPEN_PREFIX}{error}"
+                )
+
+    # ---- 统计 ----
+
+    def snapshot(self, keys: Iterable[str]) -> List[Dict]:
+        """非关闭状态的熔断器（统计接口使用）"""
+
+        keys = list(keys)
+        states = self.cache.get_many([self._key(key, 'state') for key in keys])
+        now = time.time()
+        result = []
+        for key in keys:
+            state = states.get(self._key(key, 'state'))
+            if state is None:
+                continue
+            retry_after = state['opened_at'] + self.open_seconds - now
+            calls, failures = self.window_counts(key)
+            result.append({
+                'key': key,
+                'state': STATE_OPEN if retry_after > 0 else STATE_HALF_OPEN,
+                'opened_at': state['opened_at'],
+                'retry_after': max(int(retry_after) + 1, 0) if retry_after > 0 else 0,
+                'error': state['error'],
+                'window_calls': calls,
+                'window_failures': failures,
+            })
+        return result
+
+
+circuit_breaker = CircuitBreaker()
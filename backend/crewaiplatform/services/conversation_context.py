@@ -0,0 +1,309 @@
+"""
+对话上下文构建
+
+原实现固定取最近10条消息直接拼接：长回答会撑大提示词、拖慢首token，
+短对话又浪费了可用的上下文。
+
+ConversationContextBuilder 按token预算组装历史对话：
+- 预算取 Agent.context_token_budget，未配置时使用 CHAT_CONTEXT_TOKEN_BUDGET
+- 会话的滚动摘要放在最前面，其余预算从最新消息往前依次放入；
+  摘要过长时先截断摘要，保证触发回复的最新消息始终放入
+- 放不下的早期消息交给 ConversationSummarizer 在后台合并进摘要，
+  不阻塞当前回复；摘要更新后，下一次回复即可使用
+- 最近消息和摘要通过 recent_message_cache 读取，已缓存的会话不访问数据库
+- 放入的消息同时按原始角色保留在 messages 中，供结构化消息布局（prompt_layout）使用
+
+token数使用 token_counter.estimate_tokens 估算。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import ChatConversation, ChatMessage
+from ..metrics import metrics
+from .message_cache import CachedMessage, recent_message_cache
+from .token_counter import estimate_tokens, truncate_to_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+# (消息ID, 角色, Agent名称, 内容)
+MessageRow = Tuple[int, str, str, str]
+
+
+class ConversationContext:
+    """按预算组装后的对话上下文"""
+
+    __slots__ = ('summary', 'turns', 'messages', 'tokens', 'overflow_until_id')
+
+    def __init__(self, summary: str = '', turns: List[str] = None, tokens: int = 0,
+                 overflow_until_id: Optional[int] = None, messages: List[CachedMessage] = None):
+        self.summary = summary
+        # 按时间顺序排列的对话行
+        self.turns = turns or []
+        # 与turns一一对应的原始消息（内容截断时为截断后的内容）
+        self.messages = messages or []
+        self.tokens = tokens
+        # 未放入上下文、也尚未合并进摘要的最新一条消息ID
+        self.overflow_until_id = overflow_until_id
+
+    @property
+    def text(self) -> str:
+        parts = []
+        if self.summary:
+            parts.append(f"之前对话的摘要: {self.summary}")
+        parts.extend(self.turns)
+        return "\n".join(parts)
+
+
+class ConversationContextBuilder:
+    """按token预算组装对话历史"""
+
+    @staticmethod
+    def token_budget(agent=None) -> int:
+        budget = getattr(agent, 'context_token_budget', None)
+        return budget or getattr(settings, 'CHAT_CONTEXT_TOKEN_BUDGET', 2000)
+
+    @staticmethod
+    def format_turn(role: str, agent_name: str, content: str) -> str:
+        speaker = "用户" if role == "user" else f"助手({agent_name})"
+        return f"{speaker}: {content}"
+
+    @staticmethod
+    def fit(rows_newest_first: Iterable[MessageRow], budget: int, summary: str = '') -> ConversationContext:
+        """
+        从最新消息往前放入预算内的消息
+
+        摘要计入预算；最新一条消息单独超出预算时截断后放入，保证当前问题可见。
+        摘要和最新一条消息放不下时先截断摘要（必要时不放摘要），最新消息不会被挤出上下文。
+        """
+
+        rows_newest_first = list(rows_newest_first)
+        if rows_newest_first:
+            message_id, role, agent_name, content = rows_newest_first[0]
+            latest_tokens = estimate_tokens(ConversationContextBuilder.format_turn(role, agent_name, content))
+            summary_budget = budget - min(latest_tokens, budget)
+            if estimate_tokens(summary) > summary_budget:
+                summary = truncate_to_tokens(summary, summary_budget)
+                metrics.incr('chat.context.summary_truncated')
+
+        remaining = budget - estimate_tokens(summary)
+        turns = []
+        messages = []
+        overflow_until_id = None
+        for message_id, role, agent_name, content in rows_newest_first:
+            line = ConversationContextBuilder.format_turn(role, agent_name, content)
+            tokens = estimate_tokens(line)
+            if tokens > remaining:
+                if not turns and remaining > 0:
+                    prefix = line[:len(line) - len(content)]
+                    line = truncate_to_tokens(line, remaining)
+                    turns.append(line)
+                    messages.append(CachedMessage(message_id, role, agent_name, line[len(prefix):]))
+                    remaining -= estimate_tokens(line)
+                    continue
+                overflow_until_id = message_id
+                break
+            turns.append(line)
+            messages.append(CachedMessage(message_id, role, agent_name, content))
+            remaining -= tokens
+
+        turns.reverse()
+        messages.reverse()
+        return ConversationContext(
+            summary=summary,
+            turns=turns,
+            messages=messages,
+            tokens=budget - remaining,
+            overflow_until_id=overflow_until_id,
+        )
+
+    @staticmethod
+    def build(conversation_id: int, budget: int, max_messages: int = None,
+              expected_message_id: int = None) -> ConversationContext:
+        """
+        按预算组装会话上下文（同步）
+        
+        已缓存的会话直接使用 recent_message_cache，不访问数据库；
+        expected_message_id 为触发本次回复的消息，缓存中缺少它时重新加载。
+        """
+
+        max_messages = max_messages or getattr(settings, 'CHAT_CONTEXT_MAX_MESSAGES', 50)
+        window = recent_message_cache.get(conversation_id, expected_message_id)
+        if window is None:
+            window = ConversationContextBuilder._load_window(conversation_id)
+
+        summary_message_id = window.summary_message_id or 0
+        rows = [m for m in window.newest_first() if m.id > summary_message_id]
+
+        context = ConversationContextBuilder.fit(rows[:max_messages], budget, window.summary)
+        if context.overflow_until_id is None:
+            if len(rows) > max_messages:
+                # 扫描上限之外的消息同样需要合并进摘要
+                context.overflow_until_id = rows[max_messages].id
+            elif (window.dropped_message_id or 0) > summary_message_id:
+                context.overflow_until_id = window.dropped_message_id
+        return context
+
+    @staticmethod
+    def _load_window(conversation_id: int):
+        """从数据库加载会话的摘要和最近消息，放入缓存"""
+
+        window_size = recent_message_cache.window_size
+        conversation = ChatConversation.objects.filter(pk=conversation_id).values(
+            'context_summary', 'summary_message_id'
+        ).first() or {}
+        summary_message_id = conversation.get('summary_message_id')
+
+        rows = list(
+            ConversationContextBuilder._history(conversation_id, summary_message_id)
+            .order_by('-id')
+            .values_list('id', 'role', 'agent_name', 'content')[:window_size + 1]
+        )
+        messages = [CachedMessage(message_id, role, agent_name or '', content or '')
+                    for message_id, role, agent_name, content in reversed(rows)]
+        return recent_message_cache.put(
+            conversation_id, messages,
+            summary=conversation.get('context_summary') or '',
+            summary_message_id=summary_message_id,
+        )
+
+    @staticmethod
+    def _history(conversation_id: int, after_message_id: Optional[int] = None):
+        """参与上下文的消息（不含处理中的占位消息）"""
+
+        queryset = ChatMessage.objects.filter(
+            conversation_id=conversation_id,
+            role__in=['user', 'assistant'],
+        ).exclude(status='processing')
+        if after_message_id:
+            queryset = queryset.filter(id__gt=after_message_id)
+        return queryset
+
+
+class ConversationSummarizer:
+    """把超出上下文的早期对话合并进会话的滚动摘要（后台执行）"""
+
+    # 单次合并的消息数和每条消息放入摘要提示词的token上限
+    BATCH_SIZE = 40
+    MESSAGE_MAX_TOKENS = 500
+
+    _inflight: Set[int] = set()
+    _tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return getattr(settings, 'CHAT_CONTEXT_SUMMARY_ENABLED', True)
+
+    @classmethod
+    def schedule(cls, conversation_id: int, llm_model, until_message_id: int) -> bool:
+        """在当前事件循环中后台更新摘要；同一会话已有更新在进行时跳过"""
+
+        if not cls.is_enabled() or llm_model is None or conversation_id in cls._inflight:
+            return False
+
+        cls._inflight.add(conversation_id)
+        task = asyncio.ensure_future(cls.update(conversation_id, llm_model, until_message_id))
+        cls._tasks.add(task)
+
+        def on_done(finished):
+            cls._tasks.discard(finished)
+            cls._inflight.discard(conversation_id)
+        task.add_done_callback(on_done)
+        metrics.incr('chat.context.summary_scheduled')
+        return True
+
+    @classmethod
+    async def update(cls, conversation_id: int, llm_model, until_message_id: int) -> bool:
+        """把摘要截止点之后、until_message_id（含）之前的消息合并进摘要"""
+
+        from asgiref.sync import sync_to_async
+
+        started_at = time.monotonic()
+        try:
+            summary, summary_message_id, rows = await sync_to_async(cls._load)(conversation_id, until_message_id)
+            if not rows:
+                return False
+
+            new_summary = await cls._summarize(llm_model, summary, rows)
+            saved = await sync_to_async(cls._save)(
+                conversation_id, summary_message_id, rows[-1][0], new_summary
+            )
+            metrics.observe('chat.context.summary_ms', (time.monotonic() - started_at) * 1000)
+            if saved:
+                metrics.incr('chat.context.summary_updates')
+                logger.info(f"会话 {conversation_id} 摘要已更新，合并 {len(rows)} 条消息")
+            return saved
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.incr('chat.context.summary_failed')
+            logger.warning(f"更新会话 {conversation_id} 摘要失败: {e}")
+            return False
+
+    @classmethod
+    def _load(cls, conversation_id: int, until_message_id: int) -> Tuple[str, Optional[int], List[MessageRow]]:
+        conversation = ChatConversation.objects.filter(pk=conversation_id).values(
+            'context_summary', 'summary_message_id'
+        ).first()
+        if conversation is None:
+            return '', None, []
+
+        summary_message_id = conversation['summary_message_id']
+        rows = list(
+            ConversationContextBuilder._history(conversation_id, summary_message_id)
+            .filter(id__lte=until_message_id)
+            .order_by('id')
+            .values_list('id', 'role', 'agent_name', 'content')[:cls.BATCH_SIZE]
+        )
+        return conversation['context_summary'] or '', summary_message_id, rows
+
+    @classmethod
+    async def _summarize(cls, llm_model, summary: str, rows: Sequence[MessageRow]) -> str:
+        from langchain_core.messages import HumanMessage, SystemMessage
+        from .llm_model_cache import llm_model_cache
+        from .rate_limiter import llm_rate_limiter
+
+        max_tokens = getattr(settings, 'CHAT_CONTEXT_SUMMARY_MAX_TOKENS', 400)
+        transcript = "\n".join(
+            ConversationContextBuilder.format_turn(role, agent_name, truncate_to_tokens(content, cls.MESSAGE_MAX_TOKENS))
+            for _, role, agent_name, content in rows
+        )
+        system = (
+            "你负责维护一段对话的滚动摘要。请把已有摘要和新的对话内容合并成一段新的摘要，"
+            "保留用户的目标、偏好、已确认的事实和结论以及未解决的问题，省略寒暄和重复内容。"
+            f"摘要不超过{max_tokens}个token，直接输出摘要正文，不要使用<thinking>或<answer>标签。"
+        )
+        human = f"已有摘要:\n{summary or '（无）'}\n\n新的对话内容:\n{transcript}"
+
+        langchain_model = await llm_model_cache.aget(llm_model)
+        async with llm_rate_limiter.limit(llm_model=llm_model):
+            response = await langchain_model.ainvoke([SystemMessage(content=system), HumanMessage(content=human)])
+        content = getattr(response, 'content', response)
+        if not isinstance(content, str):
+            content = str(content)
+        return truncate_to_tokens(content.strip(), max_tokens)
+
+    @staticmethod
+    def _save(conversation_id: int, previous_message_id: Optional[int], until_message_id: int, summary: str) -> bool:
+        """条件更新：摘要截止点未被其他更新推进时才写入"""
+
+        queryset = ChatConversation.objects.filter(pk=conversation_id)
+        if previous_message_id is None:
+            queryset = queryset.filter(summary_message_id__isnull=True)
+        else:
+            queryset = queryset.filter(summary_message_id=previous_message_id)
+        saved = bool(queryset.update(
+            context_summary=summary,
+            summary_message_id=until_message_id,
+            summary_updated_at=timezone.now(),
+        ))
+        if saved:
+            recent_message_cache.set_summary(conversation_id, summary, until_message_id)
+        return saved
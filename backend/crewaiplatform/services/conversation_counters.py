@@ -0,0 +1,151 @@
+"""
+会话计数
+
+ChatConversation 的 total_messages、total_agent_calls 和 last_activity_at 原本在
+ChatMessage/ChatAgentTask.save 中以"读取-加一-保存"的方式更新：并发写入会丢失计数，
+每条消息还要额外保存两次会话。
+
+ConversationCounters 在消息和任务创建时（post_save信号）累加计数：
+- 默认立即执行一条F表达式UPDATE（ChatConversation.add_counts），与创建在同一个事务中
+- 开启 CHAT_COUNTER_WRITE_BEHIND 后改为写后合并：事务提交后把增量累积在进程内，
+  由后台线程每隔 CHAT_COUNTER_FLUSH_INTERVAL_MS 毫秒按会话合并写入（每个会话一条UPDATE），
+  进程退出时写入剩余的增量
+
+进程崩溃会丢失尚未写入的增量，批量创建（bulk_create）不触发信号；
+manage.py reconcile_conversation_counters 根据消息表和任务表重新计算计数。
+"""
+
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from ..models import ChatConversation
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class CounterDelta:
+    """单个会话尚未写入的计数增量"""
+
+    __slots__ = ('messages', 'agent_calls', 'activity_at')
+
+    def __init__(self):
+        self.messages = 0
+        self.agent_calls = 0
+        self.activity_at = None
+
+    def add(self, messages: int = 0, agent_calls: int = 0, activity_at=None):
+        self.messages += messages
+        self.agent_calls += agent_calls
+        if activity_at is not None and (self.activity_at is None or activity_at > self.activity_at):
+            self.activity_at = activity_at
+
+
+class ConversationCounters:
+    """会话计数累加（立即原子更新，或写后合并）"""
+
+    def __init__(self, write_behind: bool = None, flush_interval_ms: int = None):
+        self._write_behind = write_behind
+        self._flush_interval_ms = flush_interval_ms
+        self._lock = threading.Lock()
+        self._pending: Dict[int, CounterDelta] = {}
+        self._flusher: Optional[threading.Thread] = None
+
+    @property
+    def write_behind(self) -> bool:
+        if self._write_behind is not None:
+            return self._write_behind
+        return getattr(settings, 'CHAT_COUNTER_WRITE_BEHIND', False)
+
+    @property
+    def flush_interval(self) -> float:
+        """后台写入间隔（秒），0表示不启动后台线程，只在flush()或进程退出时写入"""
+        if self._flush_interval_ms is not None:
+            interval_ms = self._flush_interval_ms
+        else:
+            interval_ms = getattr(settings, 'CHAT_COUNTER_FLUSH_INTERVAL_MS', 250)
+        return max(interval_ms, 0) / 1000
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def record(self, conversation_id: int, messages: int = 0, agent_calls: int = 0, activity_at=None):
+        """累加会话计数"""
+
+        if not self.write_behind:
+            ChatConversation.add_counts(conversation_id, messages, agent_calls, activity_at)
+            return
+
+        # 只累积已提交的写入，回滚的消息不计数
+        transaction.on_commit(lambda: self._enqueue(conversation_id, messages, agent_calls, activity_at))
+
+    def _enqueue(self, conversation_id: int, messages: int, agent_calls: int, activity_at):
+        with self._lock:
+            delta = self._pending.get(conversation_id)
+            if delta is None:
+                delta = self._pending[conversation_id] = CounterDelta()
+            delta.add(messages, agent_calls, activity_at)
+            metrics.set_gauge('chat.counters.pending', len(self._pending))
+        self._ensure_flusher()
+
+    def flush(self) -> int:
+        """写入全部累积的增量，返回写入的会话数"""
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        written = 0
+        for conversation_id, delta in pending.items():
+            try:
+                ChatConversation.add_counts(conversation_id, delta.messages, delta.agent_calls, delta.activity_at)
+                written += 1
+            except Exception as e:
+                # 数据库暂时不可用：放回队列，下次再写
+                logger.warning(f"写入会话 {conversation_id} 计数失败: {e}")
+                with self._lock:
+                    self._pending.setdefault(conversation_id, CounterDelta()).add(
+                        delta.messages, delta.agent_calls, delta.activity_at
+                    )
+        metrics.incr('chat.counters.flushed', written)
+        metrics.set_gauge('chat.counters.pending', self.pending_count())
+        return written
+
+    def _ensure_flusher(self):
+        if self.flush_interval <= 0 or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run, name='conversation-counters', daemon=True)
+            self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval or 1)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写入会话计数失败: {e}")
+
+
+conversation_counters = ConversationCounters()
+
+
+@atexit.register
+def _flush_on_exit():
+    if conversation_counters.pending_count():
+        try:
+            conversation_counters.flush()
+        except Exception as e:
+            logger.error(f"进程退出时写入会话计数失败: {e}")
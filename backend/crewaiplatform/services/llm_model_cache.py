@@ -0,0 +1,199 @@
+"""
+LangChain模型实例缓存
+
+每条聊天消息都需要一个LangChain聊天模型实例。重新创建实例需要解密API密钥、
+重建配置并创建新的HTTP客户端，导致TLS连接无法在多轮对话之间复用。
+
+本模块在进程内缓存模型实例：
+- 缓存键为 (LLMModel.pk, LLMModel.updated_at)，配置变更后自动失效
+- OpenAI兼容的提供商按 (提供商, API端点) 共享一个异步HTTP连接池
+- 实例和连接池按事件循环隔离（异步连接不能跨事件循环使用）
+- LLMModel保存或删除时通过信号主动清除对应条目
+- 条目被清除（失效、淘汰、clear()）后不再有缓存实例使用的连接池，在其事件循环上关闭；
+  事件循环已关闭的条目随之丢弃
+"""
+
+import asyncio
+import logging
+import threading
+import weakref
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# 使用OpenAI兼容客户端、可以注入共享http_async_client的提供商
+OPENAI_COMPATIBLE_PROVIDERS = ('openai', 'azure_openai', 'moonshot', 'qwen', 'custom')
+
+
+class LangChainModelCache:
+    """LangChain模型实例与HTTP连接池缓存"""
+
+    def __init__(self, max_entries: int = None):
+        if max_entries is None:
+            max_entries = getattr(settings, 'LLM_MODEL_CACHE_SIZE', 64)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # 事件循环 -> {(pk, updated_at): (模型实例, 使用的连接池端点)}
+        self._models: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+        # 事件循环 -> {(provider, endpoint): httpx.AsyncClient}
+        self._http_clients: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+        # (事件循环, 端点) -> 正在创建、尚未放入缓存的模型实例数（这些连接池不能关闭）
+        self._pending = Counter()
+
+    @staticmethod
+    def cache_key(llm_model) -> Tuple[int, Optional[str]]:
+        updated_at = llm_model.updated_at.isoformat() if llm_model.updated_at else None
+        return llm_model.pk, updated_at
+
+    async def aget(self, llm_model):
+        """获取（必要时创建）当前事件循环可用的模型实例"""
+
+        loop = asyncio.get_running_loop()
+        key = self.cache_key(llm_model)
+
+        with self._lock:
+            models = self._models.get(loop)
+            if models is not None and key in models:
+                models.move_to_end(key)
+                metrics.incr('llm.model_cache.hits')
+                return models[key][0]
+
+        metrics.incr('llm.model_cache.misses')
+
+        from asgiref.sync import sync_to_async
+
+        overrides = {}
+        endpoint = self._endpoint(llm_model)
+        http_client = self._get_http_client(loop, llm_model)
+        if http_client is None:
+            endpoint = None
+        else:
+            overrides['http_async_client'] = http_client
+
+        try:
+            model = await sync_to_async(llm_model.create_langchain_model)(**overrides)
+        finally:
+            with self._lock:
+                self._release_pending(loop, endpoint)
+
+        with self._lock:
+            self._prune_closed_loops()
+            models = self._models.setdefault(loop, OrderedDict())
+            # 同一个LLMModel只保留最新版本
+            for stale_key in [k for k in models if k[0] == key[0] and k != key]:
+                del models[stale_key]
+            models[key] = (model, endpoint)
+            while len(models) > self.max_entries:
+                models.popitem(last=False)
+            unused = self._unused_clients(loop)
+
+        self._close_clients(loop, unused)
+        logger.info(f"LLM模型实例已缓存: {llm_model.name} (pk={llm_model.pk})")
+        return model
+
+    def invalidate(self, pk: int):
+        """清除指定LLMModel的全部缓存实例，关闭不再使用的连接池"""
+
+        closing = []
+        with self._lock:
+            self._prune_closed_loops()
+            for loop, models in list(self._models.items()):
+                for key in [k for k in models if k[0] == pk]:
+                    del models[key]
+                closing.append((loop, self._unused_clients(loop)))
+
+        for loop, clients in closing:
+            self._close_clients(loop, clients)
+
+    def clear(self):
+        """清空全部缓存并关闭连接池（测试使用）"""
+
+        with self._lock:
+            closing = list(self._http_clients.items())
+            self._models = weakref.WeakKeyDictionary()
+            self._http_clients = weakref.WeakKeyDictionary()
+
+        for loop, clients in closing:
+            self._close_clients(loop, list(clients.values()))
+
+    def size(self) -> int:
+        with self._lock:
+            return sum(len(models) for models in self._models.values())
+
+    @staticmethod
+    def _endpoint(llm_model) -> Tuple[str, str]:
+        return llm_model.provider, llm_model.api_base_url or ''
+
+    def _get_http_client(self, loop, llm_model):
+        """获取指定提供商端点在当前事件循环上的共享连接池（计入创建中的实例，由调用方释放）"""
+
+        if llm_model.provider not in OPENAI_COMPATIBLE_PROVIDERS:
+            return None
+
+        try:
+            import httpx
+        except ImportError:
+            return None
+
+        endpoint = self._endpoint(llm_model)
+        with self._lock:
+            self._pending[(loop, endpoint)] += 1
+            clients: Dict = self._http_clients.setdefault(loop, {})
+            client = clients.get(endpoint)
+            if client is None or client.is_closed:
+                client = clients[endpoint] = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=getattr(settings, 'LLM_HTTP_POOL_MAX_CONNECTIONS', 100),
+                        max_keepalive_connections=getattr(settings, 'LLM_HTTP_POOL_MAX_KEEPALIVE', 20),
+                    ),
+                    timeout=httpx.Timeout(llm_model.timeout),
+                )
+            return client
+
+    def _release_pending(self, loop, endpoint):
+        if endpoint is None:
+            return
+        self._pending[(loop, endpoint)] -= 1
+        if self._pending[(loop, endpoint)] <= 0:
+            del self._pending[(loop, endpoint)]
+
+    def _unused_clients(self, loop) -> list:
+        """取出事件循环上不再有缓存实例（或创建中的实例）使用的连接池（持有锁时调用）"""
+
+        clients = self._http_clients.get(loop)
+        if not clients:
+            return []
+        in_use = {endpoint for _, endpoint in self._models.get(loop, {}).values()}
+        unused = [endpoint for endpoint in clients
+                  if endpoint not in in_use and (loop, endpoint) not in self._pending]
+        return [clients.pop(endpoint) for endpoint in unused]
+
+    def _prune_closed_loops(self):
+        """丢弃已关闭的事件循环的条目（其连接池已无法关闭，随条目释放）（持有锁时调用）"""
+
+        for cache in (self._models, self._http_clients):
+            for loop in [loop for loop in cache.keys() if loop.is_closed()]:
+                del cache[loop]
+
+    @staticmethod
+    def _close_clients(loop, clients: list):
+        """在连接池所属的事件循环上关闭（可从其他线程调用）"""
+
+        if not clients or loop.is_closed() or not loop.is_running():
+            return
+        for client in clients:
+            try:
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+
+llm_model_cache = LangChainModelCache()
@@ -0,0 +1,445 @@
+"""
+LLM路由：故障转移与对冲请求
+
+提供商变慢时，所有会话只能等待主模型；原有的 _fallback_llm_call 按提供商分支调用，
+但从未被使用（Anthropic分支还是模拟响应）。
+
+LLMRouter 在Agent的主模型和 CrewAIAgent.fallback_llm_models（按顺序排列的备用模型）之间路由：
+- 按LLMModel记录滚动的首个token耗时（TTFT，进程内最近 LLM_TTFT_WINDOW 次）
+- 流式调用时，主模型在其TTFT的 LLM_HEDGE_PERCENTILE 分位耗时内仍未返回首个token，
+  向下一个备用模型发出对冲请求，先返回首个token的一方胜出，另一方的流被取消并关闭
+- 首个token之前调用失败时立即转移到下一个备用模型（非流式调用只做故障转移）
+- 备用模型受其自身的速率/并发限制，无法立即获得许可时跳过
+- 熔断器打开的模型按调用失败处理（立即失败，不等待超时），直接转移到下一个模型；
+  首个token到达计为成功，首个token之前的异常计为失败，对冲落败被取消的调用不计入
+
+每个候选模型的流在独立的任务中读取，chunk经有界队列交给调用方，
+上游HTTP流始终在打开它的任务中关闭。胜出的模型和是否发生过对冲
+记录在当前任务的 LLMRoute 上，随 ChatAgentTask 保存。
+"""
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence
+
+from django.conf import settings
+
+from ..metrics import metrics
+from .circuit_breaker import CIRCUIT_OPEN_PREFIX, circuit_breaker, is_tripped, llm_model_key
+from .llm_model_cache import llm_model_cache
+from .prompt_layout import strip_cache_breakpoints, supports_cache_breakpoints
+from .rate_limiter import llm_rate_limiter, RateLimitExceeded
+
+
+logger = logging.getLogger(__name__)
+
+
+# 流结束标记
+_END = object()
+
+
+class TTFTTracker:
+    """按LLM模型记录滚动的首个token耗时（秒）"""
+
+    def __init__(self, window: int = None):
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[int, deque] = {}
+
+    @property
+    def window(self) -> int:
+        if self._window is not None:
+            return self._window
+        return getattr(settings, 'LLM_TTFT_WINDOW', 200)
+
+    def record(self, llm_model_id: int, seconds: float):
+        with self._lock:
+            samples = self._samples.get(llm_model_id)
+            if samples is None or samples.maxlen != self.window:
+                samples = self._samples[llm_model_id] = deque(samples or (), maxlen=self.window)
+            samples.append(seconds)
+        metrics.observe('llm.ttft_ms', seconds * 1000, llm_model=llm_model_id)
+
+    def percentile(self, llm_model_id: int, pct: float, min_samples: int = 1) -> Optional[float]:
+        """分位耗时，样本数不足时返回None"""
+
+        with self._lock:
+            samples = sorted(self._samples.get(llm_model_id) or ())
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(int(len(samples) * pct / 100), len(samples) - 1)
+        return samples[index]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class LLMRoute:
+    """一次Agent任务的路由结果"""
+
+    __slots__ = ('llm_model', 'hedged', 'attempted')
+
+    def __init__(self):
+        # 实际返回响应的模型
+        self.llm_model = None
+        # 是否向备用模型发出过请求（对冲或故障转移）
+        self.hedged = False
+        self.attempted: List[int] = []
+
+
+class _Attempt:
+    """一个候选模型的流式调用"""
+
+    __slots__ = ('llm_model', 'lease', 'queue', 'first', 'task', 'started', 'first_at')
+
+    def __init__(self, llm_model, lease=None):
+        self.llm_model = llm_model
+        self.lease = lease
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+        # 首个chunk（或流结束）到达时完成；首个chunk之前失败时为异常
+        self.first: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self.started = 0.0
+        self.first_at = 0.0
+
+
+class RoutedStream:
+    """胜出模型的流式输出（aclose 取消读取任务并关闭上游流）"""
+
+    def __init__(self, attempt: _Attempt, router: 'LLMRouter'):
+        self.llm_model = attempt.llm_model
+        self._attempt = attempt
+        self._router = router
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._finished:
+            raise StopAsyncIteration
+        item = await self._attempt.queue.get()
+        if item is _END:
+            self._finished = True
+            raise StopAsyncIteration
+        if isinstance(item, BaseException):
+            self._finished = True
+            raise item
+        return item
+
+    async def aclose(self):
+        self._finished = True
+        await self._router._abandon(self._attempt)
+
+
+class LLMRouter:
+    """主模型 + 备用模型的故障转移与对冲请求"""
+
+    def __init__(self, tracker: TTFTTracker = None):
+        self.tracker = tracker or TTFTTracker()
+
+    @property
+    def hedging_enabled(self) -> bool:
+        return getattr(settings, 'LLM_HEDGE_ENABLED', True)
+
+    def hedge_delay(self, llm_model) -> float:
+        """
+        发出对冲请求前等待首个token的时间（秒）
+
+        取模型滚动TTFT的 LLM_HEDGE_PERCENTILE 分位；样本不足 LLM_HEDGE_MIN_SAMPLES 时
+        使用 LLM_HEDGE_DEFAULT_DELAY_MS，且不低于 LLM_HEDGE_MIN_DELAY_MS
+        """
+
+        delay = self.tracker.percentile(
+            llm_model.pk,
+            getattr(settings, 'LLM_HEDGE_PERCENTILE', 95),
+            getattr(settings, 'LLM_HEDGE_MIN_SAMPLES', 20),
+        )
+        if delay is None:
+            delay = getattr(settings, 'LLM_HEDGE_DEFAULT_DELAY_MS', 5000) / 1000
+        return max(delay, getattr(settings, 'LLM_HEDGE_MIN_DELAY_MS', 500) / 1000)
+
+    @staticmethod
+    async def fallback_models(fallback_ids: Sequence[int]) -> list:
+        """按配置顺序加载可用的备用模型（只在需要对冲或故障转移时查询）"""
+
+        if not fallback_ids:
+            return []
+
+        from asgiref.sync import sync_to_async
+        from django.db.models import Q
+        from ..models import LLMModel
+
+        @sync_to_async
+        def load():
+            # 熔断写入的不可用状态也加载，由熔断器决定是否放行探测请求
+            return LLMModel.objects.filter(
+                Q(is_available=True) | Q(validation_error__startswith=CIRCUIT_OPEN_PREFIX),
+                pk__in=fallback_ids, is_active=True,
+            ).in_bulk()
+
+        models = await load()
+        return [models[pk] for pk in fallback_ids if pk in models]
+
+    async def open_stream(self, llm_model, messages: list, fallbacks: Sequence[int] = (),
+                          langchain_model=None) -> RoutedStream:
+        """
+        打开流式调用，返回首个token最先到达的模型的流
+
+        Args:
+            llm_model: 主模型（调用方已按其速率/并发限制获得许可）
+            messages: 按主模型组装的消息列表
+            fallbacks: 备用模型ID列表
+            langchain_model: 主模型的LangChain实例，为空时从缓存获取
+
+        Raises:
+            所有候选模型都在首个token之前失败时，抛出最先失败的异常
+        """
+
+        loop = asyncio.get_running_loop()
+        route = current_llm_route()
+        candidates = _Candidates(self, fallbacks)
+        errors = []
+
+        attempts = [self._start(llm_model, messages, langchain_model, route)]
+        try:
+            while True:
+                timeout = None
+                if self.hedging_enabled and candidates.may_have_more():
+                    latest = attempts[-1]
+                    timeout = max(latest.started + self.hedge_delay(latest.llm_model) - loop.time(), 0)
+
+                done, _ = await asyncio.wait(
+                    [attempt.first for attempt in attempts], timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    # 首个token超时：向下一个备用模型发出对冲请求
+                    candidate = await candidates.next()
+                    if candidate is not None:
+                        logger.info(f"模型 {attempts[-1].llm_model.name} 首个token超时，对冲请求 {candidate[0].name}")
+                        metrics.incr('llm.hedge.launched', llm_model=attempts[-1].llm_model.pk)
+                        attempts.append(self._start(candidate[0], messages, None, route, candidate[1]))
+                    continue
+
+                winner = None
+                for attempt in list(attempts):
+                    if attempt.first not in done:
+                        continue
+                    attempts.remove(attempt)
+                    error = attempt.first.exception()
+                    if error is None:
+                        winner = attempt
+                        break
+                    errors.append(error)
+                    logger.warning(f"模型 {attempt.llm_model.name} 调用失败: {error}")
+                    metrics.incr('llm.failover', llm_model=attempt.llm_model.pk)
+                    await self._abandon(attempt)
+
+                if winner is not None:
+                    break
+
+                if not attempts:
+                    # 全部候选都已失败：立即转移到下一个备用模型
+                    candidate = await candidates.next()
+                    if candidate is None:
+                        raise errors[0]
+                    logger.info(f"故障转移到备用模型 {candidate[0].name}")
+                    attempts.append(self._start(candidate[0], messages, None, route, candidate[1]))
+        except BaseException:
+            for attempt in attempts:
+                await self._abandon(attempt)
+            raise
+
+        for attempt in attempts:
+            metrics.incr('llm.hedge.cancelled', llm_model=attempt.llm_model.pk)
+            await self._abandon(attempt)
+
+        self.tracker.record(winner.llm_model.pk, winner.first_at - winner.started)
+        if winner.llm_model.pk != llm_model.pk:
+            metrics.incr('llm.hedge.fallback_won', llm_model=winner.llm_model.pk)
+        if route is not None:
+            route.llm_model = winner.llm_model
+        return RoutedStream(winner, self)
+
+    async def ainvoke(self, llm_model, messages: list, fallbacks: Sequence[int] = (), langchain_model=None):
+        """非流式调用：主模型失败时依次转移到备用模型"""
+
+        route = current_llm_route()
+        candidates = _Candidates(self, fallbacks)
+        current, lease, first_error = llm_model, None, None
+        while True:
+            if route is not None:
+                route.attempted.append(current.pk)
+            permit = None
+            try:
+                permit = await self._permit(current)
+                model = langchain_model if current is llm_model and langchain_model is not None \
+                    else await llm_model_cache.aget(current)
+                response = await model.ainvoke(self._messages_for(current, messages))
+            except Exception as e:
+                first_error = first_error or e
+                logger.warning(f"模型 {current.name} 调用失败: {e}")
+                metrics.incr('llm.failover', llm_model=current.pk)
+                if permit is not None:
+                    await circuit_breaker.afailure(permit, e)
+            except BaseException:
+                if permit is not None:
+                    await circuit_breaker.arelease(permit)
+                raise
+            else:
+                await circuit_breaker.asuccess(permit)
+                if route is not None:
+                    route.llm_model = current
+                return response
+            finally:
+                if lease is not None:
+                    await llm_rate_limiter.release(lease)
+
+            candidate = await candidates.next()
+            if candidate is None:
+                raise first_error
+            current, lease = candidate
+            logger.info(f"故障转移到备用模型 {current.name}")
+            if route is not None:
+                route.hedged = True
+
+    @staticmethod
+    async def _permit(llm_model):
+        """熔断器放行许可（打开时抛出 CircuitOpenError）"""
+        return await circuit_breaker.abefore(
+            llm_model_key(llm_model), tripped=is_tripped(getattr(llm_model, 'validation_error', None))
+        )
+
+    @staticmethod
+    def _messages_for(llm_model, messages: list) -> list:
+        # 主模型可能是Anthropic并带有缓存断点，其他提供商使用纯文本内容
+        if supports_cache_breakpoints(llm_model):
+            return messages
+        return strip_cache_breakpoints(messages)
+
+    def _start(self, llm_model, messages: list, langchain_model, route: Optional[LLMRoute],
+               lease=None) -> _Attempt:
+        attempt = _Attempt(llm_model, lease)
+        attempt.started = asyncio.get_running_loop().time()
+        attempt.task = asyncio.ensure_future(self._pump(attempt, messages, langchain_model))
+        if route is not None:
+            route.attempted.append(llm_model.pk)
+            if len(route.attempted) > 1:
+                route.hedged = True
+        return attempt
+
+    async def _pump(self, attempt: _Attempt, messages: list, langchain_model):
+        """在独立任务中读取一个候选模型的流，上游流在本任务中关闭"""
+
+        stream = permit = None
+        try:
+            permit = await self._permit(attempt.llm_model)
+            if langchain_model is None:
+                langchain_model = await llm_model_cache.aget(attempt.llm_model)
+            stream = langchain_model.astream(self._messages_for(attempt.llm_model, messages))
+            async for chunk in stream:
+                first = not attempt.first.done()
+                if first:
+                    self._first_arrived(attempt)
+                await attempt.queue.put(chunk)
+                if first:
+                    permit, succeeded = None, permit
+                    await circuit_breaker.asuccess(succeeded)
+            if not attempt.first.done():
+                self._first_arrived(attempt)
+                permit, succeeded = None, permit
+                await circuit_breaker.asuccess(succeeded)
+            await attempt.queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if permit is not None:
+                # 首个token之前的失败计入熔断统计（熔断器拒绝的调用除外）
+                failed, permit = permit, None
+                await circuit_breaker.afailure(failed, e)
+            if not attempt.first.done():
+                attempt.first.set_exception(e)
+            else:
+                await attempt.queue.put(e)
+        finally:
+            if permit is not None:
+                # 被取消（如对冲落败）：不计入成功或失败，释放探测名额
+                await circuit_breaker.arelease(permit)
+            if stream is not None:
+                aclose = getattr(stream, 'aclose', None)
+                if aclose is not None:
+                    await aclose()
+
+    @staticmethod
+    def _first_arrived(attempt: _Attempt):
+        attempt.first_at = asyncio.get_running_loop().time()
+        attempt.first.set_result(True)
+
+    async def _abandon(self, attempt: _Attempt):
+        """取消候选模型的读取任务（等待其关闭上游流）并释放其限流许可"""
+
+        if attempt.task is not None and not attempt.task.done():
+            attempt.task.cancel()
+            await asyncio.gather(attempt.task, return_exceptions=True)
+        if not attempt.first.done():
+            attempt.first.cancel()
+        elif not attempt.first.cancelled():
+            # 避免"Future exception was never retrieved"警告
+            attempt.first.exception()
+        if attempt.lease is not None:
+            lease, attempt.lease = attempt.lease, None
+            await llm_rate_limiter.release(lease)
+
+
+class _Candidates:
+    """按顺序取出的备用模型（首次需要时才加载），跳过无法立即获得限流许可的模型"""
+
+    def __init__(self, router: LLMRouter, fallback_ids: Sequence[int]):
+        self._router = router
+        self._fallback_ids = list(fallback_ids or ())
+        self._models: Optional[list] = None
+
+    def may_have_more(self) -> bool:
+        return bool(self._fallback_ids) if self._models is None else bool(self._models)
+
+    async def next(self):
+        """下一个备用模型及其限流许可，没有可用的备用模型时返回None"""
+
+        if self._models is None:
+            self._models = await self._router.fallback_models(self._fallback_ids)
+        while self._models:
+            llm_model = self._models.pop(0)
+            limits = llm_rate_limiter.limits_for(llm_model=llm_model)
+            if not limits or not getattr(settings, 'LLM_RATE_LIMIT_ENABLED', True):
+                return llm_model, None
+            try:
+                return llm_model, await llm_rate_limiter.acquire(limits, max_wait=0)
+            except RateLimitExceeded:
+                logger.info(f"备用模型 {llm_model.name} 已达到限流上限，跳过")
+        return None
+
+
+_current_route: ContextVar[Optional[LLMRoute]] = ContextVar('llm_route', default=None)
+
+
+def current_llm_route() -> Optional[LLMRoute]:
+    """当前Agent任务的路由结果记录（不在任务中执行时为None）"""
+    return _current_route.get()
+
+
+def bind_llm_route(route: LLMRoute):
+    """在当前上下文中登记路由结果记录，返回用于恢复的令牌"""
+    return _current_route.set(route)
+
+
+def unbind_llm_route(context_token):
+    _current_route.reset(context_token)
+
+
+llm_router = LLMRouter()
@@ -0,0 +1,235 @@
+"""
+会话最近消息缓存
+
+每次回复都要查询会话的最近消息来组装上下文，而这些消息大多是本进程刚刚写入的。
+
+RecentMessageCache 在进程内为每个会话缓存最近N条参与上下文的消息（用户/助手，
+不含处理中的占位消息）以及会话的滚动摘要：
+- 写穿：ChatMessage保存/删除（信号，事务提交后）和摘要更新时同步更新已缓存的会话；
+  未缓存的会话不做处理，下次组装上下文时从数据库加载
+- 会话之间按LRU淘汰，同时受会话数上限和内容字节数上限约束
+- 其他进程写入的消息无法写穿：组装上下文时若触发本次回复的用户消息不在缓存中，
+  视为缓存过期并重新加载；此外条目在 CHAT_MESSAGE_CACHE_TTL 秒后过期
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+
+from ..metrics import metrics
+
+
+# 每条缓存消息的固定开销估算（元组、整数、短字符串等），用于字节数上限
+ROW_OVERHEAD_BYTES = 200
+
+
+class CachedMessage(NamedTuple):
+    id: int
+    role: str
+    agent_name: str
+    content: str
+
+
+class ConversationWindow:
+    """单个会话的最近消息窗口（按消息ID升序）"""
+
+    __slots__ = ('messages', 'summary', 'summary_message_id', 'dropped_message_id', 'loaded_at', 'size')
+
+    def __init__(self, messages: List[CachedMessage], summary: str, summary_message_id: Optional[int],
+                 dropped_message_id: Optional[int]):
+        self.messages: 'OrderedDict[int, CachedMessage]' = OrderedDict((m.id, m) for m in messages)
+        self.summary = summary
+        self.summary_message_id = summary_message_id
+        # 已不在窗口中的最新一条消息ID（窗口之外仍有更早的消息）
+        self.dropped_message_id = dropped_message_id
+        self.loaded_at = time.monotonic()
+        self.size = 0
+        self._resize()
+
+    def newest_first(self) -> List[CachedMessage]:
+        return list(reversed(self.messages.values()))
+
+    def upsert(self, message: CachedMessage, limit: int):
+        self.messages[message.id] = message
+        if len(self.messages) > 1 and next(reversed(self.messages)) != message.id:
+            # 迟到的旧消息：重新按ID排序
+            self.messages = OrderedDict(sorted(self.messages.items()))
+        while len(self.messages) > limit:
+            dropped_id, _ = self.messages.popitem(last=False)
+            self.dropped_message_id = max(self.dropped_message_id or 0, dropped_id)
+        self._resize()
+
+    def remove(self, message_id: int):
+        if self.messages.pop(message_id, None) is not None:
+            self._resize()
+
+    def _resize(self):
+        self.size = len(self.summary.encode('utf-8')) + sum(
+            len(m.content.encode('utf-8')) + ROW_OVERHEAD_BYTES for m in self.messages.values()
+        )
+
+
+class RecentMessageCache:
+    """按会话缓存最近消息（LRU + 会话数上限 + 字节数上限）"""
+
+    def __init__(self, window_size: int = None, max_conversations: int = None,
+                 max_bytes: int = None, ttl: float = None):
+        self._window_size = window_size
+        self._max_conversations = max_conversations
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._windows: 'OrderedDict[int, ConversationWindow]' = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def window_size(self) -> int:
+        if self._window_size is not None:
+            return self._window_size
+        return getattr(settings, 'CHAT_MESSAGE_CACHE_WINDOW', 51)
+
+    @property
+    def max_conversations(self) -> int:
+        if self._max_conversations is not None:
+            return self._max_conversations
+        return getattr(settings, 'CHAT_MESSAGE_CACHE_MAX_CONVERSATIONS', 1000)
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, 'CHAT_MESSAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+
+    @property
+    def ttl(self) -> float:
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'CHAT_MESSAGE_CACHE_TTL', 300)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'conversations': len(self._windows), 'bytes': self._bytes}
+
+    @staticmethod
+    def is_context_message(message) -> bool:
+        """消息是否参与上下文"""
+        return message.role in ('user', 'assistant') and message.status != 'processing'
+
+    # ---- 读取 ----
+
+    def get(self, conversation_id: int, expected_message_id: int = None) -> Optional[ConversationWindow]:
+        """
+        获取会话窗口，未缓存、已过期或缺少 expected_message_id 时返回None
+
+        expected_message_id 通常是触发本次回复的用户消息，它由其他进程写入时
+        本进程的窗口必然缺少它，据此发现过期的缓存。
+        """
+
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is not None and self.ttl and time.monotonic() - window.loaded_at > self.ttl:
+                self._pop(conversation_id)
+                window = None
+            if window is not None and expected_message_id is not None \
+                    and expected_message_id not in window.messages \
+                    and expected_message_id > max(window.messages, default=0):
+                metrics.incr('chat.message_cache.stale')
+                self._pop(conversation_id)
+                window = None
+            if window is None:
+                metrics.incr('chat.message_cache.misses')
+                return None
+            self._windows.move_to_end(conversation_id)
+            metrics.incr('chat.message_cache.hits')
+            return window
+
+    # ---- 写入 ----
+
+    def put(self, conversation_id: int, messages: List[CachedMessage], summary: str = '',
+            summary_message_id: int = None, dropped_message_id: int = None) -> ConversationWindow:
+        """放入从数据库加载的窗口（messages按ID升序）"""
+
+        window = ConversationWindow(messages[-self.window_size:], summary or '', summary_message_id,
+                                    dropped_message_id)
+        if len(messages) > self.window_size:
+            window.dropped_message_id = max(window.dropped_message_id or 0,
+                                            messages[-self.window_size - 1].id)
+        with self._lock:
+            self._pop(conversation_id)
+            self._windows[conversation_id] = window
+            self._bytes += window.size
+            self._evict()
+        return window
+
+    def apply(self, message):
+        """写穿：ChatMessage保存后更新已缓存的会话"""
+
+        with self._lock:
+            window = self._windows.get(message.conversation_id)
+            if window is None:
+                return
+            before = window.size
+            if self.is_context_message(message):
+                window.upsert(CachedMessage(message.id, message.role, message.agent_name or '', message.content or ''),
+                              self.window_size)
+            else:
+                window.remove(message.id)
+            self._bytes += window.size - before
+            self._evict()
+
+    def discard_message(self, conversation_id: int, message_id: int):
+        """写穿：ChatMessage删除后移出窗口"""
+
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is None:
+                return
+            before = window.size
+            window.remove(message_id)
+            self._bytes += window.size - before
+
+    def set_summary(self, conversation_id: int, summary: str, summary_message_id: int):
+        """写穿：滚动摘要更新"""
+
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is None:
+                return
+            before = window.size
+            window.summary = summary or ''
+            window.summary_message_id = summary_message_id
+            window._resize()
+            self._bytes += window.size - before
+            self._evict()
+
+    def invalidate(self, conversation_id: int):
+        """丢弃会话窗口（批量更新等无法写穿的场景）"""
+
+        with self._lock:
+            self._pop(conversation_id)
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+            self._bytes = 0
+
+    def _pop(self, conversation_id: int):
+        window = self._windows.pop(conversation_id, None)
+        if window is not None:
+            self._bytes -= window.size
+
+    def _evict(self):
+        """按LRU淘汰直到满足会话数和字节数上限（调用方持有锁）"""
+
+        while self._windows and (len(self._windows) > self.max_conversations or self._bytes > self.max_bytes):
+            _, window = self._windows.popitem(last=False)
+            self._bytes -= window.size
+            metrics.incr('chat.message_cache.evictions')
+        metrics.set_gauge('chat.message_cache.conversations', len(self._windows))
+        metrics.set_gauge('chat.message_cache.bytes', self._bytes)
+
+
+recent_message_cache = RecentMessageCache()
@@ -0,0 +1,198 @@
+"""
+提示词消息布局与提示词token用量
+
+flat（默认）：角色设定、对话历史和当前任务拼成一条用户消息。每一轮的消息前缀都不同，
+提供商的提示词前缀缓存（OpenAI自动缓存、Anthropic cache_control）无法命中。
+
+structured：按提供商前缀缓存友好的顺序组装消息
+- 系统消息：角色设定 + 思考模式说明 + 响应要求，同一Agent配置版本内不变
+- 会话的滚动摘要（有时）作为第一条用户消息
+- 之前的对话按原始角色逐条放入，只追加不改写
+- 最后是本次的用户消息
+支持显式缓存断点的提供商在系统消息和历史末尾标记 cache_control；
+OpenAI等自动缓存前缀的提供商不需要标记。
+
+PromptUsage 记录一次Agent任务的提示词token用量（含命中缓存的部分），
+通过上下文变量在调用链中传递，任务结束时保存到 ChatAgentTask。
+"""
+
+from contextvars import ContextVar
+from typing import List, Optional
+
+from django.conf import settings
+
+from .token_counter import estimate_tokens
+
+
+LAYOUT_FLAT = 'flat'
+LAYOUT_STRUCTURED = 'structured'
+PROMPT_LAYOUTS = (LAYOUT_FLAT, LAYOUT_STRUCTURED)
+
+# 支持在消息内容块上标记 cache_control 的提供商
+CACHE_BREAKPOINT_PROVIDERS = ('anthropic',)
+
+CACHE_CONTROL = {'type': 'ephemeral'}
+
+# 窗口以助手消息开头时补在最前面的用户消息（部分提供商要求第一条消息来自用户）
+EARLIER_TURNS_OMITTED = '（更早的对话已省略）'
+
+
+def prompt_layout() -> str:
+    layout = getattr(settings, 'CHAT_PROMPT_LAYOUT', LAYOUT_FLAT)
+    return layout if layout in PROMPT_LAYOUTS else LAYOUT_FLAT
+
+
+def supports_cache_breakpoints(llm_model) -> bool:
+    return getattr(llm_model, 'provider', None) in CACHE_BREAKPOINT_PROVIDERS
+
+
+def strip_cache_breakpoints(messages) -> list:
+    """去掉内容块上的缓存断点，还原为纯文本内容（发给不支持断点的提供商时使用）"""
+
+    stripped = []
+    for message in messages:
+        content = message.content
+        if isinstance(content, list) and any(isinstance(block, dict) and 'cache_control' in block for block in content):
+            text = ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+            message = message.model_copy(update={'content': text})
+        stripped.append(message)
+    return stripped
+
+
+def estimate_message_tokens(messages) -> int:
+    """估算消息列表的提示词token数"""
+
+    total = 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, list):
+            content = ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+        total += estimate_tokens(content)
+    return total
+
+
+class StructuredPromptBuilder:
+    """按前缀缓存友好的顺序组装消息"""
+
+    @staticmethod
+    def format_answer(content: str) -> str:
+        # 历史中只保存了最终答案，按思考模式的答案格式放回，保持输出格式一致
+        return f"<answer>\n{content}\n</answer>"
+
+    @staticmethod
+    def turns(context, latest_message_id: int = None):
+        """
+        把上下文拆成 (历史对话, 本次用户消息)
+
+        Returns:
+            ([(角色, 内容), ...], 本次用户消息内容或None)
+        """
+
+        history = []
+        current = None
+        for message in context.messages:
+            if latest_message_id is not None and message.id == latest_message_id:
+                current = message.content
+                continue
+            role = 'user' if message.role == 'user' else 'assistant'
+            content = message.content if role == 'user' else StructuredPromptBuilder.format_answer(message.content)
+            if history and history[-1][0] == role:
+                # 连续的同角色消息合并为一条（部分提供商要求用户/助手交替）
+                history[-1] = (role, f"{history[-1][1]}\n\n{content}")
+            else:
+                history.append((role, content))
+
+        if context.summary:
+            summary = f"之前对话的摘要: {context.summary}"
+            if history and history[0][0] == 'user':
+                history[0] = ('user', f"{summary}\n\n{history[0][1]}")
+            else:
+                history.insert(0, ('user', summary))
+        elif history and history[0][0] == 'assistant':
+            history.insert(0, ('user', EARLIER_TURNS_OMITTED))
+        return history, current
+
+    @staticmethod
+    def build(compiled_prompt, context, task_description: str, latest_message_id: int = None,
+              cache_breakpoints: bool = False) -> list:
+        """
+        组装消息列表
+
+        Args:
+            compiled_prompt: Agent的编译提示词（提供系统消息）
+            context: ConversationContext（保留原始角色的历史消息）
+            task_description: 上下文中没有本次用户消息时使用的任务描述
+            latest_message_id: 触发本次回复的用户消息ID
+            cache_breakpoints: 是否在系统消息和历史末尾标记缓存断点
+        """
+
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        history, current = StructuredPromptBuilder.turns(context, latest_message_id)
+
+        messages = [compiled_prompt.structured_system_message(cache_breakpoints)]
+        for index, (role, content) in enumerate(history):
+            if cache_breakpoints and index == len(history) - 1:
+                content = [{'type': 'text', 'text': content, 'cache_control': CACHE_CONTROL}]
+            messages.append(HumanMessage(content=content) if role == 'user' else AIMessage(content=content))
+        messages.append(HumanMessage(content=current if current else task_description))
+        return messages
+
+
+class PromptUsage:
+    """一次Agent任务的提示词token用量"""
+
+    __slots__ = ('prompt_tokens', 'cached_tokens', 'cache_write_tokens', 'reported')
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+        # 是否来自模型返回的用量（否则为估算值）
+        self.reported = False
+
+    @property
+    def uncached_tokens(self) -> int:
+        return max(self.prompt_tokens - self.cached_tokens, 0)
+
+    def estimate(self, messages):
+        """模型未返回用量时使用的估算值"""
+
+        if not self.reported:
+            self.prompt_tokens = estimate_message_tokens(messages)
+
+    def observe(self, message):
+        """
+        读取LangChain消息（或流式chunk）上的 usage_metadata
+
+        input_tokens 包含命中缓存的部分；流式输出中提示词用量只出现在一个chunk上，
+        其他chunk为0，取最大值即可。
+        """
+
+        usage = getattr(message, 'usage_metadata', None)
+        if not usage or not usage.get('input_tokens'):
+            return
+        details = usage.get('input_token_details') or {}
+        if not self.reported:
+            self.prompt_tokens = 0
+            self.reported = True
+        self.prompt_tokens = max(self.prompt_tokens, usage['input_tokens'])
+        self.cached_tokens = max(self.cached_tokens, details.get('cache_read') or 0)
+        self.cache_write_tokens = max(self.cache_write_tokens, details.get('cache_creation') or 0)
+
+
+_current_usage: ContextVar[Optional[PromptUsage]] = ContextVar('prompt_usage', default=None)
+
+
+def current_prompt_usage() -> Optional[PromptUsage]:
+    """当前Agent任务的提示词用量记录（不在任务中执行时为None）"""
+    return _current_usage.get()
+
+
+def bind_prompt_usage(usage: PromptUsage):
+    """在当前上下文中登记用量记录，返回用于恢复的令牌"""
+    return _current_usage.set(usage)
+
+
+def unbind_prompt_usage(context_token):
+    _current_usage.reset(context_token)
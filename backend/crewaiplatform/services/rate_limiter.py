@@ -0,0 +1,273 @@
+"""
+LLM请求限流
+
+CrewAIAgent.max_rpm 原本只传给CrewAI配置，直接调用LangChain的聊天路径不受限制，
+同一个LLM模型的请求也没有并发上限：突发流量会触发提供商的429并引发重试风暴。
+
+LLMRateLimiter 在每次LLM调用前按以下键限流，状态保存在Django缓存中（配置 REDIS_URL
+时由所有worker进程共享，开发环境的内存缓存只在进程内生效）：
+- agent:<id>      CrewAIAgent.max_rpm，每分钟请求数
+- llm_model:<id>  LLMModel.max_rpm（所有Agent共享的提供商速率）和
+                  LLMModel.max_concurrency（同时进行中的请求数）
+
+速率使用滑动窗口计数（当前分钟的计数 + 上一分钟的计数按剩余比例折算），
+只依赖缓存的原子 add/incr；并发上限使用固定数量的槽位键，每个请求用 add 占用一个，
+带过期时间，进程崩溃后槽位自动释放。
+
+超出限制的请求排队等待（轮询间隔带随机抖动），直到截止时间
+（默认 LLM_RATE_LIMIT_MAX_WAIT_SECONDS 秒）仍未获得许可时抛出 RateLimitExceeded。
+每个键的等待时间记录在 llm.rate_limit.wait_ms 指标中。
+"""
+
+import asyncio
+import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """截止时间内未获得LLM调用许可"""
+
+    def __init__(self, key: str, waited: float, retry_after: int = 5):
+        self.key = key
+        self.waited = waited
+        self.retry_after = retry_after
+        super().__init__(f"LLM请求过于频繁（{key}），已等待 {waited:.1f} 秒，请稍后重试")
+
+
+class RateLimit:
+    """一个限流键的配置"""
+
+    __slots__ = ('key', 'rpm', 'concurrency')
+
+    def __init__(self, key: str, rpm: Optional[int] = None, concurrency: Optional[int] = None):
+        self.key = key
+        self.rpm = rpm
+        self.concurrency = concurrency
+
+
+class RateLimitLease:
+    """已获得的许可（持有的并发槽位）"""
+
+    __slots__ = ('token', 'slots', 'waited')
+
+    def __init__(self, token: str):
+        self.token = token
+        self.slots: List[str] = []
+        self.waited = 0.0
+
+
+class LLMRateLimiter:
+    """基于Django缓存的跨进程速率与并发限制"""
+
+    KEY_PREFIX = 'llm_rate'
+    WINDOW_SECONDS = 60
+    MIN_POLL_SECONDS = 0.05
+    MAX_POLL_SECONDS = 1.0
+
+    def __init__(self, cache_alias: str = None, max_wait: float = None, slot_ttl: int = None):
+        self._cache_alias = cache_alias
+        self._max_wait = max_wait
+        self._slot_ttl = slot_ttl
+
+    @property
+    def cache(self):
+        return caches[self._cache_alias or 'default']
+
+    @property
+    def max_wait(self) -> float:
+        if self._max_wait is not None:
+            return self._max_wait
+        return getattr(settings, 'LLM_RATE_LIMIT_MAX_WAIT_SECONDS', 30)
+
+    @property
+    def slot_ttl(self) -> int:
+        """并发槽位的过期时间（秒），应大于单次LLM调用（含流式输出）的最长耗时"""
+        if self._slot_ttl is not None:
+            return self._slot_ttl
+        return getattr(settings, 'LLM_CONCURRENCY_SLOT_TTL', 600)
+
+    @staticmethod
+    def limits_for(agent=None, llm_model=None) -> List[RateLimit]:
+        """Agent和LLM模型上配置的限制（未配置的键不限流）"""
+
+        if llm_model is None and agent is not None:
+            llm_model = getattr(agent, 'llm_model', None)
+
+        limits = []
+        if agent is not None and getattr(agent, 'max_rpm', None):
+            limits.append(RateLimit(f"agent:{agent.pk}", rpm=agent.max_rpm))
+        if llm_model is not None:
+            rpm = getattr(llm_model, 'max_rpm', None)
+            concurrency = getattr(llm_model, 'max_concurrency', None)
+            if rpm or concurrency:
+                limits.append(RateLimit(f"llm_model:{llm_model.pk}", rpm=rpm, concurrency=concurrency))
+        return limits
+
+    @asynccontextmanager
+    async def limit(self, agent=None, llm_model=None, max_wait: float = None):
+        """
+        在限制内执行一次LLM调用
+
+            async with llm_rate_limiter.limit(agent=agent):
+                response = await langchain_model.ainvoke(messages)
+        """
+
+        limits = self.limits_for(agent, llm_model)
+        if not limits or not getattr(settings, 'LLM_RATE_LIMIT_ENABLED', True):
+            yield None
+            return
+
+        lease = await self.acquire(limits, max_wait)
+        try:
+            yield lease
+        finally:
+            await self.release(lease)
+
+    async def acquire(self, limits: List[RateLimit], max_wait: float = None) -> RateLimitLease:
+        """
+        排队等待直到所有限制都允许本次调用
+
+        先占用并发槽位，再计入速率窗口（等待槽位期间不消耗速率配额）。
+
+        Raises:
+            RateLimitExceeded: 截止时间内未获得许可（已占用的槽位会释放）
+        """
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + (self.max_wait if max_wait is None else max_wait)
+        lease = RateLimitLease(uuid.uuid4().hex)
+
+        try:
+            for limit in limits:
+                if limit.concurrency:
+                    slot = await self._wait(deadline, lambda: self._try_slot(limit, lease.token))
+                    lease.slots.append(slot)
+            rate_limits = [limit for limit in limits if limit.rpm]
+            if rate_limits:
+                await self._wait(deadline, lambda: self._try_windows(rate_limits))
+        except BaseException:
+            await self.release(lease)
+            raise
+
+        lease.waited = loop.time() - started
+        for limit in limits:
+            metrics.observe('llm.rate_limit.wait_ms', lease.waited * 1000, key=limit.key)
+        return lease
+
+    async def release(self, lease: RateLimitLease):
+        """释放持有的并发槽位（槽位已过期并被其他请求占用时不删除）"""
+
+        for slot in lease.slots:
+            try:
+                if await self.cache.aget(slot) == lease.token:
+                    await self.cache.adelete(slot)
+            except Exception as e:
+                logger.warning(f"释放并发槽位 {slot} 失败: {e}")
+        lease.slots = []
+
+    async def _wait(self, deadline: float, attempt):
+        """
+        重复尝试直到成功或超过截止时间
+
+        attempt 返回 (结果, 限流的键, 建议等待秒数)，结果为None表示暂不允许
+        """
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        throttled = set()
+        poll = self.MIN_POLL_SECONDS
+        while True:
+            result, key, retry_in = await attempt()
+            if result is not None:
+                return result
+
+            if key not in throttled:
+                throttled.add(key)
+                metrics.incr('llm.rate_limit.throttled', key=key)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0 or (retry_in is not None and retry_in > remaining):
+                # 截止时间前不可能获得许可，立即失败而不是空等
+                waited = loop.time() - started
+                metrics.incr('llm.rate_limit.timeouts', key=key)
+                logger.warning(f"LLM限流等待超时: {key}（已等待 {waited:.1f} 秒）")
+                raise RateLimitExceeded(key, waited, retry_after=max(int(retry_in or 1), 1))
+
+            delay = retry_in if retry_in is not None else poll
+            # 抖动避免多个等待者同时醒来争抢
+            await asyncio.sleep(min(delay, remaining) * random.uniform(1.0, 1.2))
+            poll = min(poll * 2, self.MAX_POLL_SECONDS)
+
+    async def _try_slot(self, limit: RateLimit, token: str):
+        """占用一个空闲的并发槽位，返回槽位键"""
+
+        # 从随机位置开始，减少多个进程争抢同一个槽位
+        offset = random.randrange(limit.concurrency)
+        for index in range(limit.concurrency):
+            slot = f"{self.KEY_PREFIX}:{limit.key}:slot:{(offset + index) % limit.concurrency}"
+            if await self.cache.aadd(slot, token, timeout=self.slot_ttl):
+                return slot, None, None
+        return None, limit.key, None
+
+    async def _try_windows(self, limits: List[RateLimit]):
+        """在所有速率窗口中计入一次请求；任一窗口超限时撤销已计入的部分"""
+
+        now = time.time()
+        window = int(now // self.WINDOW_SECONDS)
+        elapsed = (now % self.WINDOW_SECONDS) / self.WINDOW_SECONDS
+
+        counted = []
+        for limit in limits:
+            key = f"{self.KEY_PREFIX}:{limit.key}:rpm:{window}"
+            previous_key = f"{self.KEY_PREFIX}:{limit.key}:rpm:{window - 1}"
+            previous = await self.cache.aget(previous_key) or 0
+            current = await self._incr(key)
+
+            # 上一分钟的请求按窗口剩余比例折算，近似滑动的60秒窗口
+            estimate = previous * (1 - elapsed) + current
+            if estimate <= limit.rpm:
+                counted.append(key)
+                continue
+
+            await self.cache.adecr(key)
+            for counted_key in counted:
+                await self.cache.adecr(counted_key)
+            return None, limit.key, self._retry_in(limit.rpm, previous, current, elapsed)
+
+        return True, None, None
+
+    async def _incr(self, key: str) -> int:
+        # 两个窗口后过期：计算折算时还需要读取上一个窗口
+        await self.cache.aadd(key, 0, timeout=self.WINDOW_SECONDS * 2 + 1)
+        try:
+            return await self.cache.aincr(key)
+        except ValueError:
+            # 键恰好在add和incr之间过期
+            await self.cache.aadd(key, 1, timeout=self.WINDOW_SECONDS * 2 + 1)
+            return 1
+
+    def _retry_in(self, rpm: int, previous: int, current: int, elapsed: float) -> float:
+        """估算窗口内再容纳一次请求需要等待的秒数"""
+
+        if current > rpm or previous <= 0:
+            # 当前窗口已满：等到下一个窗口
+            return (1 - elapsed) * self.WINDOW_SECONDS
+        # previous * (1 - t) + current <= rpm 时允许
+        needed = 1 - (rpm - current) / previous
+        return max(needed - elapsed, 0) * self.WINDOW_SECONDS or self.MIN_POLL_SECONDS
+
+
+llm_rate_limiter = LLMRateLimiter()
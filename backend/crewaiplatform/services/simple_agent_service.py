@@ -6,10 +6,27 @@
 
 import logging
 import asyncio
+from types import SimpleNamespace
 from typing import Optional, Dict, Any
 from django.conf import settings
 from ..models import CrewAIAgent, ChatAgentTask, ChatMessage, LLMModel
-from .chat_service import ChatMessageService, ChatAgentTaskService
+from .chat_service import ChatMessageService
+from .agent_reply import AgentReplyService
+from .stream_parser import ThinkingStreamParser, StreamSegment
+from .llm_model_cache import llm_model_cache
+from .rate_limiter import llm_rate_limiter
+from .llm_router import LLMRoute, bind_llm_route, llm_router, unbind_llm_route
+from .circuit_breaker import is_tripped
+from .agent_task_queue import AgentTaskQueue
+from .conversation_context import ConversationContext, ConversationContextBuilder, ConversationSummarizer
+from .agent_prompt_cache import CompiledAgentPrompt, agent_prompt_cache
+from .prompt_layout import (
+    LAYOUT_STRUCTURED, PromptUsage, StructuredPromptBuilder, bind_prompt_usage, current_prompt_usage,
+    prompt_layout, supports_cache_breakpoints, unbind_prompt_usage,
+)
+from .token_counter import estimate_tokens
+from ..metrics import metrics
+from ..task_registry import agent_task_cancellation, current_cancellation_token, CANCEL_REASON_LABELS
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +40,9 @@ class SimpleAgentService:
         """
         处理用户消息，调用Agent生成响应
         
+        对于HTTP API调用直接返回处理中的占位消息：任务留在队列中（pending），
+        由 run_agent_worker 认领执行，结果通过channel layer推送到会话群组
+        
         Args:
             user_message: 用户消息对象
             
@@ -30,242 +50,259 @@ class SimpleAgentService:
             助手响应消息，如果失败返回None
         """
         
+        from asgiref.sync import sync_to_async
+        
         try:
             conversation = user_message.conversation
             
-            # 选择要使用的Agent
-            from asgiref.sync import sync_to_async
-            
-            @sync_to_async
-            def select_agent():
-                return SimpleAgentService._select_agent(conversation)
-            
-            agent = await select_agent()
-            if not agent:
-                # 创建错误消息 - 使用sync_to_async包装
-                @sync_to_async
-                def create_error_message():
-                    return ChatMessageService.create_system_message(
-                        conversation, "抱歉，当前没有可用的Agent，请先配置Agent。"
-                    )
-                
-                return await create_error_message()
-            
-            # 创建Agent任务 - 使用sync_to_async包装
-            @sync_to_async
-            def create_task():
-                return ChatAgentTaskService.create_agent_task(
-                    conversation=conversation,
-                    message=user_message,
-                    agent=agent,
-                    task_description=f"回复用户消息: {user_message.content}"
-                )
-            
-            task = await create_task()
-            
-            # 对于HTTP API调用，我们直接返回处理中状态
-            # 实际的Agent任务处理应该通过WebSocket触发
-            # 这里不创建后台任务，避免任务被销毁的警告
-            
-            # 创建处理中的消息 - 使用sync_to_async包装
-            @sync_to_async
-            def create_processing_message():
-                processing_message = ChatMessageService.create_assistant_message(
-                    conversation=conversation,
-                    content="正在思考中...",
-                    agent=agent,
-                    agent_name=agent.name
+            # 选择Agent并创建任务和占位消息（一个事务）
+            task = await sync_to_async(AgentReplyService.start)(conversation, user_message)
+            if task is None:
+                return await sync_to_async(ChatMessageService.create_system_message)(
+                    conversation, "抱歉，当前没有可用的Agent，请先配置Agent。"
                 )
-                processing_message.status = 'processing'
-                processing_message.save(update_fields=['status'])
-                return processing_message
             
-            return await create_processing_message()
+            return task.response_message
             
         except Exception as e:
             logger.error(f"处理用户消息失败: {e}")
-            
-            # 创建错误消息 - 使用sync_to_async包装
-            from asgiref.sync import sync_to_async
-            
-            @sync_to_async
-            def create_error_message():
-                return ChatMessageService.create_system_message(
-                    user_message.conversation, f"处理消息时发生错误: {str(e)}"
-                )
-            
-            return await create_error_message()
+            return await sync_to_async(ChatMessageService.create_system_message)(
+                user_message.conversation, f"处理消息时发生错误: {str(e)}"
+            )
     
     @staticmethod
-    async def process_user_message_with_websocket(user_message: ChatMessage, websocket_consumer) -> Optional[ChatMessage]:
+    async def process_user_message_with_websocket(user_message: ChatMessage, websocket_consumer,
+                                                  queue: bool = None) -> Optional[ChatMessage]:
         """
         通过WebSocket处理用户消息（完整流式功能）
         
+        数据库往返：创建任务和占位消息（一个事务，直接执行时任务即为已认领）、
+        组装上下文（最近消息缓存未命中时）、写入结果（一个事务）
+        
         Args:
             user_message: 用户消息对象
             websocket_consumer: WebSocket消费者实例
+            queue: 是否只入队由worker执行，为空时按 CHAT_AGENT_TASK_QUEUE_ENABLED
+                   （SSE端点直接从LLM流下发，始终在当前进程执行）
             
         Returns:
             助手响应消息，如果失败返回None
         """
         
+        from asgiref.sync import sync_to_async
+        
         try:
             conversation = user_message.conversation
             
-            # 选择要使用的Agent
-            from asgiref.sync import sync_to_async
-            
-            @sync_to_async
-            def select_agent():
-                return SimpleAgentService._select_agent(conversation)
-            
-            agent = await select_agent()
-            if not agent:
-                # 创建错误消息 - 使用sync_to_async包装
-                @sync_to_async
-                def create_error_message():
-                    return ChatMessageService.create_system_message(
-                        conversation, "抱歉，当前没有可用的Agent，请先配置Agent。"
-                    )
-                
-                return await create_error_message()
-            
-            # 创建Agent任务 - 使用sync_to_async包装
-            @sync_to_async
-            def create_task():
-                return ChatAgentTaskService.create_agent_task(
-                    conversation=conversation,
-                    message=user_message,
-                    agent=agent,
-                    task_description=f"回复用户消息: {user_message.content}"
-                )
-            
-            task = await create_task()
+            # 队列模式下任务留在队列中，由worker执行并通过channel layer推送到会话群组
+            queued = AgentTaskQueue.is_enabled() if queue is None else queue
+            lease_owner = None if queued else AgentTaskQueue.process_owner()
             
-            # 创建处理中的消息 - 使用sync_to_async包装
-            @sync_to_async
-            def create_processing_message():
-                processing_message = ChatMessageService.create_assistant_message(
-                    conversation=conversation,
-                    content="正在思考中...",
-                    agent=agent,
-                    agent_name=agent.name
+            # 选择Agent并创建任务和占位消息（一个事务）
+            task = await sync_to_async(AgentReplyService.start)(conversation, user_message, lease_owner)
+            if task is None:
+                return await sync_to_async(ChatMessageService.create_system_message)(
+                    conversation, "抱歉，当前没有可用的Agent，请先配置Agent。"
                 )
-                processing_message.status = 'processing'
-                processing_message.save(update_fields=['status'])
-                return processing_message
             
-            await create_processing_message()
+            # 把任务关联到发起连接的后台任务注册表（用于跟踪和取消）
+            bind_agent_task = getattr(websocket_consumer, 'bind_agent_task', None)
+            if bind_agent_task is not None:
+                await bind_agent_task(task)
             
-            # 直接执行Agent任务，传递websocket_consumer
-            await SimpleAgentService._execute_agent_task(task, websocket_consumer)
+            if queued:
+                logger.info(f"Agent任务 {task.id} 已入队")
+                return task.response_message
             
-            # 返回最后的助手消息
-            @sync_to_async
-            def get_latest_assistant_message():
-                return ChatMessage.objects.filter(
-                    conversation=conversation,
-                    role='assistant'
-                ).order_by('-created_at').first()
-            
-            return await get_latest_assistant_message()
+            # 直接执行Agent任务，传递websocket_consumer；结束时占位消息已就地更新
+            await SimpleAgentService._execute_agent_task(task, websocket_consumer, lease_owner=lease_owner)
+            return task.response_message
             
         except Exception as e:
             logger.error(f"通过WebSocket处理用户消息失败: {e}")
-            
-            # 创建错误消息 - 使用sync_to_async包装
-            from asgiref.sync import sync_to_async
-            
-            @sync_to_async
-            def create_error_message():
-                return ChatMessageService.create_system_message(
-                    user_message.conversation, f"处理消息时发生错误: {str(e)}"
-                )
-            
-            return await create_error_message()
+            return await sync_to_async(ChatMessageService.create_system_message)(
+                user_message.conversation, f"处理消息时发生错误: {str(e)}"
+            )
     
     @staticmethod
     def _select_agent(conversation) -> Optional[CrewAIAgent]:
         """选择要使用的Agent"""
         
-        # 优先使用会话配置的主要Agent - 预加载llm_model关系
-        if conversation.primary_agent and conversation.primary_agent.is_active:
-            # 使用select_related预加载llm_model
-            return CrewAIAgent.objects.select_related('llm_model').get(pk=conversation.primary_agent.pk)
-        
-        # 否则选择用户的第一个可用Agent - 预加载llm_model关系
-        available_agents = CrewAIAgent.objects.filter(
-            owner=conversation.user,
-            is_active=True
-        ).select_related('llm_model').order_by('-created_at')
-        
-        return available_agents.first()
+        return AgentReplyService.select_agent(conversation)
     
     @staticmethod
-    async def _execute_agent_task(task: ChatAgentTask, websocket_consumer=None):
-        """执行Agent任务"""
+    async def _execute_agent_task(task: ChatAgentTask, websocket_consumer=None,
+                                  lease_owner: str = None, lease_seconds: int = None):
+        """
+        执行Agent任务（可通过 agent_task_cancellation 取消）
         
+        Args:
+            lease_owner: 已认领任务的执行方标识（worker，或创建时即已认领的当前进程）；
+                         为空时由当前进程认领，任务已被其他执行方认领时直接返回
+            lease_seconds: 执行租约时长，默认取 CHAT_AGENT_TASK_LEASE_SECONDS
+        """
+        
+        from asgiref.sync import sync_to_async
+        
+        if lease_owner is None:
+            lease_owner = AgentTaskQueue.process_owner()
+            claimed = await sync_to_async(AgentTaskQueue.claim_task)(task, lease_owner, lease_seconds)
+            if not claimed:
+                logger.info(f"Agent任务 {task.id} 已由其他执行方认领或已取消，跳过执行")
+                return
+        
+        cancel_token = agent_task_cancellation.register(task.id)
+        lease_keeper = asyncio.ensure_future(
+            AgentTaskQueue.keep_lease(task, lease_owner, cancel_token, lease_seconds)
+        )
+        prompt_usage = PromptUsage()
+        usage_context = bind_prompt_usage(prompt_usage)
+        route = LLMRoute()
+        route_context = bind_llm_route(route)
         try:
-            # 标记任务开始执行 - 使用sync_to_async包装
-            from asgiref.sync import sync_to_async
-            
-            @sync_to_async
-            def start_task():
-                return ChatAgentTaskService.start_task_execution(task)
-            
-            await start_task()
+            logger.info(f"任务 {task.id} 开始执行（{lease_owner}，第 {task.attempts} 次）")
             
             # 调用Agent生成响应，传递websocket_consumer
             response = await SimpleAgentService._call_agent(
                 task.agent, 
                 task.task_description,
                 task.conversation,
-                websocket_consumer
+                websocket_consumer,
+                latest_message_id=task.message_id
             )
             
-            # 完成任务 - 使用sync_to_async包装
+            # 完成任务并更新助手消息（一个事务）
+            # 存储时仅保存最终答案内容，去除<thinking>/<answer>标签，避免刷新后看到原始标签
+            answer = SimpleAgentService._extract_answer_content(response) if isinstance(response, str) else response
+            
             @sync_to_async
             def complete_task():
-                return ChatAgentTaskService.complete_task_execution(task, response)
+                SimpleAgentService._record_prompt_usage(task, prompt_usage)
+                task.record_llm_route(route)
+                return AgentReplyService.complete(task, response, answer)
             
             await complete_task()
             
-            # 更新对应的助手消息
-            await SimpleAgentService._update_assistant_message(task, response)
-            
             logger.info(f"Agent任务 {task.id} 执行完成")
             
         except Exception as e:
-            # 标记任务失败 - 使用sync_to_async包装
-            from asgiref.sync import sync_to_async
-            
+            # 标记任务失败并把错误写入助手消息（一个事务）
             @sync_to_async
             def fail_task():
-                return ChatAgentTaskService.fail_task_execution(task, str(e))
-            
-            await fail_task()
+                SimpleAgentService._record_prompt_usage(task, prompt_usage)
+                task.record_llm_route(route)
+                return AgentReplyService.fail(task, str(e))
             
-            # 更新对应的助手消息为错误状态
-            await SimpleAgentService._update_assistant_message(
-                task, f"抱歉，处理您的请求时遇到了问题: {str(e)}", is_error=True
-            )
+            try:
+                await fail_task()
+            except Exception as save_error:
+                logger.error(f"保存失败任务 {task.id} 出错: {save_error}")
             
             logger.error(f"Agent任务 {task.id} 执行失败: {e}")
+        
+        except asyncio.CancelledError:
+            # 取消令牌以外的取消（如事件循环关闭）按连接断开处理，并继续向上传播
+            external = not cancel_token.cancelled
+            if external:
+                cancel_token.reason = 'disconnect'
+            if cancel_token.reason == 'lease_lost':
+                # 租约已被回收（任务可能已由其他执行方重新执行）或任务已在别处取消，不再写入结果
+                discard = getattr(websocket_consumer, 'discard', None)
+                if discard is not None:
+                    discard()
+            else:
+                SimpleAgentService._record_prompt_usage(task, prompt_usage)
+                task.record_llm_route(route)
+                await SimpleAgentService._cancel_agent_task(task, cancel_token, websocket_consumer)
+            if external:
+                raise
+            # 由取消令牌发起的取消在这里结束，任务正常返回
+            current = asyncio.current_task()
+            if current is not None and hasattr(current, 'uncancel'):
+                current.uncancel()
+        
+        finally:
+            unbind_llm_route(route_context)
+            unbind_prompt_usage(usage_context)
+            lease_keeper.cancel()
+            agent_task_cancellation.unregister(cancel_token)
+    
+    @staticmethod
+    def _record_prompt_usage(task: ChatAgentTask, usage: PromptUsage):
+        """把提示词token用量记到任务上（随任务结束一起保存）"""
+        
+        if not usage.prompt_tokens:
+            return
+        task.record_prompt_usage(usage)
+        metrics.incr('llm.prompt_tokens.cached', usage.cached_tokens)
+        metrics.incr('llm.prompt_tokens.uncached', usage.uncached_tokens)
+        if usage.cache_write_tokens:
+            metrics.incr('llm.prompt_tokens.cache_write', usage.cache_write_tokens)
+    
+    @staticmethod
+    async def _cancel_agent_task(task: ChatAgentTask, cancel_token, websocket_consumer=None):
+        """保存被取消任务的部分答案，并通知前端结束流"""
+        
+        from asgiref.sync import sync_to_async
+        
+        reason = CANCEL_REASON_LABELS.get(cancel_token.reason, cancel_token.reason)
+        partial_response = cancel_token.partial_response
+        partial_answer = cancel_token.partial_answer
+        
+        try:
+            await sync_to_async(AgentReplyService.cancel)(task, partial_response, partial_answer, reason)
+        except Exception as e:
+            logger.error(f"保存已取消任务 {task.id} 失败: {e}")
+        
+        # 按模型的max_tokens估算被取消掉的剩余生成量（上限估计）
+        generated_tokens = estimate_tokens(partial_response)
+        try:
+            max_tokens = getattr(task.agent.llm_model, 'max_tokens', None) or 0
+        except Exception:
+            # 关联对象未预加载时不在异步上下文中查询
+            max_tokens = 0
+        metrics.incr('llm.cancel.completed', reason=cancel_token.reason)
+        metrics.incr('llm.cancel.tokens_generated', generated_tokens)
+        metrics.incr('llm.cancel.tokens_saved', max(max_tokens - generated_tokens, 0))
+        
+        logger.info(f"Agent任务 {task.id} 已取消（{reason}），已生成约 {generated_tokens} tokens")
+        
+        if websocket_consumer is not None:
+            try:
+                if cancel_token.progress is not None and cancel_token.progress.answer_started:
+                    await websocket_consumer.send_answer_stream_complete(partial_answer)
+                await websocket_consumer.send_thinking_status(False, reason)
+                send_task_status = getattr(websocket_consumer, 'send_task_status', None)
+                if send_task_status is not None:
+                    await send_task_status(task)
+            except Exception as e:
+                logger.warning(f"通知任务 {task.id} 取消失败: {e}")
     
     @staticmethod
     async def _call_agent(agent: CrewAIAgent, task_description: str, 
-                         conversation, websocket_consumer=None) -> str:
-        """调用Agent生成响应"""
+                         conversation, websocket_consumer=None, latest_message_id: int = None) -> str:
+        """调用Agent生成响应（latest_message_id 为触发本次回复的用户消息）"""
         
         try:
             # 构建对话上下文
-            context = await SimpleAgentService._build_conversation_context(conversation)
-            
-            # 构建提示词
-            prompt = SimpleAgentService._build_agent_prompt(
-                agent, task_description, context
+            structured = prompt_layout() == LAYOUT_STRUCTURED
+            context = await SimpleAgentService._build_conversation_context(
+                conversation, agent, latest_message_id, as_text=not structured
             )
             
+            # 构建提示词（Agent的角色设定、系统提示词和解析器按配置版本缓存）
+            compiled_prompt = agent_prompt_cache.get(agent)
+            if structured:
+                # 稳定的系统消息 + 按角色排列的历史 + 本次用户消息，提供商可以缓存前缀
+                messages = StructuredPromptBuilder.build(
+                    compiled_prompt, context, task_description, latest_message_id,
+                    cache_breakpoints=supports_cache_breakpoints(agent.llm_model)
+                )
+                prompt = messages[-1].content
+            else:
+                prompt = compiled_prompt.render(task_description, context)
+                messages = None
+            
             # 调用LLM，传递websocket_consumer以支持思考过程
             # 从预加载的关系中获取模型信息，避免同步查询
             llm_model_name = getattr(agent.llm_model, 'name', 'unknown') if agent.llm_model else 'unknown'
@@ -273,10 +310,17 @@ class SimpleAgentService:
             
             logger.info(f"准备调用LLM，模型: {llm_model_name}, 提供商: {llm_model_provider}")
             logger.info(f"Prompt长度: {len(prompt)}")
-            
-            response = await SimpleAgentService._call_llm(
-                agent.llm_model, prompt, websocket_consumer
-            )
+            usage = current_prompt_usage()
+            if usage is not None:
+                usage.estimate(messages or compiled_prompt.messages(prompt))
+            metrics.observe('llm.prompt_tokens', estimate_tokens(prompt))
+            
+            # 按Agent的max_rpm和模型的速率/并发上限排队（跨进程）
+            async with llm_rate_limiter.limit(agent=agent):
+                response = await SimpleAgentService._call_llm(
+                    agent.llm_model, prompt, websocket_consumer, compiled_prompt, messages,
+                    fallbacks=agent.fallback_llm_models
+                )
             
             logger.info(f"LLM调用成功，响应长度: {len(response) if response else 0}")
             logger.info(f"响应内容预览: {response[:200] if response else 'None'}...")
@@ -290,80 +334,57 @@ class SimpleAgentService:
             raise e
     
     @staticmethod
-    async def _build_conversation_context(conversation, max_messages: int = 10) -> str:
-        """构建对话上下文"""
+    async def _build_conversation_context(conversation, agent: CrewAIAgent = None,
+                                          latest_message_id: int = None, as_text: bool = True):
+        """
+        构建对话上下文（按Agent的token预算，超出部分在后台合并进滚动摘要）
+        
+        as_text为False时返回 ConversationContext（结构化消息布局使用）
+        """
         
         from asgiref.sync import sync_to_async
         
         try:
-            @sync_to_async
-            def get_recent_messages():
-                # 获取最近的消息
-                recent_messages = ChatMessage.objects.filter(
-                    conversation=conversation,
-                    role__in=['user', 'assistant']
-                ).order_by('-created_at')[:max_messages]
-                
-                # 反向排序以保持时间顺序
-                return list(reversed(recent_messages))
+            budget = ConversationContextBuilder.token_budget(agent)
+            context = await sync_to_async(ConversationContextBuilder.build)(
+                conversation.id, budget, expected_message_id=latest_message_id
+            )
             
-            recent_messages = await get_recent_messages()
+            metrics.observe('chat.context.tokens', context.tokens)
+            metrics.observe('chat.context.turns', len(context.turns))
             
-            # 构建上下文字符串
-            context_parts = []
-            for message in recent_messages:
-                role = "用户" if message.role == "user" else f"助手({message.agent_name})"
-                context_parts.append(f"{role}: {message.content}")
+            if context.overflow_until_id is not None and agent is not None:
+                ConversationSummarizer.schedule(conversation.id, agent.llm_model, context.overflow_until_id)
             
-            return "\n".join(context_parts)
+            return context.text if as_text else context
             
         except Exception as e:
             logger.error(f"构建对话上下文失败: {e}")
-            return ""
+            return "" if as_text else ConversationContext()
     
     @staticmethod
     def _build_agent_prompt(agent: CrewAIAgent, task_description: str, 
                            context: str) -> str:
-        """构建Agent提示词"""
-        
-        prompt_parts = []
-        
-        # Agent角色设定
-        if agent.role:
-            prompt_parts.append(f"你是一个{agent.role}。")
-        
-        # Agent目标
-        if agent.goal:
-            prompt_parts.append(f"你的目标是: {agent.goal}")
-        
-        # Agent背景故事
-        if agent.backstory:
-            prompt_parts.append(f"背景信息: {agent.backstory}")
-        
-        # 对话上下文
-        if context:
-            prompt_parts.append(f"\n以下是之前的对话历史:\n{context}")
+        """构建Agent提示词（角色设定来自编译缓存）"""
         
-        # 当前任务
-        prompt_parts.append(f"\n当前任务: {task_description}")
-        
-        # 响应要求
-        prompt_parts.append(
-            "\n请根据你的角色和目标，结合对话历史，为当前任务提供准确、有用的响应。"
-            "请保持友好、专业的语气，直接回答问题，不需要重复任务描述。"
-        )
-        
-        return "\n".join(prompt_parts)
+        return agent_prompt_cache.get(agent).render(task_description, context)
     
     @staticmethod
-    async def _call_llm(llm_model: LLMModel, prompt: str, websocket_consumer=None) -> str:
-        """统一的LLM调用方法，全部使用思考模式并保留标签"""
+    async def _call_llm(llm_model: LLMModel, prompt: str, websocket_consumer=None,
+                        compiled_prompt: CompiledAgentPrompt = None, messages: list = None,
+                        fallbacks: list = None) -> str:
+        """
+        统一的LLM调用方法，全部使用思考模式并保留标签
+        
+        messages为结构化布局组装好的消息列表，为空时由prompt组装；
+        fallbacks为备用模型ID列表，主模型过慢或失败时由 llm_router 对冲或故障转移
+        """
         
         try:
             logger.info(f"开始调用LLM: {llm_model.name} ({llm_model.provider})")
             
-            # 检查LLM模型是否可用
-            if not llm_model.is_available:
+            # 检查LLM模型是否可用（熔断写入的不可用状态由 llm_router 按熔断器状态放行探测或转移到备用模型）
+            if not llm_model.is_available and not is_tripped(llm_model.validation_error):
                 error_msg = f"LLM模型 {llm_model.name} 当前不可用，请检查配置"
                 logger.error(error_msg)
                 raise ValueError(error_msg)
@@ -374,27 +395,23 @@ class SimpleAgentService:
             if websocket_consumer:
                 logger.info("使用WebSocket思考模式流式调用")
                 return await SimpleAgentService._call_llm_with_thinking_unified(
-                    llm_model, prompt, websocket_consumer
+                    llm_model, prompt, websocket_consumer, compiled_prompt, messages, fallbacks
                 )
             else:
                 # 非WebSocket调用，使用普通LangChain调用
                 logger.info("使用普通LangChain调用")
                 
-                # 使用sync_to_async包装create_langchain_model调用
-                from asgiref.sync import sync_to_async
-                
-                @sync_to_async
-                def create_model():
-                    return llm_model.create_langchain_model()
-                
-                langchain_model = await create_model()
+                # 复用进程内缓存的模型实例和连接池
+                langchain_model = await llm_model_cache.aget(llm_model)
                 logger.info(f"LangChain模型创建成功: {type(langchain_model).__name__}")
                 
                 from langchain_core.messages import HumanMessage
-                message = HumanMessage(content=prompt)
+                if messages is None:
+                    messages = [HumanMessage(content=prompt)]
                 logger.info("发送消息到LangChain模型")
                 
-                response = await langchain_model.ainvoke([message])
+                response = await llm_router.ainvoke(llm_model, messages, fallbacks, langchain_model)
+                SimpleAgentService._observe_prompt_usage(response)
                 logger.info(f"LangChain模型响应成功，内容长度: {len(response.content) if response.content else 0}")
                 
                 return response.content
@@ -406,88 +423,41 @@ class SimpleAgentService:
             raise e
     
     @staticmethod
-    async def _call_llm_with_thinking_unified(llm_model: LLMModel, prompt: str, websocket_consumer) -> str:
+    async def _call_llm_with_thinking_unified(llm_model: LLMModel, prompt: str, websocket_consumer,
+                                              compiled_prompt: CompiledAgentPrompt = None,
+                                              messages: list = None, fallbacks: list = None) -> str:
         """使用LangChain的结构化输出和Prompt模板进行思考模式调用"""
         
-        from langchain_core.prompts import ChatPromptTemplate
-        from langchain_core.output_parsers import BaseOutputParser
-        from langchain_core.messages import HumanMessage, SystemMessage
-        from langchain.schema.runnable import RunnablePassthrough
-        from asgiref.sync import sync_to_async
-        import re
-        
         try:
             logger.info(f"开始LangChain结构化调用: {llm_model.name}")
             
-            # 创建LangChain模型
-            @sync_to_async
-            def create_model():
-                return llm_model.create_langchain_model()
-            
-            langchain_model = await create_model()
+            # 获取LangChain模型（复用进程内缓存的实例和连接池）
+            langchain_model = await llm_model_cache.aget(llm_model)
             
-            # 定义结构化输出解析器
-            class ThinkingOutputParser(BaseOutputParser):
-                """解析思考过程和答案的输出解析器"""
-                
-                def parse(self, text: str) -> dict:
-                    thinking_match = re.search(r'<thinking>(.*?)</thinking>', text, re.DOTALL)
-                    answer_match = re.search(r'<answer>(.*?)</answer>', text, re.DOTALL)
-                    
-                    return {
-                        'thinking': thinking_match.group(1).strip() if thinking_match else '',
-                        'answer': answer_match.group(1).strip() if answer_match else text,
-                        'full_response': text
-                    }
-            
-            # 创建结构化提示词模板
-            system_template = """你是一个善于思考的AI助手。请在回答问题时，先展示你的思考过程，然后给出最终答案。
-
-请严格按照以下格式回答：
-
-<thinking>
-在这里写你的详细思考过程：
-- 分析问题的关键点
-- 考虑不同的角度和可能性
-- 推理和判断过程
-- 得出结论的逻辑
-</thinking>
-
-<answer>
-在这里给出简洁明了的最终答案
-</answer>
-
-注意：
-1. thinking部分要详细展示思考过程
-2. answer部分要简洁直接地回答问题
-3. 必须使用指定的XML标签格式"""
-            
-            human_template = "{input}"
-            
-            # 创建ChatPromptTemplate
-            prompt_template = ChatPromptTemplate.from_messages([
-                ("system", system_template),
-                ("human", human_template)
-            ])
-            
-            # 创建输出解析器
-            output_parser = ThinkingOutputParser()
+            # 系统提示词、Prompt模板和输出解析器来自Agent的编译缓存
+            if compiled_prompt is None:
+                compiled_prompt = CompiledAgentPrompt(SimpleNamespace(role='', goal='', backstory=''))
+            output_parser = compiled_prompt.output_parser
+            if messages is None:
+                messages = compiled_prompt.messages(prompt)
             
             # 构建链式调用
             if hasattr(langchain_model, 'astream'):  # 支持流式输出
                 logger.info("使用LangChain流式调用")
                 return await SimpleAgentService._langchain_stream_call(
-                    langchain_model, prompt_template, output_parser, prompt, websocket_consumer
+                    langchain_model, compiled_prompt, prompt, websocket_consumer, messages,
+                    llm_model=llm_model, fallbacks=fallbacks
                 )
             else:
                 logger.info("使用LangChain普通调用")
-                # 普通调用
-                chain = prompt_template | langchain_model | output_parser
                 
                 # 发送思考开始信号
                 await websocket_consumer.send_thinking_status(True, "开始思考...")
                 
-                result = await chain.ainvoke({"input": prompt})
+                # 普通调用（主模型失败时转移到备用模型）
+                response = await llm_router.ainvoke(llm_model, messages, fallbacks, langchain_model)
+                SimpleAgentService._observe_prompt_usage(response)
+                result = output_parser.parse(_chunk_text(response))
                 
                 # 处理结果
                 if result['thinking']:
@@ -509,77 +479,31 @@ class SimpleAgentService:
             raise e
     
     @staticmethod
-    async def _langchain_stream_call(langchain_model, prompt_template, output_parser, user_input: str, websocket_consumer) -> str:
+    async def _langchain_stream_call(langchain_model, compiled_prompt: CompiledAgentPrompt,
+                                     user_input: str, websocket_consumer, messages: list = None,
+                                     llm_model: LLMModel = None, fallbacks: list = None) -> str:
         """LangChain流式调用处理"""
         
         try:
             logger.info("开始LangChain流式处理")
             
-            # 构建完整的提示词
-            messages = await prompt_template.aformat_messages(input=user_input)
-            
-            full_response = ""
-            current_thinking_content = ""
-            current_answer_content = ""
-            in_thinking = False
-            in_answer = False
-            thinking_buffer = ""
-            answer_buffer = ""
-            answer_stream_started = False
+            # 构建完整的提示词（复用编译好的系统消息）
+            if messages is None:
+                messages = compiled_prompt.messages(user_input)
+            output_parser = compiled_prompt.output_parser
             
             # 发送思考开始信号
             await websocket_consumer.send_thinking_status(True, "开始分析问题...")
             
-            # 流式调用LangChain模型
-            async for chunk in langchain_model.astream(messages):
-                if hasattr(chunk, 'content') and chunk.content:
-                    content = chunk.content
-                    full_response += content
-                    
-                    # 逐字符处理，检测标签
-                    for char in content:
-                        if in_thinking:
-                            thinking_buffer += char
-                            # 检测 </thinking> 结束标签
-                            if thinking_buffer.endswith('</thinking>'):
-                                # 移除结束标签并保存思考内容
-                                current_thinking_content = thinking_buffer[:-12].strip()
-                                await websocket_consumer.send_thinking_complete(current_thinking_content)
-                                in_thinking = False
-                                thinking_buffer = ""
-                            else:
-                                # 实时更新思考内容
-                                clean_thinking = thinking_buffer.replace('</thinking>', '').strip()
-                                if clean_thinking:
-                                    await websocket_consumer.send_thinking_update(clean_thinking)
-                        
-                        elif in_answer:
-                            answer_buffer += char
-                            # 检测 </answer> 结束标签
-                            if answer_buffer.endswith('</answer>'):
-                                # 移除结束标签并保存答案内容
-                                current_answer_content = answer_buffer[:-9].strip()
-                                in_answer = False
-                                break  # 答案结束，停止处理
-                            else:
-                                # 实时更新答案内容
-                                clean_answer = answer_buffer.replace('</answer>', '').strip()
-                                # 推送累计的已解析答案内容，前端可直接覆盖展示
-                                if not answer_stream_started:
-                                    await websocket_consumer.send_answer_stream_start()
-                                    answer_stream_started = True
-                                await websocket_consumer.send_answer_stream_update(clean_answer)
-                        
-                        else:
-                            # 检测开始标签
-                            if full_response.endswith('<thinking>'):
-                                in_thinking = True
-                                thinking_buffer = ""
-                            elif full_response.endswith('<answer>'):
-                                in_answer = True
-                                answer_buffer = ""
-                                await websocket_consumer.send_answer_stream_start()
-                                answer_stream_started = True
+            # 流式调用LangChain模型，按chunk增量解析标签
+            parser = ThinkingStreamParser()
+            await SimpleAgentService._consume_stream(
+                langchain_model, messages, parser, websocket_consumer, llm_model, fallbacks
+            )
+            
+            full_response = parser.full_response
+            answer_stream_started = parser.answer_started
+            current_answer_content = parser.answer_content if parser.answer_completed else ""
             
             # 使用输出解析器解析完整响应
             parsed_result = output_parser.parse(full_response)
@@ -603,6 +527,66 @@ class SimpleAgentService:
             logger.error(f"错误堆栈: {traceback.format_exc()}")
             raise e
 
+    @staticmethod
+    async def _consume_stream(langchain_model, messages, parser: ThinkingStreamParser, websocket_consumer,
+                              llm_model: LLMModel = None, fallbacks: list = None):
+        """
+        消费模型的流式输出并推送解析出的片段
+        
+        解析器登记到当前任务的取消令牌上，取消时可以读取已生成的内容；
+        无论正常结束、出错还是被取消，都会关闭上游异步生成器以释放HTTP流。
+        传入llm_model时经 llm_router 打开流（首个token过慢时对冲到备用模型）。
+        """
+        
+        cancel_token = current_cancellation_token()
+        if cancel_token is not None:
+            cancel_token.progress = parser
+        
+        if llm_model is not None:
+            stream = await llm_router.open_stream(llm_model, messages, fallbacks or (), langchain_model)
+        else:
+            stream = langchain_model.astream(messages)
+        try:
+            async for chunk in stream:
+                SimpleAgentService._observe_prompt_usage(chunk)
+                await SimpleAgentService._dispatch_stream_segments(
+                    parser.feed(_chunk_text(chunk)), websocket_consumer
+                )
+                if cancel_token is not None and cancel_token.cancelled:
+                    # 跨线程的取消请求可能尚未送达事件循环，在chunk之间主动检查
+                    raise asyncio.CancelledError()
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        
+        await SimpleAgentService._dispatch_stream_segments(
+            parser.close(), websocket_consumer
+        )
+    
+    @staticmethod
+    def _observe_prompt_usage(message):
+        """从模型响应（或流式chunk）中读取提示词用量，包括命中提供商缓存的token数"""
+        
+        usage = current_prompt_usage()
+        if usage is not None:
+            usage.observe(message)
+    
+    @staticmethod
+    async def _dispatch_stream_segments(segments, websocket_consumer):
+        """将解析器输出的片段推送到WebSocket"""
+        
+        for segment in segments:
+            if segment.kind == StreamSegment.THINKING_DELTA:
+                await websocket_consumer.send_thinking_update(segment.text)
+            elif segment.kind == StreamSegment.THINKING_END:
+                await websocket_consumer.send_thinking_complete(segment.text)
+            elif segment.kind == StreamSegment.ANSWER_START:
+                await websocket_consumer.send_answer_stream_start()
+            elif segment.kind == StreamSegment.ANSWER_DELTA:
+                # 只推送增量，累计内容由消费者按连接协议重建
+                await websocket_consumer.send_answer_stream_update(segment.text)
+
     @staticmethod
     async def _generate_test_response(llm_model: LLMModel, prompt: str) -> str:
         """生成智能的测试响应"""
@@ -653,134 +637,6 @@ class SimpleAgentService:
             ]
         
         return random.choice(responses)
-    
-    @staticmethod
-    async def _fallback_llm_call(llm_model: LLMModel, prompt: str) -> str:
-        """降级LLM调用（如果LangChain失败）"""
-        
-        try:
-            # 根据不同的LLM提供商调用相应的API
-            if llm_model.provider == 'openai':
-                return await SimpleAgentService._call_openai_api(llm_model, prompt)
-            elif llm_model.provider == 'anthropic':
-                return await SimpleAgentService._call_anthropic_api(llm_model, prompt)
-            elif llm_model.provider == 'qwen':
-                return await SimpleAgentService._call_qwen_api(llm_model, prompt)
-            else:
-                raise ValueError(f"不支持的LLM提供商: {llm_model.provider}")
-                
-        except Exception as e:
-            logger.error(f"降级调用失败: {e}")
-            raise e
-    
-    @staticmethod
-    async def _call_openai_api(llm_model: LLMModel, prompt: str) -> str:
-        """调用OpenAI API"""
-        
-        import openai
-        
-        try:
-            config = llm_model.config
-            
-            # 配置OpenAI客户端
-            client = openai.AsyncOpenAI(
-                api_key=config.get('api_key'),
-                base_url=config.get('base_url')
-            )
-            
-            # 调用API
-            response = await client.chat.completions.create(
-                model=llm_model.model_name,
-                messages=[
-                    {"role": "system", "content": prompt}
-                ],
-                temperature=config.get('temperature', 0.7),
-                max_tokens=config.get('max_tokens', 1000),
-                timeout=config.get('timeout', 30)
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            logger.error(f"OpenAI API调用失败: {e}")
-            raise e
-    
-    @staticmethod
-    async def _call_anthropic_api(llm_model: LLMModel, prompt: str) -> str:
-        """调用Anthropic API"""
-        
-        try:
-            # TODO: 实现Anthropic API调用
-            # 这里使用模拟响应
-            await asyncio.sleep(1)  # 模拟API调用延迟
-            return f"[Anthropic] 基于您的问题，我来为您提供帮助... (模拟响应)"
-            
-        except Exception as e:
-            logger.error(f"Anthropic API调用失败: {e}")
-            raise e
-    
-    @staticmethod
-    async def _call_qwen_api(llm_model: LLMModel, prompt: str) -> str:
-        """调用Qwen API"""
-        
-        try:
-            # Qwen通常兼容OpenAI格式，复用OpenAI调用逻辑
-            return await SimpleAgentService._call_openai_api(llm_model, prompt)
-            
-        except Exception as e:
-            logger.error(f"Qwen API调用失败: {e}")
-            raise e
-    
-    @staticmethod
-    async def _update_assistant_message(task: ChatAgentTask, content: str, 
-                                      is_error: bool = False):
-        """更新助手消息内容"""
-        
-        from asgiref.sync import sync_to_async
-        
-        try:
-            # 使用sync_to_async包装数据库操作
-            @sync_to_async
-            def get_assistant_message():
-                return ChatMessage.objects.filter(
-                    conversation=task.conversation,
-                    role='assistant',
-                    agent=task.agent,
-                    status='processing'
-                ).order_by('-created_at').first()
-            
-            @sync_to_async
-            def update_message(message, new_content, error_status, error_msg=None):
-                # 存储时仅保存最终答案内容，去除<thinking>/<answer>标签，避免刷新后看到原始标签
-                if not error_status and isinstance(new_content, str):
-                    try:
-                        final_answer_only = SimpleAgentService._extract_answer_content(new_content)
-                    except Exception:
-                        final_answer_only = new_content
-                    message.content = final_answer_only
-                else:
-                    message.content = new_content
-                message.status = 'failed' if error_status else 'completed'
-                if error_status:
-                    message.error_message = error_msg or new_content
-                
-                message.save(update_fields=[
-                    'content', 'status', 'error_message', 'updated_at'
-                ])
-                return message.id
-            
-            # 查找对应的助手消息
-            assistant_message = await get_assistant_message()
-            
-            if assistant_message:
-                message_id = await update_message(assistant_message, content, is_error, 
-                                                content if is_error else None)
-                logger.info(f"助手消息 {message_id} 已更新")
-            else:
-                logger.warning(f"未找到待更新的助手消息，任务ID: {task.id}")
-            
-        except Exception as e:
-            logger.error(f"更新助手消息失败: {e}")
 
 
 class MockAgentService:
@@ -871,68 +727,17 @@ async def _process_langchain_stream(langchain_model, messages, websocket_consume
     """处理LangChain流式响应"""
     
     try:
-        full_response = ""
-        current_thinking_content = ""
-        current_answer_content = ""
-        in_thinking = False
-        in_answer = False
-        thinking_buffer = ""
-        answer_buffer = ""
-        
         # 发送思考开始信号
         await websocket_consumer.send_thinking_status(True, "开始思考...")
         
-        # 使用LangChain的流式输出
-        async for chunk in langchain_model.astream(messages):
-            if hasattr(chunk, 'content') and chunk.content:
-                content = chunk.content
-            elif isinstance(chunk, str):
-                content = chunk
-            else:
-                continue
-            
-            full_response += content
-            
-            # 逐字符处理，检测标签
-            for char in content:
-                if in_thinking:
-                    thinking_buffer += char
-                    # 检测 </thinking> 结束标签
-                    if thinking_buffer.endswith('</thinking>'):
-                        # 移除结束标签并保存思考内容
-                        current_thinking_content = thinking_buffer[:-12]  # 移除 </thinking>
-                        await websocket_consumer.send_thinking_complete(current_thinking_content)
-                        in_thinking = False
-                        thinking_buffer = ""
-                    else:
-                        # 实时更新思考内容
-                        clean_thinking = thinking_buffer.replace('</thinking>', '')
-                        await websocket_consumer.send_thinking_update(clean_thinking)
-                
-                elif in_answer:
-                    answer_buffer += char
-                    # 检测 </answer> 结束标签
-                    if answer_buffer.endswith('</answer>'):
-                        # 移除结束标签并保存答案内容
-                        current_answer_content = answer_buffer[:-9]  # 移除 </answer>
-                        in_answer = False
-                        break  # 答案结束，停止处理
-                    else:
-                        # 实时更新答案内容
-                        await websocket_consumer.send_answer_stream_update(char)
-                
-                else:
-                    # 检测开始标签
-                    if full_response.endswith('<thinking>'):
-                        in_thinking = True
-                        thinking_buffer = ""
-                    elif full_response.endswith('<answer>'):
-                        in_answer = True
-                        answer_buffer = ""
-                        await websocket_consumer.send_answer_stream_start()
+        # 使用LangChain的流式输出，按chunk增量解析标签
+        parser = ThinkingStreamParser()
+        await SimpleAgentService._consume_stream(langchain_model, messages, parser, websocket_consumer)
+        
+        full_response = parser.full_response
         
         # 发送流式完成
-        final_answer = current_answer_content if current_answer_content else full_response
+        final_answer = parser.answer_content if parser.answer_completed else full_response
         await websocket_consumer.send_answer_stream_complete(final_answer)
         
         # 返回完整响应（保留标签）
@@ -984,6 +789,13 @@ async def _process_langchain_response(langchain_model, messages, websocket_consu
         logger.error(f"LangChain普通响应处理失败: {e}")
         raise e
 
+def _chunk_text(chunk) -> str:
+    """提取流式chunk中的文本内容"""
+    if isinstance(chunk, str):
+        return chunk
+    content = getattr(chunk, 'content', None)
+    return content if isinstance(content, str) else ""
+
 def _extract_thinking_content(content: str) -> str:
     """提取<thinking>标签内的内容"""
     import re
@@ -0,0 +1,214 @@
+"""
+流式标签解析器
+
+增量解析LLM流式输出中的<thinking>/<answer>标签：
+- 按整块(chunk)消费输入，单次遍历的状态机，摊还O(n)
+- 支持标签被切分在多个chunk之间
+- 输出带类型的片段（思考增量、答案增量、完成等）
+"""
+
+from typing import List, Optional
+
+
+class StreamSegment:
+    """解析器输出的片段"""
+
+    THINKING_DELTA = 'thinking_delta'
+    THINKING_END = 'thinking_end'
+    ANSWER_START = 'answer_start'
+    ANSWER_DELTA = 'answer_delta'
+    ANSWER_END = 'answer_end'
+    DONE = 'done'
+
+    __slots__ = ('kind', 'text')
+
+    def __init__(self, kind: str, text: str = ''):
+        self.kind = kind
+        self.text = text
+
+    def __eq__(self, other):
+        if not isinstance(other, StreamSegment):
+            return NotImplemented
+        return self.kind == other.kind and self.text == other.text
+
+    def __repr__(self):
+        return f"StreamSegment({self.kind!r}, {self.text!r})"
+
+
+class ThinkingStreamParser:
+    """
+    <thinking>/<answer>增量解析器
+
+    用法:
+        parser = ThinkingStreamParser()
+        async for chunk in llm.astream(messages):
+            for segment in parser.feed(chunk.content):
+                ...
+        for segment in parser.close():
+            ...
+
+    标签外的文本不产生片段，但会保留在 full_response 中，
+    以便调用方在没有<answer>标签时做兜底提取。
+    """
+
+    THINKING_OPEN = '<thinking>'
+    THINKING_CLOSE = '</thinking>'
+    ANSWER_OPEN = '<answer>'
+    ANSWER_CLOSE = '</answer>'
+
+    STATE_OUTSIDE = 'outside'
+    STATE_THINKING = 'thinking'
+    STATE_ANSWER = 'answer'
+
+    def __init__(self):
+        self._state = self.STATE_OUTSIDE
+        # 可能是标签前缀的尾部字符，长度不超过最长标签-1
+        self._pending = ''
+        self._response_parts: List[str] = []
+        self._thinking_parts: List[str] = []
+        self._answer_parts: List[str] = []
+        self._thinking_completed = False
+        self._answer_started = False
+        self._answer_completed = False
+        self._closed = False
+
+    # ------------------------------------------------------------------
+    # 状态查询
+    # ------------------------------------------------------------------
+
+    @property
+    def full_response(self) -> str:
+        """到目前为止收到的完整原始响应（保留标签）"""
+        if len(self._response_parts) > 1:
+            self._response_parts = [''.join(self._response_parts)]
+        return self._response_parts[0] if self._response_parts else ''
+
+    @property
+    def thinking_content(self) -> str:
+        """已解析的思考内容（去除首尾空白）"""
+        return ''.join(self._thinking_parts).strip()
+
+    @property
+    def answer_content(self) -> str:
+        """已解析的答案内容（去除首尾空白）"""
+        return ''.join(self._answer_parts).strip()
+
+    @property
+    def thinking_completed(self) -> bool:
+        return self._thinking_completed
+
+    @property
+    def answer_started(self) -> bool:
+        return self._answer_started
+
+    @property
+    def answer_completed(self) -> bool:
+        return self._answer_completed
+
+    # ------------------------------------------------------------------
+    # 解析
+    # ------------------------------------------------------------------
+
+    def feed(self, chunk: Optional[str]) -> List[StreamSegment]:
+        """消费一个chunk，返回本次产生的片段列表"""
+
+        if not chunk or self._closed:
+            return []
+
+        self._response_parts.append(chunk)
+        segments: List[StreamSegment] = []
+        text = self._pending + chunk
+        self._pending = ''
+        pos = 0
+        length = len(text)
+
+        while pos < length:
+            if self._state == self.STATE_OUTSIDE:
+                pos = self._consume_outside(text, pos, segments)
+            else:
+                pos = self._consume_inside(text, pos, segments)
+
+        return segments
+
+    def close(self) -> List[StreamSegment]:
+        """结束输入，冲刷残留内容并产生DONE片段"""
+
+        if self._closed:
+            return []
+        self._closed = True
+
+        segments: List[StreamSegment] = []
+        if self._pending and self._state != self.STATE_OUTSIDE:
+            # 流结束时残留的标签前缀只是普通文本
+            self._emit_delta(self._pending, segments)
+        self._pending = ''
+        segments.append(StreamSegment(StreamSegment.DONE))
+        return segments
+
+    def _consume_outside(self, text: str, pos: int, segments: List[StreamSegment]) -> int:
+        """标签外：查找下一个开始标签"""
+
+        thinking_at = text.find(self.THINKING_OPEN, pos)
+        answer_at = text.find(self.ANSWER_OPEN, pos)
+
+        if thinking_at != -1 and (answer_at == -1 or thinking_at < answer_at):
+            self._state = self.STATE_THINKING
+            return thinking_at + len(self.THINKING_OPEN)
+
+        if answer_at != -1:
+            self._state = self.STATE_ANSWER
+            self._answer_started = True
+            segments.append(StreamSegment(StreamSegment.ANSWER_START))
+            return answer_at + len(self.ANSWER_OPEN)
+
+        # 没有完整的开始标签，保留可能的标签前缀
+        self._pending = self._partial_tag_suffix(
+            text, pos, (self.THINKING_OPEN, self.ANSWER_OPEN)
+        )
+        return len(text)
+
+    def _consume_inside(self, text: str, pos: int, segments: List[StreamSegment]) -> int:
+        """标签内：输出增量，直到遇到对应的结束标签"""
+
+        close_tag = self.THINKING_CLOSE if self._state == self.STATE_THINKING else self.ANSWER_CLOSE
+        close_at = text.find(close_tag, pos)
+
+        if close_at != -1:
+            self._emit_delta(text[pos:close_at], segments)
+            if self._state == self.STATE_THINKING:
+                self._thinking_completed = True
+                segments.append(StreamSegment(StreamSegment.THINKING_END, self.thinking_content))
+            else:
+                self._answer_completed = True
+                segments.append(StreamSegment(StreamSegment.ANSWER_END, self.answer_content))
+            self._state = self.STATE_OUTSIDE
+            return close_at + len(close_tag)
+
+        self._pending = self._partial_tag_suffix(text, pos, (close_tag,))
+        self._emit_delta(text[pos:len(text) - len(self._pending)], segments)
+        return len(text)
+
+    def _emit_delta(self, delta: str, segments: List[StreamSegment]):
+        """记录并输出当前状态下的增量文本"""
+
+        if not delta:
+            return
+        if self._state == self.STATE_THINKING:
+            self._thinking_parts.append(delta)
+            segments.append(StreamSegment(StreamSegment.THINKING_DELTA, delta))
+        elif self._state == self.STATE_ANSWER:
+            self._answer_parts.append(delta)
+            segments.append(StreamSegment(StreamSegment.ANSWER_DELTA, delta))
+
+    @staticmethod
+    def _partial_tag_suffix(text: str, pos: int, tags) -> str:
+        """返回text[pos:]末尾可能构成某个标签前缀的最长后缀"""
+
+        tail_start = max(pos, len(text) - max(len(tag) for tag in tags) + 1)
+        lt = text.find('<', tail_start)
+        while lt != -1:
+            suffix = text[lt:]
+            if any(tag.startswith(suffix) for tag in tags):
+                return suffix
+            lt = text.find('<', lt + 1)
+        return ''
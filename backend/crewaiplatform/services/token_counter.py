@@ -0,0 +1,41 @@
+"""
+Token估算
+
+在没有提供商tokenizer的情况下粗略估算文本的token数：
+中日韩字符按每字1个token计算，其余字符按每4个字符1个token计算。
+用于指标统计和上下文预算，不用于计费。
+"""
+
+import re
+
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数"""
+
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = '…') -> str:
+    """截断文本使估算token数不超过max_tokens（保留开头）"""
+
+    if max_tokens <= 0:
+        return ''
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    # 估算是单调的，二分查找可保留的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) < max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + marker
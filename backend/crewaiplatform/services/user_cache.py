@@ -0,0 +1,103 @@
+"""
+认证用户缓存
+
+每个REST请求和每次WebSocket/SSE连接都要按令牌中的用户ID加载用户，原实现每次都查询用户表：
+前端轮询接口和断线重连风暴时，这些查询占了请求数据库访问的大头。
+
+UserCache 把用户对象以 auth:user:<id> 为键保存在Django缓存中（配置 REDIS_URL 时由所有
+worker进程共享），过期时间为 AUTH_USER_CACHE_TTL 秒（为0时不缓存）。用户保存或删除时
+（包括停用、修改密码、更新最后登录时间）由信号清除对应的键，过期时间只是兜底：
+绕过信号的批量更新（QuerySet.update）最多在这段时间后生效。
+
+不存在的用户不缓存，以免缓存被伪造ID的令牌填满。
+命中和未命中记录在 auth.user_cache.hits / auth.user_cache.misses 指标中。
+"""
+
+import logging
+from typing import Optional
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """按用户ID缓存认证用的用户对象"""
+
+    KEY_PREFIX = 'auth:user'
+
+    def __init__(self, cache_alias: str = None, ttl: int = None):
+        self._cache_alias = cache_alias
+        self._ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self._cache_alias or 'default']
+
+    @property
+    def ttl(self) -> int:
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+    def key(self, user_id) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}"
+
+    def get(self, user_id):
+        """返回用户对象，用户不存在时返回None"""
+
+        if self.ttl <= 0:
+            return self._load(user_id)
+
+        user = self.cache.get(self.key(user_id))
+        if user is not None:
+            metrics.incr('auth.user_cache.hits')
+            return user
+
+        metrics.incr('auth.user_cache.misses')
+        user = self._load(user_id)
+        if user is not None:
+            self.cache.set(self.key(user_id), user, timeout=self.ttl)
+        return user
+
+    async def aget(self, user_id):
+        """get 的异步版本，命中缓存时不占用数据库线程"""
+
+        if self.ttl <= 0:
+            return await database_sync_to_async(self._load)(user_id)
+
+        user = await self.cache.aget(self.key(user_id))
+        if user is not None:
+            metrics.incr('auth.user_cache.hits')
+            return user
+
+        metrics.incr('auth.user_cache.misses')
+        user = await database_sync_to_async(self._load)(user_id)
+        if user is not None:
+            await self.cache.aset(self.key(user_id), user, timeout=self.ttl)
+        return user
+
+    def invalidate(self, user_id):
+        try:
+            self.cache.delete(self.key(user_id))
+        except Exception as e:
+            # 缓存不可用时只能等待过期
+            logger.warning(f"清除用户缓存失败: user_id={user_id}, {e}")
+
+    def _load(self, user_id) -> Optional[object]:
+        from rest_framework_simplejwt.settings import api_settings
+
+        User = get_user_model()
+        try:
+            return User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except (User.DoesNotExist, ValueError):
+            return None
+
+
+user_cache = UserCache()
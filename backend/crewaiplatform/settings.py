@@ -134,7 +134,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Django REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'crewaiplatform.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -217,12 +217,139 @@ LOGGING = {
 }
 
 # Channels配置
-CHANNEL_LAYERS = {
-    'default': {
-        # 开发环境使用内存通道层（避免Redis认证问题）
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
-    },
-}
+# CHANNEL_LAYER_BACKEND: memory（单进程，默认）/ ipc（同一主机多进程，Unix域套接字）/ postgres（多节点，LISTEN/NOTIFY，实验性）
+# 运行多个ASGI进程或独立的agent worker时需要 ipc 或 postgres，内存通道层只在进程内有效
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'memory')
+if CHANNEL_LAYER_BACKEND == 'ipc':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'crewaiplatform.channel_layers.IPCChannelLayer',
+            # 同一主机上的所有进程使用同一目录，不同部署使用不同目录
+            'CONFIG': {'path': os.environ.get('CHANNEL_LAYER_IPC_PATH') or None},
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'postgres':
+    # 实验性：LISTEN/NOTIFY、断线重连和切换事件循环的路径尚未在真实的PostgreSQL上验证
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'crewaiplatform.channel_layers.PostgresChannelLayer',
+            'CONFIG': {'prefix': os.environ.get('CHANNEL_LAYER_PG_PREFIX', 'crewai')},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            # 开发环境使用内存通道层（避免Redis认证问题）
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        },
+    }
+
+# 聊天流式协议: cumulative(兼容旧版前端，推送累计内容) / delta(协议v2，仅推送增量)
+# 客户端可通过连接参数 ?stream_protocol=delta 单独选择
+CHAT_STREAM_PROTOCOL = os.environ.get('CHAT_STREAM_PROTOCOL', 'cumulative')
+
+# WebSocket帧编码: json（默认）/ msgpack（二进制帧）/ deflate（较大的事件压缩为二进制帧）
+# 客户端可通过子协议 crewai.<编码> 或连接参数 ?encoding=msgpack 单独选择
+CHAT_WS_FRAME_ENCODING = os.environ.get('CHAT_WS_FRAME_ENCODING', 'json')
+CHAT_WS_DEFLATE_MIN_BYTES = int(os.environ.get('CHAT_WS_DEFLATE_MIN_BYTES', 1024))
+# 客户端deflate帧解压后的大小上限（字节）
+CHAT_WS_MAX_INFLATED_BYTES = int(os.environ.get('CHAT_WS_MAX_INFLATED_BYTES', 1024 * 1024))
+
+# WebSocket发送队列：每个连接最多排队的帧数（为0时不使用队列，直接写出），超过后中间的流式更新帧
+# 合并(coalesce)或丢弃(drop)；持续超限超过该秒数的慢客户端被断开（关闭码4008）
+CHAT_WS_SEND_QUEUE_MAX_FRAMES = int(os.environ.get('CHAT_WS_SEND_QUEUE_MAX_FRAMES', 256))
+CHAT_WS_SEND_QUEUE_POLICY = os.environ.get('CHAT_WS_SEND_QUEUE_POLICY', 'coalesce')
+CHAT_WS_SEND_QUEUE_OVERFLOW_SECONDS = float(os.environ.get('CHAT_WS_SEND_QUEUE_OVERFLOW_SECONDS', 10))
+
+# 流式帧合并：增量在时间窗口(毫秒)内或达到字节阈值前合并为一帧，窗口为0时不合并
+CHAT_STREAM_COALESCE_WINDOW_MS = int(os.environ.get('CHAT_STREAM_COALESCE_WINDOW_MS', 40))
+CHAT_STREAM_COALESCE_MAX_BYTES = int(os.environ.get('CHAT_STREAM_COALESCE_MAX_BYTES', 2048))
+
+# 每个WebSocket连接同时在后台生成的Agent回复数上限
+CHAT_MAX_INFLIGHT_RESPONSES_PER_CONNECTION = int(os.environ.get('CHAT_MAX_INFLIGHT_RESPONSES_PER_CONNECTION', 3))
+
+# 连接断开时是否取消其正在生成的回复：always / last_subscriber(会话最后一个连接断开时) / never
+CHAT_CANCEL_ON_DISCONNECT = os.environ.get('CHAT_CANCEL_ON_DISCONNECT', 'always')
+
+# SSE流式端点：空闲超过该秒数时发送注释行心跳
+CHAT_SSE_HEARTBEAT_SECONDS = float(os.environ.get('CHAT_SSE_HEARTBEAT_SECONDS', 15))
+
+# REST接口触发的Agent处理：同时执行的任务数，以及排队上限（超过后返回503）
+CHAT_EXECUTOR_CONCURRENCY = int(os.environ.get('CHAT_EXECUTOR_CONCURRENCY', 8))
+CHAT_EXECUTOR_QUEUE_LIMIT = int(os.environ.get('CHAT_EXECUTOR_QUEUE_LIMIT', 100))
+
+# Agent任务队列（manage.py run_agent_worker）：执行租约时长(秒)、租约过期后的最大执行次数；
+# 开启 CHAT_AGENT_TASK_QUEUE_ENABLED 后WebSocket消息也只入队，由worker执行并通过channel layer推送
+CHAT_AGENT_TASK_LEASE_SECONDS = int(os.environ.get('CHAT_AGENT_TASK_LEASE_SECONDS', 60))
+CHAT_AGENT_TASK_MAX_ATTEMPTS = int(os.environ.get('CHAT_AGENT_TASK_MAX_ATTEMPTS', 3))
+CHAT_AGENT_TASK_QUEUE_ENABLED = os.environ.get('CHAT_AGENT_TASK_QUEUE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# 对话上下文：历史对话的默认token预算（Agent可单独配置），每次最多扫描的消息数；
+# 超出预算的早期对话在后台合并为会话的滚动摘要
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 2000))
+CHAT_CONTEXT_MAX_MESSAGES = int(os.environ.get('CHAT_CONTEXT_MAX_MESSAGES', 50))
+CHAT_CONTEXT_SUMMARY_ENABLED = os.environ.get('CHAT_CONTEXT_SUMMARY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CHAT_CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get('CHAT_CONTEXT_SUMMARY_MAX_TOKENS', 400))
+
+# 会话最近消息缓存：每个会话缓存的消息数、最多缓存的会话数、内容总字节数上限、过期时间(秒)
+CHAT_MESSAGE_CACHE_WINDOW = int(os.environ.get('CHAT_MESSAGE_CACHE_WINDOW', CHAT_CONTEXT_MAX_MESSAGES + 1))
+CHAT_MESSAGE_CACHE_MAX_CONVERSATIONS = int(os.environ.get('CHAT_MESSAGE_CACHE_MAX_CONVERSATIONS', 1000))
+CHAT_MESSAGE_CACHE_MAX_BYTES = int(os.environ.get('CHAT_MESSAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+CHAT_MESSAGE_CACHE_TTL = int(os.environ.get('CHAT_MESSAGE_CACHE_TTL', 300))
+
+# 会话计数：默认每条消息/任务一条原子UPDATE；开启写后合并后按会话每隔N毫秒批量写入
+CHAT_COUNTER_WRITE_BEHIND = os.environ.get('CHAT_COUNTER_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+CHAT_COUNTER_FLUSH_INTERVAL_MS = int(os.environ.get('CHAT_COUNTER_FLUSH_INTERVAL_MS', 250))
+
+# LLM模型实例缓存：每个事件循环最多缓存的模型实例数，以及每个API端点共享的连接池大小
+LLM_MODEL_CACHE_SIZE = int(os.environ.get('LLM_MODEL_CACHE_SIZE', 64))
+LLM_HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_POOL_MAX_CONNECTIONS', 100))
+LLM_HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get('LLM_HTTP_POOL_MAX_KEEPALIVE', 20))
+
+# LLM请求限流（Agent的max_rpm、模型的max_rpm/max_concurrency，状态保存在缓存中以便跨进程共享）：
+# 排队等待的最长时间(秒)、并发槽位的过期时间(秒，应大于单次调用的最长耗时)
+LLM_RATE_LIMIT_ENABLED = os.environ.get('LLM_RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('LLM_RATE_LIMIT_MAX_WAIT_SECONDS', 30))
+LLM_CONCURRENCY_SLOT_TTL = int(os.environ.get('LLM_CONCURRENCY_SLOT_TTL', 600))
+
+# LLM故障转移与对冲请求：主模型超过其首个token耗时(TTFT)的分位值仍无输出时向Agent的备用模型发出对冲请求。
+# 滚动窗口样本数、分位数、启用分位值前的最少样本数、样本不足时的等待时间(毫秒)、等待时间下限(毫秒)
+LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_TTFT_WINDOW = int(os.environ.get('LLM_TTFT_WINDOW', 200))
+LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20))
+LLM_HEDGE_DEFAULT_DELAY_MS = int(os.environ.get('LLM_HEDGE_DEFAULT_DELAY_MS', 5000))
+LLM_HEDGE_MIN_DELAY_MS = int(os.environ.get('LLM_HEDGE_MIN_DELAY_MS', 500))
+
+# LLM模型与MCP工具的熔断器：统计窗口(秒)、分桶粒度(秒)、打开前的最少调用数、打开的失败率阈值、
+# 打开后进入半开探测前的时间(秒)、探测请求的最长占用时间(秒)
+CIRCUIT_BREAKER_ENABLED = os.environ.get('CIRCUIT_BREAKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CIRCUIT_BREAKER_WINDOW_SECONDS = int(os.environ.get('CIRCUIT_BREAKER_WINDOW_SECONDS', 60))
+CIRCUIT_BREAKER_BUCKET_SECONDS = int(os.environ.get('CIRCUIT_BREAKER_BUCKET_SECONDS', 10))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.environ.get('CIRCUIT_BREAKER_MIN_CALLS', 10))
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.environ.get('CIRCUIT_BREAKER_FAILURE_RATE', 0.5))
+CIRCUIT_BREAKER_OPEN_SECONDS = int(os.environ.get('CIRCUIT_BREAKER_OPEN_SECONDS', 30))
+CIRCUIT_BREAKER_PROBE_TIMEOUT = int(os.environ.get('CIRCUIT_BREAKER_PROBE_TIMEOUT', 120))
+
+# Agent提示词编译缓存：最多缓存的Agent数
+AGENT_PROMPT_CACHE_SIZE = int(os.environ.get('AGENT_PROMPT_CACHE_SIZE', 256))
+
+# 提示词消息布局：flat 把历史拼进一条用户消息；structured 使用稳定的系统消息和按角色排列的历史，
+# 便于提供商缓存提示词前缀（Anthropic 额外标记缓存断点）
+CHAT_PROMPT_LAYOUT = os.environ.get('CHAT_PROMPT_LAYOUT', 'flat')
+
+# 认证用户缓存：按用户ID缓存的过期时间(秒)，用户保存或删除时立即失效；为0时每次认证都查询用户表
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+
+# API密钥加密：版本号 -> 密钥材料，新密文使用当前版本加密，其余版本仅用于解密旧数据
+# 环境变量格式 "v2:新密钥,v1:旧密钥"；轮换后执行 manage.py reencrypt_llm_api_keys
+LLM_API_KEY_ENCRYPTION_KEYS = {'v1': SECRET_KEY}
+if os.environ.get('LLM_API_KEY_ENCRYPTION_KEYS'):
+    LLM_API_KEY_ENCRYPTION_KEYS = dict(
+        item.split(':', 1) for item in os.environ['LLM_API_KEY_ENCRYPTION_KEYS'].split(',') if item
+    )
+LLM_API_KEY_CURRENT_VERSION = os.environ.get('LLM_API_KEY_CURRENT_VERSION', next(iter(LLM_API_KEY_ENCRYPTION_KEYS)))
+LLM_API_KEY_DECRYPT_CACHE_SIZE = int(os.environ.get('LLM_API_KEY_DECRYPT_CACHE_SIZE', 256))
 
 # 确保日志目录存在
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
@@ -0,0 +1,134 @@
+"""
+模型信号处理
+
+在模型变更时清除相关的缓存（含认证用户缓存），维护会话计数，并在手动恢复可用后清除熔断状态。
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .models import User, LLMModel, MCPTool, CrewAIAgent, ChatConversation, ChatMessage, ChatAgentTask
+
+
+@receiver([post_save, post_delete], sender=LLMModel)
+def invalidate_llm_model_cache(sender, instance, **kwargs):
+    """LLM模型配置变更时清除缓存的LangChain模型实例"""
+    from .services.llm_model_cache import llm_model_cache
+    llm_model_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=LLMModel)
+def reset_llm_model_circuit(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """LLM模型重新标记为可用（如手动验证通过）后清除熔断状态"""
+    if created or raw or not instance.is_available:
+        return
+    if update_fields is None or 'is_available' in update_fields:
+        from .services.circuit_breaker import circuit_breaker, llm_model_key
+        circuit_breaker.reset(llm_model_key(instance))
+
+
+@receiver(post_save, sender=MCPTool)
+def reset_mcp_tool_circuit(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """MCP工具健康检查通过后清除熔断状态"""
+    if created or raw or instance.status != 'healthy':
+        return
+    if update_fields is None or 'status' in update_fields:
+        from .services.circuit_breaker import circuit_breaker, mcp_tool_key
+        circuit_breaker.reset(mcp_tool_key(instance))
+
+
+@receiver([post_save, post_delete], sender=CrewAIAgent)
+def invalidate_agent_prompt_cache(sender, instance, **kwargs):
+    """Agent配置变更时清除编译好的提示词"""
+    from .services.agent_prompt_cache import agent_prompt_cache
+    agent_prompt_cache.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """用户保存（含停用、修改密码）或删除时清除认证用户缓存"""
+    from .services.user_cache import user_cache
+    user_cache.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ChatConversation)
+def notify_conversation_context(sender, instance, raw=False, **kwargs):
+    """会话变更时通知其WebSocket连接重新加载上下文"""
+    if not raw:
+        from .connection_context import notify_context_changed
+        notify_context_changed([f'chat_{instance.pk}'], 'conversation', instance.pk)
+
+
+@receiver([post_save, post_delete], sender=CrewAIAgent)
+def notify_agent_context(sender, instance, raw=False, **kwargs):
+    """Agent变更时通知以它为主要Agent的连接重新加载上下文"""
+    if not raw:
+        from .connection_context import agent_group_name, notify_context_changed
+        notify_context_changed([agent_group_name(instance.pk)], 'agent', instance.pk)
+
+
+# 连接上下文不使用的LLM模型字段：只更新这些字段时不通知
+LLM_MODEL_NON_CONTEXT_FIELDS = frozenset({'last_validated', 'model_info', 'updated_at'})
+
+
+@receiver(post_save, sender=LLMModel)
+def notify_llm_model_context(sender, instance, update_fields=None, raw=False, **kwargs):
+    """
+    LLM模型变更时通知使用它的各Agent的连接重新加载上下文
+
+    使用该模型的Agent在事务提交后（且配置了channel layer时）才查询。
+    Agent的LLM模型外键为PROTECT，能删除的模型没有Agent使用，删除时无需通知。
+    """
+    if raw or (update_fields is not None and update_fields <= LLM_MODEL_NON_CONTEXT_FIELDS):
+        return
+
+    from .connection_context import agent_group_name, notify_context_changed
+
+    llm_model_id = instance.pk
+
+    def agent_groups():
+        agent_ids = CrewAIAgent.objects.filter(llm_model_id=llm_model_id).values_list('pk', flat=True)
+        return [agent_group_name(pk) for pk in agent_ids]
+
+    notify_context_changed(agent_groups, 'llm_model', llm_model_id)
+
+
+@receiver(post_save, sender=ChatMessage)
+def write_through_recent_messages(sender, instance, **kwargs):
+    """聊天消息保存后（事务提交时）写穿到会话最近消息缓存"""
+    from .services.message_cache import recent_message_cache
+    transaction.on_commit(lambda: recent_message_cache.apply(instance))
+
+
+@receiver(post_delete, sender=ChatMessage)
+def discard_recent_message(sender, instance, **kwargs):
+    """聊天消息删除后（事务提交时）移出会话最近消息缓存"""
+    from .services.message_cache import recent_message_cache
+    conversation_id, message_id = instance.conversation_id, instance.pk
+    transaction.on_commit(lambda: recent_message_cache.discard_message(conversation_id, message_id))
+
+
+@receiver(post_save, sender=ChatMessage)
+def count_chat_message(sender, instance, created, raw=False, **kwargs):
+    """新消息累加会话的消息数并更新最后活动时间"""
+    if created and not raw:
+        from .services.conversation_counters import conversation_counters
+        conversation_counters.record(instance.conversation_id, messages=1, activity_at=instance.created_at)
+
+
+@receiver(post_save, sender=ChatAgentTask)
+def count_agent_task(sender, instance, created, raw=False, **kwargs):
+    """新任务累加会话的Agent调用数"""
+    if created and not raw:
+        from .services.conversation_counters import conversation_counters
+        conversation_counters.record(instance.conversation_id, agent_calls=1)
+
+
+@receiver(setting_changed)
+def reload_api_key_encryption(sender, setting, **kwargs):
+    """加密密钥配置变更时（如测试中override_settings）重新加载密钥"""
+    if setting in ('SECRET_KEY', 'LLM_API_KEY_ENCRYPTION_KEYS', 'LLM_API_KEY_CURRENT_VERSION'):
+        from .key_manager import key_manager
+        key_manager.reload()
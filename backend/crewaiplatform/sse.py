@@ -0,0 +1,298 @@
+"""
+聊天响应的HTTP流式端点（Server-Sent Events）
+
+不能保持WebSocket连接的客户端原本通过 send_message 接口发送消息，
+拿到"正在思考中..."占位后轮询 messages。ChatEventStreamConsumer 是ASGI原生的
+text/event-stream 端点：
+
+    POST /api/chat/conversations/<id>/stream/   {"content": "..."}
+
+在同一个请求中执行Agent，直接从LLM流下发与ChatConsumer相同的思考/答案事件，
+不经过channel layer：
+- 每个事件一帧：event 为事件类型，data 为与WebSocket相同的JSON；
+  ?stream_protocol=delta 选择协议，未指定时使用 settings.CHAT_STREAM_PROTOCOL
+- 空闲超过 CHAT_SSE_HEARTBEAT_SECONDS 秒时发送注释行心跳，避免代理断开空闲连接
+- 客户端断开时按 CHAT_CANCEL_ON_DISCONNECT 取消生成并保存部分答案（never 时继续生成）
+- 回复结束后发送 done 事件（附带助手消息）并结束响应
+
+认证使用JWT（Authorization: Bearer 头或 ?token= 查询参数）。
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .frame_encoding import dumps_json
+from .metrics import metrics
+from .models import ChatConversation
+from .stream_protocol import (
+    STREAM_PROTOCOL_VERSION,
+    AgentResponseStream,
+    StreamEventEncoder,
+    resolve_stream_protocol,
+)
+from .task_registry import TaskRegistry
+
+
+logger = logging.getLogger(__name__)
+
+
+class SSEResponseStream(AgentResponseStream):
+    """直接写入SSE响应的Agent响应流（不经过channel layer）"""
+
+    async def _group_send(self, event: dict):
+        await self.consumer.send_event(event)
+
+
+class ChatEventStreamConsumer:
+    """聊天响应的SSE端点（每个请求一个实例）"""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.base_send = send
+        self.conversation_id = scope['url_route']['kwargs']['conversation_id']
+        self.user = scope.get('user')
+        self.stream_protocol = resolve_stream_protocol(scope)
+        self.stream_encoder = StreamEventEncoder(self.stream_protocol)
+        self.agent_tasks = TaskRegistry(owner=f"SSE 会话 {self.conversation_id}")
+        self.streaming = False
+        self.closed = False
+        self.last_write = time.monotonic()
+        self._write_lock = asyncio.Lock()
+
+    @classmethod
+    def as_asgi(cls):
+        """返回ASGI应用"""
+
+        async def app(scope, receive, send):
+            await cls(scope, receive, send).handle()
+
+        app.consumer_class = cls
+        return app
+
+    async def handle(self):
+        """校验请求、创建用户消息，然后在本请求中流式下发Agent响应"""
+
+        if self.scope['method'] == 'OPTIONS':
+            # 跨域预检（本端点不经过Django，由这里按 CORS_ALLOWED_ORIGINS 响应）
+            await self.base_send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': self.cors_headers() + [
+                    (b'access-control-allow-methods', b'POST, OPTIONS'),
+                    (b'access-control-allow-headers', b'authorization, content-type'),
+                ],
+            })
+            await self.base_send({'type': 'http.response.body', 'body': b''})
+            return
+        if self.scope['method'] != 'POST':
+            await self.send_json_response(405, {'error': '只支持POST请求'}, [(b'allow', b'POST, OPTIONS')])
+            return
+
+        body = await self.read_body()
+        if body is None:
+            return
+
+        if self.user is None or not self.user.is_authenticated:
+            await self.send_json_response(401, {'error': '未认证'})
+            return
+
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            await self.send_json_response(400, {'error': '无效的JSON格式'})
+            return
+
+        from .serializers import ChatMessageCreateSerializer
+
+        serializer = ChatMessageCreateSerializer(data=data if isinstance(data, dict) else {})
+        if not serializer.is_valid():
+            await self.send_json_response(400, serializer.errors)
+            return
+
+        conversation = await self.get_conversation()
+        if conversation is None:
+            await self.send_json_response(404, {'error': '会话不存在'})
+            return
+        if not conversation.primary_agent:
+            await self.send_json_response(400, {'error': '该会话没有配置Agent，请先选择一个Agent。'})
+            return
+
+        user_message = await self.create_user_message(conversation, serializer.validated_data['content'])
+
+        await self.start_stream()
+        await self.send_event({
+            'type': 'connection_established',
+            'conversation_id': self.conversation_id,
+            'stream_protocol': self.stream_protocol,
+            'protocol_version': STREAM_PROTOCOL_VERSION,
+        })
+        await self.send_event({'type': 'new_message', 'message': await self.serialize_message(user_message)})
+
+        stream = SSEResponseStream(self)
+        stream.task_key = self.agent_tasks.start(self.run_agent_response(user_message, stream))
+        await self.wait_for_response(self.agent_tasks.find(stream.task_key).task, stream)
+
+    async def wait_for_response(self, task: asyncio.Task, stream: SSEResponseStream):
+        """等待回复结束或客户端断开，期间发送心跳"""
+
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect())
+        heartbeat = asyncio.ensure_future(self.heartbeat())
+        try:
+            await asyncio.wait([task, disconnect], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+
+        if disconnect.done():
+            # 客户端已断开：不再写入响应
+            self.closed = True
+            metrics.incr('chat.sse.disconnects')
+            if getattr(settings, 'CHAT_CANCEL_ON_DISCONNECT', 'always') == 'never':
+                logger.info(f"{self.agent_tasks.owner} 客户端已断开，回复继续生成")
+            else:
+                # 本请求是这次回复唯一的订阅者，last_subscriber 策略同样取消
+                await self.agent_tasks.cancel_all(reason='disconnect')
+                stream.discard()
+            return
+
+        disconnect.cancel()
+        reply = None if task.cancelled() or task.exception() is not None else task.result()
+        await self.send_event({
+            'type': 'done',
+            'message': await self.serialize_message(reply) if reply is not None else None,
+        })
+        await self.finish_stream()
+
+    async def run_agent_response(self, user_message, stream: SSEResponseStream):
+        """执行Agent响应并返回助手消息，错误通过流事件报告"""
+
+        from .services import SimpleAgentService
+
+        try:
+            await stream.send_thinking_status(True, '正在分析您的问题...')
+            # 直接从LLM流下发，不进入任务队列
+            return await SimpleAgentService.process_user_message_with_websocket(user_message, stream, queue=False)
+        except asyncio.CancelledError:
+            stream.discard()
+            raise
+        except Exception as e:
+            logger.error(f"Agent处理失败: {e}")
+            await stream.abort()
+            await self.send_event({'type': 'error', 'message': f"Agent响应失败: {str(e)}"})
+            return None
+        finally:
+            logger.info(f"{self.agent_tasks.owner} 流式帧统计: {stream.stream_coalescer.stats()}")
+
+    # ---- 请求与响应 ----
+
+    async def read_body(self):
+        """读取完整的请求体；客户端在此之前断开时返回None"""
+
+        parts = []
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            parts.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(parts)
+
+    async def wait_for_disconnect(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    def cors_headers(self) -> list:
+        """请求来源在 CORS_ALLOWED_ORIGINS 中时返回跨域响应头"""
+
+        origin = dict(self.scope.get('headers', [])).get(b'origin')
+        if origin is None or origin.decode('latin1') not in getattr(settings, 'CORS_ALLOWED_ORIGINS', []):
+            return []
+        headers = [(b'access-control-allow-origin', origin), (b'vary', b'origin')]
+        if getattr(settings, 'CORS_ALLOW_CREDENTIALS', False):
+            headers.append((b'access-control-allow-credentials', b'true'))
+        return headers
+
+    async def send_json_response(self, status: int, data, headers=None):
+        await self.base_send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')] + self.cors_headers() + list(headers or []),
+        })
+        await self.base_send({
+            'type': 'http.response.body',
+            'body': json.dumps(data, ensure_ascii=False).encode('utf-8'),
+        })
+
+    async def start_stream(self):
+        await self.base_send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                # 关闭nginx等反向代理的响应缓冲
+                (b'x-accel-buffering', b'no'),
+            ] + self.cors_headers(),
+        })
+        self.streaming = True
+        metrics.incr('chat.sse.streams')
+
+    async def finish_stream(self):
+        async with self._write_lock:
+            if self.closed:
+                return
+            self.closed = True
+            await self.base_send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def send_event(self, event: dict):
+        """按连接协议编码事件并作为一帧SSE下发"""
+
+        frame = self.stream_encoder.encode(event)
+        if frame is None:
+            return
+        data = dumps_json(frame)
+        await self._write(f"event: {frame['type']}\ndata: {data}\n\n".encode('utf-8'))
+
+    async def heartbeat(self):
+        """空闲时发送注释行心跳"""
+
+        interval = getattr(settings, 'CHAT_SSE_HEARTBEAT_SECONDS', 15)
+        while True:
+            await asyncio.sleep(max(interval - (time.monotonic() - self.last_write), 0.01))
+            if time.monotonic() - self.last_write >= interval:
+                await self._write(b': ping\n\n')
+                metrics.incr('chat.sse.heartbeats')
+
+    async def _write(self, body: bytes):
+        async with self._write_lock:
+            if self.closed or not self.streaming:
+                return
+            await self.base_send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            self.last_write = time.monotonic()
+
+    # ---- 数据库 ----
+
+    @database_sync_to_async
+    def get_conversation(self):
+        return ChatConversation.objects.select_related('primary_agent').filter(
+            id=self.conversation_id, user=self.user
+        ).first()
+
+    @database_sync_to_async
+    def create_user_message(self, conversation, content):
+        from .services import ChatMessageService
+
+        return ChatMessageService.create_user_message(conversation=conversation, content=content)
+
+    @database_sync_to_async
+    def serialize_message(self, message):
+        from .serializers import ChatMessageSerializer
+
+        return ChatMessageSerializer(message).data
@@ -0,0 +1,444 @@
+"""
+WebSocket流式传输协议
+
+定义思考/答案流的传输协议：
+- cumulative: 兼容模式，每次更新推送累计的完整内容（旧版前端）
+- delta: 协议版本2，每次更新只推送新增内容，附带流ID和序号，
+  完成事件附带校验和，客户端可据此校验拼接结果
+
+客户端在连接时通过查询参数 ?stream_protocol=delta 选择协议，
+未指定时使用 settings.CHAT_STREAM_PROTOCOL。
+
+生产端的增量会先进入 FrameCoalescer，按时间窗口或字节阈值合并后
+再经过通道层下发，避免每个token单独一帧。
+
+AgentResponseStream 是一次Agent响应的生产端，可以挂在WebSocket连接上，
+也可以通过 ChannelGroupTarget 由没有连接的后台worker直接推送到会话群组。
+发起连接是会话群组唯一的订阅者时，事件直接交给该连接处理，不经过通道层（见 group_subscribers）。
+StreamEventEncoder 把生产端的事件按连接协商的协议编码为客户端帧，
+WebSocket连接和SSE端点共用。
+"""
+
+import asyncio
+import time
+import uuid
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+from django.conf import settings
+
+from .group_subscribers import group_subscribers
+from .metrics import metrics
+
+
+STREAM_PROTOCOL_CUMULATIVE = 'cumulative'
+STREAM_PROTOCOL_DELTA = 'delta'
+STREAM_PROTOCOLS = (STREAM_PROTOCOL_CUMULATIVE, STREAM_PROTOCOL_DELTA)
+
+# delta协议的版本号，随每个增量事件下发
+STREAM_PROTOCOL_VERSION = 2
+
+STREAM_THINKING = 'thinking'
+STREAM_ANSWER = 'answer'
+
+
+def resolve_stream_protocol(scope) -> str:
+    """根据连接的查询参数解析客户端请求的流式协议"""
+
+    default = getattr(settings, 'CHAT_STREAM_PROTOCOL', STREAM_PROTOCOL_CUMULATIVE)
+    query_string = scope.get('query_string', b'')
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode()
+
+    requested = parse_qs(query_string).get('stream_protocol', [default])[0]
+    return requested if requested in STREAM_PROTOCOLS else default
+
+
+def content_checksum(content: str) -> str:
+    """计算内容的CRC32校验和（8位十六进制）"""
+    return f"{zlib.crc32(content.encode('utf-8')) & 0xffffffff:08x}"
+
+
+class OutgoingStream:
+    """生产端的单个流状态（思考流或答案流）"""
+
+    __slots__ = ('stream_id', 'kind', 'seq', '_parts')
+
+    def __init__(self, stream_id: str, kind: str):
+        self.stream_id = stream_id
+        self.kind = kind
+        self.seq = 0
+        self._parts: List[str] = []
+
+    def append(self, delta: str) -> int:
+        """追加增量内容，返回该增量的序号"""
+        self.seq += 1
+        self._parts.append(delta)
+        return self.seq
+
+    def next_seq(self) -> int:
+        """为非增量事件（开始/完成）分配序号"""
+        self.seq += 1
+        return self.seq
+
+    @property
+    def streamed_text(self) -> str:
+        """已推送增量拼接后的内容"""
+        return ''.join(self._parts)
+
+
+class OutgoingStreams:
+    """生产端的流集合，一次Agent响应共享同一个stream_id"""
+
+    def __init__(self):
+        self._stream_id: Optional[str] = None
+        self._streams: Dict[str, OutgoingStream] = {}
+
+    def get(self, kind: str) -> OutgoingStream:
+        """获取（必要时创建）指定类型的流"""
+        if self._stream_id is None:
+            self._stream_id = uuid.uuid4().hex
+        stream = self._streams.get(kind)
+        if stream is None:
+            stream = self._streams[kind] = OutgoingStream(self._stream_id, kind)
+        return stream
+
+    def reset(self, kind: str = None):
+        """结束指定类型的流；不指定时结束整个响应"""
+        if kind is None:
+            self._stream_id = None
+            self._streams.clear()
+        else:
+            self._streams.pop(kind, None)
+
+
+class CumulativeAssembler:
+    """兼容模式的接收端：把增量重新拼接为累计内容"""
+
+    def __init__(self):
+        self._buffers: Dict[Tuple[str, str], List[str]] = {}
+
+    def append(self, stream_id: str, kind: str, delta: str) -> str:
+        """追加增量并返回累计内容（去除首尾空白，与旧协议一致）"""
+        parts = self._buffers.setdefault((stream_id, kind), [])
+        if delta:
+            parts.append(delta)
+        if len(parts) > 1:
+            parts[:] = [''.join(parts)]
+        return parts[0].strip() if parts else ''
+
+    def discard(self, stream_id: str, kind: str):
+        """丢弃已完成流的缓冲"""
+        self._buffers.pop((stream_id, kind), None)
+
+
+def build_complete_payload(stream: OutgoingStream, content: str) -> dict:
+    """构建完成事件的公共字段（流ID、序号、校验和）"""
+
+    return {
+        'stream_id': stream.stream_id,
+        'seq': stream.next_seq(),
+        'content': content,
+        'checksum': content_checksum(content),
+        'length': len(content),
+        # 增量拼接结果与最终内容一致时，delta协议可以省略完整内容
+        'matches_stream': stream.streamed_text.strip() == content,
+    }
+
+
+class StreamEventEncoder:
+    """
+    按连接协议把生产端事件编码为客户端帧
+
+    delta协议直接下发增量（附带流ID、序号、校验和）；cumulative兼容模式重新拼接为累计内容。
+    思考/答案流以外的事件（思考状态、任务状态）原样下发。
+    """
+
+    DELTA_EVENTS = {'thinking_content_update': STREAM_THINKING, 'answer_stream_update': STREAM_ANSWER}
+    COMPLETE_EVENTS = {'thinking_complete': STREAM_THINKING, 'answer_stream_complete': STREAM_ANSWER}
+
+    def __init__(self, protocol: str):
+        self.protocol = protocol
+        self.cumulative_assembler = CumulativeAssembler()
+
+    def encode(self, event: dict) -> Optional[dict]:
+        """返回要下发的帧；兼容模式下没有可下发的内容时返回None"""
+
+        event_type = event['type']
+        if event_type == 'answer_stream_start':
+            if self.protocol == STREAM_PROTOCOL_DELTA:
+                return {
+                    'type': event_type,
+                    'protocol': STREAM_PROTOCOL_VERSION,
+                    'stream_id': event['stream_id'],
+                    'seq': event['seq'],
+                }
+            return {'type': event_type}
+        if event_type in self.DELTA_EVENTS:
+            return self._encode_delta(event, self.DELTA_EVENTS[event_type])
+        if event_type in self.COMPLETE_EVENTS:
+            return self._encode_complete(event, self.COMPLETE_EVENTS[event_type])
+        return dict(event)
+
+    def _encode_delta(self, event: dict, kind: str) -> Optional[dict]:
+        if self.protocol == STREAM_PROTOCOL_DELTA:
+            return {
+                'type': event['type'],
+                'protocol': STREAM_PROTOCOL_VERSION,
+                'stream_id': event['stream_id'],
+                'seq': event['seq'],
+                'delta': event['delta'],
+            }
+
+        # 兼容模式：重新拼接为累计内容
+        content = self.cumulative_assembler.append(event['stream_id'], kind, event['delta'])
+        if not content:
+            return None
+        return {'type': event['type'], 'content': content}
+
+    def _encode_complete(self, event: dict, kind: str) -> dict:
+        self.cumulative_assembler.discard(event['stream_id'], kind)
+
+        if self.protocol != STREAM_PROTOCOL_DELTA:
+            return {'type': event['type'], 'content': event['content']}
+
+        frame = {
+            'type': event['type'],
+            'protocol': STREAM_PROTOCOL_VERSION,
+            'stream_id': event['stream_id'],
+            'seq': event['seq'],
+            'checksum': event['checksum'],
+            'length': event['length'],
+        }
+        # 拼接结果与最终内容不一致时（如兜底提取的答案）才下发完整内容
+        if not event['matches_stream']:
+            frame['content'] = event['content']
+        return frame
+
+
+class FrameCoalescer:
+    """
+    按流合并增量帧
+
+    同一个流的增量先缓存，满足以下任一条件时合并为一帧下发：
+    - 距离第一个未下发增量超过时间窗口 window_ms
+    - 缓存的字节数达到 max_bytes
+    - 调用方显式 flush（流开始、完成前）
+    window_ms 为0时不合并，每个增量直接下发。
+    """
+
+    def __init__(self, send_frame: Callable[[str, str], Awaitable[None]],
+                 window_ms: int = None, max_bytes: int = None):
+        if window_ms is None:
+            window_ms = getattr(settings, 'CHAT_STREAM_COALESCE_WINDOW_MS', 40)
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'CHAT_STREAM_COALESCE_MAX_BYTES', 2048)
+
+        self._send_frame = send_frame
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_bytes = max_bytes
+        self._pending: Dict[str, List[str]] = {}
+        self._pending_bytes: Dict[str, int] = {}
+        self._first_at: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._timer_flushes = set()
+        self._lock = asyncio.Lock()
+
+        # 计数：收到的增量数、实际下发的帧数
+        self.deltas_received = 0
+        self.frames_sent = 0
+
+    @property
+    def frames_coalesced(self) -> int:
+        """被合并掉（未单独成帧）的增量数"""
+        return self.deltas_received - self.frames_sent
+
+    def stats(self) -> dict:
+        return {
+            'deltas_received': self.deltas_received,
+            'frames_sent': self.frames_sent,
+            'frames_coalesced': self.frames_coalesced,
+        }
+
+    async def add(self, kind: str, delta: str):
+        """添加一个增量，必要时立即下发"""
+
+        if not delta:
+            return
+        self.deltas_received += 1
+        metrics.incr('chat.stream.deltas_received')
+
+        parts = self._pending.setdefault(kind, [])
+        parts.append(delta)
+        size = self._pending_bytes.get(kind, 0) + len(delta.encode('utf-8'))
+        self._pending_bytes[kind] = size
+        now = time.monotonic()
+        first_at = self._first_at.setdefault(kind, now)
+
+        if self.window <= 0 or size >= self.max_bytes or now - first_at >= self.window:
+            await self.flush(kind)
+        elif kind not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[kind] = loop.call_later(
+                self.window - (now - first_at), self._flush_soon, kind
+            )
+
+    async def flush(self, kind: str = None):
+        """立即下发指定流（不指定时为全部流）的缓存内容"""
+
+        async with self._lock:
+            kinds = [kind] if kind is not None else list(self._pending)
+            for pending_kind in kinds:
+                timer = self._timers.pop(pending_kind, None)
+                if timer is not None:
+                    timer.cancel()
+                parts = self._pending.pop(pending_kind, None)
+                self._pending_bytes.pop(pending_kind, None)
+                self._first_at.pop(pending_kind, None)
+                if not parts:
+                    continue
+                self.frames_sent += 1
+                metrics.incr('chat.stream.frames_sent')
+                await self._send_frame(pending_kind, ''.join(parts))
+
+    def discard(self):
+        """丢弃全部缓存（连接关闭或出错时）"""
+
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._pending.clear()
+        self._pending_bytes.clear()
+        self._first_at.clear()
+
+    def _flush_soon(self, kind: str):
+        """定时器回调：窗口到期后下发"""
+
+        self._timers.pop(kind, None)
+        task = asyncio.ensure_future(self.flush(kind))
+        self._timer_flushes.add(task)
+        task.add_done_callback(self._timer_flushes.discard)
+
+
+class ChannelGroupTarget:
+    """没有WebSocket连接时（如后台worker）向会话群组推送事件的目标"""
+    
+    def __init__(self, conversation_id, channel_layer=None):
+        if channel_layer is None:
+            from channels.layers import get_channel_layer
+            channel_layer = get_channel_layer()
+        self.channel_layer = channel_layer
+        self.conversation_group_name = f'chat_{conversation_id}'
+        self.agent_tasks = None
+
+
+class AgentResponseStream:
+    """
+    一次Agent响应的生产端流状态
+    
+    每个后台任务持有独立的流ID、序号和帧合并缓冲，同一连接上并发的响应互不干扰。
+    SimpleAgentService 通过它下发思考/答案事件（作为 websocket_consumer 参数传入）。
+    
+    target 提供 channel_layer 和 conversation_group_name（通常是ChatConsumer；
+    后台worker使用 ChannelGroupTarget），可选的 agent_tasks 为连接的任务注册表。
+    """
+    
+    def __init__(self, target):
+        self.consumer = target
+        self.task_key = None
+        self.outgoing_streams = OutgoingStreams()
+        self.stream_coalescer = FrameCoalescer(self._group_send_delta)
+        # 生产端连接是群组唯一的订阅者时直接调用其事件处理方法；回退到群组后不再切回
+        self.direct_send = True
+    
+    async def _group_send(self, event: dict):
+        group = self.consumer.conversation_group_name
+        if self.direct_send:
+            if await group_subscribers.send_direct(self.consumer, group, event):
+                return
+            self.direct_send = False
+        await self.consumer.channel_layer.group_send(group, event)
+    
+    async def bind_agent_task(self, task):
+        """创建ChatAgentTask后关联到连接的任务注册表，并广播任务ID（用于取消）"""
+        if self.task_key is not None:
+            self.consumer.agent_tasks.bind(self.task_key, task.id)
+        await self.send_task_status(task)
+    
+    async def send_task_status(self, task):
+        """广播任务状态"""
+        await self._group_send({
+            'type': 'task_status_update',
+            'task': {
+                'id': task.id,
+                'status': task.status,
+                'agent_name': task.agent_name,
+                'message_id': task.message_id,
+            }
+        })
+    
+    def discard(self):
+        """丢弃未下发的缓冲和流状态"""
+        self.stream_coalescer.discard()
+        self.outgoing_streams.reset()
+    
+    async def abort(self):
+        """出错时结束本次响应：丢弃缓冲并清除思考状态"""
+        self.discard()
+        await self.send_thinking_status(False, '')
+    
+    async def send_thinking_status(self, is_thinking: bool, message: str):
+        """发送思考状态"""
+        await self._group_send({
+            'type': 'thinking_status_update',
+            'is_thinking': is_thinking,
+            'message': message
+        })
+    
+    async def send_thinking_update(self, delta: str):
+        """发送思考过程更新（仅新增内容，按时间窗口合并）"""
+        await self.stream_coalescer.add(STREAM_THINKING, delta)
+    
+    async def send_thinking_complete(self, thinking_content: str):
+        """发送思考完成"""
+        await self.stream_coalescer.flush(STREAM_THINKING)
+        stream = self.outgoing_streams.get(STREAM_THINKING)
+        event = build_complete_payload(stream, thinking_content)
+        event['type'] = 'thinking_complete'
+        self.outgoing_streams.reset(STREAM_THINKING)
+        await self._group_send(event)
+    
+    async def send_answer_stream_start(self):
+        """发送答案流开始"""
+        await self.stream_coalescer.flush()
+        self.outgoing_streams.reset(STREAM_ANSWER)
+        stream = self.outgoing_streams.get(STREAM_ANSWER)
+        await self._group_send({
+            'type': 'answer_stream_start',
+            'stream_id': stream.stream_id,
+            'seq': stream.next_seq()
+        })
+    
+    async def send_answer_stream_update(self, delta: str):
+        """发送答案流更新（仅新增内容，按时间窗口合并）"""
+        await self.stream_coalescer.add(STREAM_ANSWER, delta)
+    
+    async def send_answer_stream_complete(self, final_content: str):
+        """发送答案流完成，同时结束本次响应的所有流"""
+        await self.stream_coalescer.flush()
+        stream = self.outgoing_streams.get(STREAM_ANSWER)
+        event = build_complete_payload(stream, final_content)
+        event['type'] = 'answer_stream_complete'
+        self.outgoing_streams.reset()
+        await self._group_send(event)
+    
+    async def _group_send_delta(self, kind: str, delta: str):
+        """把合并后的增量作为一帧广播到会话群组"""
+        stream = self.outgoing_streams.get(kind)
+        event_type = 'thinking_content_update' if kind == STREAM_THINKING else 'answer_stream_update'
+        await self._group_send({
+            'type': event_type,
+            'stream_id': stream.stream_id,
+            'seq': stream.append(delta),
+            'delta': delta
+        })
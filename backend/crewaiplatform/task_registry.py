@@ -0,0 +1,234 @@
+"""
+连接级后台任务注册表
+
+Agent响应可能持续数十秒。如果在 ChatConsumer.receive 中直接等待，
+整个连接在生成期间无法处理心跳、输入状态或新的消息。
+
+TaskRegistry 把Agent执行放到后台 asyncio 任务中运行：
+- 每个任务有一个本地键（启动时分配），创建ChatAgentTask后再关联其ID
+- 任务结束（完成、失败或取消）后自动从注册表移除
+- 连接关闭时取消并等待该连接拥有的全部任务
+
+AgentTaskCancellation 是进程级的取消注册表：正在执行的ChatAgentTask
+登记一个 CancellationToken，REST取消接口、WebSocket的cancel_task消息、
+连接断开都通过它取消同一个任务。取消会中断正在等待的 astream 循环，
+由执行方关闭上游流并把已生成的部分答案保存为已取消的消息。
+"""
+
+import asyncio
+import logging
+import threading
+import uuid
+from contextvars import ContextVar
+from typing import Awaitable, Dict, List, Optional
+
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class RegisteredTask:
+    """注册表中的一个后台任务"""
+
+    __slots__ = ('key', 'task', 'agent_task_id')
+
+    def __init__(self, key: str, task: asyncio.Task):
+        self.key = key
+        self.task = task
+        self.agent_task_id: Optional[int] = None
+
+
+class TaskRegistry:
+    """单个连接拥有的后台任务集合"""
+
+    def __init__(self, owner: str = ''):
+        self.owner = owner
+        self._entries: Dict[str, RegisteredTask] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> List[str]:
+        return list(self._entries)
+
+    def start(self, coro: Awaitable, key: str = None) -> str:
+        """在后台启动任务并立即返回其键"""
+
+        key = key or uuid.uuid4().hex
+        if key in self._entries:
+            raise ValueError(f"任务 {key} 已在运行")
+
+        task = asyncio.ensure_future(coro)
+        self._entries[key] = RegisteredTask(key, task)
+        task.add_done_callback(lambda finished: self._on_done(key, finished))
+
+        metrics.incr('chat.tasks.started')
+        metrics.max_gauge('chat.tasks.inflight_per_connection_max', len(self._entries))
+        return key
+
+    def bind(self, key: str, agent_task_id: int):
+        """关联后台任务与ChatAgentTask ID"""
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.agent_task_id = agent_task_id
+
+    def find(self, key_or_agent_task_id) -> Optional[RegisteredTask]:
+        """按本地键或ChatAgentTask ID查找任务"""
+
+        entry = self._entries.get(str(key_or_agent_task_id))
+        if entry is not None:
+            return entry
+        for entry in self._entries.values():
+            if entry.agent_task_id is not None and str(entry.agent_task_id) == str(key_or_agent_task_id):
+                return entry
+        return None
+
+    async def cancel_all(self, timeout: float = 5.0, reason: str = 'disconnect'):
+        """取消并等待全部任务（连接关闭时调用）"""
+
+        tasks = [entry.task for entry in self._entries.values() if not entry.task.done()]
+        if not tasks:
+            return
+        for entry in list(self._entries.values()):
+            # 已关联ChatAgentTask的任务通过取消令牌取消，以便保存部分答案
+            if entry.agent_task_id is None or not agent_task_cancellation.cancel(entry.agent_task_id, reason):
+                entry.task.cancel()
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"{self.owner} 有 {len(pending)} 个后台任务未在 {timeout}s 内结束")
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        """任务结束回调：移除条目并记录未处理的异常"""
+
+        self._entries.pop(key, None)
+        if task.cancelled():
+            metrics.incr('chat.tasks.cancelled')
+            return
+        exc = task.exception()
+        if exc is not None:
+            metrics.incr('chat.tasks.failed')
+            logger.error(f"{self.owner} 后台任务 {key} 异常结束: {exc}", exc_info=exc)
+        else:
+            metrics.incr('chat.tasks.completed')
+
+
+# 取消来源 -> 保存到任务/消息上的说明
+CANCEL_REASON_LABELS = {
+    'api': '用户通过接口取消任务',
+    'websocket': '用户取消回复',
+    'disconnect': '连接已断开',
+    'lease_lost': '执行租约已失效',
+}
+
+
+_current_token: ContextVar[Optional['CancellationToken']] = ContextVar('agent_task_cancellation', default=None)
+
+
+def current_cancellation_token() -> Optional['CancellationToken']:
+    """当前协程所属ChatAgentTask的取消令牌（未登记时为None）"""
+    return _current_token.get()
+
+
+class CancellationToken:
+    """单个ChatAgentTask的取消令牌，可以从任意线程取消"""
+
+    def __init__(self, agent_task_id: int, task: Optional[asyncio.Task], loop: asyncio.AbstractEventLoop):
+        self.agent_task_id = agent_task_id
+        self.reason: Optional[str] = None
+        # 流式解析器（ThinkingStreamParser），用于取消时读取已生成的内容
+        self.progress = None
+        self._task = task
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._context_token = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    @property
+    def partial_response(self) -> str:
+        return self.progress.full_response if self.progress is not None else ''
+
+    @property
+    def partial_answer(self) -> str:
+        return self.progress.answer_content if self.progress is not None else ''
+
+    def cancel(self, reason: str) -> bool:
+        """请求取消，重复取消返回False"""
+
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+
+        if self._task is not None and not self._task.done():
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is self._loop:
+                self._task.cancel()
+            elif not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._task.cancel)
+        return True
+
+
+class AgentTaskCancellation:
+    """进程级的ChatAgentTask取消注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[int, CancellationToken] = {}
+
+    def register(self, agent_task_id: int) -> CancellationToken:
+        """在执行任务的协程中调用，登记当前asyncio任务"""
+
+        token = CancellationToken(agent_task_id, asyncio.current_task(), asyncio.get_running_loop())
+        token._context_token = _current_token.set(token)
+        with self._lock:
+            self._tokens[agent_task_id] = token
+        return token
+
+    def unregister(self, token: CancellationToken):
+        with self._lock:
+            if self._tokens.get(token.agent_task_id) is token:
+                del self._tokens[token.agent_task_id]
+        if token._context_token is not None:
+            try:
+                _current_token.reset(token._context_token)
+            except ValueError:
+                # 在其他上下文中注销时无需恢复
+                pass
+            token._context_token = None
+
+    def is_running(self, agent_task_id) -> bool:
+        with self._lock:
+            return self._coerce(agent_task_id) in self._tokens
+
+    def cancel(self, agent_task_id, reason: str = 'api') -> bool:
+        """取消本进程内运行的任务；任务不在本进程运行时返回False"""
+
+        with self._lock:
+            token = self._tokens.get(self._coerce(agent_task_id))
+        if token is None:
+            return False
+        if token.cancel(reason):
+            metrics.incr('llm.cancel.requested', reason=reason)
+            logger.info(f"Agent任务 {token.agent_task_id} 取消请求已送达（来源: {reason}）")
+        return True
+
+    @staticmethod
+    def _coerce(agent_task_id):
+        try:
+            return int(agent_task_id)
+        except (TypeError, ValueError):
+            return agent_task_id
+
+
+agent_task_cancellation = AgentTaskCancellation()
@@ -6,4 +6,28 @@
 - test_auth.py: 认证功能测试  
 - test_rbac.py: RBAC权限管理测试
 - test_crewai.py: CrewAI集成功能测试
+- test_stream_parser.py: 流式标签解析器测试
+- test_stream_protocol.py: 流式传输协议测试
+- test_llm_model_cache.py: LLM模型实例缓存测试
+- test_key_manager.py: API密钥加密管理测试
+- test_task_registry.py: 后台任务注册表测试
+- test_task_cancellation.py: Agent任务取消测试
+- test_agent_executor.py: Agent执行服务测试
+- test_agent_task_queue.py: Agent任务队列与worker测试
+- test_conversation_context.py: 对话上下文与滚动摘要测试
+- test_message_cache.py: 会话最近消息缓存测试
+- test_agent_prompt_cache.py: Agent提示词编译缓存测试
+- test_prompt_layout.py: 提示词消息布局与token用量测试
+- test_agent_reply.py: Agent回复生命周期与查询数测试
+- test_conversation_counters.py: 会话计数与校正命令测试
+- test_rate_limiter.py: LLM请求限流测试
+- test_llm_router.py: LLM故障转移与对冲请求测试
+- test_circuit_breaker.py: LLM模型与MCP工具熔断器测试
+- test_sse.py: 聊天响应SSE流式端点测试
+- test_group_subscribers.py: 单订阅者会话群组直接下发测试
+- test_channel_layers.py: 多进程通道层（Unix域套接字、LISTEN/NOTIFY）测试
+- test_frame_encoding.py: WebSocket帧编码（JSON/MessagePack/deflate）协商与编解码测试
+- test_authentication.py: JWT认证与用户缓存测试
+- test_connection_context.py: WebSocket连接上下文（会话/Agent/LLM模型）与失效事件测试
+- test_outbound_queue.py: WebSocket有界发送队列（合并/丢弃/慢客户端断开）测试
 """
\ No newline at end of file
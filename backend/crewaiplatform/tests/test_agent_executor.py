@@ -0,0 +1,102 @@
+"""
+Agent执行服务测试
+
+测试并发上限、排队上限、指标，以及队列已满时接口返回503
+"""
+
+import asyncio
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from crewaiplatform.metrics import metrics
+from crewaiplatform.models import ChatMessage
+from crewaiplatform.services.agent_executor import AgentExecutor, AgentExecutorFull
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+class AgentExecutorTest(SimpleTestCase):
+    """执行服务测试"""
+
+    def setUp(self):
+        metrics.reset()
+        self.executor = AgentExecutor(concurrency=2, queue_limit=2)
+        self.release = threading.Event()
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    async def _job(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        while not self.release.is_set():
+            await asyncio.sleep(0.005)
+        with self.lock:
+            self.active -= 1
+        return 'done'
+
+    def test_concurrency_and_queue_limits(self):
+        """测试同时执行数不超过并发上限，排队满后拒绝"""
+        futures = [self.executor.submit(self._job) for _ in range(2)]
+        # 等待前两个任务占满并发槽
+        for _ in range(200):
+            if self.executor.stats()['running'] == 2:
+                break
+            threading.Event().wait(0.005)
+
+        futures += [self.executor.submit(self._job) for _ in range(2)]
+        with self.assertRaises(AgentExecutorFull):
+            self.executor.submit(self._job)
+        self.assertFalse(self.executor.has_capacity())
+
+        self.release.set()
+        self.assertEqual([f.result(timeout=5) for f in futures], ['done'] * 4)
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(metrics.get_counter('chat.executor.rejected'), 1)
+        self.assertEqual(metrics.get_summary('chat.executor.wait_ms')['count'], 4)
+        self.assertEqual(metrics.get_gauge('chat.executor.queue_depth'), 0)
+
+    def test_single_loop_thread_is_reused(self):
+        """测试所有任务复用同一个事件循环线程"""
+        async def thread_name():
+            return threading.current_thread().name
+
+        names = {self.executor.submit(thread_name).result(timeout=5) for _ in range(5)}
+        self.assertEqual(names, {'agent-executor'})
+
+
+class SendMessageBackpressureTest(TestCase):
+    """接口背压测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.client = APIClient()
+        self.client.force_authenticate(self.fixture['user'])
+        self.url = f"/api/chat/conversations/{self.fixture['conversation'].id}/send_message/"
+
+    def test_returns_503_when_queue_is_full(self):
+        """测试队列已满时返回503且不创建消息"""
+        before = ChatMessage.objects.count()
+        with mock.patch('crewaiplatform.views.chat_views.agent_executor.has_capacity', return_value=False):
+            response = self.client.post(self.url, {'content': '你好'}, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(ChatMessage.objects.count(), before)
+
+    def test_message_is_submitted_to_executor(self):
+        """测试消息提交到执行服务而不是新建线程"""
+        with mock.patch('crewaiplatform.views.chat_views.agent_executor.submit') as submit, \
+                mock.patch('threading.Thread') as thread:
+            response = self.client.post(self.url, {'content': '你好'}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        submit.assert_called_once()
+        thread.assert_not_called()
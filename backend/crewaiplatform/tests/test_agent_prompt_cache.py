@@ -0,0 +1,68 @@
+"""
+Agent提示词编译缓存测试
+
+测试按配置哈希复用编译结果、Agent保存时失效，以及提示词内容与原实现一致
+"""
+
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, TestCase
+
+from crewaiplatform.services.agent_prompt_cache import (
+    AgentPromptCache,
+    CompiledAgentPrompt,
+    agent_prompt_cache,
+)
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+class CompiledAgentPromptTest(SimpleTestCase):
+    """编译结果测试"""
+
+    def test_render_matches_legacy_layout(self):
+        """测试组装的提示词与原实现的格式一致"""
+        agent = SimpleNamespace(role='助手', goal='回答问题', backstory='')
+        prompt = CompiledAgentPrompt(agent).render('回复用户消息: 你好', '用户: 你好')
+
+        self.assertEqual(prompt, "\n".join([
+            "你是一个助手。",
+            "你的目标是: 回答问题",
+            "\n以下是之前的对话历史:\n用户: 你好",
+            "\n当前任务: 回复用户消息: 你好",
+            "\n请根据你的角色和目标，结合对话历史，为当前任务提供准确、有用的响应。"
+            "请保持友好、专业的语气，直接回答问题，不需要重复任务描述。",
+        ]))
+
+    def test_parser_class_defined_once(self):
+        """测试输出解析器类只定义一次"""
+        first = CompiledAgentPrompt(SimpleNamespace(role='a', goal='', backstory=''))
+        second = CompiledAgentPrompt(SimpleNamespace(role='b', goal='', backstory=''))
+
+        self.assertIs(type(first.output_parser), type(second.output_parser))
+        self.assertEqual(first.output_parser.parse('<thinking>想</thinking><answer>答</answer>')['answer'], '答')
+
+    def test_reuses_entry_until_prompt_fields_change(self):
+        """测试提示词字段不变时复用编译结果，变化后重新编译"""
+        cache = AgentPromptCache(max_entries=10)
+        agent = SimpleNamespace(pk=1, role='助手', goal='回答问题', backstory='')
+
+        first = cache.get(agent)
+        self.assertIs(cache.get(agent), first)
+
+        agent.goal = '写代码'
+        self.assertIsNot(cache.get(agent), first)
+        self.assertIn('写代码', cache.get(agent).persona)
+
+
+class AgentPromptCacheInvalidationTest(TestCase):
+    """Agent保存时失效测试"""
+
+    def test_agent_save_invalidates(self):
+        """测试CrewAIAgent保存后清除编译结果"""
+        agent = create_chat_fixture()['agent']
+        agent_prompt_cache.invalidate()
+        compiled = agent_prompt_cache.get(agent)
+
+        agent.save()
+
+        self.assertIsNot(agent_prompt_cache.get(agent), compiled)
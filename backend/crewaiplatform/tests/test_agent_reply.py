@@ -0,0 +1,98 @@
+"""
+Agent回复生命周期测试
+
+测试每条消息的数据库查询数、占位消息的关联与就地更新，以及队列模式和旧任务的兼容
+"""
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from crewaiplatform.models import ChatAgentTask, ChatMessage
+from crewaiplatform.services import SimpleAgentService
+from crewaiplatform.services.agent_reply import AgentReplyService
+from crewaiplatform.services.conversation_counters import conversation_counters
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel, RecordingStream
+
+
+class AgentReplyLifecycleTest(TestCase):
+    """消息生命周期测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+        self.model = FakeStreamingModel(['<thinking>想</thinking>', '<answer>好的</answer>'])
+
+    def send(self, content='再问一个问题'):
+        # 提交回调中执行消息缓存的写穿，与生产环境一致
+        with self.captureOnCommitCallbacks(execute=True):
+            user_message = ChatMessage.objects.create(
+                conversation=self.conversation, role='user', content=content, status='sent'
+            )
+        return user_message
+
+    def reply(self, user_message):
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=self.model)):
+            return async_to_sync(SimpleAgentService.process_user_message_with_websocket)(
+                user_message, RecordingStream()
+            )
+
+    def test_queries_per_message(self):
+        """
+        测试每条消息的查询数（最近消息缓存已命中）
+
+        选择Agent 1 + 创建占位消息和任务 2 + 会话计数 2 + 写入任务结果和回复消息 2，
+        两个事务各有一对SAVEPOINT/RELEASE（测试在外层事务中运行）
+        """
+        self.reply(self.send('第一个问题'))
+        user_message = self.send()
+
+        with self.assertNumQueries(11):
+            reply = self.reply(user_message)
+
+        self.assertEqual(reply.status, 'completed')
+        self.assertEqual(reply.content, '好的')
+
+    @override_settings(CHAT_COUNTER_WRITE_BEHIND=True, CHAT_COUNTER_FLUSH_INTERVAL_MS=0)
+    def test_queries_per_message_with_write_behind_counters(self):
+        """测试会话计数写后合并时，每条消息不再单独更新会话"""
+        self.addCleanup(conversation_counters.flush)
+        self.reply(self.send('第一个问题'))
+        user_message = self.send()
+
+        with self.assertNumQueries(9):
+            self.reply(user_message)
+
+    def test_placeholder_carried_through_task(self):
+        """测试任务关联占位消息，结束时更新同一条消息并直接返回"""
+        reply = self.reply(self.send())
+
+        task = ChatAgentTask.objects.filter(conversation=self.conversation).latest('id')
+        self.assertEqual(task.response_message_id, reply.id)
+        self.assertEqual(task.status, 'completed')
+        self.assertEqual(task.attempts, 1)
+        self.assertIsNone(task.lease_owner)
+        self.assertEqual(ChatMessage.objects.get(pk=reply.id).content, '好的')
+        # 夹具中另一条处理中的占位消息不受影响
+        self.assertEqual(ChatMessage.objects.get(pk=self.fixture['assistant_message'].pk).status, 'processing')
+
+    @override_settings(CHAT_AGENT_TASK_QUEUE_ENABLED=True)
+    def test_queue_mode_leaves_task_pending(self):
+        """测试队列模式下任务保持待执行，返回处理中的占位消息"""
+        reply = self.reply(self.send())
+
+        task = ChatAgentTask.objects.get(response_message=reply)
+        self.assertEqual((task.status, task.attempts), ('pending', 0))
+        self.assertEqual(reply.status, 'processing')
+        self.assertEqual(self.model.calls, 0)
+
+    def test_legacy_task_without_reply_link(self):
+        """测试没有关联回复消息的旧任务按处理中的消息查找"""
+        task = self.fixture['task']
+        ChatAgentTask.objects.filter(pk=task.pk).update(response_message=None)
+        task = ChatAgentTask.objects.get(pk=task.pk)
+
+        self.assertEqual(AgentReplyService.reply_message(task), self.fixture['assistant_message'])
@@ -0,0 +1,152 @@
+"""
+Agent任务队列测试
+
+测试任务认领、租约续约与回收，以及worker执行任务并通过channel layer推送结果
+"""
+
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.test import TestCase
+from django.utils import timezone
+
+from crewaiplatform.models import ChatAgentTask, ChatMessage
+from crewaiplatform.services import ChatAgentTaskService
+from crewaiplatform.services.agent_task_queue import AgentTaskQueue
+from crewaiplatform.services.agent_worker import AgentWorker
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel
+
+
+class AgentTaskQueueTest(TestCase):
+    """任务认领与租约测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.task = self.fixture['task']
+
+    def _add_task(self):
+        return ChatAgentTask.objects.create(
+            conversation=self.fixture['conversation'], message=self.fixture['user_message'],
+            agent=self.fixture['agent'], agent_name='agent', task_description='回复用户消息: 再见',
+        )
+
+    def test_claim_task_only_once(self):
+        """测试同一任务只能被认领一次"""
+        self.assertTrue(AgentTaskQueue.claim_task(self.task, 'worker-a'))
+        other = ChatAgentTask.objects.get(pk=self.task.pk)
+        self.assertFalse(AgentTaskQueue.claim_task(other, 'worker-b'))
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'running')
+        self.assertEqual(self.task.lease_owner, 'worker-a')
+        self.assertEqual(self.task.attempts, 1)
+        self.assertGreater(self.task.lease_expires_at, timezone.now())
+
+    def test_claim_batch_in_creation_order(self):
+        """测试批量认领按创建顺序进行，且不会重复认领"""
+        second = self._add_task()
+        third = self._add_task()
+
+        first_batch = AgentTaskQueue.claim_batch('worker-a', 2)
+        second_batch = AgentTaskQueue.claim_batch('worker-b', 5)
+
+        self.assertEqual([t.pk for t in first_batch], [self.task.pk, second.pk])
+        self.assertEqual([t.pk for t in second_batch], [third.pk])
+        self.assertEqual(AgentTaskQueue.claim_batch('worker-c', 5), [])
+
+    def test_renew_lease_requires_ownership(self):
+        """测试只有租约持有者可以续约，任务取消后续约失败"""
+        AgentTaskQueue.claim_task(self.task, 'worker-a')
+
+        self.assertTrue(AgentTaskQueue.renew_lease(self.task.pk, 'worker-a'))
+        self.assertFalse(AgentTaskQueue.renew_lease(self.task.pk, 'worker-b'))
+
+        ChatAgentTaskService.request_cancel(self.task)
+        self.assertFalse(AgentTaskQueue.renew_lease(self.task.pk, 'worker-a'))
+
+    def test_requeue_stale_tasks(self):
+        """测试租约过期的任务重新入队，超过最大执行次数的标记为失败"""
+        exhausted = self._add_task()
+        AgentTaskQueue.claim_task(self.task, 'worker-a')
+        AgentTaskQueue.claim_task(exhausted, 'worker-a')
+        expired = timezone.now() - timedelta(seconds=1)
+        ChatAgentTask.objects.filter(pk=self.task.pk).update(lease_expires_at=expired)
+        ChatAgentTask.objects.filter(pk=exhausted.pk).update(lease_expires_at=expired, attempts=3)
+
+        requeued, failed = AgentTaskQueue.requeue_stale(max_attempts=3)
+
+        self.assertEqual((requeued, failed), (1, 1))
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'pending')
+        self.assertIsNone(self.task.lease_owner)
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, 'failed')
+        message = ChatMessage.objects.get(pk=self.fixture['assistant_message'].pk)
+        self.assertEqual(message.status, 'failed')
+
+
+class AgentWorkerTest(TestCase):
+    """worker执行测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.task = self.fixture['task']
+
+    def test_worker_executes_pending_task_and_publishes_to_group(self):
+        """测试worker执行待执行任务，并把流式事件推送到会话群组"""
+        model = FakeStreamingModel(['<thinking>想一想</thinking>', '<answer>你好', '！</answer>'])
+        channel_layer = InMemoryChannelLayer()
+        group = f"chat_{self.fixture['conversation'].id}"
+
+        async def scenario():
+            channel = await channel_layer.new_channel()
+            await channel_layer.group_add(group, channel)
+            worker = AgentWorker(worker_id='worker-test', channel_layer=channel_layer, poll_interval=0.01)
+            with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+                await asyncio.wait_for(worker.run(once=True), 5)
+
+            events = []
+            while True:
+                try:
+                    events.append(await asyncio.wait_for(channel_layer.receive(channel), 0.1))
+                except asyncio.TimeoutError:
+                    return worker, events
+
+        worker, events = async_to_sync(scenario)()
+
+        self.assertEqual(worker.processed, 1)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'completed')
+        self.assertIsNone(self.task.lease_owner)
+        message = ChatMessage.objects.get(pk=self.fixture['assistant_message'].pk)
+        self.assertEqual(message.status, 'completed')
+        self.assertEqual(message.content, '你好！')
+
+        types = [event['type'] for event in events]
+        self.assertEqual(types[0], 'task_status_update')
+        self.assertIn('answer_stream_complete', types)
+        self.assertEqual(events[-1]['task']['status'], 'completed')
+
+    def test_worker_stops_when_task_cancelled_elsewhere(self):
+        """测试任务在其他节点被取消后，worker续约失败并停止执行，不覆盖取消状态"""
+        model = FakeStreamingModel(['<answer>很长的', '回答'], hang=True)
+        worker = AgentWorker(worker_id='worker-test', channel_layer=InMemoryChannelLayer(),
+                             lease_seconds=1, poll_interval=0.01)
+
+        async def scenario():
+            with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+                running = asyncio.ensure_future(worker.run(once=True))
+                await asyncio.wait_for(model.yielded.wait(), 5)
+                # 模拟其他节点上的取消：只修改数据库中的任务状态
+                await ChatAgentTask.objects.filter(pk=self.task.pk).aupdate(status='cancelled')
+                await asyncio.wait_for(running, 5)
+
+        async_to_sync(scenario)()
+
+        self.assertTrue(model.closed)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'cancelled')
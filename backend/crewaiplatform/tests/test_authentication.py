@@ -0,0 +1,124 @@
+"""
+JWT认证与用户缓存测试
+
+测试REST接口和WebSocket中间件共用的认证：缓存命中时不查询用户表，用户保存、停用或删除后缓存失效，
+WebSocket与REST接口一样只接受访问令牌
+"""
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from crewaiplatform.authentication import jwt_authentication
+from crewaiplatform.metrics import metrics
+from crewaiplatform.middleware import JWTAuthMiddlewareStack
+from crewaiplatform.models import User
+
+
+def user_queries(context):
+    return [query['sql'] for query in context.captured_queries if 'auth_user' in query['sql']]
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    """DRF认证类测试"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = User.objects.create_user(username='auth-user', password='pass')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_cached_user_skips_users_table(self):
+        """测试第二次认证从缓存加载用户，不查询用户表"""
+        self.assertEqual(jwt_authentication.authenticate_token(self.token), self.user)
+
+        with self.assertNumQueries(0):
+            user = jwt_authentication.authenticate_token(self.token)
+
+        self.assertEqual(user.username, 'auth-user')
+        self.assertEqual(metrics.get_counter('auth.user_cache.hits'), 1)
+        self.assertEqual(metrics.get_counter('auth.user_cache.misses'), 1)
+
+    def test_deactivation_and_deletion_invalidate(self):
+        """测试用户停用、删除后立即认证失败，而不是等缓存过期"""
+        jwt_authentication.authenticate_token(self.token)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        with self.assertRaises(AuthenticationFailed):
+            jwt_authentication.authenticate_token(self.token)
+
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            jwt_authentication.authenticate_token(self.token)
+
+    @override_settings(AUTH_USER_CACHE_TTL=0)
+    def test_zero_ttl_disables_cache(self):
+        jwt_authentication.authenticate_token(self.token)
+
+        with self.assertNumQueries(1):
+            jwt_authentication.authenticate_token(self.token)
+
+    def test_rest_polling_hits_cache(self):
+        """测试REST接口使用缓存认证：重复请求不再查询用户表"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+
+        with CaptureQueriesContext(connection) as context:
+            response = client.get('/api/auth/me/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_queries(context), [])
+
+
+class JWTAuthMiddlewareTest(TestCase):
+    """WebSocket/SSE认证中间件测试"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ws-user', password='pass')
+
+    def connect(self, query_string=b'', headers=()):
+        scopes = []
+
+        async def inner(scope, receive, send):
+            scopes.append(scope)
+
+        app = JWTAuthMiddlewareStack(inner)
+        async_to_sync(app)(
+            {'type': 'websocket', 'query_string': query_string, 'headers': list(headers)}, None, None
+        )
+        return scopes[0]['user']
+
+    def test_reconnect_uses_cached_user(self):
+        """测试重连时用户从缓存加载"""
+        query_string = f'token={AccessToken.for_user(self.user)}'.encode()
+        self.assertEqual(self.connect(query_string), self.user)
+
+        with CaptureQueriesContext(connection) as context:
+            user = self.connect(query_string)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(user_queries(context), [])
+
+    def test_bearer_header(self):
+        headers = [(b'authorization', f'Bearer {AccessToken.for_user(self.user)}'.encode())]
+        self.assertEqual(self.connect(headers=headers), self.user)
+
+    def test_invalid_tokens_are_anonymous(self):
+        """测试刷新令牌、伪造令牌和已停用用户的令牌都得到匿名用户"""
+        refresh = RefreshToken.for_user(self.user)
+        self.assertFalse(self.connect(f'token={refresh}'.encode()).is_authenticated)
+        self.assertFalse(self.connect(b'token=not-a-jwt').is_authenticated)
+
+        token = AccessToken.for_user(self.user)
+        self.assertTrue(self.connect(f'token={token}'.encode()).is_authenticated)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.connect(f'token={token}'.encode()).is_authenticated)
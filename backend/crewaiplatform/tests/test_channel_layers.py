@@ -0,0 +1,178 @@
+"""
+多进程通道层测试
+
+用两个通道层实例模拟同一主机上的两个进程（经Unix域套接字和共享目录通信），
+测试跨进程的 send/group_send、退出群组、已退出进程的清理和接收方满时丢弃；
+PostgreSQL LISTEN/NOTIFY 模式测试负载分片与重组，连接PostgreSQL时测试真实的跨进程投递
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import SimpleTestCase
+
+from crewaiplatform.channel_layers import IPCChannelLayer, NOTIFY_PAYLOAD_LIMIT, PostgresChannelLayer
+from crewaiplatform.metrics import metrics
+
+
+def receive(layer, channel, timeout=2):
+    return asyncio.wait_for(layer.receive(channel), timeout)
+
+
+class IPCChannelLayerTest(SimpleTestCase):
+    """Unix域套接字通道层测试"""
+
+    def setUp(self):
+        metrics.reset()
+        self.path = tempfile.mkdtemp(prefix='channels-')
+        self.addCleanup(shutil.rmtree, self.path, True)
+
+    def run_processes(self, scenario, **config):
+        async def run():
+            first = IPCChannelLayer(path=self.path, **config)
+            second = IPCChannelLayer(path=self.path, **config)
+            try:
+                return await scenario(first, second)
+            finally:
+                await first.close()
+                await second.close()
+
+        return async_to_sync(run)()
+
+    def test_group_send_reaches_every_process(self):
+        """测试群组消息送达各进程的成员，包括发送方自己的成员"""
+        async def scenario(first, second):
+            first_channel, second_channel = await first.new_channel(), await second.new_channel()
+            await first.group_add('chat_1', first_channel)
+            await second.group_add('chat_1', second_channel)
+
+            await first.group_send('chat_1', {'type': 'chat.message', 'content': '你好'})
+            return await receive(first, first_channel), await receive(second, second_channel)
+
+        local, remote = self.run_processes(scenario)
+
+        self.assertEqual(local, {'type': 'chat.message', 'content': '你好'})
+        self.assertEqual(remote, local)
+
+    def test_send_and_group_discard(self):
+        """测试发送到其他进程的专属通道，退出群组后不再收到群组消息"""
+        async def scenario(first, second):
+            channel = await second.new_channel()
+            await second.group_add('chat_1', channel)
+            await second.group_discard('chat_1', channel)
+
+            await first.group_send('chat_1', {'type': 'chat.message', 'content': '群组'})
+            await first.send(channel, {'type': 'chat.message', 'content': '直接'})
+            return await receive(second, channel)
+
+        message = self.run_processes(scenario)
+
+        self.assertEqual(message['content'], '直接')
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'groups', 'chat_1')))
+
+    def test_exited_process_is_forgotten(self):
+        """测试连接不上的进程被视为已退出，其群组成员被清除"""
+        async def scenario(first, second):
+            channel = await second.new_channel()
+            await second.group_add('chat_1', channel)
+            # 模拟进程崩溃：停止接收但没有清理群组成员和套接字文件
+            second._release_loop()
+
+            await first.group_send('chat_1', {'type': 'chat.message'})
+            return os.listdir(os.path.join(self.path, 'groups', 'chat_1'))
+
+        self.assertEqual(self.run_processes(scenario), [])
+        self.assertEqual(metrics.get_counter('channel_layer.peers_gone'), 1)
+
+    def test_full_remote_channel_drops(self):
+        """测试跨进程发送时接收方通道已满则丢弃消息"""
+        async def scenario(first, second):
+            channel = await second.new_channel()
+            await second.group_add('chat_1', channel)
+            for index in range(3):
+                await first.group_send('chat_1', {'type': 'chat.message', 'index': index})
+            first_message = await receive(second, channel)
+            while metrics.get_counter('channel_layer.dropped') < 2:
+                await asyncio.sleep(0.01)
+            return first_message, second.channels.get(channel)
+
+        message, queue = self.run_processes(scenario, capacity=1)
+
+        self.assertEqual(message['index'], 0)
+        self.assertIsNone(queue)
+
+
+class PostgresChannelLayerTest(SimpleTestCase):
+    """LISTEN/NOTIFY 通道层测试"""
+
+    def test_large_message_is_chunked_and_reassembled(self):
+        """测试超过NOTIFY负载上限的消息分片发布，接收进程收齐后投递给本地成员"""
+        publisher, subscriber = PostgresChannelLayer(), PostgresChannelLayer()
+        channel = f"specific.{subscriber.client_prefix}!abc"
+        subscriber.groups['chat_1'] = {channel: time.time()}
+        message = {'type': 'chat.message', 'content': '长' * 5000}
+
+        payloads = publisher._payloads({'g': 'chat_1', 'm': message})
+        for payload in payloads:
+            publisher._handle_payload(payload)
+            subscriber._handle_payload(payload)
+
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode('utf-8')) < 8000 for payload in payloads))
+        self.assertLessEqual(len(payloads[0].encode('utf-8')), NOTIFY_PAYLOAD_LIMIT)
+        _, delivered = subscriber.channels[channel].get_nowait()
+        self.assertEqual(delivered, message)
+        # 发布方忽略自己发布的群组消息（已直接投递给本地成员）
+        self.assertEqual(publisher.channels, {})
+
+    def test_concurrent_new_channel_opens_one_listen_connection(self):
+        """测试并发创建通道（一批socket同时重连）时只建立一个LISTEN连接"""
+        layer = PostgresChannelLayer()
+        readable, writable = socket.socketpair()
+        self.addCleanup(readable.close)
+        self.addCleanup(writable.close)
+        connections = []
+
+        def connect(autocommit=False):
+            time.sleep(0.05)
+            conn = mock.MagicMock()
+            conn.fileno.return_value = readable.fileno()
+            connections.append(conn)
+            return conn
+
+        async def scenario():
+            try:
+                with mock.patch.object(layer, '_connect', side_effect=connect):
+                    return await asyncio.gather(*(layer.new_channel() for _ in range(5)))
+            finally:
+                await layer.close()
+
+        channels = async_to_sync(scenario)()
+
+        self.assertEqual(len(set(channels)), 5)
+        self.assertEqual(len(connections), 1)
+        connections[0].close.assert_called()
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', '需要PostgreSQL')
+    def test_group_send_between_processes(self):
+        """测试经PostgreSQL在两个进程间投递群组消息"""
+        async def scenario():
+            first, second = PostgresChannelLayer(), PostgresChannelLayer()
+            try:
+                channel = await second.new_channel()
+                await second.group_add('chat_1', channel)
+                await first.group_send('chat_1', {'type': 'chat.message', 'content': '你好'})
+                return await receive(second, channel, timeout=5)
+            finally:
+                await first.close()
+                await second.close()
+
+        self.assertEqual(async_to_sync(scenario)()['content'], '你好')
@@ -0,0 +1,231 @@
+"""
+熔断器测试
+
+测试按失败率打开、打开时立即失败、半开状态的单个探测请求、数据库状态写回与恢复，
+以及LLM路由、MCP工具调用和统计接口的接入
+"""
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from langchain_core.messages import HumanMessage
+from rest_framework.test import APIClient
+
+from crewaiplatform.metrics import metrics
+from crewaiplatform.models import LLMModel, MCPTool
+from crewaiplatform.services.circuit_breaker import (
+    CIRCUIT_OPEN_PREFIX, CircuitBreaker, CircuitOpenError, llm_model_key, mcp_tool_key,
+)
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.services.llm_router import LLMRouter, TTFTTracker
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel
+
+
+NOW = 1_000_000_005
+
+
+@override_settings(
+    CIRCUIT_BREAKER_MIN_CALLS=4, CIRCUIT_BREAKER_FAILURE_RATE=0.5, CIRCUIT_BREAKER_OPEN_SECONDS=30,
+)
+class CircuitBreakerTest(TestCase):
+    """熔断器状态转换测试"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.breaker = CircuitBreaker()
+        self.llm_model = create_chat_fixture()['llm_model']
+        self.key = llm_model_key(self.llm_model)
+        self.now = NOW
+        clock = mock.patch('crewaiplatform.services.circuit_breaker.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def call(self, ok=True):
+        permit = self.breaker.before(self.key, tripped=False)
+        if ok:
+            self.breaker.success(permit)
+        else:
+            self.breaker.failure(permit, RuntimeError('502 Bad Gateway'))
+
+    def trip(self):
+        for ok in (True, False, True, False):
+            self.call(ok)
+
+    def test_opens_on_failure_rate_and_writes_back(self):
+        """测试窗口内调用数达到下限且失败率达到阈值时打开，并把不可用状态写回数据库"""
+        self.call(False)
+        self.call(False)
+        self.call(True)
+        self.llm_model.refresh_from_db()
+        self.assertTrue(self.llm_model.is_available)
+
+        self.call(False)
+
+        self.llm_model.refresh_from_db()
+        self.assertFalse(self.llm_model.is_available)
+        self.assertTrue(self.llm_model.validation_error.startswith(CIRCUIT_OPEN_PREFIX))
+        self.assertIn('502', self.llm_model.validation_error)
+        self.assertEqual(metrics.get_counter('circuit.opened', key=self.key), 1)
+
+    def test_open_fails_fast(self):
+        """测试打开期间调用立即失败并给出重试时间"""
+        self.trip()
+        self.now += 10
+
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before(self.key)
+        self.assertEqual(raised.exception.retry_after, 21)
+        self.assertEqual(metrics.get_counter('circuit.rejected', key=self.key), 1)
+
+    def test_half_open_probe_closes_and_restores(self):
+        """测试半开状态只放行一个探测请求，探测成功后关闭并恢复数据库中的可用状态"""
+        self.trip()
+        self.now += 31
+
+        probe = self.breaker.before(self.key)
+        self.assertTrue(probe.probe)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before(self.key)
+
+        self.breaker.success(probe)
+
+        self.llm_model.refresh_from_db()
+        self.assertTrue(self.llm_model.is_available)
+        self.assertEqual(self.llm_model.validation_error, '')
+        self.assertFalse(self.breaker.before(self.key).probe)
+        # 打开前的失败不再计入窗口
+        self.assertEqual(self.breaker.window_counts(self.key), (0, 0))
+
+    def test_failed_probe_reopens(self):
+        """测试探测失败时重新打开，重新计算等待时间"""
+        self.trip()
+        self.now += 31
+        probe = self.breaker.before(self.key)
+
+        self.breaker.failure(probe, RuntimeError('仍然失败'))
+
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before(self.key)
+        self.assertEqual(raised.exception.retry_after, 31)
+        self.llm_model.refresh_from_db()
+        self.assertFalse(self.llm_model.is_available)
+
+    def test_tripped_state_without_cache_is_probed(self):
+        """测试缓存中的状态丢失而数据库仍为熔断写入的不可用状态时，放行一个探测请求"""
+        permit = self.breaker.before(self.key, tripped=True)
+
+        self.assertTrue(permit.probe)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before(self.key, tripped=True)
+
+    def test_manual_recovery_resets_breaker(self):
+        """测试手动把模型标记为可用后清除熔断状态，手动验证失败的状态不会被熔断器恢复"""
+        self.trip()
+        self.llm_model.refresh_from_db()
+        self.llm_model.is_available = True
+        self.llm_model.validation_error = ''
+        self.llm_model.save()
+
+        self.assertFalse(self.breaker.before(self.key).probe)
+
+        LLMModel.objects.filter(pk=self.llm_model.pk).update(is_available=False, validation_error='密钥无效')
+        CircuitBreaker._write_back(self.key, available=True)
+        self.llm_model.refresh_from_db()
+        self.assertFalse(self.llm_model.is_available)
+
+
+@override_settings(
+    CIRCUIT_BREAKER_MIN_CALLS=1, LLM_RATE_LIMIT_ENABLED=False, LLM_HEDGE_ENABLED=False,
+)
+class CircuitBreakerIntegrationTest(TestCase):
+    """LLM路由、MCP工具调用与统计接口的接入测试"""
+
+    def setUp(self):
+        cache.clear()
+        self.fixture = create_chat_fixture()
+        self.primary = self.fixture['llm_model']
+        self.fallback = LLMModel.objects.create(
+            name='fallback-llm', provider='openai', model_name='gpt-4o', api_key='sk-test', is_available=True,
+        )
+        self.tool = MCPTool.objects.create(
+            name='weather', server_type='http', connection_config={'base_url': 'http://127.0.0.1:1'}, status='healthy',
+        )
+
+    def test_router_skips_open_primary(self):
+        """测试主模型熔断后不再调用，直接转移到备用模型"""
+        primary = FakeStreamingModel([], error=RuntimeError('502'))
+        models = {self.primary.pk: primary, self.fallback.pk: FakeStreamingModel(['备用'])}
+        router = LLMRouter(TTFTTracker())
+
+        async def run():
+            stream = await router.open_stream(self.primary, [HumanMessage(content='问题')], [self.fallback.pk])
+            try:
+                return ''.join([chunk.content async for chunk in stream])
+            finally:
+                await stream.aclose()
+
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(side_effect=lambda m: models[m.pk])):
+            self.assertEqual(async_to_sync(run)(), '备用')
+            self.assertEqual(async_to_sync(run)(), '备用')
+
+        self.assertEqual(primary.calls, 1)
+
+    def test_mcp_tool_fails_fast_when_open(self):
+        """测试MCP工具熔断后调用立即失败，健康检查通过后恢复"""
+        client = mock.Mock()
+        client.call_tool.side_effect = ConnectionError('连接超时')
+        with mock.patch.object(MCPTool, 'create_mcp_client', mock.Mock(return_value=client)):
+            self.assertFalse(self.tool.call_tool('forecast')[0])
+            success, error = self.tool.call_tool('forecast')
+
+        self.assertFalse(success)
+        self.assertIn('熔断', error)
+        self.assertEqual(client.call_tool.call_count, 1)
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.status, 'unhealthy')
+        self.assertEqual(self.tool.total_calls, 1)
+
+        self.tool.status = 'healthy'
+        self.tool.last_error = ''
+        self.tool.save()
+        client.call_tool.side_effect = None
+        client.call_tool.return_value = {'ok': True}
+        with mock.patch.object(MCPTool, 'create_mcp_client', mock.Mock(return_value=client)):
+            self.assertEqual(self.tool.call_tool('forecast'), (True, {'ok': True}))
+
+    def test_mcp_tool_error_status_kept(self):
+        """测试熔断打开和关闭都不改写健康检查写入的错误状态"""
+        self.tool.status = 'error'
+        self.tool.last_error = '配置错误'
+        self.tool.save()
+        key = mcp_tool_key(self.tool)
+
+        CircuitBreaker._write_back(key, available=False, error='连接超时')
+        self.tool.refresh_from_db()
+        self.assertEqual((self.tool.status, self.tool.last_error), ('error', '配置错误'))
+
+        CircuitBreaker._write_back(key, available=True)
+        self.tool.refresh_from_db()
+        self.assertEqual((self.tool.status, self.tool.last_error), ('error', '配置错误'))
+
+    def test_stats_list_open_circuits(self):
+        """测试统计接口列出非关闭状态的熔断器"""
+        from crewaiplatform.services.circuit_breaker import circuit_breaker
+
+        permit = circuit_breaker.before(llm_model_key(self.primary))
+        circuit_breaker.failure(permit, RuntimeError('502'))
+        client = APIClient()
+        client.force_authenticate(self.fixture['user'])
+
+        data = client.get('/api/llm-models/stats/').json()
+
+        self.assertEqual(data['usage_stats']['open_circuits'], 1)
+        self.assertEqual(data['circuit_breakers'][0]['name'], self.primary.name)
+        self.assertEqual(data['circuit_breakers'][0]['state'], 'open')
+        self.assertEqual(
+            client.get('/api/mcp-tools/stats/').json()['circuit_breakers'], []
+        )
+        self.assertIsNone(cache.get(f"circuit:{mcp_tool_key(self.tool)}:state"))
@@ -0,0 +1,193 @@
+"""
+WebSocket连接上下文测试
+
+测试会话、主要Agent和LLM模型在连接时加载一次、后续消息不再查询，
+模型变更后的失效事件（会话群组、Agent群组）以及连接随主要Agent切换Agent群组
+"""
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from crewaiplatform.connection_context import CONTEXT_EVENT, ConnectionContext, agent_group_name
+from crewaiplatform.consumers import ChatConsumer
+from crewaiplatform.models import CrewAIAgent
+from crewaiplatform.services.agent_reply import AgentReplyService
+from crewaiplatform.tests.test_group_subscribers import RecordingChannelLayer
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+class GroupRecordingChannelLayer(RecordingChannelLayer):
+    """同时记录群组成员变化的测试通道层"""
+
+    def __init__(self):
+        super().__init__()
+        self.groups = {}
+
+    async def group_add(self, group, channel):
+        self.groups.setdefault(group, set()).add(channel)
+
+    async def group_discard(self, group, channel):
+        self.groups.get(group, set()).discard(channel)
+
+
+class ConnectionContextTest(TestCase):
+    """连接上下文加载与失效测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+        self.context = ConnectionContext(self.conversation.id, self.fixture['user'])
+
+    def test_loaded_once_until_invalidated(self):
+        """测试上下文只加载一次（一次JOIN查询），失效后重新加载"""
+        with self.assertNumQueries(1):
+            conversation = async_to_sync(self.context.get)()
+        with self.assertNumQueries(0):
+            async_to_sync(self.context.get)()
+            agent = AgentReplyService.select_agent(conversation)
+
+        self.assertEqual(agent, self.fixture['agent'])
+        self.assertEqual(agent.llm_model, self.fixture['llm_model'])
+
+        self.context.invalidate()
+        with self.assertNumQueries(1):
+            async_to_sync(self.context.get)()
+
+    def test_other_users_conversation_is_none(self):
+        other = create_chat_fixture(username='other-user')
+        context = ConnectionContext(self.conversation.id, other['user'])
+
+        self.assertIsNone(async_to_sync(context.get)())
+
+    def test_inactive_preloaded_agent_falls_back_to_query(self):
+        """测试预加载的主要Agent不可用时按原逻辑从数据库查询"""
+        conversation = async_to_sync(self.context.get)()
+        conversation.primary_agent.is_active = False
+
+        with self.assertNumQueries(1):
+            agent = AgentReplyService.select_agent(conversation)
+
+        self.assertIsNot(agent, conversation.primary_agent)
+        self.assertEqual(agent, self.fixture['agent'])
+
+
+class ContextInvalidationSignalTest(TestCase):
+    """模型变更后的失效事件测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.layer = RecordingChannelLayer()
+        patcher = mock.patch('channels.layers.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_events_sent_to_conversation_and_agent_groups(self):
+        """测试会话、Agent、LLM模型变更在事务提交后通知对应的群组"""
+        sent = []
+
+        async def group_send(group, event):
+            sent.append((group, event))
+
+        self.layer.group_send = group_send
+        conversation, agent = self.fixture['conversation'], self.fixture['agent']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversation.title = '新标题'
+            conversation.save()
+            agent.save()
+            self.fixture['llm_model'].save()
+            self.assertEqual(sent, [])
+
+        self.assertEqual(sent, [
+            (f'chat_{conversation.id}', {'type': CONTEXT_EVENT, 'model': 'conversation', 'id': conversation.id}),
+            (agent_group_name(agent.id), {'type': CONTEXT_EVENT, 'model': 'agent', 'id': agent.id}),
+            (agent_group_name(agent.id), {'type': CONTEXT_EVENT, 'model': 'llm_model', 'id': agent.llm_model_id}),
+        ])
+
+    def test_llm_model_agents_queried_after_commit(self):
+        """测试LLM模型变更时使用它的Agent在提交后才查询，没有channel layer时不查询"""
+        llm_model = self.fixture['llm_model']
+
+        with mock.patch('channels.layers.get_channel_layer', return_value=None), \
+                CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks(execute=True):
+                llm_model.save()
+
+        self.assertFalse([q for q in context.captured_queries if 'FROM "crewai_agent"' in q['sql']])
+
+    def test_llm_model_validation_fields_not_notified(self):
+        """测试只更新验证信息时不发送失效事件"""
+        sent = []
+
+        async def group_send(group, event):
+            sent.append((group, event))
+
+        self.layer.group_send = group_send
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.fixture['llm_model'].save(update_fields=['last_validated', 'model_info', 'updated_at'])
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(sent, [])
+
+
+@override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0)
+class ConsumerContextTest(TestCase):
+    """ChatConsumer使用连接上下文测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+        self.layer = GroupRecordingChannelLayer()
+        self.consumer = ChatConsumer()
+        self.consumer.scope = {'query_string': b''}
+        self.consumer.channel_layer = self.layer
+        self.consumer.channel_name = 'local.context'
+        self.consumer.conversation_id = self.conversation.id
+        self.consumer.conversation_group_name = f'chat_{self.conversation.id}'
+        self.consumer.user = self.fixture['user']
+        self.consumer.context = ConnectionContext(self.conversation.id, self.fixture['user'])
+        self.consumer.triggered = []
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+
+        async def trigger_agent_response(conversation, user_message):
+            self.consumer.triggered.append(conversation)
+
+        self.consumer.send = send
+        self.consumer.trigger_agent_response = trigger_agent_response
+        self.consumer.init_stream_state()
+
+    def test_messages_reuse_conversation(self):
+        """测试连接后的消息不再查询会话"""
+        async_to_sync(self.consumer.get_conversation)()
+
+        with CaptureQueriesContext(connection) as context:
+            async_to_sync(self.consumer.handle_send_message)({'content': '你好'})
+
+        self.assertFalse([q for q in context.captured_queries if 'FROM "chat_conversation"' in q['sql']])
+        self.assertIs(self.consumer.triggered[0], self.consumer.context.conversation)
+        self.assertEqual(self.layer.groups[agent_group_name(self.fixture['agent'].id)], {'local.context'})
+
+    def test_context_event_reloads_and_switches_agent_group(self):
+        """测试收到失效事件后下一条消息重新加载，主要Agent变化时切换Agent群组"""
+        first_agent = self.fixture['agent']
+        async_to_sync(self.consumer.handle_send_message)({'content': '第一条'})
+        second_agent = CrewAIAgent.objects.create(
+            name='second-agent', role='助手', goal='回答问题', backstory='测试',
+            llm_model=self.fixture['llm_model'], owner=self.fixture['user'],
+        )
+        self.conversation.primary_agent = second_agent
+        self.conversation.save()
+
+        async_to_sync(self.consumer.chat_context)({'type': CONTEXT_EVENT, 'model': 'conversation', 'id': 1})
+        async_to_sync(self.consumer.handle_send_message)({'content': '第二条'})
+
+        self.assertEqual(self.consumer.triggered[1].primary_agent, second_agent)
+        self.assertEqual(self.layer.groups[agent_group_name(first_agent.id)], set())
+        self.assertEqual(self.layer.groups[agent_group_name(second_agent.id)], {'local.context'})
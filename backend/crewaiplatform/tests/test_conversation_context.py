@@ -0,0 +1,119 @@
+"""
+对话上下文测试
+
+测试按token预算组装历史对话，以及超出预算的对话合并进滚动摘要
+"""
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase
+
+from crewaiplatform.models import ChatConversation, ChatMessage
+from crewaiplatform.services.conversation_context import (
+    ConversationContextBuilder,
+    ConversationSummarizer,
+)
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.services.token_counter import estimate_tokens, truncate_to_tokens
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel
+
+
+class ContextFitTest(SimpleTestCase):
+    """预算分配测试"""
+
+    def test_keeps_newest_turns_within_budget(self):
+        """测试从最新消息往前放入，超出预算的消息记为待摘要"""
+        rows = [(4, 'user', '', '最新问题'), (3, 'assistant', 'A', '回' * 30), (2, 'user', '', '旧问题' * 20)]
+
+        context = ConversationContextBuilder.fit(rows, budget=50)
+
+        self.assertEqual(context.turns, ['助手(A): ' + '回' * 30, '用户: 最新问题'])
+        self.assertEqual(context.overflow_until_id, 2)
+        self.assertLessEqual(context.tokens, 50)
+
+    def test_summary_counts_against_budget(self):
+        """测试摘要计入预算并放在上下文最前面"""
+        rows = [(2, 'user', '', '问' * 10), (1, 'assistant', 'A', '答' * 10)]
+
+        context = ConversationContextBuilder.fit(rows, budget=25, summary='摘' * 10)
+
+        self.assertEqual(len(context.turns), 1)
+        self.assertTrue(context.text.startswith('之前对话的摘要: '))
+
+    def test_summary_over_budget_keeps_latest_message(self):
+        """测试摘要单独超出预算时截断摘要，最新消息仍完整放入且不记为待摘要"""
+        rows = [(2, 'user', '', '当前问题'), (1, 'assistant', 'A', '答' * 10)]
+
+        context = ConversationContextBuilder.fit(rows, budget=30, summary='摘' * 200)
+
+        self.assertEqual(context.turns, ['用户: 当前问题'])
+        self.assertTrue(context.summary.startswith('摘'))
+        self.assertLessEqual(context.tokens, 30)
+        self.assertEqual(context.overflow_until_id, 1)
+
+        context = ConversationContextBuilder.fit([(2, 'user', '', '长' * 500)], budget=30, summary='摘' * 200)
+
+        self.assertEqual(context.summary, '')
+        self.assertEqual(len(context.turns), 1)
+        self.assertIsNone(context.overflow_until_id)
+
+    def test_oversized_latest_message_is_truncated(self):
+        """测试最新一条消息单独超出预算时截断放入"""
+        context = ConversationContextBuilder.fit([(1, 'user', '', '长' * 500)], budget=40)
+
+        self.assertEqual(len(context.turns), 1)
+        self.assertLessEqual(estimate_tokens(context.turns[0]), 40)
+        self.assertIsNone(context.overflow_until_id)
+
+    def test_truncate_to_tokens(self):
+        """测试按token截断"""
+        self.assertEqual(truncate_to_tokens('short', 10), 'short')
+        self.assertLessEqual(estimate_tokens(truncate_to_tokens('abcd' * 100, 10)), 10)
+
+
+class ConversationSummaryTest(TestCase):
+    """滚动摘要测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+        for i in range(6):
+            ChatMessage.objects.create(
+                conversation=self.conversation, role='assistant', agent_name='A',
+                content=f'第{i}条' + '很长的回答' * 40, status='completed'
+            )
+
+    def test_build_reports_overflow_and_summary_advances(self):
+        """测试超出预算的消息被合并进摘要，之后的上下文使用摘要"""
+        context = ConversationContextBuilder.build(self.conversation.id, budget=300)
+        self.assertIsNotNone(context.overflow_until_id)
+
+        model = FakeStreamingModel(['用户打招呼，助手给出了多条长回答'])
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+            saved = async_to_sync(ConversationSummarizer.update)(
+                self.conversation.id, self.fixture['llm_model'], context.overflow_until_id
+            )
+
+        self.assertTrue(saved)
+        conversation = ChatConversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.context_summary, '用户打招呼，助手给出了多条长回答')
+        self.assertEqual(conversation.summary_message_id, context.overflow_until_id)
+
+        after = ConversationContextBuilder.build(self.conversation.id, budget=300)
+        self.assertIn('之前对话的摘要: 用户打招呼', after.text)
+        self.assertLessEqual(after.tokens, 300)
+
+    def test_processing_placeholder_excluded(self):
+        """测试处理中的占位消息不进入上下文"""
+        context = ConversationContextBuilder.build(self.conversation.id, budget=100000)
+
+        self.assertNotIn('正在思考中...', context.text)
+        self.assertIn('用户: 你好', context.text)
+
+    def test_stale_update_not_saved(self):
+        """测试摘要截止点已被推进时不覆盖"""
+        last_id = ChatMessage.objects.filter(conversation=self.conversation).order_by('-id').first().id
+        ChatConversation.objects.filter(pk=self.conversation.pk).update(summary_message_id=last_id)
+
+        self.assertFalse(ConversationSummarizer._save(self.conversation.id, None, last_id, '过期摘要'))
@@ -0,0 +1,109 @@
+"""
+会话计数测试
+
+测试原子累加、写后合并和计数校正命令
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+
+from crewaiplatform.models import ChatAgentTask, ChatConversation, ChatMessage
+from crewaiplatform.services.conversation_counters import ConversationCounters
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+class ConversationCountersTest(TestCase):
+    """计数累加测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+
+    def counts(self):
+        conversation = ChatConversation.objects.get(pk=self.conversation.pk)
+        return conversation.total_messages, conversation.total_agent_calls
+
+    def test_created_rows_are_counted(self):
+        """测试新建消息和任务累加会话计数，并更新最后活动时间"""
+        self.assertEqual(self.counts(), (2, 1))
+
+        message = ChatMessage.objects.create(conversation=self.conversation, role='user', content='再问')
+        message.content = '修改内容'
+        message.save()
+
+        self.assertEqual(self.counts(), (3, 1))
+        conversation = ChatConversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.last_activity_at, message.created_at)
+
+    def test_stale_instances_do_not_lose_increments(self):
+        """测试多个持有旧计数的实例并发累加不会互相覆盖"""
+        first = ChatConversation.objects.get(pk=self.conversation.pk)
+        second = ChatConversation.objects.get(pk=self.conversation.pk)
+
+        first.increment_message_count()
+        second.increment_message_count()
+        second.increment_agent_call_count()
+
+        self.assertEqual(self.counts(), (4, 2))
+
+    def test_write_behind_batches_per_conversation(self):
+        """测试写后合并：提交后才累积，同一会话的多次增量合并为一条UPDATE"""
+        counters = ConversationCounters(write_behind=True, flush_interval_ms=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                counters.record(self.conversation.pk, messages=1)
+            counters.record(self.conversation.pk, agent_calls=1)
+
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertEqual(counters.pending_count(), 1)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.flush(), 1)
+        self.assertEqual(self.counts(), (5, 2))
+        self.assertEqual(counters.flush(), 0)
+
+    def test_write_behind_skips_rolled_back_writes(self):
+        """测试写后合并不计入回滚的写入"""
+        counters = ConversationCounters(write_behind=True, flush_interval_ms=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    counters.record(self.conversation.pk, messages=1)
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+
+        self.assertEqual(counters.pending_count(), 0)
+
+
+class ReconcileCountersCommandTest(TestCase):
+    """计数校正命令测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+        ChatConversation.objects.filter(pk=self.conversation.pk).update(
+            total_messages=99, total_agent_calls=0, last_activity_at=None
+        )
+
+    def test_recomputes_from_source_tables(self):
+        """测试根据消息表和任务表重新计算计数"""
+        out = StringIO()
+        call_command('reconcile_conversation_counters', stdout=out)
+
+        conversation = ChatConversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.total_messages, ChatMessage.objects.filter(conversation=conversation).count())
+        self.assertEqual(conversation.total_agent_calls, ChatAgentTask.objects.filter(conversation=conversation).count())
+        self.assertEqual(conversation.last_activity_at, self.fixture['assistant_message'].created_at)
+        self.assertIn('已校正 1 个', out.getvalue())
+
+    def test_dry_run_does_not_write(self):
+        """测试--dry-run只统计不写入"""
+        out = StringIO()
+        call_command('reconcile_conversation_counters', '--dry-run', stdout=out)
+
+        self.assertEqual(ChatConversation.objects.get(pk=self.conversation.pk).total_messages, 99)
+        self.assertIn('计数有偏差 1 个', out.getvalue())
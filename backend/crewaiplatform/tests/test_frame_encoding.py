@@ -0,0 +1,175 @@
+"""
+WebSocket帧编码测试
+
+测试编码的协商（子协议优先于查询参数）、各编码的编解码、deflate的大小阈值，
+以及ChatConsumer按协商的编码下发流式事件和解码客户端的二进制帧
+"""
+
+import json
+import zlib
+
+import ormsgpack
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from crewaiplatform.consumers import ChatConsumer
+from crewaiplatform.frame_encoding import FrameDecodeError, FrameEncoder, dumps_json, resolve_frame_encoding
+from crewaiplatform.group_subscribers import group_subscribers
+from crewaiplatform.middleware import JWTAuthMiddlewareStack
+from crewaiplatform.routing import websocket_urlpatterns
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+def deflate(payload: bytes) -> bytes:
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(payload) + compressor.flush()
+
+
+class ResolveFrameEncodingTest(SimpleTestCase):
+    """帧编码协商测试"""
+
+    def test_subprotocol_takes_precedence_over_query(self):
+        """测试子协议优先于查询参数，并返回需要回应的子协议"""
+        scope = {'subprotocols': ['other', 'crewai.msgpack'], 'query_string': b'encoding=deflate'}
+        self.assertEqual(resolve_frame_encoding(scope), ('msgpack', 'crewai.msgpack'))
+
+    def test_query_parameter_and_default(self):
+        """测试查询参数选择编码，未知编码回退到默认配置"""
+        self.assertEqual(resolve_frame_encoding({'query_string': b'encoding=deflate'}), ('deflate', None))
+        self.assertEqual(resolve_frame_encoding({'query_string': b'encoding=xml'}), ('json', None))
+        with override_settings(CHAT_WS_FRAME_ENCODING='msgpack'):
+            self.assertEqual(resolve_frame_encoding({'query_string': b''}), ('msgpack', None))
+
+
+class FrameEncoderTest(SimpleTestCase):
+    """编解码测试"""
+
+    event = {'type': 'answer_stream_update', 'delta': '你好', 'seq': 3}
+
+    def test_json_is_text_without_ascii_escaping(self):
+        """测试默认编码为文本帧，中文不转义"""
+        text, binary = FrameEncoder('json').encode(self.event)
+
+        self.assertIsNone(binary)
+        self.assertIn('你好', text)
+        self.assertEqual(json.loads(text), self.event)
+
+    def test_msgpack_roundtrip(self):
+        """测试msgpack编码为二进制帧，并能解码同样编码的客户端帧"""
+        encoder = FrameEncoder('msgpack')
+        text, binary = encoder.encode(self.event)
+
+        self.assertIsNone(text)
+        self.assertEqual(ormsgpack.unpackb(binary), self.event)
+        self.assertEqual(encoder.decode(bytes_data=binary), self.event)
+        # 文本帧始终按JSON解码
+        self.assertEqual(encoder.decode(text_data='{"type": "ping"}'), {'type': 'ping'})
+
+    @override_settings(CHAT_WS_DEFLATE_MIN_BYTES=512)
+    def test_deflate_only_large_payloads(self):
+        """测试deflate只压缩超过阈值的事件"""
+        encoder = FrameEncoder('deflate')
+        large = {'type': 'answer_stream_complete', 'content': '长答案' * 500}
+
+        self.assertEqual(encoder.encode(self.event)[1], None)
+        text, binary = encoder.encode(large)
+        self.assertIsNone(text)
+        self.assertLess(len(binary), len(dumps_json(large).encode('utf-8')) / 10)
+        self.assertEqual(json.loads(zlib.decompress(binary, -zlib.MAX_WBITS)), large)
+        self.assertEqual(encoder.decode(bytes_data=binary), large)
+
+    def test_invalid_frame_raises_decode_error(self):
+        with self.assertRaises(FrameDecodeError):
+            FrameEncoder('msgpack').decode(bytes_data=b'\xc1')
+        with self.assertRaises(FrameDecodeError):
+            FrameEncoder('json').decode(text_data='{')
+        with self.assertRaises(FrameDecodeError):
+            FrameEncoder('json').decode(bytes_data=deflate(b'{}'))
+
+    @override_settings(CHAT_WS_MAX_INFLATED_BYTES=1024)
+    def test_oversized_inflated_frame_rejected(self):
+        """测试解压后超过上限的deflate帧被拒绝（压缩炸弹）"""
+        bomb = deflate(b'[' + b'0,' * 1_000_000 + b'0]')
+
+        self.assertLess(len(bomb), 10_000)
+        with self.assertRaises(FrameDecodeError):
+            FrameEncoder('deflate').decode(bytes_data=bomb)
+
+
+class ConsumerFrameEncodingTest(SimpleTestCase):
+    """ChatConsumer按连接的编码收发帧"""
+
+    def make_consumer(self, query_string):
+        consumer = ChatConsumer()
+        consumer.scope = {'query_string': query_string}
+        consumer.channel_layer = None
+        consumer.conversation_group_name = 'chat_encoding'
+        consumer.channel_name = 'local.encoding'
+        consumer.sent = []
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            consumer.sent.append((text_data, bytes_data))
+
+        consumer.send = send
+        consumer.init_stream_state()
+        return consumer
+
+    @override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0)
+    def test_stream_events_and_client_frames_use_msgpack(self):
+        """测试流式事件下发为msgpack二进制帧，客户端的msgpack心跳得到msgpack回复"""
+        consumer = self.make_consumer(b'stream_protocol=delta&encoding=msgpack')
+
+        async def scenario():
+            await consumer._send_stream_event({'type': 'answer_stream_start', 'stream_id': 's1', 'seq': 0})
+            await consumer.receive(bytes_data=ormsgpack.packb({'type': 'ping', 'timestamp': 1}))
+
+        async_to_sync(scenario)()
+
+        self.assertTrue(all(text is None for text, _ in consumer.sent))
+        frames = [ormsgpack.unpackb(binary) for _, binary in consumer.sent]
+        self.assertEqual(frames[0]['type'], 'answer_stream_start')
+        self.assertEqual(frames[1], {'type': 'pong', 'timestamp': 1})
+
+    def test_invalid_binary_frame_reports_error(self):
+        consumer = self.make_consumer(b'encoding=deflate')
+
+        async_to_sync(consumer.receive)(bytes_data=b'not deflate')
+
+        self.assertEqual(json.loads(consumer.sent[0][0]), {'type': 'error', 'message': '无效的消息格式'})
+
+
+class WebSocketSubprotocolTest(TestCase):
+    """子协议握手测试"""
+
+    def test_accept_echoes_negotiated_subprotocol(self):
+        """测试通过子协议协商编码时握手回应该子协议，连接成功消息按该编码下发"""
+        group_subscribers.clear()
+        self.addCleanup(group_subscribers.clear)
+        fixture = create_chat_fixture()
+        token = str(AccessToken.for_user(fixture['user']))
+        app = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+        async def scenario():
+            communicator = ApplicationCommunicator(app, {
+                'type': 'websocket',
+                'path': f"/ws/chat/{fixture['conversation'].id}/",
+                'query_string': f'token={token}'.encode(),
+                'headers': [],
+                'subprotocols': ['crewai.msgpack'],
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            accept = await communicator.receive_output(5)
+            established = await communicator.receive_output(5)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+            return accept, established
+
+        accept, established = async_to_sync(scenario)()
+
+        self.assertEqual(accept['subprotocol'], 'crewai.msgpack')
+        frame = ormsgpack.unpackb(established['bytes'])
+        self.assertEqual(frame['type'], 'connection_established')
+        self.assertEqual(frame['encoding'], 'msgpack')
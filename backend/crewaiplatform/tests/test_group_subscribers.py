@@ -0,0 +1,143 @@
+"""
+群组直接下发测试
+
+测试生产端连接是会话唯一订阅者时不经过通道层直接下发，
+有其他本地或其他进程的订阅者时回退到群组，以及回退后不再切回
+"""
+
+import json
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from crewaiplatform.consumers import ChatConsumer
+from crewaiplatform.group_subscribers import SUBSCRIBER_EVENT, GroupSubscribers, group_subscribers
+from crewaiplatform.stream_protocol import AgentResponseStream
+
+
+class RecordingChannelLayer:
+    """记录group_send/send并把群组事件分发给同组消费者的测试通道层"""
+
+    def __init__(self):
+        self.consumers = []
+        self.group_events = []
+        self.sent = []
+
+    async def group_send(self, group, event):
+        self.group_events.append(event)
+        for consumer in list(self.consumers):
+            await getattr(consumer, event['type'].replace('.', '_'))(event)
+
+    async def send(self, channel, event):
+        self.sent.append((channel, event))
+
+
+def _make_consumer(layer, name):
+    consumer = ChatConsumer()
+    consumer.scope = {'query_string': b'stream_protocol=delta'}
+    consumer.channel_layer = layer
+    consumer.conversation_group_name = 'chat_direct'
+    consumer.channel_name = name
+    consumer.frames = []
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        consumer.frames.append(json.loads(text_data))
+
+    consumer.send = send
+    consumer.init_stream_state()
+    layer.consumers.append(consumer)
+    group_subscribers.add(consumer.conversation_group_name, consumer)
+    return consumer
+
+
+async def _answer(stream, chunks):
+    await stream.send_answer_stream_start()
+    for chunk in chunks:
+        await stream.send_answer_stream_update(chunk)
+    await stream.send_answer_stream_complete(''.join(chunks))
+
+
+@override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0)
+class DirectSendTest(SimpleTestCase):
+    """直接下发测试"""
+
+    def setUp(self):
+        group_subscribers.clear()
+        self.addCleanup(group_subscribers.clear)
+        self.layer = RecordingChannelLayer()
+        self.producer = _make_consumer(self.layer, 'local.1')
+
+    def test_sole_subscriber_bypasses_channel_layer(self):
+        """测试唯一订阅者的流式事件直接交给连接处理，不经过通道层"""
+        async_to_sync(_answer)(AgentResponseStream(self.producer), ['你', '好'])
+
+        self.assertEqual(self.layer.group_events, [])
+        self.assertEqual(
+            [frame['type'] for frame in self.producer.frames],
+            ['answer_stream_start', 'answer_stream_update', 'answer_stream_update', 'answer_stream_complete']
+        )
+
+    def test_second_local_subscriber_uses_group(self):
+        """测试本进程内有其他订阅者时经群组下发，双方都收到事件"""
+        other = _make_consumer(self.layer, 'local.2')
+
+        async_to_sync(_answer)(AgentResponseStream(self.producer), ['你', '好'])
+
+        self.assertEqual(len(self.layer.group_events), 4)
+        self.assertEqual(len(other.frames), 4)
+        self.assertEqual(self.producer.frames, other.frames)
+
+    def test_fallback_is_sticky_within_response(self):
+        """测试一次响应回退到群组后，即使其他订阅者离开也不再切回直接下发"""
+        other = _make_consumer(self.layer, 'local.2')
+        stream = AgentResponseStream(self.producer)
+
+        async def scenario():
+            await stream.send_answer_stream_start()
+            group_subscribers.discard(other.conversation_group_name, other)
+            self.layer.consumers.remove(other)
+            await stream.send_answer_stream_update('你')
+
+        async_to_sync(scenario)()
+
+        self.assertEqual(len(self.layer.group_events), 2)
+        self.assertFalse(stream.direct_send)
+
+    def test_remote_subscriber_disables_direct_send(self):
+        """测试其他进程的订阅者加入时回退到群组并回复本进程的订阅，离开后恢复直接下发"""
+        async_to_sync(self.producer.chat_subscriber)(
+            {'type': SUBSCRIBER_EVENT, 'event': 'joined', 'channel': 'remote.1'}
+        )
+
+        self.assertEqual(self.layer.sent, [('remote.1', {
+            'type': SUBSCRIBER_EVENT, 'event': 'present', 'channel': 'local.1',
+        })])
+        async_to_sync(_answer)(AgentResponseStream(self.producer), ['你'])
+        self.assertEqual(len(self.layer.group_events), 3)
+
+        async_to_sync(self.producer.chat_subscriber)(
+            {'type': SUBSCRIBER_EVENT, 'event': 'left', 'channel': 'remote.1'}
+        )
+        async_to_sync(_answer)(AgentResponseStream(self.producer), ['好'])
+        self.assertEqual(len(self.layer.group_events), 3)
+
+
+class GroupSubscribersTest(SimpleTestCase):
+    """订阅者注册表测试"""
+
+    def test_discard_returns_remaining_and_forgets_remote(self):
+        """测试移除返回本进程剩余订阅数，最后一个本地订阅者离开时清除其他进程的记录"""
+        registry = GroupSubscribers()
+        first, second = ChatConsumer(), ChatConsumer()
+        first.channel_name, second.channel_name = 'a', 'b'
+        registry.add('chat_1', first)
+        registry.add('chat_1', second)
+        registry.remote_joined('chat_1', 'remote')
+
+        self.assertEqual(registry.discard('chat_1', first), 1)
+        self.assertEqual(registry.remote_count('chat_1'), 1)
+        self.assertEqual(registry.discard('chat_1', second), 0)
+        self.assertEqual(registry.remote_count('chat_1'), 0)
+        # 本进程没有订阅时不记录其他进程的订阅者
+        registry.remote_joined('chat_1', 'remote')
+        self.assertEqual(registry.remote_count('chat_1'), 0)
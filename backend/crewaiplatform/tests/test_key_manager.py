@@ -0,0 +1,114 @@
+"""
+API密钥加密管理测试
+
+测试版本前缀密文、旧格式兼容、解密缓存以及密钥轮换命令
+"""
+
+from io import StringIO
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from crewaiplatform.key_manager import KeyManager, derive_fernet_key, key_manager
+from crewaiplatform.metrics import metrics
+from crewaiplatform.models import LLMModel
+
+
+ROTATED_KEYS = {'v2': 'new-secret', 'v1': settings.SECRET_KEY}
+
+
+class KeyManagerTest(TestCase):
+    """加解密与轮换测试"""
+
+    def setUp(self):
+        key_manager.reload()
+
+    def _create_model(self, api_key='sk-test', name='key-test'):
+        return LLMModel.objects.create(
+            name=name, provider='openai', model_name='gpt-4o-mini', api_key=api_key,
+        )
+
+    def test_encrypted_value_carries_version_prefix(self):
+        """测试新密文带版本前缀且可以还原"""
+        llm_model = self._create_model()
+
+        self.assertTrue(llm_model.api_key.startswith(f'enc:{key_manager.current_version}:'))
+        self.assertEqual(llm_model.get_decrypted_api_key(), 'sk-test')
+
+    def test_is_encrypted_uses_prefix_only(self):
+        """测试只凭前缀判断是否加密，明文不会被当作密文"""
+        legacy = Fernet(derive_fernet_key(settings.SECRET_KEY)).encrypt(b'sk-old').decode()
+
+        self.assertTrue(KeyManager.is_encrypted('enc:v1:whatever'))
+        self.assertTrue(KeyManager.is_encrypted(legacy))
+        self.assertFalse(KeyManager.is_encrypted('sk-plain-text-key'))
+        self.assertFalse(KeyManager.is_encrypted(''))
+
+    def test_saving_twice_does_not_double_encrypt(self):
+        """测试重复保存不会重复加密"""
+        llm_model = self._create_model()
+        encrypted = llm_model.api_key
+        llm_model.save()
+
+        self.assertEqual(llm_model.api_key, encrypted)
+
+    def test_legacy_token_is_decrypted(self):
+        """测试无前缀的旧格式密文仍然可以解密"""
+        llm_model = self._create_model()
+        legacy = Fernet(derive_fernet_key(settings.SECRET_KEY)).encrypt(b'sk-old').decode()
+        LLMModel.objects.filter(pk=llm_model.pk).update(api_key=legacy)
+        llm_model.refresh_from_db()
+
+        self.assertEqual(llm_model.get_decrypted_api_key(), 'sk-old')
+        self.assertTrue(key_manager.needs_rotation(legacy))
+
+    def test_decrypt_results_are_cached(self):
+        """测试同一密文只解密一次"""
+        manager = KeyManager(decrypt_cache_size=2)
+        encrypted = manager.encrypt('sk-cache')
+        metrics.reset()
+
+        manager.decrypt(encrypted)
+        manager.decrypt(encrypted)
+
+        self.assertEqual(metrics.get_counter('llm.api_key.decrypt_cache_misses'), 1)
+        self.assertEqual(metrics.get_counter('llm.api_key.decrypt_cache_hits'), 1)
+
+    def test_rotation_command_reencrypts_old_versions(self):
+        """测试轮换密钥后命令把旧版本、旧格式和明文统一加密为当前版本"""
+        current = self._create_model('sk-current', name='current')
+        legacy = self._create_model(name='legacy')
+        plain = self._create_model(name='plain')
+        LLMModel.objects.filter(pk=legacy.pk).update(
+            api_key=Fernet(derive_fernet_key(settings.SECRET_KEY)).encrypt(b'sk-legacy').decode()
+        )
+        LLMModel.objects.filter(pk=plain.pk).update(api_key='sk-plain')
+
+        with override_settings(LLM_API_KEY_ENCRYPTION_KEYS=ROTATED_KEYS, LLM_API_KEY_CURRENT_VERSION='v2'):
+            # 轮换前旧版本密文仍可解密
+            current.refresh_from_db()
+            self.assertEqual(current.get_decrypted_api_key(), 'sk-current')
+
+            out = StringIO()
+            call_command('reencrypt_llm_api_keys', batch_size=2, stdout=out)
+            self.assertIn('已重新加密 3 条', out.getvalue())
+
+            expected = {current.pk: 'sk-current', legacy.pk: 'sk-legacy', plain.pk: 'sk-plain'}
+            for llm_model in LLMModel.objects.filter(pk__in=expected):
+                self.assertTrue(llm_model.api_key.startswith('enc:v2:'))
+                self.assertEqual(llm_model.get_decrypted_api_key(), expected[llm_model.pk])
+
+    def test_rotation_dry_run_writes_nothing(self):
+        """测试dry-run只统计不写入"""
+        llm_model = self._create_model()
+        encrypted = llm_model.api_key
+
+        with override_settings(LLM_API_KEY_ENCRYPTION_KEYS=ROTATED_KEYS, LLM_API_KEY_CURRENT_VERSION='v2'):
+            out = StringIO()
+            call_command('reencrypt_llm_api_keys', dry_run=True, stdout=out)
+
+        self.assertIn('需要重新加密 1 条', out.getvalue())
+        llm_model.refresh_from_db()
+        self.assertEqual(llm_model.api_key, encrypted)
@@ -0,0 +1,115 @@
+"""
+LLM模型实例缓存测试
+
+测试LangChain模型实例的复用、配置变更失效以及连接池的共享与关闭
+"""
+
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from crewaiplatform.models import LLMModel
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+
+
+class LangChainModelCacheTest(TestCase):
+    """模型实例缓存测试"""
+
+    def setUp(self):
+        llm_model_cache.clear()
+        self.llm_model = LLMModel.objects.create(
+            name='cache-test',
+            provider='openai',
+            model_name='gpt-4o-mini',
+            api_key='sk-test',
+            api_base_url='https://api.example.com/v1',
+        )
+
+    def tearDown(self):
+        llm_model_cache.clear()
+
+    def test_same_model_is_reused(self):
+        """测试同一事件循环内重复获取返回同一实例"""
+        async def scenario():
+            first = await llm_model_cache.aget(self.llm_model)
+            second = await llm_model_cache.aget(self.llm_model)
+            return first, second
+
+        first, second = async_to_sync(scenario)()
+        self.assertIs(first, second)
+
+    def test_updated_row_builds_new_instance(self):
+        """测试配置更新后不再命中旧实例"""
+        async def scenario():
+            first = await llm_model_cache.aget(self.llm_model)
+            self.llm_model.temperature = 0.1
+            await self._save(self.llm_model)
+            second = await llm_model_cache.aget(self.llm_model)
+            return first, second
+
+        first, second = async_to_sync(scenario)()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.temperature, 0.1)
+
+    def test_save_signal_evicts_entries(self):
+        """测试保存LLMModel时清除缓存条目"""
+        async def scenario():
+            await llm_model_cache.aget(self.llm_model)
+            return llm_model_cache.size()
+
+        self.assertEqual(async_to_sync(scenario)(), 1)
+        self.llm_model.save()
+        self.assertEqual(llm_model_cache.size(), 0)
+
+    def test_http_pool_shared_per_endpoint(self):
+        """测试同一端点的模型共享HTTP连接池"""
+        other = LLMModel.objects.create(
+            name='cache-test-2',
+            provider='openai',
+            model_name='gpt-4o',
+            api_key='sk-test',
+            api_base_url='https://api.example.com/v1',
+        )
+
+        async def scenario():
+            first = await llm_model_cache.aget(self.llm_model)
+            second = await llm_model_cache.aget(other)
+            return first, second
+
+        first, second = async_to_sync(scenario)()
+        self.assertIsNot(first, second)
+        self.assertIs(first.http_async_client, second.http_async_client)
+
+    def test_unused_http_pool_closed_after_eviction(self):
+        """测试端点变更后旧连接池不再被使用时关闭，仍被其他实例使用的连接池保留"""
+        other = LLMModel.objects.create(
+            name='cache-test-2', provider='openai', model_name='gpt-4o', api_key='sk-test',
+            api_base_url='https://api.example.com/v1',
+        )
+
+        async def scenario():
+            first = await llm_model_cache.aget(self.llm_model)
+            await llm_model_cache.aget(other)
+            shared = first.http_async_client
+
+            self.llm_model.api_base_url = 'https://api.example.org/v1'
+            await self._save(self.llm_model)
+            moved = (await llm_model_cache.aget(self.llm_model)).http_async_client
+            await asyncio.sleep(0.01)
+            shared_open_while_used = not shared.is_closed
+
+            await self._save(other)
+            await asyncio.sleep(0.01)
+            return shared_open_while_used, shared.is_closed, moved.is_closed
+
+        shared_open_while_used, shared_closed, moved_closed = async_to_sync(scenario)()
+
+        self.assertTrue(shared_open_while_used)
+        self.assertTrue(shared_closed)
+        self.assertFalse(moved_closed)
+
+    @staticmethod
+    async def _save(instance):
+        from asgiref.sync import sync_to_async
+        await sync_to_async(instance.save)()
@@ -0,0 +1,201 @@
+"""
+LLM路由测试
+
+测试首个token耗时统计、对冲请求、故障转移、落败流的关闭，以及任务记录的响应模型
+"""
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from langchain_core.messages import HumanMessage
+
+from crewaiplatform.models import ChatAgentTask, ChatMessage, CrewAIAgent, LLMModel
+from crewaiplatform.services import SimpleAgentService
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.services.llm_router import (
+    LLMRoute, LLMRouter, TTFTTracker, bind_llm_route, unbind_llm_route,
+)
+from crewaiplatform.services.prompt_layout import CACHE_CONTROL
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel, RecordingStream
+
+
+class TTFTTrackerTest(TestCase):
+    """首个token耗时统计测试"""
+
+    def test_percentile_over_rolling_window(self):
+        """测试分位值只统计最近的样本，样本不足时返回None"""
+        tracker = TTFTTracker(window=10)
+        for seconds in range(100):
+            tracker.record(1, seconds)
+
+        self.assertEqual(tracker.percentile(1, 50), 95)
+        self.assertEqual(tracker.percentile(1, 100), 99)
+        self.assertIsNone(tracker.percentile(1, 50, min_samples=11))
+        self.assertIsNone(tracker.percentile(2, 50))
+
+
+@override_settings(LLM_HEDGE_DEFAULT_DELAY_MS=50, LLM_HEDGE_MIN_DELAY_MS=0, LLM_RATE_LIMIT_ENABLED=False)
+class LLMRouterTest(TestCase):
+    """对冲请求与故障转移测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.primary = self.fixture['llm_model']
+        self.fallback = LLMModel.objects.create(
+            name='fallback-llm', provider='openai', model_name='gpt-4o', api_key='sk-test', is_available=True,
+        )
+        self.router = LLMRouter(TTFTTracker())
+        self.models = {}
+
+    def model_for(self, llm_model):
+        return self.models[llm_model.pk]
+
+    def stream(self, messages=None):
+        """经路由读取全部chunk，返回 (内容, 路由结果)"""
+        route = LLMRoute()
+
+        async def run():
+            context = bind_llm_route(route)
+            try:
+                stream = await self.router.open_stream(
+                    self.primary, messages or [HumanMessage(content='问题')],
+                    [self.fallback.pk],
+                    self.models[self.primary.pk]
+                )
+                try:
+                    return ''.join([chunk.content async for chunk in stream])
+                finally:
+                    await stream.aclose()
+            finally:
+                unbind_llm_route(context)
+
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(side_effect=self.model_for)):
+            return async_to_sync(run)(), route
+
+    def test_fast_primary_is_not_hedged(self):
+        """测试主模型及时返回首个token时不发出对冲请求，也不查询备用模型"""
+        self.models = {self.primary.pk: FakeStreamingModel(['主', '模型']), self.fallback.pk: FakeStreamingModel(['备'])}
+
+        content, route = self.stream()
+
+        self.assertEqual(content, '主模型')
+        self.assertEqual((route.llm_model, route.hedged), (self.primary, False))
+        self.assertEqual(self.models[self.fallback.pk].calls, 0)
+        self.assertIsNotNone(self.router.tracker.percentile(self.primary.pk, 50))
+
+    def test_slow_first_token_is_hedged(self):
+        """测试主模型首个token超时后对冲到备用模型，先到者胜出，落败的流被关闭"""
+        slow = FakeStreamingModel(['慢'], delay=5)
+        self.models = {self.primary.pk: slow, self.fallback.pk: FakeStreamingModel(['快', '速'])}
+
+        content, route = self.stream()
+
+        self.assertEqual(content, '快速')
+        self.assertEqual((route.llm_model, route.hedged), (self.fallback, True))
+        self.assertEqual(route.attempted, [self.primary.pk, self.fallback.pk])
+        self.assertTrue(slow.closed)
+
+    @override_settings(LLM_HEDGE_ENABLED=False)
+    def test_error_before_first_token_fails_over(self):
+        """测试首个token之前失败时立即转移到备用模型（不依赖对冲开关）"""
+        self.models = {
+            self.primary.pk: FakeStreamingModel([], error=RuntimeError('502')),
+            self.fallback.pk: FakeStreamingModel(['备用']),
+        }
+
+        content, route = self.stream()
+
+        self.assertEqual(content, '备用')
+        self.assertEqual((route.llm_model, route.hedged), (self.fallback, True))
+
+    def test_all_candidates_fail(self):
+        """测试所有候选都失败时抛出最先失败的异常"""
+        self.models = {
+            self.primary.pk: FakeStreamingModel([], error=RuntimeError('主模型失败')),
+            self.fallback.pk: FakeStreamingModel([], error=RuntimeError('备用失败')),
+        }
+
+        with self.assertRaisesMessage(RuntimeError, '主模型失败'):
+            self.stream()
+
+    def test_unavailable_fallback_is_skipped(self):
+        """测试不可用的备用模型被跳过"""
+        LLMModel.objects.filter(pk=self.fallback.pk).update(is_available=False)
+        self.models = {self.primary.pk: FakeStreamingModel([], error=RuntimeError('主模型失败'))}
+
+        with self.assertRaisesMessage(RuntimeError, '主模型失败'):
+            self.stream()
+
+    def test_cache_breakpoints_stripped_for_other_providers(self):
+        """测试按Anthropic组装的缓存断点在发给其他提供商时还原为纯文本"""
+        self.models = {
+            self.primary.pk: FakeStreamingModel([], error=RuntimeError('502')),
+            self.fallback.pk: FakeStreamingModel(['备用']),
+        }
+        messages = [HumanMessage(content=[{'type': 'text', 'text': '历史', 'cache_control': CACHE_CONTROL}])]
+
+        self.stream(messages)
+
+        self.assertEqual(self.models[self.fallback.pk].messages[0].content, '历史')
+
+    def test_ainvoke_fails_over(self):
+        """测试非流式调用在主模型失败时转移到备用模型"""
+        self.models = {
+            self.primary.pk: FakeStreamingModel([], error=RuntimeError('502')),
+            self.fallback.pk: FakeStreamingModel(['备用']),
+        }
+        route = LLMRoute()
+
+        async def run():
+            context = bind_llm_route(route)
+            try:
+                return await self.router.ainvoke(self.primary, [HumanMessage(content='问题')], [self.fallback.pk])
+            finally:
+                unbind_llm_route(context)
+
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(side_effect=self.model_for)):
+            response = async_to_sync(run)()
+
+        self.assertEqual(response.content, '备用')
+        self.assertEqual((route.llm_model, route.hedged), (self.fallback, True))
+
+
+@override_settings(LLM_HEDGE_DEFAULT_DELAY_MS=50, LLM_HEDGE_MIN_DELAY_MS=0)
+class ChatFailoverTest(TestCase):
+    """任务记录响应模型测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.primary = self.fixture['llm_model']
+        self.fallback = LLMModel.objects.create(
+            name='fallback-llm', provider='openai', model_name='gpt-4o', api_key='sk-test', is_available=True,
+        )
+        CrewAIAgent.objects.filter(pk=self.fixture['agent'].pk).update(fallback_llm_models=[self.fallback.pk])
+
+    def reply(self, models):
+        user_message = ChatMessage.objects.create(
+            conversation=self.fixture['conversation'], role='user', content='问题', status='sent'
+        )
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(side_effect=lambda m: models[m.pk])):
+            reply = async_to_sync(SimpleAgentService.process_user_message_with_websocket)(
+                user_message, RecordingStream()
+            )
+        return reply, ChatAgentTask.objects.get(response_message=reply)
+
+    def test_task_records_primary_model(self):
+        """测试主模型响应时任务记录主模型，未对冲"""
+        reply, task = self.reply({self.primary.pk: FakeStreamingModel(['<answer>主模型</answer>'])})
+
+        self.assertEqual(reply.content, '主模型')
+        self.assertEqual((task.llm_model_id, task.hedged), (self.primary.pk, False))
+
+    def test_task_records_fallback_model(self):
+        """测试主模型过慢时由备用模型完成回复，任务记录胜出的备用模型"""
+        reply, task = self.reply({
+            self.primary.pk: FakeStreamingModel(['<answer>慢</answer>'], delay=5),
+            self.fallback.pk: FakeStreamingModel(['<answer>备用模型</answer>']),
+        })
+
+        self.assertEqual(reply.content, '备用模型')
+        self.assertEqual((task.llm_model_id, task.hedged), (self.fallback.pk, True))
@@ -0,0 +1,108 @@
+"""
+会话最近消息缓存测试
+
+测试写穿更新、LRU淘汰、内存上限，以及已缓存会话组装上下文不访问数据库
+"""
+
+from django.test import SimpleTestCase, TestCase
+
+from crewaiplatform.models import ChatMessage
+from crewaiplatform.services.conversation_context import ConversationContextBuilder
+from crewaiplatform.services.message_cache import CachedMessage, RecentMessageCache, recent_message_cache
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+class RecentMessageCacheTest(SimpleTestCase):
+    """缓存结构测试"""
+
+    def _messages(self, count, size=10, start=1):
+        return [CachedMessage(i, 'user', '', 'x' * size) for i in range(start, start + count)]
+
+    def test_lru_eviction_by_conversation_count(self):
+        """测试超过会话数上限时淘汰最久未使用的会话"""
+        cache = RecentMessageCache(window_size=10, max_conversations=2, ttl=0)
+        cache.put(1, self._messages(1))
+        cache.put(2, self._messages(1))
+        cache.get(1)
+        cache.put(3, self._messages(1))
+
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(3))
+
+    def test_eviction_by_memory_cap(self):
+        """测试内容字节数超过上限时淘汰"""
+        cache = RecentMessageCache(window_size=10, max_conversations=100, max_bytes=5000, ttl=0)
+        for conversation_id in range(1, 6):
+            cache.put(conversation_id, self._messages(2, size=1000))
+
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 5000)
+        self.assertLess(stats['conversations'], 5)
+        self.assertIsNotNone(cache.get(5))
+
+    def test_window_keeps_last_n_and_tracks_dropped(self):
+        """测试窗口只保留最近N条，并记录移出窗口的最新消息"""
+        cache = RecentMessageCache(window_size=3, ttl=0)
+        window = cache.put(1, self._messages(5))
+
+        self.assertEqual([m.id for m in window.newest_first()], [5, 4, 3])
+        self.assertEqual(window.dropped_message_id, 2)
+
+    def test_missing_expected_message_marks_stale(self):
+        """测试缺少更新的消息时（其他进程写入）视为过期"""
+        cache = RecentMessageCache(window_size=10, ttl=0)
+        cache.put(1, self._messages(3))
+
+        self.assertIsNotNone(cache.get(1, expected_message_id=2))
+        self.assertIsNone(cache.get(1, expected_message_id=9))
+        self.assertIsNone(cache.get(1))
+
+
+class MessageCacheWriteThroughTest(TestCase):
+    """写穿与上下文组装测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.conversation = self.fixture['conversation']
+
+    def test_hot_conversation_builds_without_queries(self):
+        """测试会话加载后，新消息写穿到缓存，组装上下文不再访问数据库"""
+        ConversationContextBuilder.build(self.conversation.id, budget=1000)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message = ChatMessage.objects.create(
+                conversation=self.conversation, role='user', content='第二个问题', status='sent'
+            )
+
+        with self.assertNumQueries(0):
+            context = ConversationContextBuilder.build(
+                self.conversation.id, budget=1000, expected_message_id=message.id
+            )
+        self.assertIn('用户: 第二个问题', context.text)
+
+    def test_completed_answer_replaces_placeholder(self):
+        """测试处理中的占位消息完成后进入缓存窗口"""
+        ConversationContextBuilder.build(self.conversation.id, budget=1000)
+        placeholder = self.fixture['assistant_message']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            placeholder.content = '最终答案'
+            placeholder.status = 'completed'
+            placeholder.save()
+
+        with self.assertNumQueries(0):
+            context = ConversationContextBuilder.build(self.conversation.id, budget=1000)
+        self.assertTrue(context.text.endswith('最终答案'))
+
+    def test_unknown_message_triggers_reload(self):
+        """测试其他进程写入的消息（未写穿）触发重新加载"""
+        ConversationContextBuilder.build(self.conversation.id, budget=1000)
+        message = ChatMessage.objects.create(
+            conversation=self.conversation, role='user', content='来自其他进程', status='sent'
+        )
+
+        context = ConversationContextBuilder.build(self.conversation.id, budget=1000, expected_message_id=message.id)
+
+        self.assertIn('来自其他进程', context.text)
+        self.assertIn(message.id, recent_message_cache.get(self.conversation.id).messages)
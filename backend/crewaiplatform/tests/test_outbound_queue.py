@@ -0,0 +1,182 @@
+"""
+WebSocket发送队列测试
+
+模拟写不出去的慢客户端，测试超过上限后中间更新帧的合并与丢弃、开始/完成帧始终入队、
+持续超限时断开连接、队列降下来后不再断开，以及连接的队列高水位统计
+"""
+
+import asyncio
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.test import SimpleTestCase, TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from crewaiplatform.group_subscribers import group_subscribers
+from crewaiplatform.metrics import metrics
+from crewaiplatform.middleware import JWTAuthMiddlewareStack
+from crewaiplatform.outbound_queue import OutboundQueue, outbound_queues
+from crewaiplatform.routing import websocket_urlpatterns
+from crewaiplatform.tests.utils import create_chat_fixture
+
+
+class SlowClient:
+    """写出帧时阻塞，直到放行"""
+
+    def __init__(self):
+        self.written = []
+        self.gate = asyncio.Event()
+
+    async def write(self, frame):
+        await self.gate.wait()
+        self.written.append(frame)
+
+
+def delta(seq, text, event_type='answer_stream_update'):
+    return {'type': event_type, 'protocol': 2, 'stream_id': 's1', 'seq': seq, 'delta': text}
+
+
+class OutboundQueueTest(SimpleTestCase):
+    """发送队列策略测试"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def run_queue(self, scenario, **config):
+        async def run():
+            client = SlowClient()
+            overflowed = []
+
+            async def on_overflow():
+                overflowed.append(True)
+
+            queue = OutboundQueue(client.write, on_overflow=on_overflow, owner='测试连接', **config)
+            queue.start()
+            try:
+                return await scenario(queue, client, overflowed)
+            finally:
+                await queue.close()
+
+        return async_to_sync(run)()
+
+    def test_coalesce_delta_frames_over_limit(self):
+        """测试超过上限后增量合并进队尾，序号取最后一个增量；全部写出后内容完整"""
+        async def scenario(queue, client, overflowed):
+            queue.put({'type': 'answer_stream_start', 'stream_id': 's1', 'seq': 1})
+            await asyncio.sleep(0)
+            for seq, text in enumerate('abcdef', start=2):
+                queue.put(delta(seq, text))
+            queued = list(queue._frames)
+            client.gate.set()
+            while len(queue):
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            return queued, client.written
+
+        queued, written = self.run_queue(scenario, max_frames=3, overflow_seconds=5)
+
+        self.assertEqual([frame['delta'] for frame in queued], ['a', 'b', 'cdef'])
+        self.assertEqual(queued[-1]['seq'], 7)
+        self.assertEqual(''.join(frame.get('delta', '') for frame in written), 'abcdef')
+        self.assertEqual(metrics.get_counter('chat.ws.send_queue.coalesced'), 3)
+
+    def test_cumulative_frames_keep_latest_content(self):
+        """测试cumulative协议合并时保留最新的累计内容，完成帧始终入队"""
+        async def scenario(queue, client, overflowed):
+            queue.put({'type': 'answer_stream_start'})
+            await asyncio.sleep(0)
+            for content in ('你', '你好', '你好呀'):
+                queue.put({'type': 'answer_stream_update', 'content': content})
+            queue.put({'type': 'answer_stream_complete', 'content': '你好呀！'})
+            return [frame.get('content') for frame in queue._frames], queue.high_water
+
+        contents, high_water = self.run_queue(scenario, max_frames=1, overflow_seconds=5)
+
+        self.assertEqual(contents, ['你好呀', '你好呀！'])
+        self.assertEqual(high_water, 2)
+
+    def test_drop_policy(self):
+        """测试drop策略丢弃cumulative更新帧，delta增量不能丢弃仍按合并处理"""
+        async def scenario(queue, client, overflowed):
+            queue.put({'type': 'answer_stream_start'})
+            await asyncio.sleep(0)
+            queue.put({'type': 'thinking_content_update', 'content': '想'})
+            queue.put({'type': 'thinking_content_update', 'content': '想一想'})
+            queue.put(delta(2, '增', 'answer_stream_update'))
+            queue.put(delta(3, '量', 'answer_stream_update'))
+            return list(queue._frames), queue.frames_dropped
+
+        frames, dropped = self.run_queue(scenario, max_frames=1, policy='drop', overflow_seconds=5)
+
+        self.assertEqual(dropped, 1)
+        self.assertEqual(frames[0]['content'], '想')
+        self.assertEqual(frames[1]['delta'], '增量')
+
+    def test_slow_client_disconnected(self):
+        """测试队列持续超限时断开连接并停止写出"""
+        async def scenario(queue, client, overflowed):
+            for index in range(4):
+                queue.put({'type': 'task_status_update', 'task': {'id': index}})
+            await asyncio.sleep(0.1)
+            queue.put({'type': 'pong'})
+            return overflowed, queue.closed, len(queue)
+
+        overflowed, closed, depth = self.run_queue(scenario, max_frames=2, overflow_seconds=0.05)
+
+        self.assertEqual(overflowed, [True])
+        self.assertTrue(closed)
+        self.assertEqual(depth, 0)
+        self.assertEqual(metrics.get_counter('chat.ws.send_queue.overflow_disconnects'), 1)
+
+    def test_recovered_client_stays_connected(self):
+        """测试超限后客户端赶上（队列降到上限以下）时不再断开"""
+        async def scenario(queue, client, overflowed):
+            for index in range(4):
+                queue.put({'type': 'task_status_update', 'task': {'id': index}})
+            client.gate.set()
+            await asyncio.sleep(0.1)
+            return overflowed, queue.over_limit_since, len(client.written)
+
+        overflowed, over_limit_since, written = self.run_queue(scenario, max_frames=2, overflow_seconds=0.05)
+
+        self.assertEqual(overflowed, [])
+        self.assertIsNone(over_limit_since)
+        self.assertEqual(written, 4)
+
+
+class ConsumerSendQueueTest(TestCase):
+    """ChatConsumer发送队列测试"""
+
+    def test_connection_registers_queue_high_water(self):
+        """测试连接期间可查看发送队列统计，断开后记入高水位分布"""
+        metrics.reset()
+        group_subscribers.clear()
+        self.addCleanup(group_subscribers.clear)
+        fixture = create_chat_fixture()
+        token = str(AccessToken.for_user(fixture['user']))
+        app = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+        async def scenario():
+            communicator = ApplicationCommunicator(app, {
+                'type': 'websocket',
+                'path': f"/ws/chat/{fixture['conversation'].id}/",
+                'query_string': f'token={token}'.encode(),
+                'headers': [],
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(5)
+            established = await communicator.receive_output(5)
+            connected = outbound_queues.snapshot()
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+            return established, connected
+
+        established, connected = async_to_sync(scenario)()
+
+        self.assertIn('connection_established', established['text'])
+        self.assertEqual(len(connected), 1)
+        self.assertEqual(connected[0]['frames_written'], 1)
+        self.assertGreaterEqual(connected[0]['high_water'], 1)
+        self.assertEqual(len(outbound_queues), 0)
+        self.assertEqual(metrics.get_summary('chat.ws.send_queue.high_water')['count'], 1)
@@ -0,0 +1,128 @@
+"""
+提示词消息布局测试
+
+测试结构化布局的消息顺序与前缀稳定性、缓存断点，以及任务的提示词token用量记录
+"""
+
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from crewaiplatform.models import ChatAgentTask, ChatMessage
+from crewaiplatform.services import SimpleAgentService
+from crewaiplatform.services.agent_prompt_cache import CompiledAgentPrompt
+from crewaiplatform.services.conversation_context import ConversationContextBuilder
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.services.prompt_layout import PromptUsage, StructuredPromptBuilder
+from crewaiplatform.tests.utils import create_chat_fixture, FakeChunk, FakeStreamingModel, RecordingStream
+
+
+COMPILED = CompiledAgentPrompt(SimpleNamespace(pk=1, role='顾问', goal='回答问题', backstory=''))
+
+
+def build(rows_newest_first, latest_message_id, summary='', cache_breakpoints=False):
+    context = ConversationContextBuilder.fit(rows_newest_first, budget=10000, summary=summary)
+    return StructuredPromptBuilder.build(
+        COMPILED, context, '回复用户消息', latest_message_id, cache_breakpoints
+    )
+
+
+class StructuredPromptTest(SimpleTestCase):
+    """结构化布局测试"""
+
+    def test_roles_and_order(self):
+        """测试系统消息在前，历史按角色排列，本次用户消息在最后"""
+        messages = build([(3, 'user', '', '第二问'), (2, 'assistant', 'A', '第一答'), (1, 'user', '', '第一问')], 3)
+
+        self.assertEqual([m.type for m in messages], ['system', 'human', 'ai', 'human'])
+        self.assertIn('你是一个顾问。', messages[0].content)
+        self.assertEqual(messages[1].content, '第一问')
+        self.assertIn('第一答', messages[2].content)
+        self.assertEqual(messages[-1].content, '第二问')
+
+    def test_prefix_stable_across_turns(self):
+        """测试下一轮只在末尾追加消息，之前的消息前缀不变"""
+        turn1 = [(3, 'user', '', '第二问'), (2, 'assistant', 'A', '第一答'), (1, 'user', '', '第一问')]
+        turn2 = [(5, 'user', '', '第三问'), (4, 'assistant', 'A', '第二答')] + turn1
+
+        first = build(turn1, 3)
+        second = build(turn2, 5)
+
+        self.assertIs(first[0], second[0])
+        self.assertEqual([m.content for m in first], [m.content for m in second[:len(first)]])
+
+    def test_summary_and_leading_assistant(self):
+        """测试摘要作为第一条用户消息；窗口以助手消息开头时补一条用户消息"""
+        with_summary = build([(3, 'user', '', '问'), (2, 'assistant', 'A', '答')], 3, summary='聊过天气')
+        self.assertEqual([m.type for m in with_summary], ['system', 'human', 'ai', 'human'])
+        self.assertIn('聊过天气', with_summary[1].content)
+
+        without_summary = build([(3, 'user', '', '问'), (2, 'assistant', 'A', '答')], 3)
+        self.assertEqual([m.type for m in without_summary], ['system', 'human', 'ai', 'human'])
+
+    def test_cache_breakpoints(self):
+        """测试在系统消息和历史末尾标记缓存断点，本次用户消息不标记"""
+        messages = build([(3, 'user', '', '第二问'), (2, 'assistant', 'A', '第一答'), (1, 'user', '', '第一问')],
+                         3, cache_breakpoints=True)
+
+        marked = [i for i, m in enumerate(messages)
+                  if isinstance(m.content, list) and m.content[0].get('cache_control')]
+        self.assertEqual(marked, [0, 2])
+        self.assertEqual(messages[-1].content, '第二问')
+
+    def test_usage_from_stream_chunks(self):
+        """测试从流式chunk读取提示词用量（含缓存命中部分）"""
+        usage = PromptUsage()
+        usage.estimate([FakeChunk('估算' * 10)])
+        usage.observe(FakeChunk('片段'))
+        usage.observe(FakeChunk('', {'input_tokens': 1200, 'output_tokens': 0,
+                                     'input_token_details': {'cache_read': 1000}}))
+        usage.observe(FakeChunk('', {'input_tokens': 0, 'output_tokens': 30}))
+
+        self.assertTrue(usage.reported)
+        self.assertEqual((usage.prompt_tokens, usage.cached_tokens, usage.uncached_tokens), (1200, 1000, 200))
+
+
+class PromptUsageRecordingTest(TestCase):
+    """任务提示词用量记录测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.task = self.fixture['task']
+        ChatMessage.objects.create(
+            conversation=self.fixture['conversation'], role='assistant', content='之前的回答',
+            agent_name='A', status='completed'
+        )
+
+    def run_task(self, model):
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+            async_to_sync(SimpleAgentService._execute_agent_task)(self.task, RecordingStream())
+        return ChatAgentTask.objects.get(pk=self.task.pk)
+
+    @override_settings(CHAT_PROMPT_LAYOUT='structured')
+    def test_structured_layout_records_cached_tokens(self):
+        """测试结构化布局：本次用户消息单独放在最后，任务记录模型返回的缓存命中token数"""
+        model = FakeStreamingModel(['<answer>好的</answer>'], usage={
+            'input_tokens': 900, 'output_tokens': 5, 'input_token_details': {'cache_read': 768},
+        })
+
+        task = self.run_task(model)
+
+        self.assertEqual(model.messages[0].type, 'system')
+        self.assertEqual(model.messages[-1].content, '你好')
+        self.assertNotIn('你好', model.messages[-2].content)
+        self.assertEqual((task.prompt_tokens, task.cached_prompt_tokens), (900, 768))
+        self.assertEqual(task.uncached_prompt_tokens, 132)
+
+    def test_flat_layout_records_estimate(self):
+        """测试模型未返回用量时记录估算值"""
+        model = FakeStreamingModel(['<answer>好的</answer>'])
+
+        task = self.run_task(model)
+
+        self.assertEqual([m.type for m in model.messages], ['system', 'human'])
+        self.assertEqual(task.status, 'completed')
+        self.assertGreater(task.prompt_tokens, 0)
+        self.assertEqual(task.cached_prompt_tokens, 0)
@@ -0,0 +1,150 @@
+"""
+LLM请求限流测试
+
+测试按Agent/LLM模型的速率窗口、并发槽位、排队等待与截止时间，以及聊天路径的接入
+"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from crewaiplatform.metrics import metrics
+from crewaiplatform.models import ChatMessage, CrewAIAgent
+from crewaiplatform.services import SimpleAgentService
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.services.rate_limiter import LLMRateLimiter, RateLimit, RateLimitExceeded
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel, RecordingStream
+
+
+# 固定在某个窗口的正中间，避免测试跨越窗口边界
+NOW = 60 * 1_000_000 + 30
+
+
+class LLMRateLimiterTest(TestCase):
+    """限流器测试"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.limiter = LLMRateLimiter(max_wait=1)
+        clock = mock.patch('crewaiplatform.services.rate_limiter.time.time', return_value=NOW)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def acquire(self, limits, max_wait=None):
+        return async_to_sync(self.limiter.acquire)(limits, max_wait)
+
+    def test_limits_for_agent_and_model(self):
+        """测试从Agent的max_rpm和模型的速率/并发上限生成限流键，未配置时不限流"""
+        llm_model = SimpleNamespace(pk=3, max_rpm=100, max_concurrency=4)
+        agent = SimpleNamespace(pk=7, max_rpm=10, llm_model=llm_model)
+
+        limits = LLMRateLimiter.limits_for(agent)
+        self.assertEqual(
+            [(limit.key, limit.rpm, limit.concurrency) for limit in limits],
+            [('agent:7', 10, None), ('llm_model:3', 100, 4)]
+        )
+        unlimited = SimpleNamespace(pk=1, max_rpm=None, llm_model=SimpleNamespace(pk=2, max_rpm=None, max_concurrency=None))
+        self.assertEqual(LLMRateLimiter.limits_for(unlimited), [])
+
+    def test_rpm_window_rejects_past_deadline(self):
+        """测试窗口已满且截止时间前不可能放行时立即失败"""
+        limits = [RateLimit('agent:1', rpm=2)]
+        self.acquire(limits)
+        self.acquire(limits)
+
+        with self.assertRaises(RateLimitExceeded) as raised:
+            self.acquire(limits)
+        self.assertEqual(raised.exception.key, 'agent:1')
+        self.assertEqual(metrics.get_counter('llm.rate_limit.timeouts', key='agent:1'), 1)
+
+    def test_previous_window_is_weighted(self):
+        """测试上一分钟的请求按剩余比例计入（滑动窗口近似）"""
+        cache.set(f"llm_rate:agent:1:rpm:{NOW // 60 - 1}", 4)
+        limits = [RateLimit('agent:1', rpm=4)]
+
+        # 窗口过半：上一分钟的4次折算为2次，还能放行2次
+        self.acquire(limits)
+        self.acquire(limits)
+        with self.assertRaises(RateLimitExceeded):
+            self.acquire(limits, max_wait=0)
+
+    def test_rejected_request_is_not_counted(self):
+        """测试任一键超限时撤销已计入其他键的请求，并释放已占用的并发槽位"""
+        agent_limit = RateLimit('agent:1', rpm=1)
+        model_limit = RateLimit('llm_model:1', rpm=10, concurrency=2)
+        self.acquire([model_limit, agent_limit])
+
+        with self.assertRaises(RateLimitExceeded):
+            self.acquire([model_limit, agent_limit], max_wait=0)
+
+        self.assertEqual(cache.get(f"llm_rate:llm_model:1:rpm:{NOW // 60}"), 1)
+        slots = [cache.get(f"llm_rate:llm_model:1:slot:{index}") for index in range(2)]
+        self.assertEqual(len([slot for slot in slots if slot]), 1)
+
+    def test_concurrency_waits_for_release(self):
+        """测试并发槽位用尽时排队等待，槽位释放后继续，并记录等待时间"""
+        limits = [RateLimit('llm_model:1', concurrency=1)]
+
+        async def scenario():
+            first = await self.limiter.acquire(limits)
+            waiter = asyncio.ensure_future(self.limiter.acquire(limits))
+            await asyncio.sleep(0.1)
+            self.assertFalse(waiter.done())
+
+            await self.limiter.release(first)
+            second = await asyncio.wait_for(waiter, 1)
+            await self.limiter.release(second)
+            return second
+
+        second = async_to_sync(scenario)()
+
+        self.assertGreater(second.waited, 0.05)
+        self.assertEqual(metrics.get_counter('llm.rate_limit.throttled', key='llm_model:1'), 1)
+        self.assertEqual(metrics.get_summary('llm.rate_limit.wait_ms', key='llm_model:1')['count'], 2)
+        self.assertIsNone(cache.get('llm_rate:llm_model:1:slot:0'))
+
+    def test_release_keeps_slot_taken_over_after_expiry(self):
+        """测试槽位过期并被其他请求占用后，原持有者释放时不删除"""
+        limits = [RateLimit('llm_model:1', concurrency=1)]
+        lease = self.acquire(limits)
+        cache.set('llm_rate:llm_model:1:slot:0', 'other')
+
+        async_to_sync(self.limiter.release)(lease)
+
+        self.assertEqual(cache.get('llm_rate:llm_model:1:slot:0'), 'other')
+
+
+@override_settings(LLM_RATE_LIMIT_MAX_WAIT_SECONDS=0)
+class ChatRateLimitTest(TestCase):
+    """聊天路径接入限流测试"""
+
+    def setUp(self):
+        cache.clear()
+        self.fixture = create_chat_fixture()
+        CrewAIAgent.objects.filter(pk=self.fixture['agent'].pk).update(max_rpm=1)
+        self.model = FakeStreamingModel(['<answer>好的</answer>'])
+
+    def reply(self):
+        user_message = ChatMessage.objects.create(
+            conversation=self.fixture['conversation'], role='user', content='问题', status='sent'
+        )
+        with mock.patch('crewaiplatform.services.rate_limiter.time.time', return_value=NOW), \
+                mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=self.model)):
+            return async_to_sync(SimpleAgentService.process_user_message_with_websocket)(
+                user_message, RecordingStream()
+            )
+
+    def test_agent_max_rpm_applies_to_chat(self):
+        """测试Agent的max_rpm限制直接调用LangChain的聊天路径，超限的回复标记为失败"""
+        self.assertEqual(self.reply().status, 'completed')
+
+        reply = self.reply()
+
+        self.assertEqual(reply.status, 'failed')
+        self.assertIn('请求过于频繁', reply.content)
+        self.assertEqual(self.model.calls, 1)
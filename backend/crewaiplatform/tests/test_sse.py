@@ -0,0 +1,145 @@
+"""
+SSE流式端点测试
+
+测试认证与参数校验、与WebSocket相同的思考/答案事件、心跳注释行，以及客户端断开时取消生成
+"""
+
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from crewaiplatform.models import ChatAgentTask, ChatMessage
+from crewaiplatform.routing import http_urlpatterns
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel
+
+
+def parse_events(body: bytes):
+    """把SSE响应体解析为 [(事件类型, 数据)]，注释行记为 (':', 内容)"""
+
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        if not block:
+            continue
+        if block.startswith(':'):
+            events.append((':', block[1:].strip()))
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0, CHAT_STREAM_PROTOCOL='delta')
+class ChatEventStreamTest(TestCase):
+    """聊天响应SSE端点测试"""
+
+    def setUp(self):
+        self.fixture = create_chat_fixture()
+        self.token = str(AccessToken.for_user(self.fixture['user']))
+        self.app = URLRouter(http_urlpatterns)
+
+    def communicator(self, method='POST', token=None):
+        conversation_id = self.fixture['conversation'].id
+        headers = [(b'content-type', b'application/json')]
+        if token is not False:
+            headers.append((b'authorization', f"Bearer {token or self.token}".encode()))
+        return ApplicationCommunicator(self.app, {
+            'type': 'http',
+            'method': method,
+            'path': f'/api/chat/conversations/{conversation_id}/stream/',
+            'query_string': b'',
+            'headers': headers,
+        })
+
+    async def post(self, communicator, content='问题'):
+        await communicator.send_input({
+            'type': 'http.request', 'body': json.dumps({'content': content}).encode(),
+        })
+        return await communicator.receive_output(5)
+
+    async def read_until(self, communicator, predicate):
+        """读取响应体直到出现满足条件的事件，返回已读取的事件"""
+        body = b''
+        while True:
+            message = await communicator.receive_output(5)
+            body += message.get('body', b'')
+            events = parse_events(body) if body.endswith(b'\n\n') else []
+            if any(predicate(event) for event in events) or not message.get('more_body'):
+                return events
+
+    def run_stream(self, model, scenario):
+        with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+            return async_to_sync(scenario)()
+
+    def test_requires_authentication(self):
+        """测试未携带令牌时返回401"""
+        async def scenario():
+            communicator = self.communicator(token=False)
+            start = await self.post(communicator)
+            body = await communicator.receive_output(5)
+            return start, json.loads(body['body'])
+
+        start, data = async_to_sync(scenario)()
+
+        self.assertEqual(start['status'], 401)
+        self.assertIn('error', data)
+
+    def test_empty_content_is_rejected(self):
+        """测试消息内容为空时返回400且不创建消息"""
+        async def scenario():
+            communicator = self.communicator()
+            return await self.post(communicator, content='  ')
+
+        self.assertEqual(async_to_sync(scenario)()['status'], 400)
+        self.assertEqual(ChatMessage.objects.filter(content='  ').count(), 0)
+
+    def test_streams_same_events_as_websocket(self):
+        """测试在同一个请求中下发思考/答案事件，结束时发送done事件并结束响应"""
+        model = FakeStreamingModel(['<thinking>想一想</thinking>', '<answer>你', '好</answer>'])
+
+        async def scenario():
+            communicator = self.communicator()
+            start = await self.post(communicator)
+            events = await self.read_until(communicator, lambda event: event[0] == 'done')
+            await communicator.wait(5)
+            return start, events
+
+        start, events = self.run_stream(model, scenario)
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), start['headers'])
+        types = [event[0] for event in events]
+        self.assertEqual(types[:2], ['connection_established', 'new_message'])
+        self.assertIn('task_status_update', types)
+        self.assertLess(types.index('thinking_complete'), types.index('answer_stream_start'))
+        deltas = [data['delta'] for kind, data in events if kind == 'answer_stream_update']
+        self.assertEqual(''.join(deltas), '你好')
+        done = events[-1][1]
+        self.assertEqual(done['message']['content'], '你好')
+        self.assertEqual(done['message']['status'], 'completed')
+
+    @override_settings(CHAT_SSE_HEARTBEAT_SECONDS=0.05)
+    def test_heartbeat_and_disconnect_cancels(self):
+        """测试空闲时发送心跳注释行，客户端断开后取消生成并保存部分答案"""
+        model = FakeStreamingModel(['<answer>部分'], hang=True)
+
+        async def scenario():
+            communicator = self.communicator()
+            await self.post(communicator)
+            events = await self.read_until(communicator, lambda event: event[0] == ':')
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(5)
+            return events
+
+        events = self.run_stream(model, scenario)
+
+        self.assertIn((':', 'ping'), events)
+        self.assertTrue(model.closed)
+        task = ChatAgentTask.objects.exclude(pk=self.fixture['task'].pk).get()
+        self.assertEqual(task.status, 'cancelled')
+        self.assertEqual(task.response_message.content, '部分')
@@ -0,0 +1,133 @@
+"""
+流式标签解析器测试
+
+测试<thinking>/<answer>增量解析，重点覆盖标签跨chunk切分的边界情况
+"""
+
+from django.test import SimpleTestCase
+
+from crewaiplatform.services.stream_parser import ThinkingStreamParser, StreamSegment
+
+
+def _feed_all(chunks):
+    """依次喂入所有chunk并返回(解析器, 全部片段)"""
+    parser = ThinkingStreamParser()
+    segments = []
+    for chunk in chunks:
+        segments.extend(parser.feed(chunk))
+    segments.extend(parser.close())
+    return parser, segments
+
+
+def _text_of(segments, kind):
+    return ''.join(segment.text for segment in segments if segment.kind == kind)
+
+
+def _kinds(segments):
+    return [segment.kind for segment in segments]
+
+
+class ThinkingStreamParserTest(SimpleTestCase):
+    """增量解析器测试"""
+
+    RESPONSE = '<thinking>\n先分析问题\n</thinking>\n<answer>\n最终答案\n</answer>'
+
+    def test_single_chunk(self):
+        """测试一次性输入完整响应"""
+        parser, segments = _feed_all([self.RESPONSE])
+
+        self.assertEqual(parser.thinking_content, '先分析问题')
+        self.assertEqual(parser.answer_content, '最终答案')
+        self.assertEqual(parser.full_response, self.RESPONSE)
+        self.assertEqual(
+            _kinds(segments),
+            [
+                StreamSegment.THINKING_DELTA,
+                StreamSegment.THINKING_END,
+                StreamSegment.ANSWER_START,
+                StreamSegment.ANSWER_DELTA,
+                StreamSegment.ANSWER_END,
+                StreamSegment.DONE,
+            ]
+        )
+
+    def test_character_by_character(self):
+        """测试逐字符输入，所有标签都被切分"""
+        parser, segments = _feed_all(list(self.RESPONSE))
+
+        self.assertEqual(parser.thinking_content, '先分析问题')
+        self.assertEqual(parser.answer_content, '最终答案')
+        self.assertEqual(_text_of(segments, StreamSegment.THINKING_DELTA), '\n先分析问题\n')
+        self.assertEqual(_text_of(segments, StreamSegment.ANSWER_DELTA), '\n最终答案\n')
+        self.assertNotIn('<', _text_of(segments, StreamSegment.ANSWER_DELTA))
+
+    def test_every_split_point(self):
+        """测试在每个位置把响应切成两个chunk"""
+        for i in range(len(self.RESPONSE) + 1):
+            with self.subTest(split=i):
+                parser, segments = _feed_all([self.RESPONSE[:i], self.RESPONSE[i:]])
+                self.assertEqual(parser.thinking_content, '先分析问题')
+                self.assertEqual(parser.answer_content, '最终答案')
+                self.assertEqual(_kinds(segments).count(StreamSegment.ANSWER_START), 1)
+                self.assertEqual(_kinds(segments).count(StreamSegment.THINKING_END), 1)
+
+    def test_close_tag_split_across_chunks(self):
+        """测试结束标签被切分时不会把标签前缀当作内容输出"""
+        parser = ThinkingStreamParser()
+
+        segments = parser.feed('<thinking>abc</thi')
+        self.assertEqual(_text_of(segments, StreamSegment.THINKING_DELTA), 'abc')
+
+        segments = parser.feed('nking>')
+        self.assertEqual(_kinds(segments), [StreamSegment.THINKING_END])
+        self.assertEqual(segments[0].text, 'abc')
+
+    def test_false_tag_prefix_is_content(self):
+        """测试看似标签前缀的普通文本最终作为内容输出"""
+        parser, segments = _feed_all(['<answer>a </ans', 'wers are', ' here</answer>'])
+
+        self.assertEqual(parser.answer_content, 'a </answers are here')
+        self.assertTrue(parser.answer_completed)
+
+    def test_unterminated_answer_flushes_on_close(self):
+        """测试流结束时残留的标签前缀作为内容冲刷"""
+        parser = ThinkingStreamParser()
+        parser.feed('<answer>结果是 x<')
+        segments = parser.close()
+
+        self.assertEqual(segments[0], StreamSegment(StreamSegment.ANSWER_DELTA, '<'))
+        self.assertEqual(segments[-1].kind, StreamSegment.DONE)
+        self.assertEqual(parser.answer_content, '结果是 x<')
+        self.assertFalse(parser.answer_completed)
+
+    def test_text_outside_tags_is_ignored(self):
+        """测试标签外的文本不产生片段但保留在完整响应中"""
+        parser, segments = _feed_all(['前言 <', 'answer>答案</answer> 结尾'])
+
+        self.assertEqual(parser.answer_content, '答案')
+        self.assertEqual(_text_of(segments, StreamSegment.ANSWER_DELTA), '答案')
+        self.assertEqual(parser.full_response, '前言 <answer>答案</answer> 结尾')
+
+    def test_no_tags(self):
+        """测试没有任何标签的响应"""
+        parser, segments = _feed_all(['纯文本', '响应'])
+
+        self.assertEqual(_kinds(segments), [StreamSegment.DONE])
+        self.assertFalse(parser.answer_started)
+        self.assertEqual(parser.full_response, '纯文本响应')
+
+    def test_feed_after_close_is_ignored(self):
+        """测试关闭后的输入被忽略"""
+        parser = ThinkingStreamParser()
+        parser.close()
+
+        self.assertEqual(parser.feed('<answer>x</answer>'), [])
+        self.assertEqual(parser.close(), [])
+
+    def test_long_stream_is_linear(self):
+        """测试长输出逐字符解析时每个字符只产生常数个片段"""
+        body = 'x' * 20000
+        parser, segments = _feed_all(list(f'<thinking>{body}</thinking>'))
+
+        self.assertEqual(parser.thinking_content, body)
+        self.assertLessEqual(len(segments), len(body) + 2)
@@ -0,0 +1,223 @@
+"""
+流式传输协议测试
+
+测试ChatConsumer在delta协议与cumulative兼容模式下下发的思考/答案事件
+"""
+
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from crewaiplatform.consumers import ChatConsumer
+from crewaiplatform.stream_protocol import (
+    STREAM_PROTOCOL_CUMULATIVE,
+    STREAM_PROTOCOL_DELTA,
+    STREAM_PROTOCOL_VERSION,
+    content_checksum,
+    resolve_stream_protocol,
+    FrameCoalescer,
+)
+
+
+class LoopbackChannelLayer:
+    """把group_send直接分发给同组消费者的测试通道层"""
+
+    def __init__(self):
+        self.consumers = []
+
+    async def group_send(self, group, event):
+        for consumer in list(self.consumers):
+            await getattr(consumer, event['type'])(event)
+
+    async def group_discard(self, group, channel):
+        self.consumers = [c for c in self.consumers if getattr(c, 'channel_name', None) != channel]
+
+
+def _make_consumer(layer, query_string=b''):
+    """创建不依赖真实连接的ChatConsumer，记录其下发的帧"""
+
+    consumer = ChatConsumer()
+    consumer.scope = {'query_string': query_string}
+    consumer.channel_layer = layer
+    consumer.conversation_group_name = 'chat_test'
+    consumer.channel_name = f'test.{len(layer.consumers)}'
+    consumer.frames = []
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        consumer.frames.append(json.loads(text_data))
+
+    consumer.send = send
+    consumer.init_stream_state()
+    layer.consumers.append(consumer)
+    return consumer
+
+
+async def _stream_answer(producer, thinking_chunks, answer_chunks, final_answer=None):
+    """模拟一次完整的思考+答案流"""
+    for chunk in thinking_chunks:
+        await producer.send_thinking_update(chunk)
+    await producer.send_thinking_complete(''.join(thinking_chunks).strip())
+    await producer.send_answer_stream_start()
+    for chunk in answer_chunks:
+        await producer.send_answer_stream_update(chunk)
+    if final_answer is None:
+        final_answer = ''.join(answer_chunks).strip()
+    await producer.send_answer_stream_complete(final_answer)
+
+
+class StreamProtocolNegotiationTest(SimpleTestCase):
+    """协议协商测试"""
+
+    @override_settings(CHAT_STREAM_PROTOCOL=STREAM_PROTOCOL_CUMULATIVE)
+    def test_default_protocol_from_settings(self):
+        """测试未指定时使用配置的默认协议"""
+        self.assertEqual(resolve_stream_protocol({'query_string': b'token=x'}), STREAM_PROTOCOL_CUMULATIVE)
+
+    def test_query_param_selects_protocol(self):
+        """测试通过查询参数选择协议"""
+        scope = {'query_string': b'token=x&stream_protocol=delta'}
+        self.assertEqual(resolve_stream_protocol(scope), STREAM_PROTOCOL_DELTA)
+
+    @override_settings(CHAT_STREAM_PROTOCOL=STREAM_PROTOCOL_DELTA)
+    def test_unknown_protocol_falls_back_to_default(self):
+        """测试未知协议回退到默认协议"""
+        scope = {'query_string': b'stream_protocol=bogus'}
+        self.assertEqual(resolve_stream_protocol(scope), STREAM_PROTOCOL_DELTA)
+
+
+@override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0)
+class StreamProtocolTest(SimpleTestCase):
+    """ChatConsumer流式事件测试（不合并帧）"""
+
+    def setUp(self):
+        self.layer = LoopbackChannelLayer()
+        self.delta_client = _make_consumer(self.layer, b'stream_protocol=delta')
+        self.legacy_client = _make_consumer(self.layer, b'stream_protocol=cumulative')
+
+    def test_delta_frames_carry_only_appended_text(self):
+        """测试delta协议只下发增量并带有递增序号"""
+        async_to_sync(_stream_answer)(self.delta_client, ['想', '一想'], ['你', '好'])
+
+        updates = [f for f in self.delta_client.frames if f['type'] == 'answer_stream_update']
+        self.assertEqual([f['delta'] for f in updates], ['你', '好'])
+        self.assertTrue(all(f['protocol'] == STREAM_PROTOCOL_VERSION for f in updates))
+
+        start = next(f for f in self.delta_client.frames if f['type'] == 'answer_stream_start')
+        seqs = [start['seq']] + [f['seq'] for f in updates]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(len(set(f['stream_id'] for f in updates)), 1)
+
+    def test_delta_complete_carries_checksum(self):
+        """测试完成事件携带校验和，内容一致时省略完整内容"""
+        async_to_sync(_stream_answer)(self.delta_client, ['t'], [' 你', '好 '])
+
+        complete = self.delta_client.frames[-1]
+        self.assertEqual(complete['type'], 'answer_stream_complete')
+        self.assertEqual(complete['checksum'], content_checksum('你好'))
+        self.assertEqual(complete['length'], 2)
+        self.assertNotIn('content', complete)
+
+    def test_delta_complete_includes_content_when_it_differs(self):
+        """测试最终答案与增量拼接结果不同时下发完整内容"""
+        async_to_sync(_stream_answer)(self.delta_client, ['t'], ['部分'], final_answer='兜底答案')
+
+        complete = self.delta_client.frames[-1]
+        self.assertEqual(complete['content'], '兜底答案')
+        self.assertEqual(complete['checksum'], content_checksum('兜底答案'))
+
+    def test_cumulative_mode_rebuilds_full_content(self):
+        """测试兼容模式下仍然下发累计内容"""
+        async_to_sync(_stream_answer)(self.delta_client, ['想', '一想'], ['你', '好'])
+
+        thinking = [f['content'] for f in self.legacy_client.frames if f['type'] == 'thinking_content_update']
+        answer = [f['content'] for f in self.legacy_client.frames if f['type'] == 'answer_stream_update']
+        self.assertEqual(thinking, ['想', '想一想'])
+        self.assertEqual(answer, ['你', '你好'])
+        self.assertEqual(self.legacy_client.frames[-1], {'type': 'answer_stream_complete', 'content': '你好'})
+        self.assertNotIn('delta', self.legacy_client.frames[0])
+
+    def test_each_answer_gets_new_stream_id(self):
+        """测试每次响应使用新的流ID"""
+        async_to_sync(_stream_answer)(self.delta_client, ['a'], ['b'])
+        async_to_sync(_stream_answer)(self.delta_client, ['c'], ['d'])
+
+        stream_ids = {f['stream_id'] for f in self.delta_client.frames if f['type'] == 'answer_stream_start'}
+        self.assertEqual(len(stream_ids), 2)
+
+
+class FrameCoalescerTest(SimpleTestCase):
+    """增量帧合并测试"""
+
+    def setUp(self):
+        self.frames = []
+
+    async def _record(self, kind, delta):
+        self.frames.append((kind, delta))
+
+    def test_deltas_within_window_are_merged(self):
+        """测试时间窗口内的增量合并为一帧，窗口到期后自动下发"""
+        async def scenario():
+            coalescer = FrameCoalescer(self._record, window_ms=20, max_bytes=1024)
+            for char in 'hello':
+                await coalescer.add('answer', char)
+            self.assertEqual(self.frames, [])
+            await asyncio.sleep(0.05)
+            return coalescer
+
+        coalescer = async_to_sync(scenario)()
+        self.assertEqual(self.frames, [('answer', 'hello')])
+        self.assertEqual(coalescer.stats(), {'deltas_received': 5, 'frames_sent': 1, 'frames_coalesced': 4})
+
+    def test_byte_threshold_triggers_flush(self):
+        """测试达到字节阈值时立即下发"""
+        async def scenario():
+            coalescer = FrameCoalescer(self._record, window_ms=10000, max_bytes=6)
+            await coalescer.add('answer', '你')
+            await coalescer.add('answer', '好')
+            await coalescer.add('answer', '!')
+            coalescer.discard()
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.frames, [('answer', '你好')])
+
+    def test_explicit_flush_keeps_streams_separate(self):
+        """测试显式flush按流分别下发"""
+        async def scenario():
+            coalescer = FrameCoalescer(self._record, window_ms=10000, max_bytes=1024)
+            await coalescer.add('thinking', 'a')
+            await coalescer.add('answer', 'b')
+            await coalescer.add('thinking', 'c')
+            await coalescer.flush()
+
+        async_to_sync(scenario)()
+        self.assertEqual(sorted(self.frames), [('answer', 'b'), ('thinking', 'ac')])
+
+    def test_zero_window_disables_coalescing(self):
+        """测试窗口为0时每个增量单独成帧"""
+        async def scenario():
+            coalescer = FrameCoalescer(self._record, window_ms=0)
+            await coalescer.add('answer', 'a')
+            await coalescer.add('answer', 'b')
+
+        async_to_sync(scenario)()
+        self.assertEqual(self.frames, [('answer', 'a'), ('answer', 'b')])
+
+    @override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=10000)
+    def test_consumer_flushes_before_complete(self):
+        """测试答案完成前会先下发缓存的增量"""
+        layer = LoopbackChannelLayer()
+        client = _make_consumer(layer, b'stream_protocol=delta')
+        async_to_sync(_stream_answer)(client, ['想', '一想'], ['你', '好'])
+
+        types = [f['type'] for f in client.frames]
+        self.assertEqual(types, [
+            'thinking_content_update',
+            'thinking_complete',
+            'answer_stream_start',
+            'answer_stream_update',
+            'answer_stream_complete',
+        ])
+        self.assertEqual(client.frames[3]['delta'], '你好')
+        self.assertNotIn('content', client.frames[-1])
@@ -0,0 +1,139 @@
+"""
+Agent任务取消测试
+
+测试取消请求中断流式调用、关闭上游流并保存部分答案
+"""
+
+import asyncio
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from crewaiplatform.metrics import metrics
+from crewaiplatform.models import ChatMessage
+from crewaiplatform.services import ChatAgentTaskService, SimpleAgentService
+from crewaiplatform.services.agent_reply import AgentReplyService
+from crewaiplatform.services.llm_model_cache import llm_model_cache
+from crewaiplatform.task_registry import agent_task_cancellation
+from crewaiplatform.tests.utils import create_chat_fixture, FakeStreamingModel, RecordingStream
+
+
+class AgentTaskCancellationTest(TestCase):
+    """任务取消测试"""
+
+    def setUp(self):
+        metrics.reset()
+        self.fixture = create_chat_fixture()
+        self.task = self.fixture['task']
+
+    def _run_and_cancel(self, cancel):
+        """执行任务，在模型输出部分内容后调用cancel"""
+        model = FakeStreamingModel(['<thinking>想', '</thinking><answer>部分', '答案'], hang=True)
+        stream = RecordingStream()
+
+        async def scenario():
+            with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+                running = asyncio.ensure_future(SimpleAgentService._execute_agent_task(self.task, stream))
+                await asyncio.wait_for(model.yielded.wait(), 5)
+                await cancel()
+                await asyncio.wait_for(running, 5)
+                return running
+
+        running = async_to_sync(scenario)()
+        return model, stream, running
+
+    def test_cancel_closes_stream_and_saves_partial_answer(self):
+        """测试取消后关闭上游流，任务和消息保存为已取消"""
+        async def cancel():
+            self.assertTrue(agent_task_cancellation.cancel(self.task.id, 'websocket'))
+
+        model, stream, running = self._run_and_cancel(cancel)
+
+        self.assertTrue(model.closed)
+        self.assertFalse(running.cancelled())
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'cancelled')
+        self.assertIn('部分答案', self.task.result)
+
+        message = ChatMessage.objects.get(pk=self.fixture['assistant_message'].pk)
+        self.assertEqual(message.status, 'cancelled')
+        self.assertEqual(message.content, '部分答案')
+
+        self.assertIn(('send_answer_stream_complete', '部分答案'), stream.events)
+        self.assertFalse(agent_task_cancellation.is_running(self.task.id))
+
+    def test_cancel_from_another_thread(self):
+        """测试从其他线程（如REST请求线程）取消"""
+        async def cancel():
+            thread = threading.Thread(target=agent_task_cancellation.cancel, args=(self.task.id, 'api'))
+            thread.start()
+            thread.join()
+
+        model, _, _ = self._run_and_cancel(cancel)
+
+        self.assertTrue(model.closed)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'cancelled')
+
+    def test_tokens_saved_metric(self):
+        """测试记录被取消节省的token估算"""
+        async def cancel():
+            agent_task_cancellation.cancel(self.task.id, 'api')
+
+        self._run_and_cancel(cancel)
+
+        generated = metrics.get_counter('llm.cancel.tokens_generated')
+        self.assertGreater(generated, 0)
+        self.assertEqual(metrics.get_counter('llm.cancel.tokens_saved'), 1000 - generated)
+        self.assertEqual(metrics.get_counter('llm.cancel.completed', reason='api'), 1)
+
+    def test_external_cancellation_propagates(self):
+        """测试连接关闭等外部取消仍保存部分答案并继续向上传播"""
+        holder = {}
+
+        async def cancel():
+            holder['task'].cancel()
+
+        model = FakeStreamingModel(['<answer>半'], hang=True)
+
+        async def scenario():
+            with mock.patch.object(llm_model_cache, 'aget', mock.AsyncMock(return_value=model)):
+                holder['task'] = asyncio.ensure_future(
+                    SimpleAgentService._execute_agent_task(self.task, RecordingStream())
+                )
+                await asyncio.wait_for(model.yielded.wait(), 5)
+                await cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await holder['task']
+
+        async_to_sync(scenario)()
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'cancelled')
+        self.assertTrue(model.closed)
+
+    def test_request_cancel_for_task_not_running_here(self):
+        """测试任务不在本进程运行时直接标记为已取消"""
+        running_locally = ChatAgentTaskService.request_cancel(self.task, reason='api')
+
+        self.assertFalse(running_locally)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'cancelled')
+        message = ChatMessage.objects.get(pk=self.fixture['assistant_message'].pk)
+        self.assertEqual(message.status, 'cancelled')
+
+    def test_request_cancel_older_of_two_tasks(self):
+        """测试两个任务同时处理中时取消较早的任务，只取消它自己的回复消息"""
+        conversation, user_message = self.fixture['conversation'], self.fixture['user_message']
+        older = AgentReplyService.start(conversation, user_message)
+        newer = AgentReplyService.start(conversation, user_message)
+
+        ChatAgentTaskService.request_cancel(older, reason='api')
+
+        older_reply = ChatMessage.objects.get(pk=older.response_message_id)
+        newer_reply = ChatMessage.objects.get(pk=newer.response_message_id)
+        self.assertEqual(older_reply.status, 'cancelled')
+        self.assertEqual(newer_reply.status, 'processing')
+        newer.refresh_from_db()
+        self.assertEqual(newer.status, 'pending')
@@ -0,0 +1,120 @@
+"""
+后台任务注册表测试
+
+测试Agent响应在后台任务中执行、连接关闭时清理，以及错误通过流事件报告
+"""
+
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from crewaiplatform.task_registry import TaskRegistry
+from crewaiplatform.tests.test_stream_protocol import LoopbackChannelLayer, _make_consumer
+
+
+PROCESS_PATH = 'crewaiplatform.services.SimpleAgentService.process_user_message_with_websocket'
+
+
+class TaskRegistryTest(SimpleTestCase):
+    """注册表基础行为测试"""
+
+    def test_finished_tasks_are_removed(self):
+        """测试任务结束后自动移除，并可按ChatAgentTask ID查找"""
+        async def scenario():
+            registry = TaskRegistry()
+            gate = asyncio.Event()
+            key = registry.start(gate.wait())
+            registry.bind(key, 42)
+            found = registry.find(42)
+            gate.set()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            return key, found, len(registry)
+
+        key, found, remaining = async_to_sync(scenario)()
+        self.assertEqual(found.key, key)
+        self.assertEqual(remaining, 0)
+
+    def test_cancel_all_stops_running_tasks(self):
+        """测试cancel_all取消并等待全部任务"""
+        async def scenario():
+            registry = TaskRegistry()
+            task_keys = [registry.start(asyncio.sleep(60)) for _ in range(3)]
+            entries = [registry.find(key).task for key in task_keys]
+            await registry.cancel_all()
+            return entries, len(registry)
+
+        tasks, remaining = async_to_sync(scenario)()
+        self.assertTrue(all(task.cancelled() for task in tasks))
+        self.assertEqual(remaining, 0)
+
+
+@override_settings(CHAT_STREAM_COALESCE_WINDOW_MS=0)
+class BackgroundAgentResponseTest(SimpleTestCase):
+    """ChatConsumer后台响应测试"""
+
+    def setUp(self):
+        self.layer = LoopbackChannelLayer()
+        self.client = _make_consumer(self.layer, b'stream_protocol=delta')
+        self.conversation = SimpleNamespace(primary_agent=object())
+
+    def test_receive_loop_is_not_blocked(self):
+        """测试Agent生成期间连接仍能处理心跳，断开时取消生成"""
+        started = []
+
+        async def slow_agent(user_message, stream):
+            started.append(stream)
+            await stream.send_answer_stream_start()
+            await asyncio.sleep(60)
+
+        async def scenario():
+            with mock.patch(PROCESS_PATH, side_effect=slow_agent):
+                await self.client.trigger_agent_response(self.conversation, object())
+                await asyncio.sleep(0)
+                await self.client.handle_ping({'timestamp': 1})
+                inflight = len(self.client.agent_tasks)
+                await self.client.disconnect(1000)
+                return inflight
+
+        inflight = async_to_sync(scenario)()
+        self.assertEqual(inflight, 1)
+        self.assertEqual(len(started), 1)
+        self.assertIn({'type': 'pong', 'timestamp': 1}, self.client.frames)
+        self.assertEqual(len(self.client.agent_tasks), 0)
+
+    def test_agent_error_is_reported_through_stream_events(self):
+        """测试后台任务的异常通过思考状态和错误事件报告"""
+        async def failing_agent(user_message, stream):
+            raise RuntimeError('boom')
+
+        async def scenario():
+            with mock.patch(PROCESS_PATH, side_effect=failing_agent):
+                await self.client.trigger_agent_response(self.conversation, object())
+                for _ in range(5):
+                    await asyncio.sleep(0)
+
+        async_to_sync(scenario)()
+        types = [frame['type'] for frame in self.client.frames]
+        self.assertEqual(types[-2:], ['thinking_status_update', 'error'])
+        self.assertIn('boom', self.client.frames[-1]['message'])
+        self.assertFalse(self.client.frames[-2]['is_thinking'])
+
+    @override_settings(CHAT_MAX_INFLIGHT_RESPONSES_PER_CONNECTION=1)
+    def test_inflight_limit(self):
+        """测试超过单连接并发上限时拒绝新的回复"""
+        async def slow_agent(user_message, stream):
+            await asyncio.sleep(60)
+
+        async def scenario():
+            with mock.patch(PROCESS_PATH, side_effect=slow_agent):
+                await self.client.trigger_agent_response(self.conversation, object())
+                await self.client.trigger_agent_response(self.conversation, object())
+                inflight = len(self.client.agent_tasks)
+                await self.client.agent_tasks.cancel_all()
+                return inflight
+
+        self.assertEqual(async_to_sync(scenario)(), 1)
+        self.assertEqual(self.client.frames[-1]['type'], 'error')
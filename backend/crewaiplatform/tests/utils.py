@@ -0,0 +1,124 @@
+"""
+测试辅助工具
+
+创建聊天相关的测试数据，以及模拟LLM流式输出的假模型
+"""
+
+import asyncio
+
+from crewaiplatform.models import (
+    User, LLMModel, CrewAIAgent, ChatConversation, ChatMessage, ChatAgentTask
+)
+from crewaiplatform.services.message_cache import recent_message_cache
+
+
+def create_chat_fixture(username='chat-user', max_tokens=1000):
+    """创建 用户/LLM模型/Agent/会话/用户消息/Agent任务/处理中的助手消息"""
+
+    # 测试之间数据库回滚后会复用会话ID，清空进程内的最近消息缓存
+    recent_message_cache.clear()
+
+    user = User.objects.create_user(username=username, password='pass')
+    llm_model = LLMModel.objects.create(
+        name=f'{username}-llm', provider='openai', model_name='gpt-4o-mini',
+        api_key='sk-test', max_tokens=max_tokens, is_available=True,
+    )
+    agent = CrewAIAgent.objects.create(
+        name=f'{username}-agent', role='助手', goal='回答问题', backstory='测试',
+        llm_model=llm_model, owner=user,
+    )
+    conversation = ChatConversation.objects.create(user=user, title='测试会话', primary_agent=agent)
+    user_message = ChatMessage.objects.create(
+        conversation=conversation, role='user', content='你好', status='sent'
+    )
+    task = ChatAgentTask.objects.create(
+        conversation=conversation, message=user_message, agent=agent,
+        agent_name=agent.name, task_description='回复用户消息: 你好',
+    )
+    assistant_message = ChatMessage.objects.create(
+        conversation=conversation, role='assistant', content='正在思考中...',
+        agent=agent, agent_name=agent.name, status='processing'
+    )
+    ChatAgentTask.objects.filter(pk=task.pk).update(response_message=assistant_message)
+    # 重新加载以预取关联对象，避免在异步代码中触发同步查询
+    task = ChatAgentTask.objects.select_related(
+        'agent__llm_model', 'conversation', 'response_message'
+    ).get(pk=task.pk)
+    return {
+        'user': user,
+        'llm_model': llm_model,
+        'agent': agent,
+        'conversation': conversation,
+        'user_message': user_message,
+        'task': task,
+        'assistant_message': assistant_message,
+    }
+
+
+class FakeChunk:
+    def __init__(self, content, usage_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class FakeStreamingModel:
+    """
+    按给定chunk流式输出的假LangChain模型；hang=True时输出完后一直等待
+
+    usage为最后一个chunk携带的 usage_metadata；error为输出第一个chunk之前抛出的异常；
+    messages记录最近一次调用收到的消息
+    """
+
+    def __init__(self, chunks, hang=False, delay=0, usage=None, error=None):
+        self.chunks = chunks
+        self.hang = hang
+        self.delay = delay
+        self.usage = usage
+        self.error = error
+        self.messages = None
+        self.calls = 0
+        self.closed = False
+        self.yielded = asyncio.Event() if hang else None
+
+    async def astream(self, messages):
+        self.calls += 1
+        self.messages = messages
+        try:
+            if self.error is not None:
+                raise self.error
+            for chunk in self.chunks:
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                yield FakeChunk(chunk)
+            if self.usage:
+                yield FakeChunk('', self.usage)
+            if self.hang:
+                self.yielded.set()
+                await asyncio.sleep(3600)
+        finally:
+            self.closed = True
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        self.messages = messages
+        if self.error is not None:
+            raise self.error
+        return FakeChunk(''.join(self.chunks), self.usage)
+
+
+class RecordingStream:
+    """记录SimpleAgentService下发事件的响应流"""
+
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        if not name.startswith('send_'):
+            raise AttributeError(name)
+
+        async def record(*args):
+            self.events.append((name,) + args)
+        return record
+
+    def names(self):
+        return [event[0] for event in self.events]
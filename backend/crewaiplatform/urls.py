@@ -10,7 +10,9 @@ from .views import (
     # 字典管理视图
     DictionaryViewSet,
     # 聊天功能视图
-    ChatConversationViewSet, ChatMessageViewSet, ChatAgentTaskViewSet, AgentSelectionViewSet
+    ChatConversationViewSet, ChatMessageViewSet, ChatAgentTaskViewSet, AgentSelectionViewSet,
+    # 运行时指标视图
+    RuntimeMetricsView
 )
 
 # 创建路由器实例，用于自动生成RESTful API路由
@@ -53,6 +55,7 @@ urlpatterns = [
         
         # 仪表盘数据
         path('dashboard/', DashboardView.as_view(), name='dashboard'),               # 仪表盘数据
+        path('metrics/', RuntimeMetricsView.as_view(), name='runtime_metrics'),      # 运行时指标（管理员）
         
         # 包含路由器生成的所有CRUD接口
         path('', include(router.urls)),
@@ -6,6 +6,7 @@ Views包，包含所有业务模块的视图
 - user_views: 用户管理视图 (用户、角色、权限管理) 
 - crewai_views: CrewAI集成视图 (LLM模型、MCP工具、Agent管理)
 - dictionary_views: 字典管理视图 (字典类型、字典项管理)
+- metrics_views: 运行时指标视图
 """
 
 # 认证相关视图
@@ -45,6 +46,11 @@ from .chat_views import (
     AgentSelectionViewSet,
 )
 
+# 运行时指标视图
+from .metrics_views import (
+    RuntimeMetricsView,
+)
+
 # 导出所有视图类
 __all__ = [
     # 认证相关
@@ -73,4 +79,7 @@ __all__ = [
     'ChatMessageViewSet',
     'ChatAgentTaskViewSet',
     'AgentSelectionViewSet',
+    
+    # 运行时指标
+    'RuntimeMetricsView',
 ]
\ No newline at end of file
@@ -32,11 +32,70 @@ from ..services import (
     SimpleAgentService,
     MockAgentService
 )
+from ..services.agent_executor import agent_executor, AgentExecutorFull
 
 
 logger = logging.getLogger(__name__)
 
 
+def _executor_busy_response(exc: AgentExecutorFull = None) -> Response:
+    """Agent执行队列已满时的503响应"""
+    stats = agent_executor.stats()
+    response = Response(
+        {
+            'error': 'Agent服务繁忙，请稍后再试',
+            'queued': stats['queued'],
+            'queue_limit': stats['queue_limit'],
+        },
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = str(exc.retry_after if exc else 5)
+    return response
+
+
+async def _process_user_message(user_message: ChatMessage):
+    """在Agent执行服务中处理用户消息（使用真实的LangChain Agent服务）"""
+    
+    from asgiref.sync import sync_to_async
+    
+    try:
+        assistant_message = await SimpleAgentService.process_user_message(user_message)
+        
+        if assistant_message:
+            logger.info(f"消息 {user_message.id} 异步处理完成")
+        else:
+            logger.error(f"消息 {user_message.id} 异步处理失败")
+            # 创建友好的错误提示消息
+            await sync_to_async(ChatMessageService.create_system_message)(
+                user_message.conversation, 
+                "抱歉，我现在无法理解您的问题，请尝试重新表述或检查Agent配置。"
+            )
+    
+    except Exception as e:
+        logger.error(f"异步处理消息失败: {e}")
+        # 创建友好的错误提示消息
+        await sync_to_async(ChatMessageService.create_system_message)(
+            user_message.conversation, 
+            f"处理消息时遇到问题：{str(e)}。请稍后再试或联系管理员。"
+        )
+
+
+async def _retry_user_message(message: ChatMessage):
+    """在Agent执行服务中重试消息"""
+    
+    try:
+        # 使用真实的Agent服务而不是Mock服务
+        assistant_message = await SimpleAgentService.process_user_message(message)
+        
+        if assistant_message:
+            logger.info(f"重试消息 {message.id} 处理完成")
+        else:
+            logger.error(f"重试消息 {message.id} 处理失败")
+    
+    except Exception as e:
+        logger.error(f"重试消息异步处理失败: {e}")
+
+
 class ChatConversationViewSet(viewsets.ModelViewSet):
     """聊天会话视图集"""
     
@@ -165,6 +224,10 @@ class ChatConversationViewSet(viewsets.ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
         
+        # 执行队列已满时直接拒绝，避免创建无人处理的消息
+        if not agent_executor.has_capacity():
+            return _executor_busy_response()
+        
         try:
             # 创建用户消息
             user_message = ChatMessageService.create_user_message(
@@ -172,22 +235,16 @@ class ChatConversationViewSet(viewsets.ModelViewSet):
                 content=serializer.validated_data['content']
             )
             
-            # 使用线程池异步处理Agent消息（避免阻塞HTTP响应）
+            # 提交到有界的Agent执行服务（避免阻塞HTTP响应）
             try:
-                import threading
-                thread = threading.Thread(
-                    target=self._process_message_sync, 
-                    args=(user_message,)
-                )
-                thread.start()
-                logger.info(f"Agent处理线程已启动，消息ID: {user_message.id}")
-            except Exception as e:
-                logger.error(f"启动Agent处理线程失败: {e}")
-                # 创建友好的错误提示消息
-                ChatMessageService.create_system_message(
-                    conversation, 
-                    "抱歉，Agent服务暂时不可用，请检查Agent配置或稍后再试。"
+                agent_executor.submit(
+                    lambda: _process_user_message(user_message),
+                    name=f'message-{user_message.id}'
                 )
+                logger.info(f"Agent处理已提交，消息ID: {user_message.id}")
+            except AgentExecutorFull as e:
+                user_message.mark_as_failed(str(e))
+                return _executor_busy_response(e)
             
             # 返回用户消息
             response_serializer = ChatMessageSerializer(user_message)
@@ -200,66 +257,6 @@ class ChatConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    def _retry_message_sync(self, message: ChatMessage):
-        """同步重试消息处理"""
-        try:
-            import asyncio
-            
-            # 创建新的事件循环在线程中运行异步代码
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                # 使用真实的Agent服务而不是Mock服务
-                assistant_message = loop.run_until_complete(
-                    SimpleAgentService.process_user_message(message)
-                )
-                
-                if assistant_message:
-                    logger.info(f"重试消息 {message.id} 处理完成")
-                else:
-                    logger.error(f"重试消息 {message.id} 处理失败")
-            finally:
-                loop.close()
-                    
-        except Exception as e:
-            logger.error(f"重试消息异步处理失败: {e}")
-
-    def _process_message_sync(self, user_message: ChatMessage):
-        """同步处理用户消息（使用真实的LangChain Agent服务）"""
-        try:
-            import asyncio
-            
-            # 创建新的事件循环在线程中运行异步代码
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                # 运行异步Agent服务
-                assistant_message = loop.run_until_complete(
-                    SimpleAgentService.process_user_message(user_message)
-                )
-                
-                if assistant_message:
-                    logger.info(f"消息 {user_message.id} 异步处理完成")
-                else:
-                    logger.error(f"消息 {user_message.id} 异步处理失败")
-                    # 创建友好的错误提示消息
-                    ChatMessageService.create_system_message(
-                        user_message.conversation, 
-                        "抱歉，我现在无法理解您的问题，请尝试重新表述或检查Agent配置。"
-                    )
-            finally:
-                loop.close()
-                    
-        except Exception as e:
-            logger.error(f"异步处理消息失败: {e}")
-            # 创建友好的错误提示消息
-            ChatMessageService.create_system_message(
-                user_message.conversation, 
-                f"处理消息时遇到问题：{str(e)}。请稍后再试或联系管理员。"
-            )
-    
     @action(detail=True, methods=['get'])
     def active_tasks(self, request, pk=None):
         """获取会话的活跃任务"""
@@ -317,17 +314,17 @@ class ChatMessageViewSet(viewsets.ReadOnlyModelViewSet):
             )
         
         try:
-            # 使用线程重新处理消息
-            import threading
-            thread = threading.Thread(
-                target=self._retry_message_sync, 
-                args=(message,)
+            # 提交到有界的Agent执行服务重新处理消息
+            agent_executor.submit(
+                lambda: _retry_user_message(message),
+                name=f'retry-{message.id}'
             )
-            thread.start()
-            logger.info(f"重试消息线程已启动，消息ID: {message.id}")
+            logger.info(f"重试消息已提交，消息ID: {message.id}")
             
             return Response({'message': '消息重试中'})
             
+        except AgentExecutorFull as e:
+            return _executor_busy_response(e)
         except Exception as e:
             logger.error(f"重试消息失败: {e}")
             return Response(
@@ -360,11 +357,16 @@ class ChatAgentTaskViewSet(viewsets.ReadOnlyModelViewSet):
             )
         
         try:
-            # 简单地标记任务为失败状态
-            ChatAgentTaskService.fail_task_execution(task, "用户取消任务")
+            # 中断正在运行的流式调用；任务不在本进程运行时直接标记为已取消
+            running_locally = ChatAgentTaskService.request_cancel(task, reason='api')
+            if not running_locally:
+                task.refresh_from_db()
             
             response_serializer = ChatAgentTaskSerializer(task)
-            return Response(response_serializer.data)
+            data = dict(response_serializer.data)
+            # 本进程内运行的任务由执行方异步保存部分答案，状态稍后更新为cancelled
+            data['cancel_pending'] = running_locally
+            return Response(data)
             
         except Exception as e:
             logger.error(f"取消任务失败: {e}")
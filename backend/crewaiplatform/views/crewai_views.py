@@ -12,6 +12,7 @@ from ..serializers import (
     AgentToolRelationSerializer, AgentToolBindingSerializer,
     LLMModelStatsSerializer, MCPToolStatsSerializer, CrewAIAgentStatsSerializer
 )
+from ..services.circuit_breaker import circuit_breaker, llm_model_key, mcp_tool_key
 
 logger = logging.getLogger(__name__)
 
@@ -187,17 +188,25 @@ class LLMModelViewSet(viewsets.ModelViewSet):
                 if count > 0:
                     provider_dist[choice[1]] = count
             
+            # 熔断状态（非关闭的熔断器）
+            names = dict(LLMModel.objects.values_list('id', 'name'))
+            breakers = circuit_breaker.snapshot(llm_model_key(LLMModel(pk=pk)) for pk in names)
+            for breaker in breakers:
+                breaker['name'] = names.get(int(breaker['key'].split(':')[1]))
+            
             # 使用统计（这里可以扩展更多统计）
             usage_stats = {
                 'active_models': LLMModel.objects.filter(is_active=True).count(),
                 'models_with_errors': LLMModel.objects.exclude(validation_error='').count(),
+                'open_circuits': len(breakers),
             }
             
             stats_data = {
                 'total_models': total_models,
                 'available_models': available_models,
                 'provider_distribution': provider_dist,
-                'usage_stats': usage_stats
+                'usage_stats': usage_stats,
+                'circuit_breakers': breakers,
             }
             
             serializer = LLMModelStatsSerializer(stats_data)
@@ -318,18 +327,26 @@ class MCPToolViewSet(viewsets.ModelViewSet):
                 if count > 0:
                     server_type_dist[choice[1]] = count
             
+            # 熔断状态（非关闭的熔断器）
+            names = dict(MCPTool.objects.values_list('id', 'name'))
+            breakers = circuit_breaker.snapshot(mcp_tool_key(MCPTool(pk=pk)) for pk in names)
+            for breaker in breakers:
+                breaker['name'] = names.get(int(breaker['key'].split(':')[1]))
+            
             # 使用统计
             usage_stats = {
                 'active_tools': MCPTool.objects.filter(is_active=True).count(),
                 'public_tools': MCPTool.objects.filter(is_public=True).count(),
                 'tools_with_errors': MCPTool.objects.filter(status='error').count(),
+                'open_circuits': len(breakers),
             }
             
             stats_data = {
                 'total_tools': total_tools,
                 'healthy_tools': healthy_tools,
                 'server_type_distribution': server_type_dist,
-                'usage_stats': usage_stats
+                'usage_stats': usage_stats,
+                'circuit_breakers': breakers,
             }
             
             serializer = MCPToolStatsSerializer(stats_data)
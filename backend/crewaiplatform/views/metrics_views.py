@@ -0,0 +1,24 @@
+"""
+运行时指标视图
+
+提供进程内运行时指标（流式传输、任务执行等）的只读接口，仅管理员可访问。
+"""
+
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..metrics import metrics
+from ..outbound_queue import outbound_queues
+
+
+class RuntimeMetricsView(APIView):
+    """运行时指标视图"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        """获取当前进程的运行时指标，可通过 ?prefix= 按名称前缀过滤；附带各WebSocket连接的发送队列高水位"""
+        prefix = request.query_params.get('prefix', '')
+        snapshot = metrics.snapshot(prefix)
+        snapshot['ws_send_queues'] = outbound_queues.snapshot()
+        return Response(snapshot)